@@ -1,4 +1,5 @@
-from fastapi import APIRouter, Depends
+from datetime import datetime
+from fastapi import APIRouter, Depends, Query
 from sqlalchemy.orm import Session
 from typing import List, Optional
 
@@ -11,10 +12,32 @@ router = APIRouter()
 
 
 @router.get("/audit", response_model=List[AuditLogRead])
-def list_audit(limit: int = 50, offset: int = 0, action: Optional[str] = None, user_id: Optional[int] = None, db: Session = Depends(get_db), _=Depends(require_root_admin)):
+def list_audit(
+    limit: int = Query(50, ge=1, le=500),
+    before_id: Optional[int] = None,
+    action: Optional[str] = None,
+    user_id: Optional[int] = None,
+    target: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: Session = Depends(get_db),
+    _=Depends(require_root_admin),
+):
+    """Newest first. Pass the smallest id of a page as `before_id` to get the next one.
+
+    since/until bound created_at, which also limits the scan to the matching monthly partitions.
+    """
     q = db.query(AuditLog)
+    if before_id is not None:
+        q = q.filter(AuditLog.id < before_id)
     if action:
         q = q.filter(AuditLog.action == action)
     if user_id is not None:
         q = q.filter(AuditLog.user_id == user_id)
-    return q.order_by(AuditLog.id.desc()).offset(offset).limit(limit).all()
\ No newline at end of file
+    if target:
+        q = q.filter(AuditLog.target == target)
+    if since is not None:
+        q = q.filter(AuditLog.created_at >= since)
+    if until is not None:
+        q = q.filter(AuditLog.created_at < until)
+    return q.order_by(AuditLog.id.desc()).limit(limit).all()
@@ -9,9 +9,8 @@ from app.models.user import User
 from app.core.security import verify_password, create_access_token, create_refresh_token
 from app.services.audit import record_audit_event
 from app.core.limiter import limiter
-from app.core.config import get_settings
 from app.core.auth import get_current_user
-from app.models.root_admin import RootAdmin
+from app.services.principal_cache import Principal
 from pydantic import BaseModel
 
 router = APIRouter()
@@ -63,15 +62,11 @@ class MeResponse(BaseModel):
 
 
 @router.get("/auth/me", response_model=MeResponse)
-def get_me(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    settings = get_settings()
-    emails = {e.strip().lower() for e in settings.root_admin_emails.split(",") if e.strip()}
-    is_env_root = current_user.email.lower() in emails
-    is_db_root = db.query(RootAdmin).filter(RootAdmin.user_id == current_user.id).first() is not None
+def get_me(current_user: Principal = Depends(get_current_user)):
     return MeResponse(
         id=current_user.id,
         name=current_user.name,
         email=current_user.email,
         role=current_user.role,
-        is_root_admin=(current_user.role == "admin" and (is_env_root or is_db_root)),
+        is_root_admin=current_user.is_root_admin,
     )
\ No newline at end of file
@@ -1,9 +1,10 @@
 from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Query, Request
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List
 from fastapi.responses import FileResponse
 
-from app.db.session import get_db
+from app.db.session import get_async_db, get_db
 from app.models.user import User
 from app.models.config import Config
 from app.schemas.config import ConfigCreate, ConfigRead, SignedURL
@@ -27,47 +28,47 @@ def list_configs(q: str | None = Query(default=None, description="search by titl
 
 @router.post("/configs", response_model=SignedURL)
 @limiter.limit("10/minute")
-async def upload_config(request: Request, title: str, file: UploadFile = File(...), db: Session = Depends(get_db), current_user: User = Depends(require_roles(["admin", "operator"]))):
+async def upload_config(request: Request, title: str, file: UploadFile = File(...), db: AsyncSession = Depends(get_async_db), current_user: User = Depends(require_roles(["admin", "operator"]))):
     content = await file.read()
     file_path = save_file(file.filename, content)
     cfg = Config(title=title, file_path=file_path, uploaded_by=current_user.id)
     db.add(cfg)
-    db.commit()
-    db.refresh(cfg)
-    record_audit_event(db, current_user.id, "upload_config", target=str(cfg.id), meta={"title": title})
+    await db.commit()
+    await db.refresh(cfg)
+    await db.run_sync(record_audit_event, current_user.id, "upload_config", target=str(cfg.id), meta={"title": title})
     sig, exp = sign_path(file_path)
     url = f"/api/configs/{cfg.id}/download?sig={sig}&exp={exp}"
     return SignedURL(url=url, expires_in=exp)
 
 
 @router.put("/configs/{config_id}", response_model=ConfigRead)
-async def update_config(config_id: int, title: str, db: Session = Depends(get_db), current_user: User = Depends(require_roles(["admin", "operator"]))):
-    cfg = db.query(Config).filter(Config.id == config_id).first()
+async def update_config(config_id: int, title: str, db: AsyncSession = Depends(get_async_db), current_user: User = Depends(require_roles(["admin", "operator"]))):
+    cfg = await db.get(Config, config_id)
     if not cfg:
         raise HTTPException(status_code=404, detail="Config not found")
     cfg.title = title
     db.add(cfg)
-    db.commit()
-    db.refresh(cfg)
-    record_audit_event(db, current_user.id, "update_config", target=str(cfg.id))
+    await db.commit()
+    await db.refresh(cfg)
+    await db.run_sync(record_audit_event, current_user.id, "update_config", target=str(cfg.id))
     return cfg
 
 
 @router.delete("/configs/{config_id}")
-async def delete_config(config_id: int, db: Session = Depends(get_db), current_user: User = Depends(require_roles(["admin"]))):
-    cfg = db.query(Config).filter(Config.id == config_id).first()
+async def delete_config(config_id: int, db: AsyncSession = Depends(get_async_db), current_user: User = Depends(require_roles(["admin"]))):
+    cfg = await db.get(Config, config_id)
     if not cfg:
         raise HTTPException(status_code=404, detail="Config not found")
     delete_file(cfg.file_path)
-    db.delete(cfg)
-    db.commit()
-    record_audit_event(db, current_user.id, "delete_config", target=str(config_id))
+    await db.delete(cfg)
+    await db.commit()
+    await db.run_sync(record_audit_event, current_user.id, "delete_config", target=str(config_id))
     return {"status": "deleted"}
 
 
 @router.get("/configs/{config_id}/download")
-async def download_config(config_id: int, sig: str = Query(...), exp: int = Query(...), db: Session = Depends(get_db), _: User = Depends(require_roles(["admin", "operator"]))):
-    cfg = db.query(Config).filter(Config.id == config_id).first()
+async def download_config(config_id: int, sig: str = Query(...), exp: int = Query(...), db: AsyncSession = Depends(get_async_db), _: User = Depends(require_roles(["admin", "operator"]))):
+    cfg = await db.get(Config, config_id)
     if not cfg:
         raise HTTPException(status_code=404, detail="Config not found")
     if not verify_signature(cfg.file_path, sig, exp):
@@ -1,8 +1,16 @@
-from fastapi import APIRouter, Depends
-from pydantic import BaseModel
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Query
+from pydantic import BaseModel, Field, model_validator
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+
 from app.core.auth import require_roles
+from app.core.config import get_settings
+from app.db.session import get_async_db
+from app.models.node_command import NodeCommand
 from app.models.user import User
-from app.services.redis_client import get_redis
+from app.services import node_commands
 
 router = APIRouter()
 
@@ -13,10 +21,85 @@ class CommandRequest(BaseModel):
     params: dict | None = None
 
 
+class BatchCommandRequest(BaseModel):
+    """Target explicit node names, or every node whose metadata has this `group`."""
+    nodes: Optional[list[str]] = Field(default=None, max_length=10000)
+    group: Optional[str] = None
+    command: str = Field(..., max_length=120)
+    params: dict | None = None
+    timeout_seconds: Optional[int] = Field(default=None, ge=1, le=7 * 24 * 3600)
+
+    @model_validator(mode="after")
+    def _one_target(self):
+        if (self.nodes is None) == (self.group is None):
+            raise ValueError("Specify exactly one of nodes, group")
+        return self
+
+
+async def _send(db: AsyncSession, payload: BatchCommandRequest, user: User) -> dict:
+    nodes, missing = await db.run_sync(node_commands.resolve_nodes, payload.nodes, payload.group)
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Unknown nodes: {', '.join(missing[:20])}")
+    if not nodes:
+        raise HTTPException(status_code=404, detail="No nodes in this group")
+    timeout = payload.timeout_seconds or get_settings().control_command_timeout_seconds
+    batch_id, commands = await db.run_sync(node_commands.create_batch, nodes, payload.command, payload.params, timeout, user.id)
+    try:
+        dispatched = await node_commands.dispatch(commands)
+    except Exception:
+        # Recorded as pending; the reconciler dispatches them once Redis is back
+        dispatched = 0
+    return {"batch_id": batch_id, "commands": [{"id": c.id, "node": c.node} for c in commands], "dispatched": dispatched}
+
+
 @router.post("/control/send")
-async def send_command(payload: CommandRequest, _: User = Depends(require_roles(["admin", "operator"]))):
-    redis = get_redis()
-    channel = f"control:{payload.node}"
-    await redis.publish(channel, payload.model_dump_json())
-    await redis.aclose()
-    return {"status": "queued"}
\ No newline at end of file
+async def send_command(payload: CommandRequest, db: AsyncSession = Depends(get_async_db), current_user: User = Depends(require_roles(["admin", "operator"]))):
+    out = await _send(db, BatchCommandRequest(nodes=[payload.node], command=payload.command, params=payload.params), current_user)
+    return {"status": "queued", "id": out["commands"][0]["id"], "batch_id": out["batch_id"]}
+
+
+@router.post("/control/commands")
+async def send_batch(payload: BatchCommandRequest, db: AsyncSession = Depends(get_async_db), current_user: User = Depends(require_roles(["admin", "operator"]))):
+    return await _send(db, payload, current_user)
+
+
+@router.get("/control/commands")
+async def list_commands(
+    batch_id: Optional[str] = None,
+    node: Optional[str] = None,
+    status: Optional[str] = None,
+    before: Optional[datetime] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    db: AsyncSession = Depends(get_async_db),
+    _: User = Depends(require_roles(["admin", "operator"])),
+):
+    """Newest first; page with `before` set to the last item's created_at."""
+    q = select(NodeCommand)
+    if batch_id:
+        q = q.where(NodeCommand.batch_id == batch_id)
+    if node:
+        q = q.where(NodeCommand.node == node)
+    if status:
+        q = q.where(NodeCommand.status == status)
+    if before is not None:
+        q = q.where(NodeCommand.created_at < before)
+    commands = (await db.scalars(q.order_by(NodeCommand.created_at.desc()).limit(limit))).all()
+    return {"items": [node_commands.command_view(c) for c in commands]}
+
+
+@router.get("/control/commands/{command_id}")
+async def get_command(command_id: str, db: AsyncSession = Depends(get_async_db), _: User = Depends(require_roles(["admin", "operator"]))):
+    command = await db.get(NodeCommand, command_id)
+    if command is None:
+        raise HTTPException(status_code=404, detail="Command not found")
+    return node_commands.command_view(command)
+
+
+@router.get("/control/batches/{batch_id}")
+async def get_batch(batch_id: str, db: AsyncSession = Depends(get_async_db), _: User = Depends(require_roles(["admin", "operator"]))):
+    """Outcome counts for a fleet-wide action, e.g. {"acked": 480, "timed_out": 3, "pending": 17}."""
+    rows = (await db.execute(select(NodeCommand.status, func.count()).where(NodeCommand.batch_id == batch_id).group_by(NodeCommand.status))).all()
+    if not rows:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    counts = {status: count for status, count in rows}
+    return {"batch_id": batch_id, "total": sum(counts.values()), "statuses": counts}
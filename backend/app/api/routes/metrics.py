@@ -0,0 +1,19 @@
+import hmac
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+from app.core.config import get_settings
+
+router = APIRouter()
+settings = get_settings()
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics(authorization: Optional[str] = Header(None)):
+    """Prometheus exposition for this worker; scraped on the loop so the pool and loop gauges are read in place."""
+    token = settings.metrics_token
+    if token and not (authorization and hmac.compare_digest(authorization, f"Bearer {token}")):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -1,27 +1,26 @@
 from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 import psutil
-from app.db.session import get_db
+from app.db.session import get_async_db
 from sqlalchemy import text
-from app.services.redis_client import get_redis
+from app.services.notification_hub import hub
+from app.services.redis_client import get_redis, redis_pool_stats
 
 router = APIRouter()
 
 
 @router.get("/monitoring/health")
-async def health(db: Session = Depends(get_db)):
+async def health(db: AsyncSession = Depends(get_async_db)):
     cpu = psutil.cpu_percent(interval=None)
     mem = psutil.virtual_memory()._asdict()
     db_ok = True
     try:
-        db.execute(text("SELECT 1"))
+        await db.execute(text("SELECT 1"))
     except Exception:
         db_ok = False
     redis_ok = True
     try:
-        r = get_redis()
-        await r.ping()
-        await r.aclose()
+        await get_redis().ping()
     except Exception:
         redis_ok = False
-    return {"cpu": cpu, "memory": mem, "database": db_ok, "redis": redis_ok}
\ No newline at end of file
+    return {"cpu": cpu, "memory": mem, "database": db_ok, "redis": redis_ok, "redis_pool": redis_pool_stats(), "websockets": hub.stats()}
\ No newline at end of file
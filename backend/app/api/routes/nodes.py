@@ -1,12 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException
+import hmac
+from datetime import datetime, timedelta, timezone
+from fastapi import APIRouter, Depends, Header, HTTPException
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from typing import Any, List, Literal, Optional
 
 from app.db.session import get_db
+from app.core.config import get_settings
 from app.models.admins_nodes import AdminNode
+from app.models.node_metric import NodeMetric
 from app.models.user import User
 from app.core.auth import require_roles
-from pydantic import BaseModel
+from app.services import node_heartbeats
+from pydantic import BaseModel, Field
 
 router = APIRouter()
 
@@ -14,11 +19,21 @@ router = APIRouter()
 class NodeCreate(BaseModel):
     name: str
     status: Optional[str] = "offline"
+    # Admin-controlled keys, e.g. "group" for node commands; "reported" belongs to heartbeats
+    metadata: Optional[dict[str, Any]] = None
 
 
 class NodeUpdate(BaseModel):
     name: Optional[str] = None
     status: Optional[str] = None
+    metadata: Optional[dict[str, Any]] = None
+
+
+def _admin_metadata(metadata: dict[str, Any], reported: Optional[dict[str, Any]] = None) -> dict[str, Any]:
+    meta = {k: v for k, v in metadata.items() if k != "reported"}
+    if reported is not None:
+        meta["reported"] = reported
+    return meta
 
 
 @router.get("/nodes", response_model=List[dict])
@@ -32,10 +47,12 @@ def create_node(payload: NodeCreate, db: Session = Depends(get_db), _: User = De
     if db.query(AdminNode).filter(AdminNode.name == payload.name).first():
         raise HTTPException(status_code=400, detail="Node name already exists")
     node = AdminNode(name=payload.name, status=payload.status or "offline")
+    if payload.metadata is not None:
+        node.meta = _admin_metadata(payload.metadata)
     db.add(node)
     db.commit()
     db.refresh(node)
-    return {"id": node.id, "name": node.name, "status": node.status}
+    return {"id": node.id, "name": node.name, "status": node.status, "metadata": node.meta}
 
 
 @router.put("/nodes/{node_id}", response_model=dict)
@@ -47,7 +64,75 @@ def update_node(node_id: int, payload: NodeUpdate, db: Session = Depends(get_db)
         node.name = payload.name
     if payload.status is not None:
         node.status = payload.status
+    if payload.metadata is not None:
+        node.meta = _admin_metadata(payload.metadata, (node.meta or {}).get("reported"))
     db.add(node)
     db.commit()
     db.refresh(node)
-    return {"id": node.id, "name": node.name, "status": node.status}
\ No newline at end of file
+    return {"id": node.id, "name": node.name, "status": node.status, "metadata": node.meta}
+
+class NodeHeartbeat(BaseModel):
+    name: str = Field(..., max_length=120)
+    status: str = Field("online", max_length=32)
+    metadata: Optional[dict[str, Any]] = None
+    cpu_percent: Optional[float] = Field(None, ge=0)
+    rx_bps: Optional[int] = Field(None, ge=0)
+    tx_bps: Optional[int] = Field(None, ge=0)
+    connections: Optional[int] = Field(None, ge=0)
+
+
+@router.post("/nodes/heartbeat", status_code=202)
+async def node_heartbeat(payload: NodeHeartbeat, x_node_token: Optional[str] = Header(None)):
+    """Nodes report every few seconds; reports are coalesced per worker and written in batches.
+
+    Unknown names are registered on first contact. Authenticated with NODE_HEARTBEAT_TOKEN.
+    `metadata` is stored under the node's metadata["reported"] and cannot change its group.
+    """
+    token = get_settings().node_heartbeat_token
+    if not token:
+        raise HTTPException(status_code=403, detail="Node heartbeats are not enabled")
+    if not x_node_token or not hmac.compare_digest(x_node_token, token):
+        raise HTTPException(status_code=401, detail="Invalid node token")
+    node_heartbeats.record(payload.name, payload.status, payload.metadata, payload.cpu_percent, payload.rx_bps, payload.tx_bps, payload.connections)
+    return {"ok": True}
+
+
+@router.get("/nodes/{node_id}/metrics", response_model=dict)
+def node_metrics(
+    node_id: int,
+    resolution: Literal["minute", "hour"] = "minute",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: Session = Depends(get_db),
+    _: User = Depends(require_roles(["admin", "operator"])),
+):
+    """Bucketed averages and peaks, oldest first; defaults to the last 6 hours (minute) or 7 days (hour)."""
+    period = 60 if resolution == "minute" else 3600
+    until = until or datetime.now(tz=timezone.utc)
+    since = since or until - (timedelta(hours=6) if period == 60 else timedelta(days=7))
+    rows = (
+        db.query(NodeMetric)
+        .filter(NodeMetric.node_id == node_id, NodeMetric.period_seconds == period, NodeMetric.bucket_start >= since, NodeMetric.bucket_start < until)
+        .order_by(NodeMetric.bucket_start.asc())
+        .limit(5000)
+        .all()
+    )
+    return {
+        "node_id": node_id,
+        "resolution": resolution,
+        "items": [
+            {
+                "bucket_start": m.bucket_start,
+                "samples": m.samples,
+                "cpu_avg": m.cpu_sum / m.cpu_samples if m.cpu_samples else None,
+                "cpu_max": m.cpu_max if m.cpu_samples else None,
+                "rx_bps_avg": m.rx_bps_sum // m.rx_bps_samples if m.rx_bps_samples else None,
+                "tx_bps_avg": m.tx_bps_sum // m.tx_bps_samples if m.tx_bps_samples else None,
+                "rx_bps_max": m.rx_bps_max if m.rx_bps_samples else None,
+                "tx_bps_max": m.tx_bps_max if m.tx_bps_samples else None,
+                "connections_avg": m.connections_sum / m.connections_samples if m.connections_samples else None,
+                "connections_max": m.connections_max if m.connections_samples else None,
+            }
+            for m in rows
+        ],
+    }
@@ -1,13 +1,17 @@
+import logging
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List, Any
 
-from app.db.session import get_db
+from app.db.session import get_async_db, get_db
 from app.core.auth import get_current_user, require_roles
 from app.models.user import User
 from app.models.notification import Notification
-from app.schemas.notification import NotificationRead
-from app.services.redis_client import get_redis
+from app.schemas.notification import NotificationBroadcastRequest, NotificationMarkRequest, NotificationRead
+from app.services.audit import record_audit_event
+from app.services import notifications
 
 router = APIRouter()
 
@@ -18,14 +22,63 @@ def my_notifications(db: Session = Depends(get_db), current_user: User = Depends
 
 
 @router.post("/notifications/send")
-async def send_notification(to_user: int, payload: Any, db: Session = Depends(get_db), _: User = Depends(require_roles(["admin", "operator"]))):
+async def send_notification(to_user: int, payload: Any, db: AsyncSession = Depends(get_async_db), _: User = Depends(require_roles(["admin", "operator"]))):
     notif = Notification(to_user=to_user, payload=payload, status="new")
     db.add(notif)
-    db.commit()
-    db.refresh(notif)
+    await db.commit()
+    await db.refresh(notif)
 
-    redis = get_redis()
-    await redis.publish(f"notifications:{to_user}", str(payload))
-    await redis.aclose()
+    # The row is the record; the stream only speeds delivery up, so a Redis outage is not an error here
+    try:
+        stream_id = await notifications.deliver(to_user, {"type": "notification", "notification_id": notif.id, "payload": payload}, notif.id)
+    except Exception as e:
+        logging.getLogger("app").warning("notification deliver_failed id=%s to_user=%s err=%s", notif.id, to_user, str(e))
+        stream_id = None
+        await notifications.invalidate_unread([to_user])
 
-    return {"status": "sent", "id": notif.id}
\ No newline at end of file
+    return {"status": "sent", "id": notif.id, "stream_id": stream_id}
+
+
+@router.post("/notifications/broadcast")
+async def broadcast_notification(
+    body: NotificationBroadcastRequest,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(require_roles(["admin"])),
+):
+    """Notify a whole segment: one INSERT for every row, then pipelined stream/publish batches."""
+    rows = await db.run_sync(notifications.insert_broadcast, body.segment, body.payload)
+    delivered = 0
+    try:
+        delivered = await notifications.fan_out(rows, body.payload)
+    except Exception as e:
+        # Rows are stored; recipients see them on their next /notifications fetch or resync
+        logging.getLogger("app").warning("notification broadcast_deliver_failed rows=%s err=%s", len(rows), str(e))
+        # Chunks already sent are fine, but which ones is unknown; reload every recipient's count
+        await notifications.invalidate_unread(uid for _, uid in rows)
+    segment = body.segment.model_dump(exclude_none=True, exclude={"user_ids"})
+    await db.run_sync(
+        record_audit_event,
+        current_user.id,
+        "notification_broadcast",
+        target=",".join(f"{k}={v}" for k, v in segment.items() if k != "include_inactive") or "user_ids",
+        meta={"recipients": len(rows), "delivered": delivered},
+    )
+    return {"status": "sent", "recipients": len(rows), "delivered": delivered}
+
+
+@router.get("/notifications/unread")
+async def my_unread_count(db: AsyncSession = Depends(get_async_db), current_user: User = Depends(get_current_user)):
+    try:
+        return {"unread": await notifications.unread_count(current_user.id)}
+    except Exception:
+        count = await db.scalar(select(func.count()).select_from(Notification).where(Notification.to_user == current_user.id, Notification.status != "read"))
+        return {"unread": count or 0}
+
+
+@router.post("/notifications/read")
+async def mark_notifications_read(payload: NotificationMarkRequest, current_user: User = Depends(get_current_user)):
+    """Read receipts are written in batches, so the list reflects them within a second or so.
+
+    Async on purpose: the receipt buffer is only touched on the event loop, where the flush swaps it.
+    """
+    return {"accepted": notifications.mark(current_user.id, payload.ids, "read")}
\ No newline at end of file
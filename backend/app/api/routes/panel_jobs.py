@@ -0,0 +1,36 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from typing import Optional
+
+from app.db.session import get_db
+from app.core.auth import get_current_user
+from app.models.panel_job import PanelJob
+from app.models.user import User
+from app.services.panel_jobs import job_view
+
+
+router = APIRouter()
+
+
+@router.get("/panel-jobs")
+def list_my_panel_jobs(
+    status: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """The caller's most recent panel jobs, newest first."""
+    q = select(PanelJob).where(PanelJob.user_id == current_user.id)
+    if status:
+        q = q.where(PanelJob.status == status)
+    jobs = db.scalars(q.order_by(PanelJob.created_at.desc()).limit(limit)).all()
+    return {"items": [job_view(j) for j in jobs]}
+
+
+@router.get("/panel-jobs/{job_id}")
+def get_panel_job(job_id: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    job = db.get(PanelJob, job_id)
+    if job is None or job.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"job": job_view(job)}
@@ -1,56 +1,167 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from decimal import Decimal, ROUND_HALF_UP
-import httpx
+import asyncio
+import csv
+import io
 import logging
 
-from app.db.session import get_db
+from app.db.session import get_async_db, get_db
 from app.models.user import User
 from app.models.panel import Panel
 from app.core.auth import require_roles, require_root_admin, get_current_user
+from app.core.config import get_settings
 from app.models.panel_inbound import PanelInbound
 from app.models.panel_created_user import PanelCreatedUser
+from app.models.panel_user_mirror import PanelUserMirror
 from app.models.user_panel_credentials import UserPanelCredential
 from pydantic import BaseModel, AnyHttpUrl
-import json
+import orjson
 from typing import Literal
-from datetime import datetime, timedelta, timezone
-from urllib.parse import urlparse, urlunparse
+from datetime import datetime, timezone
 from sqlalchemy.exc import IntegrityError, ProgrammingError, SQLAlchemyError
 from app.models.plan import Plan
-from app.models.wallet import Wallet, WalletTransaction
+from app.models.wallet import WalletHold
 from app.models.template import UserTemplate, Template, TemplateInbound
-from app.models.plan_template import UserPlanTemplate, PlanTemplateItem
 from app.services.audit import record_audit_event
+from app.services.pricing import effective_price
+from app.services import panel_jobs
+from app.services import wallet as wallet_service
+from app.services.panel_auth import panel_sessions
+from app.services.panel_discovery import panel_discovery
+from app.services.panel_adapters import CreatedPanelUser, PanelError, PanelUser, PlanLimits, UserQuery, adapter_class, get_adapter
+from app.services.panel_user_sync import mirror_owner, mirror_patch, mirror_patch_many, mirror_put, mirror_remove, query_mirror, sync_panel_users, sync_state
 
 
 router = APIRouter()
 
-def _join_url(base_url: str, path: str) -> str:
-    b = (base_url or "").rstrip("/")
-    p = path if path.startswith("/") else "/" + path
-    lb = b.lower()
-    if lb.endswith("/xui") and p.startswith("/xui/"):
-        b = b[:-4]
-    elif lb.endswith("/panel") and p.startswith("/panel/"):
-        b = b[:-6]
-    return b + p
-
-def effective_price_for_user(db: Session, user: User, plan_obj: Plan) -> Decimal:
+def _require_xui_assignment(db: Session, panel_id: int, user: User) -> None:
+    # Operators reach XUI panels through the admin account; they must be assigned via template
     try:
-        base = Decimal(str(plan_obj.price)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-        if user.role != "operator":
-            return base
-        upt = db.query(UserPlanTemplate).filter(UserPlanTemplate.user_id == user.id).first()
-        if not upt:
-            return base
-        it = db.query(PlanTemplateItem).filter(PlanTemplateItem.template_id == upt.template_id, PlanTemplateItem.plan_id == plan_obj.id).first()
-        return Decimal(str(it.price_override)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP) if it else base
+        ut = db.query(UserTemplate).filter(UserTemplate.user_id == user.id).first()
+        tpl = db.query(Template).filter(Template.id == ut.template_id).first() if ut else None
+        if not tpl or tpl.panel_id != panel_id:
+            raise HTTPException(status_code=403, detail="Operator not assigned to this XUI panel")
+    except HTTPException:
+        raise
     except Exception:
-        return Decimal(str(plan_obj.price)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+        raise HTTPException(status_code=403, detail="Operator assignment not found for this panel")
 
 
+def _panel_credentials(db: Session, panel: Panel, user: User, own_account: bool = False) -> tuple[str, str]:
+    """Credentials `user` acts with on `panel`: their own panel account, else the panel admin if assigned.
+
+    On XUI panels operators read through the admin account and need a template assignment;
+    with `own_account` (user creation) an XUI operator's own panel account is used when they
+    have one, as creation always did.
+    """
+    if user.role != "operator":
+        return panel.username, panel.password
+    rec = db.query(UserPanelCredential).filter(UserPanelCredential.user_id == user.id, UserPanelCredential.panel_id == panel.id).first()
+    if getattr(panel, "type", "marzban") == "xui":
+        if own_account and rec:
+            return rec.username, rec.password
+        _require_xui_assignment(db, panel.id, user)
+        return panel.username, panel.password
+    if rec:
+        return rec.username, rec.password
+    # Fallback: allow using panel default credentials only if a template is assigned to this operator for this panel
+    try:
+        ut = db.query(UserTemplate).filter(UserTemplate.user_id == user.id).first()
+        if not ut:
+            raise HTTPException(status_code=403, detail="Operator panel credentials not found. Ask admin to provision your panel access.")
+        tpl = db.query(Template).filter(Template.id == ut.template_id).first()
+        if not tpl or tpl.panel_id != panel.id:
+            raise HTTPException(status_code=403, detail="Operator panel credentials not found for this panel")
+    except HTTPException:
+        raise
+    except Exception:
+        raise HTTPException(status_code=403, detail="Operator panel credentials not found")
+    return panel.username, panel.password
+
+
+def _user_query(offset: int, limit: Optional[int], status: Optional[str], search: Optional[str], expiring_before: Optional[int], sort: Optional[str]) -> UserQuery:
+    if offset < 0 or (limit is not None and limit < 1):
+        raise HTTPException(status_code=400, detail="offset must be >= 0 and limit >= 1")
+    query = UserQuery(offset=offset, limit=limit, status=status or None, search=search or None, expiring_before=expiring_before, sort=sort or None)
+    try:
+        query.sort_key()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return query
+
+
+def _assigned_template(db: Session, panel_id: int, user: User) -> Optional[Template]:
+    try:
+        ut = db.query(UserTemplate).filter(UserTemplate.user_id == user.id).first()
+        tpl = db.query(Template).filter(Template.id == ut.template_id).first() if ut else None
+        return tpl if tpl and tpl.panel_id == panel_id else None
+    except Exception:
+        return None
+
+
+def _create_inbounds(db: Session, panel_id: int, user: User) -> list[str]:
+    # The operator's template for this panel wins over the panel-wide selection
+    tpl = _assigned_template(db, panel_id, user)
+    tpl_inbounds = [row.inbound_id for row in db.query(TemplateInbound).filter(TemplateInbound.template_id == tpl.id).order_by(TemplateInbound.id.asc()).all()] if tpl else []
+    return tpl_inbounds or [r.inbound_id for r in db.query(PanelInbound).filter(PanelInbound.panel_id == panel_id).order_by(PanelInbound.id.asc()).all()]
+
+
+def _hold_in_progress(hold: WalletHold) -> None:
+    if hold.status == "held":
+        raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+
+
+_KEY_REUSED = "This Idempotency-Key was already used for a different request"
+
+
+async def _place_hold(
+    db: AsyncSession, user: User, price: Decimal, reason: str, idempotency_key: Optional[str], scope: str, fingerprint: str
+) -> tuple[Optional[WalletHold], bool]:
+    try:
+        return await db.run_sync(wallet_service.place_hold, user.id, price, reason, idempotency_key, scope, fingerprint)
+    except wallet_service.IdempotencyConflict:
+        raise HTTPException(status_code=422, detail=_KEY_REUSED)
+
+
+def _wants_job(prefer: Optional[str]) -> bool:
+    """`Prefer: respond-async` (RFC 7240) asks for a 202 and a panel job instead of waiting on the panel."""
+    return bool(prefer) and "respond-async" in prefer.lower()
+
+
+async def _accept_job(
+    db: AsyncSession,
+    user: User,
+    panel_id: int,
+    kind: str,
+    params: dict,
+    price: Decimal = Decimal("0"),
+    reason: str = "",
+    idempotency_key: Optional[str] = None,
+    fingerprint: Optional[str] = None,
+) -> ORJSONResponse:
+    try:
+        job, fresh = await db.run_sync(panel_jobs.submit, user.id, panel_id, kind, params, price, reason, idempotency_key, fingerprint)
+    except wallet_service.IdempotencyConflict:
+        raise HTTPException(status_code=422, detail=_KEY_REUSED)
+    if job is None:
+        raise HTTPException(status_code=402, detail="Insufficient wallet balance")
+    if fresh:
+        try:
+            await panel_jobs.push([job.id])
+        except Exception as e:
+            # The job is committed; the worker relay pushes it shortly
+            logging.getLogger("app").warning("panel_job push_failed id=%s err=%s", job.id, str(e))
+    return ORJSONResponse(
+        status_code=202,
+        content={"job": panel_jobs.job_view(job)},
+        headers={"Location": f"{get_settings().api_prefix}/panel-jobs/{job.id}"},
+    )
+
 
 class PanelCreate(BaseModel):
     name: str
@@ -90,17 +201,8 @@ def list_panels(db: Session = Depends(get_db), _: User = Depends(require_root_ad
 @router.get("/panels/my", response_model=List[PanelRead])
 def list_my_panels(db: Session = Depends(get_db), current_user: User = Depends(require_roles(["admin", "operator"]))):
     # Root admin: all panels
-    try:
-      from app.core.config import get_settings
-      from app.models.root_admin import RootAdmin
-      settings = get_settings()
-      emails = {e.strip().lower() for e in settings.root_admin_emails.split(",") if e.strip()}
-      is_env_root = current_user.email.lower() in emails
-      is_db_root = db.query(RootAdmin).filter(RootAdmin.user_id == current_user.id).first() is not None
-      if current_user.role == "admin" and (is_env_root or is_db_root):
-          return db.query(Panel).order_by(Panel.id.desc()).all()
-    except Exception:
-      pass
+    if current_user.is_root_admin:
+        return db.query(Panel).order_by(Panel.id.desc()).all()
     # Operator: panels with stored credentials
     if current_user.role == "operator":
         panels = (
@@ -178,6 +280,8 @@ def delete_panel(panel_id: int, db: Session = Depends(get_db), _: User = Depends
         raise HTTPException(status_code=404, detail="Panel not found")
     db.delete(panel)
     db.commit()
+    panel_sessions.invalidate_panel(panel.base_url)
+    panel_discovery.reset(panel_id)
     return {"ok": True}
 
 
@@ -196,92 +300,9 @@ class PanelTestResponse(BaseModel):
     error: Optional[str] = None
 
 
-async def _try_login(base_url: str, username: str, password: str) -> tuple[bool, Optional[str], Optional[int], Optional[str]]:
-    # Use official Marzban endpoint first
-    async with httpx.AsyncClient(timeout=10.0, verify=False, follow_redirects=True) as client:  # allow redirects
-        url = base_url.rstrip("/") + "/api/admin/token"
-        last_error = None
-        for method in ("form", "json"):
-            try:
-                if method == "form":
-                    res = await client.post(url, data={"username": username, "password": password})
-                else:
-                    res = await client.post(url, json={"username": username, "password": password})
-            except Exception as e:
-                last_error = str(e)
-                continue
-            if res.headers.get("content-type", "").startswith("application/json"):
-                try:
-                    data = res.json()
-                except Exception:
-                    data = {}
-                token = data.get("access_token") or data.get("token")
-                if token:
-                    # Optionally verify the token by calling GET /api/admin
-                    try:
-                        chk = await client.get(base_url.rstrip("/") + "/api/admin", headers={"Authorization": f"Bearer {token}"})
-                        if chk.status_code in (200, 204):
-                            return True, "/api/admin/token", res.status_code, token[:12] + "..."
-                    except Exception:
-                        pass
-                    return True, "/api/admin/token", res.status_code, token[:12] + "..."
-                if res.status_code in (401, 403):
-                    return False, "/api/admin/token", res.status_code, "Unauthorized"
-        # fallback: reachability
-        try:
-            res = await client.get(base_url.rstrip("/") + "/docs")
-            if res.status_code == 200:
-                return False, "/docs", 200, "Reachable, but login failed"
-        except Exception as e:
-            last_error = str(e)
-    return False, None, None, last_error
-
-
-async def _try_login_xui(base_url: str, username: str, password: str) -> tuple[bool, Optional[str], Optional[int], Optional[str]]:
-    # X-UI typically uses cookie-based auth via /login or /xui/login
-    last_error = None
-    async with httpx.AsyncClient(timeout=10.0, verify=False, follow_redirects=True) as client:
-        for path in ("/xui/login", "/login"):
-            url = base_url.rstrip("/") + path
-            try:
-                # Common fields for x-ui login
-                res = await client.post(url, data={"username": username, "password": password})
-            except Exception as e:
-                last_error = str(e)
-                continue
-            # Check for set-cookie
-            sc = res.headers.get("set-cookie") or res.headers.get("Set-Cookie")
-            if sc and res.status_code in (200, 204, 302):
-                # Try to access a protected page/json to confirm
-                try:
-                    # Some panels expose /xui/inbounds or /panel/inbounds
-                    for check_path in ("/xui/inbounds", "/panel/inbounds", "/xui/", "/"):
-                        chk = await client.get(base_url.rstrip("/") + check_path)
-                        if chk.status_code in (200, 204):
-                            # Return cookie preview as token_preview
-                            return True, path, res.status_code, (sc.split(";")[0][:24] + "...")
-                except Exception:
-                    pass
-                return True, path, res.status_code, (sc.split(";")[0][:24] + "...")
-            if res.status_code in (401, 403):
-                return False, path, res.status_code, "Unauthorized"
-        # Fallback: check reachability
-        try:
-            chk = await client.get(base_url.rstrip("/") + "/xui/")
-            if chk.status_code == 200:
-                return False, "/xui/", 200, "Reachable, but login failed"
-        except Exception as e:
-            last_error = str(e)
-    return False, None, None, last_error
-
-
 @router.post("/panels/test", response_model=PanelTestResponse)
 async def test_panel(payload: PanelTestRequest, _: User = Depends(require_root_admin)):
-    ptype = (payload.type or "marzban").lower()
-    if ptype == "xui":
-        ok, endpoint, status, info = await _try_login_xui(str(payload.base_url), payload.username, payload.password)
-    else:
-        ok, endpoint, status, info = await _try_login(str(payload.base_url), payload.username, payload.password)
+    ok, endpoint, status, info = await adapter_class(payload.type).probe(str(payload.base_url), payload.username, payload.password)
     if ok:
         return PanelTestResponse(ok=True, endpoint=endpoint, status=status, token_preview=info)
     return PanelTestResponse(ok=False, endpoint=endpoint, status=status, error=info)
@@ -298,119 +319,15 @@ class PanelInboundsResponse(BaseModel):
 
 
 @router.get("/panels/{panel_id}/inbounds", response_model=PanelInboundsResponse)
-async def list_inbounds(panel_id: int, db: Session = Depends(get_db), _: User = Depends(require_root_admin)):
-    panel = db.query(Panel).filter(Panel.id == panel_id).first()
+async def list_inbounds(panel_id: int, db: AsyncSession = Depends(get_async_db), _: User = Depends(require_root_admin)):
+    panel = await db.get(Panel, panel_id)
     if not panel:
         raise HTTPException(status_code=404, detail="Panel not found")
-    # XUI: cookie-based and endpoints differ
-    if getattr(panel, "type", "marzban") == "xui":
-        async with httpx.AsyncClient(timeout=15.0, verify=False, follow_redirects=True) as client:
-            # login (try several field variants)
-            logged_in = False
-            login_variants = [
-                {"username": panel.username, "password": panel.password},
-                {"username": panel.username, "password": panel.password, "remember": "on"},
-                {"username": panel.username, "password": panel.password, "remember_me": "true"},
-            ]
-            for path in ("/xui/login", "/login"):
-                for body in login_variants:
-                    try:
-                        r = await client.post(panel.base_url.rstrip("/") + path, data=body)
-                        if r.status_code in (200, 204, 302) and (r.headers.get("set-cookie") or r.headers.get("Set-Cookie")):
-                            logged_in = True
-                            break
-                    except Exception:
-                        continue
-                if logged_in:
-                    break
-            if not logged_in:
-                raise HTTPException(status_code=502, detail="Login to XUI failed")
-            # fetch inbounds via common XUI endpoints
-            data = None
-            endpoints = (
-                "/xui/api/inbounds/list",
-                "/xui/api/inbounds",
-                "/xui/API/inbounds",
-                "/xui/inbound/list",
-                "/xui/inbounds/list",
-                "/panel/api/inbounds/list",
-                "/panel/inbounds/list",
-                "/panel/inbounds",
-                "/api/inbounds",
-            )
-            for ep in endpoints:
-                try:
-                    res = await client.get(panel.base_url.rstrip("/") + ep, headers={"Accept": "application/json"})
-                    if res.headers.get("content-type", "").startswith("application/json"):
-                        data = res.json()
-                        break
-                except Exception:
-                    continue
-            items: list[InboundItem] = []
-            if isinstance(data, dict):
-                # variants: { obj: [...] } or { inbounds: [...] } or { items: [...] } or { data: [...] } or { list: [...] }
-                candidates = None
-                for key in ("obj", "inbounds", "items", "data", "list"):
-                    if isinstance(data.get(key), list):
-                        candidates = data.get(key)
-                        break
-                # sometimes nested under data: { data: { items: [...] } }
-                if candidates is None and isinstance(data.get("data"), dict):
-                    for key in ("items", "inbounds", "list", "obj"):
-                        if isinstance(data["data"].get(key), list):
-                            candidates = data["data"][key]
-                            break
-                if isinstance(candidates, list):
-                    for it in candidates:
-                        if not isinstance(it, dict):
-                            continue
-                        iid = str(it.get("id") or it.get("tag") or it.get("remark") or it.get("listen") or "")
-                        remark = it.get("remark") or ":".join([str(it.get("protocol")) if it.get("protocol") else "", str(it.get("port")) if it.get("port") else ""]).strip(":")
-                        items.append(InboundItem(id=iid, tag=str(it.get("tag") or None) or None, remark=remark or None))
-            elif isinstance(data, list):
-                for it in data:
-                    if not isinstance(it, dict):
-                        continue
-                    iid = str(it.get("id") or it.get("tag") or it.get("remark") or it.get("listen") or "")
-                    remark = it.get("remark") or ":".join([str(it.get("protocol")) if it.get("protocol") else "", str(it.get("port")) if it.get("port") else ""]).strip(":")
-                    items.append(InboundItem(id=iid, tag=str(it.get("tag") or None) or None, remark=remark or None))
-            return PanelInboundsResponse(items=items)
-
-    # Marzban default
-    token = await _login_get_token(panel.base_url, panel.username, panel.password)
-    if not token:
-        raise HTTPException(status_code=502, detail="Login to panel failed")
-    headers = {"Authorization": f"Bearer {token}"}
-    url = panel.base_url.rstrip("/") + "/api/inbounds"
-    async with httpx.AsyncClient(timeout=15.0, verify=False, follow_redirects=True) as client:
-        res = await client.get(url, headers=headers)
-        if not res.headers.get("content-type", "").startswith("application/json"):
-            raise HTTPException(status_code=502, detail="Unexpected response")
-        data = res.json()
-        items: list[InboundItem] = []
-        # Case 1: API returns a list of inbounds
-        if isinstance(data, list):
-            for it in data:
-                iid = str(it.get("tag") or it.get("id") or it.get("_id") or it.get("remark") or "")
-                remark = it.get("remark") or ":".join([str(it.get("protocol")) if it.get("protocol") else "", str(it.get("port")) if it.get("port") else ""]).strip(":")
-                items.append(InboundItem(id=iid, tag=it.get("tag"), remark=remark or None))
-        # Case 2: { items: [...] }
-        elif isinstance(data, dict) and isinstance(data.get("items"), list):
-            for it in data["items"]:
-                iid = str(it.get("tag") or it.get("id") or it.get("_id") or it.get("remark") or "")
-                remark = it.get("remark") or ":".join([str(it.get("protocol")) if it.get("protocol") else "", str(it.get("port")) if it.get("port") else ""]).strip(":")
-                items.append(InboundItem(id=iid, tag=it.get("tag"), remark=remark or None))
-        # Case 3: dict of arrays (e.g., { group1: [ {...}, ... ], group2: [...] })
-        elif isinstance(data, dict):
-            for key, value in data.items():
-                if isinstance(value, list):
-                    for it in value:
-                        if not isinstance(it, dict):
-                            continue
-                        iid = str(it.get("tag") or it.get("id") or it.get("_id") or it.get("remark") or key)
-                        remark = it.get("remark") or ":".join([str(it.get("protocol")) if it.get("protocol") else "", str(it.get("port")) if it.get("port") else ""]).strip(":")
-                        items.append(InboundItem(id=iid, tag=it.get("tag"), remark=remark or None))
-        return PanelInboundsResponse(items=items)
+    try:
+        inbounds = await get_adapter(panel).list_inbounds()
+    except PanelError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    return PanelInboundsResponse(items=[InboundItem(id=it.id, tag=it.tag, remark=it.remark) for it in inbounds])
 
 
 class HostItem(BaseModel):
@@ -422,29 +339,15 @@ class PanelHostsResponse(BaseModel):
 
 
 @router.get("/panels/{panel_id}/hosts", response_model=PanelHostsResponse)
-async def list_hosts(panel_id: int, db: Session = Depends(get_db), _: User = Depends(require_root_admin)):
-    panel = db.query(Panel).filter(Panel.id == panel_id).first()
+async def list_hosts(panel_id: int, db: AsyncSession = Depends(get_async_db), _: User = Depends(require_root_admin)):
+    panel = await db.get(Panel, panel_id)
     if not panel:
         raise HTTPException(status_code=404, detail="Panel not found")
-    token = await _login_get_token(panel.base_url, panel.username, panel.password)
-    if not token:
-        raise HTTPException(status_code=502, detail="Login to panel failed")
-    headers = {"Authorization": f"Bearer {token}"}
-    url = panel.base_url.rstrip("/") + "/api/hosts"
-    async with httpx.AsyncClient(timeout=15.0, verify=False) as client:
-        res = await client.get(url, headers=headers)
-        if not res.headers.get("content-type", "").startswith("application/json"):
-            raise HTTPException(status_code=502, detail="Unexpected response")
-        data = res.json()
-        items: list[HostItem] = []
-        if isinstance(data, list):
-            items = [HostItem(host=str(h)) for h in data]
-        elif isinstance(data, dict):
-            for key in ("hosts", "items", "domains"):
-                if isinstance(data.get(key), list):
-                    items = [HostItem(host=str(h)) for h in data[key]]
-                    break
-        return PanelHostsResponse(items=items)
+    try:
+        hosts = await get_adapter(panel).list_hosts()
+    except PanelError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    return PanelHostsResponse(items=[HostItem(host=h) for h in hosts])
 
 
 class PanelUserListItem(BaseModel):
@@ -457,159 +360,95 @@ class PanelUserListItem(BaseModel):
 
 class PanelUsersResponse(BaseModel):
     items: list[PanelUserListItem]
+    # Users matching the filters, before limit/offset
+    total: Optional[int] = None
+    # When the local mirror was last refreshed from the panel
+    synced_at: Optional[datetime] = None
 
 
 @router.get("/panels/{panel_id}/users", response_model=PanelUsersResponse)
-async def list_panel_users(panel_id: int, db: Session = Depends(get_db), current_user: User = Depends(require_roles(["admin", "operator"]))):
-    panel = db.query(Panel).filter(Panel.id == panel_id).first()
+async def list_panel_users(
+    panel_id: int,
+    refresh: bool = False,
+    limit: Optional[int] = None,
+    offset: int = 0,
+    status: Optional[str] = None,
+    search: Optional[str] = None,
+    expiring_before: Optional[int] = None,
+    sort: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db), current_user: User = Depends(require_roles(["admin", "operator"])),
+):
+    query = _user_query(offset, limit, status, search, expiring_before, sort)
+    panel = await db.get(Panel, panel_id)
     if not panel:
         raise HTTPException(status_code=404, detail="Panel not found")
-    cred_username = panel.username
-    cred_password = panel.password
-    if current_user.role == "operator":
-        if getattr(panel, "type", "marzban") == "xui":
-            # For XUI, always use panel admin credentials; enforce operator is assigned to this panel
-            try:
-                ut = db.query(UserTemplate).filter(UserTemplate.user_id == current_user.id).first()
-                tpl = db.query(Template).filter(Template.id == ut.template_id).first() if ut else None
-                if not tpl or tpl.panel_id != panel_id:
-                    raise HTTPException(status_code=403, detail="Operator not assigned to this XUI panel")
-            except HTTPException:
-                raise
-            except Exception:
-                raise HTTPException(status_code=403, detail="Operator assignment not found for this panel")
-        else:
-            rec = db.query(UserPanelCredential).filter(UserPanelCredential.user_id == current_user.id, UserPanelCredential.panel_id == panel_id).first()
-            if rec:
-                cred_username = rec.username
-                cred_password = rec.password
-            else:
-                # Fallback: allow using panel default credentials only if a template is assigned to this operator for this panel
-                try:
-                    ut = db.query(UserTemplate).filter(UserTemplate.user_id == current_user.id).first()
-                    if not ut:
-                        raise HTTPException(status_code=403, detail="Operator panel credentials not found. Ask admin to provision your panel access.")
-                    tpl = db.query(Template).filter(Template.id == ut.template_id).first()
-                    if not tpl or tpl.panel_id != panel_id:
-                        raise HTTPException(status_code=403, detail="Operator panel credentials not found for this panel")
-                    # else: keep using panel.username/password
-                except HTTPException:
-                    raise
-                except Exception:
-                    raise HTTPException(status_code=403, detail="Operator panel credentials not found")
-    # XUI branch
-    if getattr(panel, "type", "marzban") == "xui":
-        async with httpx.AsyncClient(timeout=20.0, verify=False, follow_redirects=True) as client:
-            # login cookie
-            logged_in = False
-            for path in ("/xui/login", "/login"):
-                try:
-                    r = await client.post(_join_url(panel.base_url, path), data={"username": cred_username, "password": cred_password, "remember": "on"})
-                    if r.status_code in (200, 204, 302) and (r.headers.get("set-cookie") or r.headers.get("Set-Cookie")):
-                        logged_in = True
-                        break
-                except Exception:
-                    continue
-            if not logged_in:
-                raise HTTPException(status_code=502, detail="Login to XUI failed")
-            # Get inbounds and parse clients
-            # Try multiple endpoints to fetch inbounds (like we do above)
-            data = None
-            for ep in ("/xui/api/inbounds", "/xui/api/inbounds/list", "/xui/API/inbounds", "/panel/api/inbounds/list", "/panel/inbounds"):
-                try:
-                    res = await client.get(panel.base_url.rstrip("/") + ep, headers={"Accept": "application/json"})
-                    if res.headers.get("content-type", "").startswith("application/json"):
-                        data = res.json()
-                        break
-                except Exception:
-                    continue
-            items: list[PanelUserListItem] = []
-            inbounds_list = None
-            if isinstance(data, dict):
-                for key in ("obj", "inbounds", "items", "data", "list"):
-                    v = data.get(key)
-                    if isinstance(v, list):
-                        inbounds_list = v
-                        break
-                if inbounds_list is None and isinstance(data.get("data"), dict):
-                    for key in ("items", "inbounds", "list", "obj"):
-                        if isinstance(data["data"].get(key), list):
-                            inbounds_list = data["data"][key]
-                            break
-            elif isinstance(data, list):
-                inbounds_list = data
-            # Extract clients from inbounds
-            if isinstance(inbounds_list, list):
-                for inbound in inbounds_list:
-                    if not isinstance(inbound, dict):
-                        continue
-                    # clients can be in settings.clients as JSON string or object
-                    clients = []
-                    settings = inbound.get("settings")
-                    if isinstance(settings, str):
-                        try:
-                            settings = json.loads(settings)
-                        except Exception:
-                            settings = None
-                    if isinstance(settings, dict) and isinstance(settings.get("clients"), list):
-                        clients = settings.get("clients")
-                    # Some variants have clients field at top level
-                    if not clients and isinstance(inbound.get("clients"), list):
-                        clients = inbound.get("clients")
-                    for c in clients:
-                        if not isinstance(c, dict):
-                            continue
-                        email = str(c.get("email") or c.get("name") or c.get("username") or "")
-                        expire_ms = c.get("expiryTime") or c.get("expire")
-                        expire_ts = None
-                        if isinstance(expire_ms, (int, float)):
-                            # detect ms vs s
-                            expire_ts = int(expire_ms / 1000) if expire_ms > 10**10 else int(expire_ms)
-                        data_limit = c.get("totalGB")
-                        if isinstance(data_limit, str):
-                            try:
-                                data_limit = int(data_limit)
-                            except Exception:
-                                data_limit = None
-                        # Map GB to bytes if small number
-                        if isinstance(data_limit, (int, float)) and data_limit and data_limit < 10**9:
-                            data_limit = int(data_limit) * (1024**3)
-                        items.append(PanelUserListItem(
-                            username=email,
-                            status=None,
-                            data_limit=data_limit if isinstance(data_limit, int) else None,
-                            expire=expire_ts,
-                            subscription_url=None,
-                        ))
-            return PanelUsersResponse(items=items)
-
-    token = await _login_get_token(panel.base_url, cred_username, cred_password)
-    if not token:
-        raise HTTPException(status_code=502, detail="Login to panel failed")
-    headers = {"Authorization": f"Bearer {token}"}
-    async with httpx.AsyncClient(timeout=20.0, verify=False) as client:
-        r = await client.get(panel.base_url.rstrip("/") + "/api/users", headers=headers)
-        if not r.headers.get("content-type", "").startswith("application/json"):
-            raise HTTPException(status_code=502, detail="Unexpected response")
-        data = r.json()
-        items: list[PanelUserListItem] = []
-        if isinstance(data, list):
-            src = data
-        elif isinstance(data, dict) and isinstance(data.get("items"), list):
-            src = data["items"]
-        else:
-            src = []
-        for it in src:
-            if not isinstance(it, dict):
-                continue
-            items.append(PanelUserListItem(
-                username=str(it.get("username") or it.get("name") or ""),
-                status=it.get("status"),
-                data_limit=it.get("data_limit"),
-                expire=it.get("expire"),
-                subscription_url=_canonicalize_subscription_url(panel.base_url, it.get("subscription_url") or it.get("subscription") or None),
-            ))
-        return PanelUsersResponse(items=items)
+    cred_username, cred_password = await db.run_sync(_panel_credentials, panel, current_user)
+    # Served from the mirror kept by services.panel_user_sync; scrape the panel only if asked or never synced
+    state = await db.run_sync(sync_state, panel_id, cred_username)
+    if refresh or state is None or state.synced_at is None:
+        try:
+            state = await sync_panel_users(db, panel, cred_username, cred_password)
+        except PanelError as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+        except Exception as e:
+            raise HTTPException(status_code=502, detail=str(e))
+    rows, total = await db.run_sync(query_mirror, panel_id, cred_username, query)
+    items = [
+        PanelUserListItem(username=r.username, status=r.status, data_limit=r.data_limit, expire=r.expire, subscription_url=r.subscription_url)
+        for r in rows
+    ]
+    return PanelUsersResponse(items=items, total=total, synced_at=state.synced_at)
+
+
+# Flush the export stream in chunks of about this many bytes
+_EXPORT_CHUNK_BYTES = 64 * 1024
+_EXPORT_FIELDS = ("username", "status", "data_limit", "expire", "subscription_url")
+
+
+@router.get("/panels/{panel_id}/users/export")
+async def export_panel_users(panel_id: int, format: Literal["ndjson", "csv"] = "ndjson", db: AsyncSession = Depends(get_async_db), current_user: User = Depends(require_roles(["admin", "operator"]))):
+    panel = await db.get(Panel, panel_id)
+    if not panel:
+        raise HTTPException(status_code=404, detail="Panel not found")
+    cred_username, cred_password = await db.run_sync(_panel_credentials, panel, current_user)
+    adapter = get_adapter(panel, cred_username, cred_password)
+    # Fail with a proper status before the first byte is sent
+    try:
+        await adapter.login()
+    except PanelError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+    def _csv_line(values) -> bytes:
+        buf = io.StringIO()
+        csv.writer(buf).writerow(["" if v is None else v for v in values])
+        return buf.getvalue().encode()
+
+    async def _rows():
+        chunk: list[bytes] = []
+        size = 0
+        if format == "csv":
+            chunk.append(_csv_line(_EXPORT_FIELDS))
+        count = 0
+        try:
+            async for user in adapter.stream_users():
+                line = _csv_line([getattr(user, f) for f in _EXPORT_FIELDS]) if format == "csv" else orjson.dumps(user.model_dump()) + b"\n"
+                chunk.append(line)
+                size += len(line)
+                count += 1
+                if size >= _EXPORT_CHUNK_BYTES:
+                    yield b"".join(chunk)
+                    chunk, size = [], 0
+        except Exception as e:
+            # Headers are already out; leave a marker NDJSON readers can detect
+            logging.getLogger("app").warning("export_panel_users failed panel_id=%s after=%s err=%s", panel_id, count, str(getattr(e, "detail", None) or e))
+            if format == "ndjson":
+                chunk.append(orjson.dumps({"error": str(getattr(e, "detail", None) or e)}) + b"\n")
+        if chunk:
+            yield b"".join(chunk)
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    headers = {"Content-Disposition": f'attachment; filename="panel-{panel_id}-users.{format}"'}
+    return StreamingResponse(_rows(), media_type=media_type, headers=headers)
 
 
 class PanelUserListItemWithPanel(BaseModel):
@@ -623,50 +462,65 @@ class PanelUserListItemWithPanel(BaseModel):
 
 class PanelUsersByUserResponse(BaseModel):
     items: list[PanelUserListItemWithPanel]
+    total: Optional[int] = None
+    # panel_id -> reason, for panels that failed or timed out; items from the others are still returned
+    errors: dict[int, str] = {}
 
 
 @router.get("/panels/users/by-user/{user_id}", response_model=PanelUsersByUserResponse)
-async def list_panel_users_by_user(user_id: int, db: Session = Depends(get_db), _: User = Depends(require_root_admin)):
-    # Find panels with stored credentials for this operator
-    records = db.query(UserPanelCredential).filter(UserPanelCredential.user_id == user_id).all()
+async def list_panel_users_by_user(
+    user_id: int,
+    limit: Optional[int] = None,
+    offset: int = 0,
+    status: Optional[str] = None,
+    search: Optional[str] = None,
+    expiring_before: Optional[int] = None,
+    sort: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
+    _: User = Depends(require_root_admin),
+):
+    query = _user_query(offset, limit, status, search, expiring_before, sort)
+    # Panels with stored credentials for this operator, in one query
+    records = (
+        await db.execute(
+            select(UserPanelCredential, Panel)
+            .join(Panel, Panel.id == UserPanelCredential.panel_id)
+            .where(UserPanelCredential.user_id == user_id)
+        )
+    ).all()
     if not records:
-        return PanelUsersByUserResponse(items=[])
+        return PanelUsersByUserResponse(items=[], total=0)
+    settings = get_settings()
+    # Each panel answers the first offset+limit matches; the merged list is then sorted and paged once
+    per_panel = query.model_copy(update={"offset": 0, "limit": None if query.limit is None else query.offset + query.limit})
+    sem = asyncio.Semaphore(max(1, settings.panel_fanout_concurrency))
+
+    async def _fetch(rec: UserPanelCredential, panel: Panel):
+        # The time budget starts once a slot is free, so queued panels are not penalised
+        async with sem:
+            return await asyncio.wait_for(
+                get_adapter(panel, rec.username, rec.password).query_users(per_panel),
+                timeout=settings.panel_fanout_timeout_seconds,
+            )
+
+    results = await asyncio.gather(*(_fetch(rec, panel) for rec, panel in records), return_exceptions=True)
     items: list[PanelUserListItemWithPanel] = []
-    async with httpx.AsyncClient(timeout=20.0, verify=False) as client:
-        for rec in records:
-            panel = db.query(Panel).filter(Panel.id == rec.panel_id).first()
-            if not panel:
-                continue
-            # Login with operator's panel credentials
-            token = await _login_get_token(panel.base_url, rec.username, rec.password)
-            if not token:
-                continue
-            headers = {"Authorization": f"Bearer {token}"}
-            try:
-                r = await client.get(panel.base_url.rstrip("/") + "/api/users", headers=headers)
-                if not r.headers.get("content-type", "").startswith("application/json"):
-                    continue
-                data = r.json()
-                if isinstance(data, dict) and isinstance(data.get("items"), list):
-                    src = data["items"]
-                elif isinstance(data, list):
-                    src = data
-                else:
-                    src = []
-                for it in src:
-                    if not isinstance(it, dict):
-                        continue
-                    items.append(PanelUserListItemWithPanel(
-                        panel_id=panel.id,
-                        username=str(it.get("username") or it.get("name") or ""),
-                        status=it.get("status"),
-                        data_limit=it.get("data_limit"),
-                        expire=it.get("expire"),
-                        subscription_url=_canonicalize_subscription_url(panel.base_url, it.get("subscription_url") or it.get("subscription") or None),
-                    ))
-            except Exception:
-                continue
-    return PanelUsersByUserResponse(items=items)
+    errors: dict[int, str] = {}
+    total: Optional[int] = 0
+    for (rec, panel), result in zip(records, results):
+        if isinstance(result, asyncio.TimeoutError):
+            errors[panel.id] = "Timed out"
+            continue
+        if isinstance(result, BaseException):
+            errors[panel.id] = getattr(result, "detail", None) or str(result) or type(result).__name__
+            continue
+        users, panel_total = result
+        items.extend(PanelUserListItemWithPanel(panel_id=panel.id, **u.model_dump()) for u in users)
+        total = total + panel_total if total is not None and panel_total is not None else None
+    if errors:
+        logging.getLogger("app").warning("panel_users_by_user partial user_id=%s failed=%s", user_id, sorted(errors))
+    page, merged_total = query.apply(items)
+    return PanelUsersByUserResponse(items=page, total=total if total is not None and query.limit is not None else merged_total, errors=errors)
 
 
 class PanelInboundSelectRequest(BaseModel):
@@ -752,202 +606,16 @@ class PanelUserInfoResponse(BaseModel):
 
 
 @router.get("/panels/{panel_id}/user/{username}/info", response_model=PanelUserInfoResponse)
-async def get_panel_user_info(panel_id: int, username: str, db: Session = Depends(get_db), current_user: User = Depends(require_roles(["admin", "operator"]))):
-    panel = db.query(Panel).filter(Panel.id == panel_id).first()
+async def get_panel_user_info(panel_id: int, username: str, db: AsyncSession = Depends(get_async_db), current_user: User = Depends(require_roles(["admin", "operator"]))):
+    panel = await db.get(Panel, panel_id)
     if not panel:
         raise HTTPException(status_code=404, detail="Panel not found")
-    # XUI branch: read clients from inbounds and construct share link
-    if getattr(panel, "type", "marzban") == "xui":
-        async with httpx.AsyncClient(timeout=15.0, verify=False) as client:
-            # login cookie
-            logged_in = False
-            for path in ("/xui/login", "/login"):
-                try:
-                    r = await client.post(panel.base_url.rstrip("/") + path, data={"username": panel.username, "password": panel.password, "remember": "on"})
-                    if r.status_code in (200, 204, 302) and (r.headers.get("set-cookie") or r.headers.get("Set-Cookie")):
-                        logged_in = True
-                        break
-                except Exception:
-                    continue
-            if not logged_in:
-                raise HTTPException(status_code=502, detail="Login to XUI failed")
-            # fetch inbounds
-            data = None
-            for ep in ("/xui/api/inbounds", "/xui/api/inbounds/list", "/xui/API/inbounds", "/panel/api/inbounds/list", "/panel/inbounds"):
-                try:
-                    res = await client.get(panel.base_url.rstrip("/") + ep, headers={"Accept": "application/json"})
-                    if res.headers.get("content-type", "").startswith("application/json"):
-                        data = res.json()
-                        break
-                except Exception:
-                    continue
-            inbounds_list = None
-            if isinstance(data, dict):
-                for key in ("obj", "inbounds", "items", "data", "list"):
-                    v = data.get(key)
-                    if isinstance(v, list):
-                        inbounds_list = v
-                        break
-                if inbounds_list is None and isinstance(data.get("data"), dict):
-                    for key in ("items", "inbounds", "list", "obj"):
-                        if isinstance(data["data"].get(key), list):
-                            inbounds_list = data["data"][key]
-                            break
-            elif isinstance(data, list):
-                inbounds_list = data
-            # locate client
-            found = None
-            found_inbound = None
-            if isinstance(inbounds_list, list):
-                for inbound in inbounds_list:
-                    if not isinstance(inbound, dict):
-                        continue
-                    settings = inbound.get("settings")
-                    if isinstance(settings, str):
-                        try:
-                            settings = json.loads(settings)
-                        except Exception:
-                            settings = None
-                    clients = []
-                    if isinstance(settings, dict) and isinstance(settings.get("clients"), list):
-                        clients = settings.get("clients")
-                    if not clients and isinstance(inbound.get("clients"), list):
-                        clients = inbound.get("clients")
-                    for c in clients:
-                        if not isinstance(c, dict):
-                            continue
-                        email = str(c.get("email") or c.get("name") or c.get("username") or "")
-                        if email == username:
-                            found = c
-                            found_inbound = inbound
-                            break
-                    if found:
-                        break
-            if not found:
-                raise HTTPException(status_code=404, detail="User not found on XUI")
-            # map fields
-            expire_ms = found.get("expiryTime") or found.get("expire")
-            expire_ts = None
-            if isinstance(expire_ms, (int, float)):
-                expire_ts = int(expire_ms / 1000) if expire_ms > 10**10 else int(expire_ms)
-            data_limit = found.get("totalGB")
-            if isinstance(data_limit, str):
-                try:
-                    data_limit = int(data_limit)
-                except Exception:
-                    data_limit = None
-            if isinstance(data_limit, (int, float)) and data_limit and data_limit < 10**9:
-                data_limit = int(data_limit) * (1024**3)
-            # build share link if possible
-            client_id = None
-            for k in ("id", "uuid", "clientId", "client_id"):
-                if isinstance(found.get(k), str):
-                    client_id = found.get(k)
-                    break
-            sub = _xui_build_share_link(panel.base_url, found_inbound or {}, username, client_id)
-            return PanelUserInfoResponse(
-                username=username,
-                data_limit=data_limit if isinstance(data_limit, int) else None,
-                used=None,
-                remaining=None,
-                expire=expire_ts,
-                expires_in=None,
-                status=None,
-                subscription_url=sub,
-            )
-    cred_username = panel.username
-    cred_password = panel.password
-    if current_user.role == "operator":
-        if getattr(panel, "type", "marzban") == "xui":
-            # For XUI, always use panel admin credentials; enforce operator assignment
-            try:
-                ut = db.query(UserTemplate).filter(UserTemplate.user_id == current_user.id).first()
-                tpl = db.query(Template).filter(Template.id == ut.template_id).first() if ut else None
-                if not tpl or tpl.panel_id != panel_id:
-                    raise HTTPException(status_code=403, detail="Operator not assigned to this XUI panel")
-            except HTTPException:
-                raise
-            except Exception:
-                raise HTTPException(status_code=403, detail="Operator assignment not found for this panel")
-        else:
-            rec = db.query(UserPanelCredential).filter(UserPanelCredential.user_id == current_user.id, UserPanelCredential.panel_id == panel_id).first()
-            if rec:
-                cred_username = rec.username
-                cred_password = rec.password
-            else:
-                try:
-                    ut = db.query(UserTemplate).filter(UserTemplate.user_id == current_user.id).first()
-                    tpl = db.query(Template).filter(Template.id == ut.template_id).first() if ut else None
-                    if not tpl or tpl.panel_id != panel_id:
-                        raise HTTPException(status_code=403, detail="Operator panel credentials not found for this panel")
-                except HTTPException:
-                    raise
-                except Exception:
-                    raise HTTPException(status_code=403, detail="Operator panel credentials not found")
-    token = await _login_get_token(panel.base_url, cred_username, cred_password)
-    if not token:
-        raise HTTPException(status_code=502, detail="Login to panel failed")
-    headers = {"Authorization": f"Bearer {token}"}
-    async with httpx.AsyncClient(timeout=15.0, verify=False) as client:
-        data_limit: Optional[int] = None
-        expire_ts: Optional[int] = None
-        status: Optional[str] = None
-        used: Optional[int] = None
-        subscription_url: Optional[str] = None
-        # Fetch user core info
-        try:
-            ures = await client.get(panel.base_url.rstrip("/") + f"/api/user/{username}", headers=headers)
-            if ures.headers.get("content-type", "").startswith("application/json"):
-                u = ures.json()
-                if isinstance(u, dict):
-                    if isinstance(u.get("data_limit"), int):
-                        data_limit = int(u.get("data_limit"))
-                    if isinstance(u.get("expire"), int):
-                        expire_ts = int(u.get("expire"))
-                    if isinstance(u.get("status"), str):
-                        status = u.get("status")
-                    # Prefer exact subscription_url if provided
-                    if isinstance(u.get("subscription_url"), str):
-                        subscription_url = u.get("subscription_url")
-                    elif isinstance(u.get("subscription"), str):
-                        subscription_url = u.get("subscription")
-        except Exception:
-            pass
-        # Fetch usage if not embedded
-        try:
-            r = await client.get(panel.base_url.rstrip("/") + f"/api/user/{username}/usage", headers=headers)
-            if r.headers.get("content-type", "").startswith("application/json"):
-                j = r.json()
-                if isinstance(j, dict):
-                    if isinstance(j.get("total"), int):
-                        used = int(j.get("total"))
-                    elif isinstance(j.get("download"), int) or isinstance(j.get("upload"), int):
-                        d = int(j.get("download") or 0)
-                        up = int(j.get("upload") or 0)
-                        used = d + up
-        except Exception:
-            pass
-
-        remaining: Optional[int] = None
-        if data_limit is not None and data_limit > 0 and used is not None:
-            remaining = max(0, data_limit - used)
-        expires_in: Optional[int] = None
-        if expire_ts is not None and expire_ts > 0:
-            now = int(datetime.now(tz=timezone.utc).timestamp())
-            expires_in = max(0, expire_ts - now)
-
-        # Canonicalize subscription to panel base URL if present
-        subscription_url = _canonicalize_subscription_url(panel.base_url, subscription_url)
-        return PanelUserInfoResponse(
-            username=username,
-            data_limit=data_limit,
-            used=used,
-            remaining=remaining,
-            expire=expire_ts,
-            expires_in=expires_in,
-            status=status,
-            subscription_url=subscription_url,
-        )
+    cred_username, cred_password = await db.run_sync(_panel_credentials, panel, current_user)
+    try:
+        info = await get_adapter(panel, cred_username, cred_password).get_user(username)
+    except PanelError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    return PanelUserInfoResponse(**info.model_dump())
 
 
 class PanelUserCreateRequest(BaseModel):
@@ -965,700 +633,228 @@ class PanelUserCreateResponse(BaseModel):
     error: Optional[str] = None
 
 
-async def _login_get_token(base_url: str, username: str, password: str) -> Optional[str]:
-    async with httpx.AsyncClient(timeout=15.0, verify=False) as client:
-        url = base_url.rstrip("/") + "/api/admin/token"
-        for method in ("form", "json"):
-            try:
-                if method == "form":
-                    res = await client.post(url, data={"username": username, "password": password})
-                else:
-                    res = await client.post(url, json={"username": username, "password": password})
-            except Exception:
-                continue
-            if res.headers.get("content-type", "").startswith("application/json"):
-                try:
-                    data = res.json()
-                except Exception:
-                    data = {}
-                token = data.get("access_token") or data.get("token")
-                if token:
-                    return token
-    return None
-
-
-def _build_payload_variants(username: str, bytes_limit: int, expire_at: Optional[datetime]) -> list[dict]:
-    # Try multiple payload shapes commonly used
-    variants: list[dict] = []
-    if expire_at is not None:
-        expire_days = max(1, int((expire_at - datetime.now(tz=timezone.utc)).total_seconds() // 86400))
-        iso = expire_at.isoformat()
-        variants.extend([
-            {"username": username, "data_limit": bytes_limit, "expire": expire_days},
-            {"username": username, "data_limit": bytes_limit, "expire_in_days": expire_days},
-            {"username": username, "data_limit": bytes_limit, "expire_at": iso},
-            {"username": username, "limit": bytes_limit, "expire": expire_days},
-            {"username": username, "quota": bytes_limit, "expire_days": expire_days},
-        ])
-    variants.append({"username": username, "data_limit": bytes_limit})
-    return variants
-
-
-async def _extract_subscription_url(base_url: str, data: dict) -> Optional[str]:
-    # Try common keys
-    for key in [
-        "subscription_url",
-        "subscription",
-        "sub_link",
-        "link",
-        "subscriptionLink",
-        "subUrl",
-    ]:
-        if isinstance(data, dict) and data.get(key):
-            return str(data[key])
-    # Try nested
-    user = data.get("user") if isinstance(data, dict) else None
-    if isinstance(user, dict):
-        for key in ["subscription_url", "subscription", "link"]:
-            if user.get(key):
-                return str(user[key])
-    # Construct from token if provided
-    token = data.get("subscription_token") or (user.get("subscription_token") if isinstance(user, dict) else None)
-    if token:
-        return base_url.rstrip("/") + "/sub/" + str(token)
-    return None
-
-
-def _canonicalize_subscription_url(base_url: str, subscription_url: Optional[str]) -> Optional[str]:
-    if not subscription_url:
-        return None
-    try:
-        b = urlparse(base_url)
-        s = urlparse(subscription_url)
-        # Try to extract token from path if contains '/sub/'
-        token = None
-        if "/sub/" in s.path:
-            token = s.path.split("/sub/", 1)[1].split("/", 1)[0]
-        # Build canonical path
-        if token:
-            path = f"/sub/{token}"
-            return urlunparse((b.scheme, b.netloc, path, "", s.query, ""))
-        # Otherwise, just swap scheme/host to base_url
-        return urlunparse((b.scheme, b.netloc, s.path or "/sub", "", s.query, ""))
-    except Exception:
-        return subscription_url
-def _xui_build_share_link(base_url: str, inbound: dict, client_email: str, client_id: Optional[str]) -> Optional[str]:
-    try:
-        b = urlparse(base_url)
-        host = b.hostname or ""
-        proto = str(inbound.get("protocol") or "").lower()
-        port = str(inbound.get("port") or "")
-        stream = inbound.get("streamSettings") or {}
-        if isinstance(stream, str):
-            try:
-                stream = json.loads(stream)
-            except Exception:
-                stream = {}
-        network = str(stream.get("network") or "tcp").lower()
-        security = str(stream.get("security") or "").lower()
-        params: list[tuple[str, str]] = []
-        tag_name = client_email
-
-        if proto == "vless":
-            # vless://UUID@host:port?encryption=none&security=...&type=...&path=...&host=...&sni=...#name
-            uuid = client_id or ""
-            if not uuid:
-                return None
-            params.append(("encryption", "none"))
-            if security:
-                params.append(("security", security))
-                if security == "tls":
-                    tls = stream.get("tlsSettings") or {}
-                    sni = tls.get("serverName") or tls.get("server_name")
-                    if sni:
-                        params.append(("sni", str(sni)))
-                    alpn = tls.get("alpn")
-                    if isinstance(alpn, list) and alpn:
-                        params.append(("alpn", ",".join(alpn)))
-                if security == "reality":
-                    rs = stream.get("realitySettings") or {}
-                    pbk = rs.get("publicKey")
-                    if pbk:
-                        params.append(("pbk", str(pbk)))
-                    sid = rs.get("shortIds")
-                    if isinstance(sid, list) and sid:
-                        params.append(("sid", sid[0]))
-                    sni = None
-                    sn = rs.get("serverNames")
-                    if isinstance(sn, list) and sn:
-                        sni = sn[0]
-                    if sni:
-                        params.append(("sni", str(sni)))
-            # transport
-            params.append(("type", network))
-            if network == "ws":
-                ws = stream.get("wsSettings") or {}
-                path = ws.get("path") or "/"
-                params.append(("path", str(path)))
-                headers = ws.get("headers") or {}
-                hhost = headers.get("Host") or headers.get("host")
-                if hhost:
-                    params.append(("host", str(hhost)))
-            elif network == "grpc":
-                gs = stream.get("grpcSettings") or {}
-                service = gs.get("serviceName") or "grpc"
-                params.append(("serviceName", str(service)))
-
-            query = "&".join([f"{k}={str(v)}" for k, v in params])
-            return f"vless://{uuid}@{host}:{port}?{query}#{tag_name}"
-
-        if proto == "vmess":
-            # vmess base64(JSON)
-            uuid = client_id or ""
-            if not uuid:
-                return None
-            tls_flag = "tls" if security in ("tls", "reality") else ""
-            ws = stream.get("wsSettings") or {}
-            gs = stream.get("grpcSettings") or {}
-            vm = {
-                "v": "2",
-                "ps": tag_name,
-                "add": host,
-                "port": str(port),
-                "id": uuid,
-                "aid": "0",
-                "net": network,
-                "type": "",
-                "host": (ws.get("headers") or {}).get("Host") or "",
-                "path": ws.get("path") or "",
-                "tls": tls_flag,
-                "sni": (stream.get("tlsSettings") or {}).get("serverName") or "",
-                "alpn": ",".join((stream.get("tlsSettings") or {}).get("alpn") or []) if (stream.get("tlsSettings") or {}).get("alpn") else "",
-                "fp": (stream.get("realitySettings") or {}).get("fingerprint") or "",
-                "serviceName": gs.get("serviceName") or "",
-            }
-            import base64
-            b64 = base64.b64encode(json.dumps(vm, separators=(",", ":")).encode()).decode()
-            return f"vmess://{b64}"
-
-        # trojan minimal (if present)
-        if proto == "trojan":
-            pwd = client_id or ""
-            if not pwd:
-                return None
-            if security:
-                params.append(("security", security))
-            if network == "ws":
-                ws = stream.get("wsSettings") or {}
-                path = ws.get("path") or "/"
-                params.append(("type", "ws"))
-                params.append(("path", str(path)))
-                headers = ws.get("headers") or {}
-                hhost = headers.get("Host") or headers.get("host")
-                if hhost:
-                    params.append(("host", str(hhost)))
-            q = "&".join([f"{k}={str(v)}" for k, v in params])
-            return f"trojan://{pwd}@{host}:{port}?{q}#{tag_name}"
-    except Exception:
-        return None
-    return None
-
-
 @router.post("/panels/{panel_id}/create_user", response_model=PanelUserCreateResponse)
-async def create_user_on_panel(panel_id: int, payload: PanelUserCreateRequest, request: Request, db: Session = Depends(get_db), current_user: User = Depends(require_roles(["admin", "operator"]))):
+async def create_user_on_panel(
+    panel_id: int,
+    payload: PanelUserCreateRequest,
+    request: Request,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=128),
+    prefer: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(require_roles(["admin", "operator"])),
+):
+    """Charged users pay through a wallet hold that is committed only once the panel has the user.
+
+    Retrying with the same Idempotency-Key never charges twice: it returns the user created
+    by the first attempt, or 409 while that attempt is still running. The key reused for
+    another name, panel or plan is a 422. With `Prefer: respond-async` the answer is a 202
+    and a panel job instead.
+    """
     logger = logging.getLogger("app")
     trace_id = getattr(request.state, "trace_id", "-")
     logger.info("create_user start trace=%s panel_id=%s user_id=%s role=%s plan_id=%s", trace_id, panel_id, current_user.id, current_user.role, payload.plan_id)
 
-    panel = db.query(Panel).filter(Panel.id == panel_id).first()
+    panel = await db.get(Panel, panel_id)
     if not panel:
         logger.warning("create_user panel_not_found panel_id=%s", panel_id)
         raise HTTPException(status_code=404, detail="Panel not found")
-    # Require inbound selection to avoid invalid subscription links
-    sel_exists = db.query(PanelInbound).filter(PanelInbound.panel_id == panel_id).first()
-    # Choose credentials: operator's own if available; otherwise panel's default admin
-    cred_username = panel.username
-    cred_password = panel.password
-    if current_user.role == "operator":
-        rec = db.query(UserPanelCredential).filter(UserPanelCredential.user_id == current_user.id, UserPanelCredential.panel_id == panel_id).first()
-        if rec:
-            cred_username = rec.username
-            cred_password = rec.password
-        else:
-            try:
-                ut = db.query(UserTemplate).filter(UserTemplate.user_id == current_user.id).first()
-                tpl = db.query(Template).filter(Template.id == ut.template_id).first() if ut else None
-                if not tpl or tpl.panel_id != panel_id:
-                    raise HTTPException(status_code=403, detail="Operator panel credentials not found for this panel")
-            except HTTPException:
-                raise
-            except Exception:
-                raise HTTPException(status_code=403, detail="Operator panel credentials not found")
-    # Helper: effective price for current user/plan
-    def _effective_price_for_user(plan_obj: Plan) -> Decimal:
-        try:
-            base = Decimal(str(plan_obj.price)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-            if current_user.role != "operator":
-                return base
-            upt = db.query(UserPlanTemplate).filter(UserPlanTemplate.user_id == current_user.id).first()
-            if not upt:
-                return base
-            it = db.query(PlanTemplateItem).filter(PlanTemplateItem.template_id == upt.template_id, PlanTemplateItem.plan_id == plan_obj.id).first()
-            return Decimal(str(it.price_override)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP) if it else base
-        except Exception as e:
-            logger.error("create_user effective_price_error user_id=%s plan_id=%s err=%s", current_user.id, plan_obj.id, str(e))
-            return Decimal(str(plan_obj.price)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+    cred_username, cred_password = await db.run_sync(_panel_credentials, panel, current_user, True)
+    adapter = get_adapter(panel, cred_username, cred_password)
 
-    # XUI branch: cookie-based login and addClient API
-    if getattr(panel, "type", "marzban") == "xui":
-        async with httpx.AsyncClient(timeout=20.0, verify=False, follow_redirects=True) as client:
-            # login
-            logged_in = False
-            login_variants = [
-                {"username": cred_username, "password": cred_password},
-                {"username": cred_username, "password": cred_password, "remember": "on"},
-                {"username": cred_username, "password": cred_password, "remember_me": "true"},
-            ]
-            for path in ("/xui/login", "/login"):
-                for body in login_variants:
-                    try:
-                        r = await client.post(panel.base_url.rstrip("/") + path, data=body)
-                        if r.status_code in (200, 204, 302) and (r.headers.get("set-cookie") or r.headers.get("Set-Cookie")):
-                            logged_in = True
-                            break
-                    except Exception:
-                        continue
-                if logged_in:
-                    break
-            if not logged_in:
-                logger.error("create_user xui_login_failed trace=%s panel_id=%s", trace_id, panel_id)
-                return PanelUserCreateResponse(ok=False, error="Login to XUI failed")
-
-            # Determine selected inbound (XUI)
-            # If operator has assigned template matching this panel, prefer its inbound selection
-            inbound_id = None
-            try:
-                ut = db.query(UserTemplate).filter(UserTemplate.user_id == current_user.id).first()
-                tpl = db.query(Template).filter(Template.id == ut.template_id).first() if ut else None
-                if tpl and tpl.panel_id == panel_id:
-                    tpl_inb = db.query(TemplateInbound).filter(TemplateInbound.template_id == tpl.id).first()
-                    if tpl_inb:
-                        inbound_id = tpl_inb.inbound_id
-            except Exception:
-                inbound_id = None
-            if not inbound_id:
-                sel_row = db.query(PanelInbound).filter(PanelInbound.panel_id == panel_id).first()
-                if not sel_row:
-                    return PanelUserCreateResponse(ok=False, error="No inbound selected for this panel")
-                inbound_id = sel_row.inbound_id
-            try:
-                inbound_id_int = int(inbound_id)
-            except Exception:
-                inbound_id_int = None
-
-            # Resolve plan for limits
-            plan = db.query(Plan).filter(Plan.id == payload.plan_id).first()
-            if not plan:
-                logger.error("create_user plan_not_found trace=%s plan_id=%s", trace_id, payload.plan_id)
-                raise HTTPException(status_code=404, detail="Plan not found")
-
-            # Deduct wallet for non-root admins (already handled below for marzban; do here for xui as well)
-            try:
-                from app.core.config import get_settings
-                from app.models.root_admin import RootAdmin
-                settings = get_settings()
-                emails = {e.strip().lower() for e in settings.root_admin_emails.split(",") if e.strip()}
-                is_env_root = current_user.email.lower() in emails
-                is_db_root = db.query(RootAdmin).filter(RootAdmin.user_id == current_user.id).first() is not None
-                is_root_admin = current_user.role == "admin" and (is_env_root or is_db_root)
-            except Exception:
-                is_root_admin = False
-            if not is_root_admin:
-                wallet = db.query(Wallet).filter(Wallet.user_id == current_user.id).first()
-                if not wallet:
-                    wallet = Wallet(user_id=current_user.id, balance=0)
-                    db.add(wallet)
-                    db.commit()
-                    db.refresh(wallet)
-                price = effective_price_for_user(db, current_user, plan)
-                wb = Decimal(str(wallet.balance or 0)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-                if wb < price:
-                    raise HTTPException(status_code=402, detail="Insufficient wallet balance")
-                wallet.balance = (wb - price).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-                tx = WalletTransaction(user_id=current_user.id, amount=-price, reason=f"Create user '{payload.name}' on XUI panel {panel_id} (plan {plan.name})")
-                db.add(wallet)
-                db.add(tx)
-                db.commit()
-
-            # Build client payloads (variants)
-            import uuid as _uuid
-            client_id = str(_uuid.uuid4())
-            # expiryTime in ms (0 for unlimited)
-            if plan.is_duration_unlimited:
-                expiry_ms = 0
-            else:
-                days = max(1, int(plan.duration_days or 0))
-                expiry_ms = int((datetime.now(tz=timezone.utc) + timedelta(days=days)).timestamp() * 1000)
-            # traffic (0 unlimited). Try both GB and bytes variants
-            if plan.is_data_unlimited:
-                total_gb_val = 0
-                total_bytes_val = 0
-            else:
-                mb = max(0, int(plan.data_quota_mb or 0))
-                total_gb_val = max(1, int(round(mb / 1024)))
-                total_bytes_val = mb * 1024 * 1024
-
-            # Generate subId for some XUI variants
-            import secrets, string as _string
-            def _rand_subid(n: int = 12) -> str:
-                alphabet = _string.ascii_lowercase + _string.digits
-                return "".join(secrets.choice(alphabet) for _ in range(n))
-
-            base_client = {
-                "enable": True,
-                "email": payload.name,
-                "limitIp": 0,
-                "flow": "",
-                "id": client_id,
-                "subId": _rand_subid(12),
-            }
-
-            attempts: list[tuple[str, dict, str]] = []
-            # JSON API variants
-            if inbound_id_int is not None:
-                # Common lowercase API paths
-                attempts.append(("/xui/api/inbounds/addClient", {"id": inbound_id_int, "client": {**base_client, "expiryTime": expiry_ms, "totalGB": total_gb_val}}, "json"))
-                attempts.append(("/xui/api/inbounds/addClient", {"id": inbound_id_int, "client": {**base_client, "expiryTime": expiry_ms, "totalGB": total_bytes_val}}, "json"))
-                attempts.append(("/xui/api/inbounds/addClient", {"id": inbound_id_int, "settings": {"clients": [{**base_client, "expiryTime": expiry_ms, "totalGB": total_gb_val}]}}, "json"))
-                attempts.append(("/xui/api/inbounds/addClient", {"id": inbound_id_int, "settings": {"clients": [{**base_client, "expiryTime": expiry_ms, "totalGB": total_bytes_val}]}}, "json"))
-                attempts.append(("/panel/api/inbounds/addClient", {"id": inbound_id_int, "client": {**base_client, "expiryTime": expiry_ms, "totalGB": total_gb_val}}, "json"))
-                # Uppercase API variants used by some forks
-                attempts.append(("/xui/API/inbounds/addClient", {"id": inbound_id_int, "client": {**base_client, "expiryTime": expiry_ms, "totalGB": total_gb_val}}, "json"))
-                attempts.append(("/xui/API/inbounds/addClient", {"id": inbound_id_int, "settings": {"clients": [{**base_client, "expiryTime": expiry_ms, "totalGB": total_gb_val}]}}, "json"))
-                attempts.append(("/panel/API/inbounds/addClient", {"id": inbound_id_int, "client": {**base_client, "expiryTime": expiry_ms, "totalGB": total_gb_val}}, "json"))
-            # Form variants
-            form_base = {"email": payload.name, "enable": "true", "limitIp": "0", "flow": "", "id": client_id}
-            attempts.append(("/xui/inbound/addClient", {**form_base, "id": inbound_id, "expiryTime": str(expiry_ms), "totalGB": str(total_gb_val)}, "form"))
-            attempts.append(("/xui/inbound/addClient", {**form_base, "id": inbound_id, "expiryTime": str(expiry_ms), "totalGB": str(total_bytes_val)}, "form"))
-            attempts.append(("/panel/inbound/addClient", {**form_base, "id": inbound_id, "expiryTime": str(expiry_ms), "totalGB": str(total_gb_val)}, "form"))
-            # Form variant with 'settings' JSON string as required by some XUI builds
-            try:
-                settings_str_gb = json.dumps({"clients": [{**base_client, "expiryTime": expiry_ms, "totalGB": total_gb_val}]})
-                settings_str_bytes = json.dumps({"clients": [{**base_client, "expiryTime": expiry_ms, "totalGB": total_bytes_val}]})
-                attempts.append(("/xui/api/inbounds/addClient", {"id": inbound_id, "settings": settings_str_gb}, "form"))
-                attempts.append(("/xui/api/inbounds/addClient", {"id": inbound_id, "settings": settings_str_bytes}, "form"))
-                # Some forks expose direct addClient without api segment
-                attempts.append(("/xui/addClient", {"id": inbound_id, "settings": settings_str_gb}, "form"))
-                attempts.append(("/panel/addClient", {"id": inbound_id, "settings": settings_str_gb}, "form"))
-            except Exception:
-                pass
-
-            last_status = None
-            last_text = None
-            for path, body, mode in attempts:
-                try:
-                    url = _join_url(panel.base_url, path)
-                    if mode == "json":
-                        res = await client.post(url, json=body, headers={"Accept": "application/json"})
-                    else:
-                        res = await client.post(url, data=body, headers={"Accept": "application/json"})
-                except Exception as e:
-                    last_status = 0
-                    last_text = str(e)
-                    logger.error("create_user xui_req_error trace=%s url=%s err=%s", trace_id, url, last_text)
-                    continue
-                if 200 <= res.status_code < 300:
-                    # Try to confirm creation by re-fetching inbounds and locating the new client
-                    sub_url = None
-                    created_confirmed = False
-                    try:
-                        inb = None
-                        clients_for_inb = []
-                        for ep in ("/xui/api/inbounds", "/xui/api/inbounds/list", "/panel/api/inbounds/list", "/panel/inbounds"):
-                            try:
-                                g = await client.get(panel.base_url.rstrip("/") + ep, headers={"Accept": "application/json"})
-                                if g.headers.get("content-type", "").startswith("application/json"):
-                                    dj = g.json()
-                                    arr = None
-                                    if isinstance(dj, dict):
-                                        for k in ("obj", "inbounds", "items", "data", "list"):
-                                            if isinstance(dj.get(k), list):
-                                                arr = dj.get(k)
-                                                break
-                                        if arr is None and isinstance(dj.get("data"), dict):
-                                            for k in ("items", "inbounds", "list", "obj"):
-                                                if isinstance(dj["data"].get(k), list):
-                                                    arr = dj["data"][k]
-                                                    break
-                                    elif isinstance(dj, list):
-                                        arr = dj
-                                    if isinstance(arr, list):
-                                        for it in arr:
-                                            if not isinstance(it, dict):
-                                                continue
-                                            if str(it.get("id") or it.get("tag") or it.get("remark") or "") == str(inbound_id) or str(it.get("tag") or "") == str(inbound_id):
-                                                inb = it
-                                                settings = inb.get("settings")
-                                                if isinstance(settings, str):
-                                                    try:
-                                                        settings = json.loads(settings)
-                                                    except Exception:
-                                                        settings = None
-                                                if isinstance(settings, dict) and isinstance(settings.get("clients"), list):
-                                                    clients_for_inb = settings.get("clients")
-                                                elif isinstance(inb.get("clients"), list):
-                                                    clients_for_inb = inb.get("clients")
-                                                break
-                                    if inb:
-                                        break
-                            except Exception:
-                                continue
-                        if inb:
-                            client_uuid = None
-                            client_password = None
-                            for c in (clients_for_inb or []):
-                                if not isinstance(c, dict):
-                                    continue
-                                email = str(c.get("email") or c.get("name") or c.get("username") or "")
-                                if email == payload.name:
-                                    created_confirmed = True
-                                    for k in ("id", "uuid", "clientId", "client_id"):
-                                        if isinstance(c.get(k), str):
-                                            client_uuid = c.get(k)
-                                            break
-                                    if isinstance(c.get("password"), str):
-                                        client_password = c.get("password")
-                                    break
-                            ident = (client_uuid or client_password)
-                            sub_url = _xui_build_share_link(panel.base_url, inb, payload.name, ident)
-                    except Exception:
-                        created_confirmed = False
-
-                    # If confirmation failed, also accept explicit success flags from response JSON
-                    if not created_confirmed:
-                        try:
-                            j = res.json()
-                            if isinstance(j, dict) and (j.get("success") is True or j.get("status") in ("ok", "success", 200)):
-                                created_confirmed = True
-                        except Exception:
-                            pass
-
-                    if created_confirmed:
-                        try:
-                            rec = PanelCreatedUser(panel_id=panel_id, username=payload.name, subscription_url=sub_url, created_by_user_id=current_user.id)
-                            db.add(rec)
-                            db.commit()
-                        except Exception:
-                            db.rollback()
-                        try:
-                            record_audit_event(db, current_user.id, "create_config_user", target=payload.name, meta={"panel_id": panel_id, "plan_id": getattr(payload, 'plan_id', None)})
-                        except Exception:
-                            pass
-                        return PanelUserCreateResponse(
-                            ok=True,
-                            username=payload.name,
-                            subscription_url=sub_url,
-                            expire=(expiry_ms // 1000) if expiry_ms else None,
-                            data_limit=(total_bytes_val if total_bytes_val else None),
-                            raw=(res.json() if res.headers.get("content-type", "").startswith("application/json") else None),
-                        )
-                    # else: try next variant
-                last_status = res.status_code
-                last_text = res.text[:200]
-                logger.warning("create_user xui_resp_non2xx trace=%s url=%s status=%s body=%s", trace_id, url, last_status, last_text)
-            return PanelUserCreateResponse(ok=False, error=f"XUI responded {last_status}", raw={"error": last_text or "unknown"})
-
-    token = await _login_get_token(panel.base_url, cred_username, cred_password)
-    if not token:
-        logger.error("create_user marzban_login_failed trace=%s panel_id=%s", trace_id, panel_id)
-        return PanelUserCreateResponse(ok=False, error="Login to panel failed")
+    inbounds = await db.run_sync(_create_inbounds, panel_id, current_user)
+    if adapter.type == "xui" and not inbounds:
+        return PanelUserCreateResponse(ok=False, error="No inbound selected for this panel")
+
+    background = _wants_job(prefer)
+    # Log in before charging so an unreachable panel costs nothing
+    if not background:
+        try:
+            await adapter.login()
+        except PanelError as e:
+            logger.error("create_user login_failed trace=%s panel_id=%s type=%s", trace_id, panel_id, adapter.type)
+            return PanelUserCreateResponse(ok=False, error=e.detail)
 
     # Enforce using plan
-    plan = db.query(Plan).filter(Plan.id == payload.plan_id).first()
+    plan = await db.get(Plan, payload.plan_id)
     if not plan:
         logger.error("create_user plan_not_found trace=%s plan_id=%s", trace_id, payload.plan_id)
         raise HTTPException(status_code=404, detail="Plan not found")
-    # Deduct wallet for non-root admins
-    try:
-        from app.core.config import get_settings
-        from app.models.root_admin import RootAdmin
-        settings = get_settings()
-        emails = {e.strip().lower() for e in settings.root_admin_emails.split(",") if e.strip()}
-        is_env_root = current_user.email.lower() in emails
-        is_db_root = db.query(RootAdmin).filter(RootAdmin.user_id == current_user.id).first() is not None
-        is_root_admin = current_user.role == "admin" and (is_env_root or is_db_root)
-    except Exception:
-        is_root_admin = False
+    fingerprint = wallet_service.request_hash({"panel_id": panel_id, "username": payload.name, "plan_id": payload.plan_id})
+    if background:
+        price = Decimal("0.00") if current_user.is_root_admin else await effective_price(current_user, plan)
+        panel_label = "XUI panel" if adapter.type == "xui" else "panel"
+        params = {"account": cred_username, "username": payload.name, "limits": PlanLimits.from_plan(plan).model_dump(), "inbounds": inbounds, "plan_id": plan.id}
+        return await _accept_job(
+            db, current_user, panel_id, "create_user", params, price,
+            f"Create user '{payload.name}' on {panel_label} {panel_id} (plan {plan.name})", idempotency_key, fingerprint,
+        )
+    # Hold the price for non-root admins before touching the panel
+    is_root_admin = current_user.is_root_admin
     logger.info("create_user role_check trace=%s is_root_admin=%s", trace_id, is_root_admin)
+    hold: Optional[WalletHold] = None
     if not is_root_admin:
-        # Ensure wallet exists
-        wallet = db.query(Wallet).filter(Wallet.user_id == current_user.id).first()
-        if not wallet:
-            wallet = Wallet(user_id=current_user.id, balance=0)
-            db.add(wallet)
-            db.commit()
-            db.refresh(wallet)
-        # Check balance using effective price
-        price = effective_price_for_user(db, current_user, plan)
-        wb = Decimal(str(wallet.balance or 0)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-        if wb < price:
+        price = await effective_price(current_user, plan)
+        panel_label = "XUI panel" if adapter.type == "xui" else "panel"
+        reason = f"Create user '{payload.name}' on {panel_label} {panel_id} (plan {plan.name})"
+        if price > 0:
+            hold, fresh = await _place_hold(db, current_user, price, reason, idempotency_key, "create_user", fingerprint)
+            if hold is None:
+                raise HTTPException(status_code=402, detail="Insufficient wallet balance")
+            if not fresh:
+                _hold_in_progress(hold)
+                logger.info("create_user idempotent_replay trace=%s hold_id=%s", trace_id, hold.id)
+                rec = await db.scalar(
+                    select(PanelCreatedUser)
+                    .where(PanelCreatedUser.panel_id == panel_id, PanelCreatedUser.username == payload.name, PanelCreatedUser.created_by_user_id == current_user.id)
+                    .order_by(PanelCreatedUser.id.desc())
+                )
+                return PanelUserCreateResponse(ok=True, username=payload.name, subscription_url=rec.subscription_url if rec else None)
+
+    try:
+        created = await adapter.create_user(payload.name, PlanLimits.from_plan(plan), inbounds)
+    except Exception as e:
+        if hold is not None:
+            await db.run_sync(wallet_service.release_hold, hold)
+        if not isinstance(e, PanelError):
+            raise
+        logger.warning("create_user panel_failed trace=%s panel_id=%s status=%s detail=%s", trace_id, panel_id, e.status_code, e.detail)
+        return PanelUserCreateResponse(ok=False, error=e.detail, raw=e.raw)
+    if hold is not None:
+        await db.run_sync(wallet_service.commit_hold, hold)
+
+    await db.run_sync(mirror_put, panel_id, mirror_owner(panel, cred_username), PanelUser(**created.model_dump(exclude={"raw"}), status="active"))
+    # Persist created user locally for admin overview
+    try:
+        rec = PanelCreatedUser(panel_id=panel_id, username=payload.name, subscription_url=created.subscription_url, created_by_user_id=current_user.id)
+        db.add(rec)
+        await db.commit()
+    except Exception:
+        await db.rollback()
+    # Audit log for created user
+    try:
+        await db.run_sync(record_audit_event, current_user.id, "create_config_user", target=payload.name, meta={"panel_id": panel_id, "plan_id": getattr(payload, 'plan_id', None)})
+    except Exception:
+        pass
+    return PanelUserCreateResponse(
+        ok=True,
+        username=payload.name,
+        subscription_url=created.subscription_url,
+        expire=created.expire,
+        data_limit=created.data_limit,
+        raw=created.raw,
+    )
+
+
+class PanelBulkCreateRequest(BaseModel):
+    names: List[str]
+    plan_id: int
+
+
+class PanelBulkCreateItem(BaseModel):
+    name: str
+    ok: bool
+    subscription_url: Optional[str] = None
+    expire: Optional[int] = None
+    data_limit: Optional[int] = None
+    error: Optional[str] = None
+
+
+class PanelBulkCreateResponse(BaseModel):
+    ok: bool
+    created: int
+    failed: int
+    charged: Decimal = Decimal("0.00")
+    refunded: Decimal = Decimal("0.00")
+    items: List[PanelBulkCreateItem]
+
+
+# Names per bulk request; keeps one request's panel time and wallet hold bounded
+BULK_CREATE_MAX = 500
+
+
+@router.post("/panels/{panel_id}/create_users/bulk", response_model=PanelBulkCreateResponse)
+async def bulk_create_users_on_panel(panel_id: int, payload: PanelBulkCreateRequest, request: Request, db: AsyncSession = Depends(get_async_db), current_user: User = Depends(require_roles(["admin", "operator"]))):
+    logger = logging.getLogger("app")
+    trace_id = getattr(request.state, "trace_id", "-")
+    names = [n.strip() for n in payload.names]
+    if not names or any(not n for n in names):
+        raise HTTPException(status_code=400, detail="names must be a non-empty list of non-empty usernames")
+    if len(names) > BULK_CREATE_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_CREATE_MAX} names per request")
+    if len(set(names)) != len(names):
+        raise HTTPException(status_code=400, detail="names must be unique")
+
+    panel = await db.get(Panel, panel_id)
+    if not panel:
+        raise HTTPException(status_code=404, detail="Panel not found")
+    cred_username, cred_password = await db.run_sync(_panel_credentials, panel, current_user, True)
+    adapter = get_adapter(panel, cred_username, cred_password)
+    inbounds = await db.run_sync(_create_inbounds, panel_id, current_user)
+    if adapter.type == "xui" and not inbounds:
+        raise HTTPException(status_code=400, detail="No inbound selected for this panel")
+    # Log in before charging so an unreachable panel costs nothing
+    try:
+        await adapter.login()
+    except PanelError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    plan = await db.get(Plan, payload.plan_id)
+    if not plan:
+        raise HTTPException(status_code=404, detail="Plan not found")
+
+    # One hold for the whole batch; only the users actually created are charged from it
+    unit_price = Decimal("0.00") if current_user.is_root_admin else await effective_price(current_user, plan)
+    charged = (unit_price * len(names)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+    panel_label = "XUI panel" if adapter.type == "xui" else "panel"
+    hold: Optional[WalletHold] = None
+    if charged > 0:
+        hold, _ = await db.run_sync(wallet_service.place_hold, current_user.id, charged, f"Bulk create {len(names)} users on {panel_label} {panel_id} (plan {plan.name})")
+        if hold is None:
             raise HTTPException(status_code=402, detail="Insufficient wallet balance")
-        # Deduct and record tx (pre-deduct to prevent race)
-        wallet.balance = (wb - price).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-        tx = WalletTransaction(user_id=current_user.id, amount=-price, reason=f"Create user '{payload.name}' on panel {panel_id} (plan {plan.name})")
-        db.add(wallet)
-        db.add(tx)
-        db.commit()
-    # Data limit bytes (0 for unlimited)
-    if plan.is_data_unlimited:
-        bytes_limit = 0
-    else:
-        bytes_limit = int(max(0, int(plan.data_quota_mb or 0)) * (1024 ** 2))
-    # Expiration (None for unlimited)
-    if plan.is_duration_unlimited:
-        expire_at = None
-        expire_ts = None  # type: ignore[assignment]
-    else:
-        days = max(1, int(plan.duration_days or 0))
-        expire_at = datetime.now(tz=timezone.utc) + timedelta(days=days)
-        expire_ts = int(expire_at.timestamp())
+    logger.info("bulk_create start trace=%s panel_id=%s user_id=%s count=%s charged=%s", trace_id, panel_id, current_user.id, len(names), charged)
 
-    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-    async with httpx.AsyncClient(timeout=20.0, verify=False) as client:
-        # Fetch panel inbounds to determine protocol for selected tags
-        try:
-            resp_inb = await client.get(panel.base_url.rstrip("/") + "/api/inbounds", headers=headers)
-            resp_inb.raise_for_status()
-            inb_data = resp_inb.json()
-        except Exception as e:
-            logger.error("create_user fetch_inbounds_failed trace=%s err=%s", trace_id, str(e))
-            return PanelUserCreateResponse(ok=False, error=f"Failed to fetch inbounds: {e}")
-
-        normalized: list[dict] = []
-        if isinstance(inb_data, list):
-            normalized = [x for x in inb_data if isinstance(x, dict)]
-        elif isinstance(inb_data, dict):
-            if isinstance(inb_data.get("items"), list):
-                normalized = [x for x in inb_data["items"] if isinstance(x, dict)]
-            else:
-                for v in inb_data.values():
-                    if isinstance(v, list):
-                        normalized.extend([x for x in v if isinstance(x, dict)])
-
-        selected_rows = db.query(PanelInbound).filter(PanelInbound.panel_id == panel_id).all()
-        selected_tags = {r.inbound_id for r in selected_rows}
-        proto_to_tags: dict[str, list[str]] = {}
-        for it in normalized:
-            tag = str(it.get("tag") or "").strip()
-            proto = str(it.get("protocol") or "").strip()
-            if tag and proto and tag in selected_tags:
-                proto_to_tags.setdefault(proto, []).append(tag)
-
-        # If current user has an assigned template, and template matches this panel, override selection
+    try:
+        results = await adapter.create_users(names, PlanLimits.from_plan(plan), inbounds, get_settings().panel_bulk_concurrency)
+    except PanelError as e:
+        # Nothing was attempted (e.g. inbound lookup failed)
+        results = [e] * len(names)
+    except Exception:
+        if hold is not None:
+            await db.run_sync(wallet_service.release_hold, hold)
+        raise
+
+    created = [r for r in results if isinstance(r, CreatedPanelUser)]
+    failed = len(names) - len(created)
+    refunded = (unit_price * failed).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+    if hold is not None:
+        # Only the created users are charged; the rest of the hold goes back
+        await db.run_sync(wallet_service.commit_hold, hold, charged - refunded, f"Bulk create {len(created)} of {len(names)} users on {panel_label} {panel_id} (plan {plan.name})")
+
+    if created:
+        await db.run_sync(mirror_put, panel_id, mirror_owner(panel, cred_username), *(PanelUser(**c.model_dump(exclude={"raw"}), status="active") for c in created))
         try:
-            ut = db.query(UserTemplate).filter(UserTemplate.user_id == current_user.id).first()
-            if ut:
-                tpl = db.query(Template).filter(Template.id == ut.template_id).first()
-                if tpl and tpl.panel_id == panel_id:
-                    tpl_inbounds = [row.inbound_id for row in db.query(TemplateInbound).filter(TemplateInbound.template_id == tpl.id).all()]
-                    selected_tpl_tags = set(tpl_inbounds)
-                    proto_to_tags = {}
-                    for it in normalized:
-                        tag = str(it.get("tag") or "").strip()
-                        proto = str(it.get("protocol") or "").strip()
-                        if tag and proto and tag in selected_tpl_tags:
-                            proto_to_tags.setdefault(proto, []).append(tag)
+            db.add_all([
+                PanelCreatedUser(panel_id=panel_id, username=c.username, subscription_url=c.subscription_url, created_by_user_id=current_user.id)
+                for c in created
+            ])
+            await db.commit()
         except Exception:
-            pass
+            await db.rollback()
+    try:
+        await db.run_sync(
+            record_audit_event, current_user.id, "bulk_create_config_users", target=f"panel:{panel_id}",
+            meta={"panel_id": panel_id, "plan_id": payload.plan_id, "created": [c.username for c in created], "failed": failed, "charged": str(charged - refunded)},
+        )
+    except Exception:
+        pass
+    logger.info("bulk_create done trace=%s panel_id=%s created=%s failed=%s refunded=%s", trace_id, panel_id, len(created), failed, refunded)
 
-        # Proxies object based on selected protocols
-        proxies_obj = {proto: {} for proto in proto_to_tags.keys()}
-
-        body = {
-            "username": payload.name,
-            "status": "active",
-            "data_limit": bytes_limit,
-            "data_limit_reset_strategy": "no_reset",
-            "proxies": proxies_obj,
-            "inbounds": proto_to_tags,
-        }
-        if expire_ts is not None:
-            body["expire"] = expire_ts
-
-        url = panel.base_url.rstrip("/") + "/api/user"
-        try:
-            res = await client.post(url, json=body, headers=headers)
-        except Exception as e:
-            logger.error("create_user marz_req_error trace=%s url=%s err=%s", trace_id, url, str(e))
-            return PanelUserCreateResponse(ok=False, error=str(e))
-
-        if res.headers.get("content-type", "").startswith("application/json"):
-            try:
-                data = res.json()
-            except Exception:
-                data = {}
-        else:
-            try:
-                raw_bytes = await res.aread()
-                raw_text = raw_bytes.decode("utf-8", errors="replace")
-            except Exception:
-                raw_text = ""
-            data = {"raw_text": raw_text}
-
-        if 200 <= res.status_code < 300:
-            sub_url = await _extract_subscription_url(panel.base_url, data)
-            if not sub_url:
-                try:
-                    info = await client.get(panel.base_url.rstrip("/") + f"/api/user/{payload.name}", headers=headers)
-                    if info.headers.get("content-type", "").startswith("application/json"):
-                        udata = info.json()
-                        # Prefer exact field
-                        if isinstance(udata, dict) and isinstance(udata.get("subscription_url"), str):
-                            sub_url = udata.get("subscription_url")
-                        elif isinstance(udata, dict) and isinstance(udata.get("subscription"), str):
-                            sub_url = udata.get("subscription")
-                except Exception:
-                    pass
-            # Persist created user locally for admin overview
-            try:
-                # Best-effort canonicalize the URL to include panel domain
-                sub_url = _canonicalize_subscription_url(panel.base_url, sub_url)
-                rec = PanelCreatedUser(panel_id=panel_id, username=payload.name, subscription_url=sub_url, created_by_user_id=current_user.id)
-                db.add(rec)
-                db.commit()
-            except Exception:
-                db.rollback()
-            # Audit log for created user
-            try:
-                record_audit_event(db, current_user.id, "create_config_user", target=payload.name, meta={"panel_id": panel_id, "plan_id": getattr(payload, 'plan_id', None)})
-            except Exception:
-                pass
-            return PanelUserCreateResponse(ok=True, username=payload.name, subscription_url=sub_url, raw=data)
-        else:
-            # Try alternative payload variants if initial failed (e.g., schema differences)
-            for body2 in _build_payload_variants(username=payload.name, bytes_limit=bytes_limit, expire_at=expire_at):
-                try:
-                    res2 = await client.post(url, json=body2, headers=headers)
-                except Exception:
-                    logger.error("create_user marz_retry_req_error trace=%s url=%s", trace_id, url)
-                    continue
-                if 200 <= res2.status_code < 300:
-                    data2 = res2.json() if res2.headers.get("content-type", "").startswith("application/json") else {}
-                    sub_url = await _extract_subscription_url(panel.base_url, data2)
-                    try:
-                        sub_url = _canonicalize_subscription_url(panel.base_url, sub_url)
-                        rec = PanelCreatedUser(panel_id=panel_id, username=payload.name, subscription_url=sub_url, created_by_user_id=current_user.id)
-                        db.add(rec)
-                        db.commit()
-                    except Exception:
-                        db.rollback()
-                    try:
-                        record_audit_event(db, current_user.id, "create_config_user", target=payload.name, meta={"panel_id": panel_id, "plan_id": getattr(payload, 'plan_id', None)})
-                    except Exception:
-                        pass
-                    return PanelUserCreateResponse(ok=True, username=payload.name, subscription_url=sub_url, raw=data2)
-            logger.warning("create_user marz_resp_non2xx trace=%s url=%s status=%s body=%s", trace_id, url, res.status_code, (data if isinstance(data, dict) else {}))
-            return PanelUserCreateResponse(ok=False, error=f"Panel responded {res.status_code}", raw=(data if isinstance(data, dict) else {}))
+    items = [
+        PanelBulkCreateItem(name=name, ok=True, subscription_url=r.subscription_url, expire=r.expire, data_limit=r.data_limit)
+        if isinstance(r, CreatedPanelUser)
+        else PanelBulkCreateItem(name=name, ok=False, error=r.detail)
+        for name, r in zip(names, results)
+    ]
+    return PanelBulkCreateResponse(ok=failed == 0, created=len(created), failed=failed, charged=charged, refunded=refunded, items=items)
 
 
 class PanelUserDeleteRequest(BaseModel):
@@ -1672,32 +868,35 @@ class PanelUserDeleteResponse(BaseModel):
 
 
 @router.post("/panels/{panel_id}/delete_user", response_model=PanelUserDeleteResponse)
-async def delete_user_on_panel(panel_id: int, payload: PanelUserDeleteRequest, db: Session = Depends(get_db), current_user: User = Depends(require_root_admin)):
-    panel = db.query(Panel).filter(Panel.id == panel_id).first()
+async def delete_user_on_panel(
+    panel_id: int,
+    payload: PanelUserDeleteRequest,
+    prefer: Optional[str] = Header(None),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=128),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(require_root_admin),
+):
+    panel = await db.get(Panel, panel_id)
     if not panel:
         raise HTTPException(status_code=404, detail="Panel not found")
+    if _wants_job(prefer):
+        params = {"account": panel.username, "username": payload.username}
+        return await _accept_job(db, current_user, panel_id, "delete_user", params, idempotency_key=idempotency_key)
     # Require root admin: always use panel default credentials
-    cred_username = panel.username
-    cred_password = panel.password
-    token = await _login_get_token(panel.base_url, cred_username, cred_password)
-    if not token:
-        return PanelUserDeleteResponse(ok=False, error="Login to panel failed")
-    headers = {"Authorization": f"Bearer {token}"}
-    url = panel.base_url.rstrip("/") + f"/api/user/{payload.username}"
-    async with httpx.AsyncClient(timeout=15.0, verify=False) as client:
-        try:
-            res = await client.delete(url, headers=headers)
-            if 200 <= res.status_code < 300:
-                # best-effort delete from local records
-                try:
-                    db.query(PanelCreatedUser).filter(PanelCreatedUser.panel_id == panel_id, PanelCreatedUser.username == payload.username).delete()
-                    db.commit()
-                except Exception:
-                    db.rollback()
-                return PanelUserDeleteResponse(ok=True, status=res.status_code)
-            return PanelUserDeleteResponse(ok=False, status=res.status_code, error=res.text[:200])
-        except Exception as e:
-            return PanelUserDeleteResponse(ok=False, error=str(e))
+    try:
+        status = await get_adapter(panel).delete_user(payload.username)
+    except PanelError as e:
+        return PanelUserDeleteResponse(ok=False, status=e.status_code, error=e.detail)
+    except Exception as e:
+        return PanelUserDeleteResponse(ok=False, error=str(e))
+    await db.run_sync(mirror_remove, panel_id, payload.username)
+    # best-effort delete from local records
+    try:
+        await db.execute(delete(PanelCreatedUser).where(PanelCreatedUser.panel_id == panel_id, PanelCreatedUser.username == payload.username))
+        await db.commit()
+    except Exception:
+        await db.rollback()
+    return PanelUserDeleteResponse(ok=True, status=status)
 
 
 class PanelUserStatusRequest(BaseModel):
@@ -1705,168 +904,35 @@ class PanelUserStatusRequest(BaseModel):
 
 
 @router.post("/panels/{panel_id}/user/{username}/status")
-async def set_user_status(panel_id: int, username: str, payload: PanelUserStatusRequest, db: Session = Depends(get_db), current_user: User = Depends(require_roles(["admin", "operator"]))):
-    panel = db.query(Panel).filter(Panel.id == panel_id).first()
+async def set_user_status(
+    panel_id: int,
+    username: str,
+    payload: PanelUserStatusRequest,
+    prefer: Optional[str] = Header(None),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=128),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(require_roles(["admin", "operator"])),
+):
+    panel = await db.get(Panel, panel_id)
     if not panel:
         raise HTTPException(status_code=404, detail="Panel not found")
-    cred_username = panel.username
-    cred_password = panel.password
     if current_user.role == "operator" and getattr(panel, "type", "marzban") == "xui":
-        # For XUI use admin creds; just enforce assignment via template
-        try:
-            ut = db.query(UserTemplate).filter(UserTemplate.user_id == current_user.id).first()
-            tpl = db.query(Template).filter(Template.id == ut.template_id).first() if ut else None
-            if not tpl or tpl.panel_id != panel_id:
-                raise HTTPException(status_code=403, detail="Operator not assigned to this XUI panel")
-        except HTTPException:
-            raise
-        except Exception:
-            raise HTTPException(status_code=403, detail="Operator assignment not found for this panel")
-    token = await _login_get_token(panel.base_url, cred_username, cred_password)
-    if not token:
-        raise HTTPException(status_code=502, detail="Login to panel failed")
-    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-    url = panel.base_url.rstrip("/") + f"/api/user/{username}"
-    async with httpx.AsyncClient(timeout=20.0, verify=False) as client:
-        try:
-            # Fetch current user to preserve existing fields (but do NOT change expire)
-            now_ts = int(datetime.now(tz=timezone.utc).timestamp())
-            current_body: dict = {}
-            try:
-                u = await client.get(panel.base_url.rstrip("/") + f"/api/user/{username}", headers=headers)
-                if u.headers.get("content-type", "").startswith("application/json"):
-                    data = u.json()
-                    if isinstance(data, dict):
-                        current_body = data
-            except Exception:
-                pass
-
-            # Canonical PATCH body (avoid touching expire; only toggle status)
-            body_base: dict = {
-                "status": payload.status,
-                "data_limit": current_body.get("data_limit", 0),
-                "data_limit_reset_strategy": "no_reset",
-                "inbounds": current_body.get("inbounds") or {},
-                "proxies": current_body.get("proxies") or {},
-                "next_plan": {
-                    "add_remaining_traffic": False,
-                    "data_limit": 0,
-                    "expire": 0,
-                    "fire_on_either": True,
-                },
-                "note": current_body.get("note", ""),
-                "on_hold_expire_duration": 0,
-                "on_hold_timeout": current_body.get("on_hold_timeout", None),
-            }
-            # Do not include expire in status toggle requests to avoid changing duration
-
-            # Helper to (re)fetch status and confirm
-            async def _confirm_status(expected: str) -> bool:
-                try:
-                    check = await client.get(panel.base_url.rstrip("/") + f"/api/user/{username}", headers=headers)
-                    if check.headers.get("content-type", "").startswith("application/json"):
-                        j = check.json()
-                        if isinstance(j, dict):
-                            st = j.get("status")
-                            expv = j.get("expire")
-                            if expected == "disabled":
-                                return (st == "disabled") or (isinstance(expv, int) and expv == 0)
-                            if expected == "active":
-                                return (st == "active") or (isinstance(expv, int) and (expv or 0) > now_ts)
-                except Exception:
-                    return False
-                return False
-
-            # Try multiple API patterns sequentially
-            attempts: list[tuple[str, str, dict]] = []
-            admin_url = panel.base_url.rstrip("/") + f"/api/admin/user/{username}"
-            url_slash = url + "/"
-            # 1) PATCH with canonical body (status)
-            attempts.append(("PATCH", url, body_base))
-            attempts.append(("PATCH", url_slash, body_base))
-            attempts.append(("PATCH", admin_url, body_base))
-            # 2) PATCH with enabled boolean
-            body_enabled = dict(body_base)
-            body_enabled["enabled"] = (payload.status == "active")
-            attempts.append(("PATCH", url, body_enabled))
-            attempts.append(("PATCH", url_slash, body_enabled))
-            attempts.append(("PATCH", admin_url, body_enabled))
-            # 3) PATCH with active boolean
-            body_active = dict(body_base)
-            body_active["active"] = (payload.status == "active")
-            attempts.append(("PATCH", url, body_active))
-            attempts.append(("PATCH", url_slash, body_active))
-            attempts.append(("PATCH", admin_url, body_active))
-            # 4) PUT variants (also without expire)
-            attempts.append(("PUT", url, body_base))
-            attempts.append(("PUT", url_slash, body_base))
-            attempts.append(("PUT", admin_url, body_base))
-            # 5) Status endpoints
-            attempts.append(("POST", panel.base_url.rstrip("/") + f"/api/user/{username}/status", {"status": payload.status}))
-            attempts.append(("PATCH", panel.base_url.rstrip("/") + f"/api/user/{username}/status", {"status": payload.status}))
-            attempts.append(("POST", panel.base_url.rstrip("/") + f"/api/admin/user/{username}/status", {"status": payload.status}))
-            # 6) Action endpoints enable/disable
-            action_endpoints_enable = [
-                panel.base_url.rstrip("/") + f"/api/user/{username}/enable",
-                panel.base_url.rstrip("/") + f"/api/user/{username}/activate",
-                panel.base_url.rstrip("/") + f"/api/admin/user/{username}/enable",
-                panel.base_url.rstrip("/") + f"/api/admin/user/{username}/activate",
-            ]
-            action_endpoints_disable = [
-                panel.base_url.rstrip("/") + f"/api/user/{username}/disable",
-                panel.base_url.rstrip("/") + f"/api/user/{username}/deactivate",
-                panel.base_url.rstrip("/") + f"/api/admin/user/{username}/disable",
-                panel.base_url.rstrip("/") + f"/api/admin/user/{username}/deactivate",
-                panel.base_url.rstrip("/") + f"/api/user/{username}/status/disabled",
-                panel.base_url.rstrip("/") + f"/api/admin/user/{username}/status/disabled",
-            ]
-            if payload.status == "disabled":
-                for ep in action_endpoints_disable:
-                    attempts.append(("POST", ep, {}))
-            else:
-                for ep in action_endpoints_enable:
-                    attempts.append(("POST", ep, {}))
-
-            # Last-resort: only if disabling and everything else fails, try forcing expire=0 once
-            if payload.status == "disabled":
-                body_force_expire = dict(body_base)
-                body_force_expire["expire"] = 0
-                attempts.append(("PATCH", url, body_force_expire))
-
-            # Try with two header styles: Bearer and Token
-            header_variants = [headers, {**headers, "Authorization": f"Token {token}"}]
-            last_status: Optional[int] = None
-            last_text: Optional[str] = None
-            for hdrs in header_variants:
-                for method, target, body_try in attempts:
-                    try:
-                        if method == "PATCH":
-                            res = await client.patch(target, json=body_try, headers=hdrs)
-                        elif method == "PUT":
-                            res = await client.put(target, json=body_try, headers=hdrs)
-                        else:
-                            res = await client.post(target, json=body_try, headers=hdrs)
-                    except Exception as e:
-                        last_status = 0
-                        last_text = str(e)
-                        continue
-                    if 200 <= res.status_code < 300:
-                        # Confirm the status actually changed
-                        if await _confirm_status(payload.status):
-                            try:
-                                record_audit_event(db, current_user.id, f"config_user_{payload.status}", target=username, meta={"panel_id": panel_id})
-                            except Exception:
-                                pass
-                            return {"ok": True}
-                        # If not confirmed, continue trying other variants
-                    last_status = res.status_code
-                    last_text = res.text[:200]
-
-            raise HTTPException(status_code=last_status or 502, detail=last_text or "Panel status change failed")
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=502, detail=str(e))
+        await db.run_sync(_require_xui_assignment, panel_id, current_user)
+    if _wants_job(prefer):
+        params = {"account": panel.username, "username": username, "status": payload.status}
+        return await _accept_job(db, current_user, panel_id, "set_status", params, idempotency_key=idempotency_key)
+    try:
+        await get_adapter(panel).set_status(username, payload.status)
+    except PanelError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    await db.run_sync(mirror_patch, panel_id, username, status=payload.status)
+    try:
+        await db.run_sync(record_audit_event, current_user.id, f"config_user_{payload.status}", target=username, meta={"panel_id": panel_id})
+    except Exception:
+        pass
+    return {"ok": True}
 
 
 class PanelUserExtendRequest(BaseModel):
@@ -1875,209 +941,267 @@ class PanelUserExtendRequest(BaseModel):
 
 
 @router.post("/panels/{panel_id}/user/{username}/extend")
-async def extend_user_on_panel(panel_id: int, username: str, payload: PanelUserExtendRequest, db: Session = Depends(get_db), current_user: User = Depends(require_roles(["admin", "operator"]))):
-    panel = db.query(Panel).filter(Panel.id == panel_id).first()
+async def extend_user_on_panel(
+    panel_id: int,
+    username: str,
+    payload: PanelUserExtendRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=128),
+    prefer: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(require_roles(["admin", "operator"])),
+):
+    panel = await db.get(Panel, panel_id)
     if not panel:
         raise HTTPException(status_code=404, detail="Panel not found")
     cred_username = panel.username
     cred_password = panel.password
     if current_user.role == "operator":
-        rec = db.query(UserPanelCredential).filter(UserPanelCredential.user_id == current_user.id, UserPanelCredential.panel_id == panel_id).first()
+        rec = await db.scalar(select(UserPanelCredential).where(UserPanelCredential.user_id == current_user.id, UserPanelCredential.panel_id == panel_id))
         if not rec:
             raise HTTPException(status_code=403, detail="Operator panel credentials not found. Ask admin to provision your panel access.")
         cred_username = rec.username
         cred_password = rec.password
-    token = await _login_get_token(panel.base_url, cred_username, cred_password)
-    if not token:
-        raise HTTPException(status_code=502, detail="Login to panel failed")
+    adapter = get_adapter(panel, cred_username, cred_password)
+    background = _wants_job(prefer)
+    if not background:
+        try:
+            await adapter.login()
+        except PanelError as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
 
-    # Resolve plan and deduct wallet for non-root admins
-    plan = db.query(Plan).filter(Plan.id == payload.plan_id).first()
+    # Resolve plan and hold the price for non-root admins; a retried key is answered from the first attempt
+    plan = await db.get(Plan, payload.plan_id)
     if not plan:
         raise HTTPException(status_code=404, detail="Plan not found")
+    fingerprint = wallet_service.request_hash(
+        {"panel_id": panel_id, "username": username, "plan_id": payload.plan_id, "template_id": payload.template_id}
+    )
+    if background:
+        price = Decimal("0.00") if current_user.is_root_admin else await effective_price(current_user, plan)
+        tpl = await db.run_sync(_assigned_template, panel_id, current_user)
+        inbounds = list(await db.scalars(select(TemplateInbound.inbound_id).where(TemplateInbound.template_id == tpl.id))) if tpl else None
+        params = {"account": cred_username, "username": username, "limits": PlanLimits.from_plan(plan).model_dump(), "inbounds": inbounds, "plan_id": plan.id}
+        return await _accept_job(
+            db, current_user, panel_id, "extend", params, price, f"Extend user '{username}' on panel {panel_id} (plan {plan.name})", idempotency_key, fingerprint
+        )
+    hold: Optional[WalletHold] = None
+    if not current_user.is_root_admin:
+        price = await effective_price(current_user, plan)
+        reason = f"Extend user '{username}' on panel {panel_id} (plan {plan.name})"
+        if price > 0:
+            hold, fresh = await _place_hold(db, current_user, price, reason, idempotency_key, "extend", fingerprint)
+            if hold is None:
+                raise HTTPException(status_code=402, detail="Insufficient wallet balance")
+            if not fresh:
+                _hold_in_progress(hold)
+                return {"ok": True}
+
+    # If a template was assigned to the operator and matches this panel, its inbounds replace the user's
+    tpl = await db.run_sync(_assigned_template, panel_id, current_user)
+    inbounds = list(await db.scalars(select(TemplateInbound.inbound_id).where(TemplateInbound.template_id == tpl.id))) if tpl else None
+    limits = PlanLimits.from_plan(plan)
+    try:
+        await adapter.extend(username, limits, inbounds)
+    except Exception as e:
+        if hold is not None:
+            await db.run_sync(wallet_service.release_hold, hold)
+        if isinstance(e, PanelError):
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+        raise
+    if hold is not None:
+        await db.run_sync(wallet_service.commit_hold, hold)
+    await db.run_sync(mirror_patch, panel_id, username, data_limit=limits.data_limit_bytes or None, expire=limits.expire_timestamp())
     try:
-        from app.core.config import get_settings
-        from app.models.root_admin import RootAdmin
-        settings = get_settings()
-        emails = {e.strip().lower() for e in settings.root_admin_emails.split(",") if e.strip()}
-        is_env_root = current_user.email.lower() in emails
-        is_db_root = db.query(RootAdmin).filter(RootAdmin.user_id == current_user.id).first() is not None
-        is_root_admin = current_user.role == "admin" and (is_env_root or is_db_root)
+        await db.run_sync(record_audit_event, current_user.id, "extend_config_user", target=username, meta={"panel_id": panel_id, "plan_id": payload.plan_id, "template_id": payload.template_id})
     except Exception:
-        is_root_admin = False
-    if not is_root_admin:
-        wallet = db.query(Wallet).filter(Wallet.user_id == current_user.id).first()
-        if not wallet:
-            wallet = Wallet(user_id=current_user.id, balance=0)
-            db.add(wallet)
-            db.commit()
-            db.refresh(wallet)
-        price = effective_price_for_user(db, current_user, plan)
-        wb = Decimal(str(wallet.balance or 0)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-        if wb < price:
-            raise HTTPException(status_code=402, detail="Insufficient wallet balance")
-        wallet.balance = (wb - price).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-        tx = WalletTransaction(user_id=current_user.id, amount=-price, reason=f"Extend user '{username}' on panel {panel_id} (plan {plan.name})")
-        db.add(wallet)
-        db.add(tx)
-        db.commit()
+        pass
+    return {"ok": True}
+
+
+class PanelBulkTargets(BaseModel):
+    # Either explicit usernames, or a filter resolved against the panel user mirror
+    usernames: Optional[List[str]] = None
+    operator_id: Optional[int] = None
+    current_status: Optional[str] = None
+    expiring_within_days: Optional[int] = None
+
+
+class PanelBulkStatusRequest(PanelBulkTargets):
+    status: Literal["active", "disabled"]
+
+
+class PanelBulkExtendRequest(PanelBulkTargets):
+    plan_id: int
+    template_id: Optional[int] = None
+
+
+class PanelBulkResultItem(BaseModel):
+    username: str
+    ok: bool
+    error: Optional[str] = None
+
+
+class PanelBulkResultResponse(BaseModel):
+    ok: bool
+    total: int
+    succeeded: int
+    failed: int
+    charged: Optional[Decimal] = None
+    items: List[PanelBulkResultItem]
 
-    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-    async with httpx.AsyncClient(timeout=20.0, verify=False) as client:
-        # Compute target expire RESET (always based on plan, from now)
-        if plan.is_duration_unlimited:
-            target_expire_ts = None
-        else:
-            add_days = max(1, int(plan.duration_days or 0))
-            target_expire_ts = int(datetime.now(tz=timezone.utc).timestamp()) + add_days * 86400
-
-        # Fetch current user to preserve fields and possibly inbounds/proxies
-        current_body: dict = {}
-        try:
-            u = await client.get(panel.base_url.rstrip("/") + f"/api/user/{username}", headers=headers)
-            if u.headers.get("content-type", "").startswith("application/json"):
-                data = u.json()
-                if isinstance(data, dict):
-                    current_body = data
-        except Exception:
-            current_body = {}
 
-        # Build canonical body: reset data_limit/expire by plan; preserve note/inbounds/proxies unless template overrides
-        proxies_obj = None
-        inbounds_obj = None
+# Users per bulk status/extend request
+BULK_UPDATE_MAX = 2000
+
+
+def _bulk_targets(db: Session, panel_id: int, owner: str, user: User, targets: PanelBulkTargets) -> list[str]:
+    """Usernames a bulk request acts on, from the explicit list or from the filter."""
+    if targets.usernames is not None:
+        names = list(dict.fromkeys(n.strip() for n in targets.usernames if n and n.strip()))
+    else:
+        if targets.operator_id is None and targets.current_status is None and targets.expiring_within_days is None:
+            raise HTTPException(status_code=400, detail="Give usernames or at least one filter")
+        if targets.operator_id is not None and targets.operator_id != user.id and not user.is_root_admin:
+            raise HTTPException(status_code=403, detail="Only root admins can target another operator's users")
+        # The mirror holds what this account sees on the panel; filters run there instead of on the panel
+        q = db.query(PanelUserMirror.username).filter(PanelUserMirror.panel_id == panel_id, PanelUserMirror.owner == owner)
+        if targets.current_status:
+            q = q.filter(PanelUserMirror.status == targets.current_status)
+        if targets.expiring_within_days is not None:
+            if targets.expiring_within_days < 0:
+                raise HTTPException(status_code=400, detail="expiring_within_days must be >= 0")
+            now_ts = int(datetime.now(tz=timezone.utc).timestamp())
+            q = q.filter(PanelUserMirror.expire > now_ts, PanelUserMirror.expire <= now_ts + targets.expiring_within_days * 86400)
+        if targets.operator_id is not None:
+            created = db.query(PanelCreatedUser.username).filter(PanelCreatedUser.panel_id == panel_id, PanelCreatedUser.created_by_user_id == targets.operator_id)
+            q = q.filter(PanelUserMirror.username.in_(created.scalar_subquery()))
+        names = [r.username for r in q.order_by(PanelUserMirror.username.asc()).limit(BULK_UPDATE_MAX + 1)]
+    if not names:
+        raise HTTPException(status_code=404, detail="No users matched")
+    if len(names) > BULK_UPDATE_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_UPDATE_MAX} users per request; narrow the filter")
+    return names
+
+
+def _bulk_response(names: list[str], results: list[Optional[PanelError]], charged: Optional[Decimal] = None) -> PanelBulkResultResponse:
+    items = [PanelBulkResultItem(username=n, ok=r is None, error=r.detail if r else None) for n, r in zip(names, results)]
+    succeeded = sum(1 for it in items if it.ok)
+    return PanelBulkResultResponse(ok=succeeded == len(items), total=len(items), succeeded=succeeded, failed=len(items) - succeeded, charged=charged, items=items)
+
+
+@router.post("/panels/{panel_id}/users/bulk/status", response_model=PanelBulkResultResponse)
+async def bulk_set_user_status(panel_id: int, payload: PanelBulkStatusRequest, request: Request, db: AsyncSession = Depends(get_async_db), current_user: User = Depends(require_roles(["admin", "operator"]))):
+    logger = logging.getLogger("app")
+    panel = await db.get(Panel, panel_id)
+    if not panel:
+        raise HTTPException(status_code=404, detail="Panel not found")
+    cred_username, cred_password = await db.run_sync(_panel_credentials, panel, current_user)
+    names = await db.run_sync(_bulk_targets, panel_id, cred_username, current_user, payload)
+    adapter = get_adapter(panel, cred_username, cred_password)
+    try:
+        await adapter.login()
+    except PanelError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+    results = await adapter.set_status_many(names, payload.status, get_settings().panel_bulk_concurrency)
+    done = [n for n, r in zip(names, results) if r is None]
+    await db.run_sync(mirror_patch_many, panel_id, done, status=payload.status)
+    try:
+        await db.run_sync(record_audit_event, current_user.id, "bulk_set_config_user_status", target=f"panel:{panel_id}", meta={"panel_id": panel_id, "status": payload.status, "usernames": done, "failed": len(names) - len(done)})
+    except Exception:
+        pass
+    logger.info("bulk_status done trace=%s panel_id=%s status=%s ok=%s failed=%s", getattr(request.state, "trace_id", "-"), panel_id, payload.status, len(done), len(names) - len(done))
+    return _bulk_response(names, results)
+
+
+def _bulk_fingerprint(panel_id: int, payload: PanelBulkExtendRequest) -> str:
+    """What a bulk extend asks for: the usernames as _bulk_targets resolves them, or the filter.
+
+    A filter is fingerprinted as sent, since the users it matches change once they are extended.
+    """
+    targets = payload.model_dump(include=set(PanelBulkTargets.model_fields))
+    if payload.usernames is not None:
+        targets = {"usernames": sorted({n.strip() for n in payload.usernames if n and n.strip()})}
+    return wallet_service.request_hash({"panel_id": panel_id, "targets": targets, "plan_id": payload.plan_id, "template_id": payload.template_id})
+
+
+def _bulk_replay(hold: WalletHold) -> PanelBulkResultResponse:
+    _hold_in_progress(hold)
+    if hold.result is None:
+        # Settled without a recorded result
+        raise HTTPException(status_code=409, detail="This Idempotency-Key was already used; its results are no longer available")
+    return PanelBulkResultResponse(**hold.result)
+
+
+@router.post("/panels/{panel_id}/users/bulk/extend", response_model=PanelBulkResultResponse)
+async def bulk_extend_users_on_panel(
+    panel_id: int,
+    payload: PanelBulkExtendRequest,
+    request: Request,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=128),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(require_roles(["admin", "operator"])),
+):
+    """Extend many users for one plan price each. Retrying with the same Idempotency-Key never
+    extends or charges twice: it returns the first attempt's results (409 while it still runs)."""
+    logger = logging.getLogger("app")
+    panel = await db.get(Panel, panel_id)
+    if not panel:
+        raise HTTPException(status_code=404, detail="Panel not found")
+    fingerprint = _bulk_fingerprint(panel_id, payload)
+    # Checked before resolving targets: a filter may match nobody once the first attempt has run
+    if idempotency_key and not current_user.is_root_admin:
         try:
-            # If a template was assigned to the operator and matches this panel, use it
-            ut = db.query(UserTemplate).filter(UserTemplate.user_id == current_user.id).first()
-            if ut:
-                tpl = db.query(Template).filter(Template.id == ut.template_id).first()
-                if tpl and tpl.panel_id == panel_id:
-                    resp_inb = await client.get(panel.base_url.rstrip("/") + "/api/inbounds", headers=headers)
-                    resp_inb.raise_for_status()
-                    inb_data = resp_inb.json()
-                    normalized: list[dict] = []
-                    if isinstance(inb_data, list):
-                        normalized = [x for x in inb_data if isinstance(x, dict)]
-                    elif isinstance(inb_data, dict):
-                        if isinstance(inb_data.get("items"), list):
-                            normalized = [x for x in inb_data["items"] if isinstance(x, dict)]
-                        else:
-                            for v in inb_data.values():
-                                if isinstance(v, list):
-                                    normalized.extend([x for x in v if isinstance(x, dict)])
-                    tpl_tags = {row.inbound_id for row in db.query(TemplateInbound).filter(TemplateInbound.template_id == tpl.id).all()}
-                    proto_to_tags: dict[str, list[str]] = {}
-                    for it in normalized:
-                        tag = str(it.get("tag") or "").strip()
-                        proto = str(it.get("protocol") or "").strip()
-                        if tag and proto and tag in tpl_tags:
-                            proto_to_tags.setdefault(proto, []).append(tag)
-                    proxies_obj = {proto: {} for proto in proto_to_tags.keys()}
-                    inbounds_obj = proto_to_tags
-        except Exception:
-            proxies_obj = None
-            inbounds_obj = None
-
-        # Data limit RESET based on plan (0 for unlimited)
-        bytes_limit = 0 if plan.is_data_unlimited else int(max(0, int(plan.data_quota_mb or 0)) * (1024 ** 2))
-
-        body_base: dict = {
-            "username": username,
-            "data_limit": bytes_limit,
-            "data_limit_reset_strategy": "no_reset",
-            "status": current_body.get("status", "active"),
-            "next_plan": {
-                "add_remaining_traffic": False,
-                "data_limit": 0,
-                "expire": 0,
-                "fire_on_either": True,
-            },
-            "note": current_body.get("note", ""),
-            "on_hold_expire_duration": 0,
-            "on_hold_timeout": current_body.get("on_hold_timeout", None),
-        }
-        if target_expire_ts is not None:
-            body_base["expire"] = target_expire_ts
-        if proxies_obj is not None and inbounds_obj is not None:
-            body_base["proxies"] = proxies_obj
-            body_base["inbounds"] = inbounds_obj
-        else:
-            body_base["proxies"] = current_body.get("proxies") or {}
-            body_base["inbounds"] = current_body.get("inbounds") or {}
-
-        user_url = panel.base_url.rstrip("/") + f"/api/user/{username}"
-        admin_user_url = panel.base_url.rstrip("/") + f"/api/admin/user/{username}"
-        base_user_url = panel.base_url.rstrip("/") + "/api/user"
-
-        # Try multiple methods/endpoints similar to status change flow
-        # Build variant bodies to handle API differences
-        variant_bodies: list[dict] = []
-        variant_bodies.append(body_base)
-        # Variant: force active status
-        body_force_active = dict(body_base)
-        body_force_active["status"] = "active"
-        variant_bodies.append(body_force_active)
-        # Variant: use days fields for expire if limited
-        if target_expire_ts is not None:
-            add_days = max(1, int(plan.duration_days or 0))
-            body_expire_days = dict(body_base)
-            # Remove timestamp to avoid conflicts
-            if "expire" in body_expire_days:
-                del body_expire_days["expire"]
-            for k in ("expire_in_days", "expire_days", "duration_days"):
-                body_expire_days[k] = add_days
-            variant_bodies.append(body_expire_days)
-        # Variant: data_limit synonyms
-        body_limit = dict(body_base)
-        if "data_limit" in body_limit:
-            dl = body_limit.get("data_limit", 0)
-            body_limit["limit"] = dl
-            body_limit["quota"] = dl
-        variant_bodies.append(body_limit)
-
-        attempts: list[tuple[str, str, dict]] = []
-        for vb in variant_bodies:
-            attempts.append(("PATCH", user_url, vb))
-            attempts.append(("PATCH", user_url + "/", vb))
-            attempts.append(("PATCH", admin_user_url, vb))
-            attempts.append(("PUT", user_url, vb))
-            attempts.append(("PUT", admin_user_url, vb))
-            # Some panels update via POST /api/user as upsert
-            attempts.append(("POST", base_user_url, vb))
-
-        header_variants = [headers, {**headers, "Authorization": f"Token {token}"}]
-        last_status: Optional[int] = None
-        last_text: Optional[str] = None
-        for hdrs in header_variants:
-            for method, target, body_try in attempts:
-                try:
-                    if method == "PATCH":
-                        res = await client.patch(target, json=body_try, headers=hdrs)
-                    elif method == "PUT":
-                        res = await client.put(target, json=body_try, headers=hdrs)
-                    else:
-                        res = await client.post(target, json=body_try, headers=hdrs)
-                except Exception as e:
-                    last_status = 0
-                    last_text = str(e)
-                    continue
-                if 200 <= res.status_code < 300:
-                    # best-effort reset traffic counters via common endpoints
-                    for ep in [
-                        panel.base_url.rstrip("/") + f"/api/user/{username}/reset",
-                        panel.base_url.rstrip("/") + f"/api/user/{username}/reset_traffic",
-                        panel.base_url.rstrip("/") + f"/api/user/{username}/reset-traffic",
-                    ]:
-                        try:
-                            await client.post(ep, headers=hdrs)
-                        except Exception:
-                            pass
-                    try:
-                        record_audit_event(db, current_user.id, "extend_config_user", target=username, meta={"panel_id": panel_id, "plan_id": payload.plan_id, "template_id": payload.template_id})
-                    except Exception:
-                        pass
-                    return {"ok": True}
-                last_status = res.status_code
-                last_text = res.text[:200]
-
-        raise HTTPException(status_code=last_status or 502, detail=last_text or "Panel extend failed")
+            prior = await db.run_sync(wallet_service.find_hold, current_user.id, "bulk_extend", idempotency_key, fingerprint)
+        except wallet_service.IdempotencyConflict:
+            raise HTTPException(status_code=422, detail=_KEY_REUSED)
+        if prior is not None:
+            return _bulk_replay(prior)
+    cred_username, cred_password = await db.run_sync(_panel_credentials, panel, current_user)
+    names = await db.run_sync(_bulk_targets, panel_id, cred_username, current_user, payload)
+    adapter = get_adapter(panel, cred_username, cred_password)
+    try:
+        await adapter.login()
+    except PanelError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    plan = await db.get(Plan, payload.plan_id)
+    if not plan:
+        raise HTTPException(status_code=404, detail="Plan not found")
+
+    # Hold the whole batch up front; only the users actually extended are charged from it
+    unit_price = Decimal("0.00") if current_user.is_root_admin else await effective_price(current_user, plan)
+    total_price = (unit_price * len(names)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+    hold: Optional[WalletHold] = None
+    if total_price > 0:
+        reason = f"Extend {len(names)} users on panel {panel_id} (plan {plan.name})"
+        hold, fresh = await _place_hold(db, current_user, total_price, reason, idempotency_key, "bulk_extend", fingerprint)
+        if hold is None:
+            raise HTTPException(status_code=402, detail="Insufficient wallet balance")
+        if not fresh:
+            return _bulk_replay(hold)
+
+    tpl = await db.run_sync(_assigned_template, panel_id, current_user)
+    inbounds = list(await db.scalars(select(TemplateInbound.inbound_id).where(TemplateInbound.template_id == tpl.id))) if tpl else None
+    limits = PlanLimits.from_plan(plan)
+    try:
+        results = await adapter.extend_many(names, limits, inbounds, get_settings().panel_bulk_concurrency)
+    except Exception:
+        if hold is not None:
+            await db.run_sync(wallet_service.release_hold, hold)
+        raise
+    done = [n for n, r in zip(names, results) if r is None]
+    charged = (unit_price * len(done)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+    response = _bulk_response(names, results, charged)
+    if hold is not None:
+        await db.run_sync(
+            wallet_service.commit_hold, hold, charged, f"Extend {len(done)} of {len(names)} users on panel {panel_id} (plan {plan.name})", response.model_dump(mode="json")
+        )
+
+    await db.run_sync(mirror_patch_many, panel_id, done, data_limit=limits.data_limit_bytes or None, expire=limits.expire_timestamp())
+    try:
+        await db.run_sync(record_audit_event, current_user.id, "bulk_extend_config_users", target=f"panel:{panel_id}", meta={"panel_id": panel_id, "plan_id": payload.plan_id, "template_id": payload.template_id, "usernames": done, "failed": len(names) - len(done), "charged": str(charged)})
+    except Exception:
+        pass
+    logger.info("bulk_extend done trace=%s panel_id=%s ok=%s failed=%s charged=%s", getattr(request.state, "trace_id", "-"), panel_id, len(done), len(names) - len(done), charged)
+    return response
 
@@ -5,6 +5,7 @@ from sqlalchemy.orm import Session
 from app.core.auth import require_root_admin, require_roles
 from app.db.session import get_db
 from app.models.plan_category import PlanCategory
+from app.services.pricing import invalidate_price_catalog
 from pydantic import BaseModel
 
 
@@ -42,6 +43,7 @@ def create_cat(payload: CategoryCreate, db: Session = Depends(get_db), _: Depend
     db.add(c)
     db.commit()
     db.refresh(c)
+    invalidate_price_catalog()
     return CategoryRead.from_orm(c)
 
 
@@ -57,6 +59,7 @@ def update_cat(cat_id: int, payload: CategoryUpdate, db: Session = Depends(get_d
     db.add(c)
     db.commit()
     db.refresh(c)
+    invalidate_price_catalog()
     return CategoryRead.from_orm(c)
 
 
@@ -67,5 +70,6 @@ def delete_cat(cat_id: int, db: Session = Depends(get_db), _: Depends = Depends(
         raise HTTPException(status_code=404, detail="Category not found")
     db.delete(c)
     db.commit()
+    invalidate_price_catalog()
     return {"ok": True}
 
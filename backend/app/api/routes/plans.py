@@ -5,9 +5,10 @@ from sqlalchemy.orm import Session
 from app.core.auth import require_root_admin, require_roles, get_current_user
 from app.db.session import get_db
 from app.models.plan import Plan
-from app.models.plan_template import UserPlanTemplate, PlanTemplateItem
 from app.schemas.plan import PlanCreate, PlanRead, PlanUpdate
 from app.models.user import User
+from app.services.pricing import invalidate_price_catalog, price_catalog
+from pydantic import BaseModel
 
 
 router = APIRouter()
@@ -15,31 +16,29 @@ router = APIRouter()
 
 @router.get("/plans", response_model=List[PlanRead])
 def list_plans(db: Session = Depends(get_db), current_user: User = Depends(require_roles(["admin", "operator"]))):
-    plans = db.query(Plan).order_by(Plan.category_id.asc(), Plan.sort_order.asc(), Plan.id.asc()).all()
-    # If operator, try to fetch assigned plan template and attach effective_price
-    try:
-        if current_user.role == "operator":
-            upt = db.query(UserPlanTemplate).filter(UserPlanTemplate.user_id == current_user.id).first()
-            if upt:
-                overrides = {row.plan_id: row.price_override for row in db.query(PlanTemplateItem).filter(PlanTemplateItem.template_id == upt.template_id).all()}
-                result: list[PlanRead] = []
-                for p in plans:
-                    pr = PlanRead.from_orm(p)
-                    if p.id in overrides:
-                        pr.effective_price = overrides[p.id]
-                    else:
-                        pr.effective_price = p.price
-                    result.append(pr)
-                return result
-    except Exception:
-        pass
-    # Default: set effective_price to base price
-    res = []
-    for p in plans:
-        pr = PlanRead.from_orm(p)
-        pr.effective_price = p.price
-        res.append(pr)
-    return res
+    # effective_price is the operator's plan template price where one applies, else the base price
+    return price_catalog.get(db).plans_for(current_user)
+
+
+class CatalogCategoryRead(BaseModel):
+    id: int
+    name: str
+    sort_order: int
+
+
+class CatalogRead(BaseModel):
+    categories: List[CatalogCategoryRead]
+    plans: List[PlanRead]
+
+
+@router.get("/catalog", response_model=CatalogRead)
+def get_catalog(db: Session = Depends(get_db), current_user: User = Depends(require_roles(["admin", "operator"]))):
+    """Everything the storefront needs in one payload, served from the cached price catalog."""
+    catalog = price_catalog.get(db)
+    return CatalogRead(
+        categories=[CatalogCategoryRead(id=c.id, name=c.name, sort_order=c.sort_order) for c in catalog.categories],
+        plans=catalog.plans_for(current_user),
+    )
 
 
 @router.post("/plans", response_model=PlanRead)
@@ -68,6 +67,7 @@ def create_plan(payload: PlanCreate, _: Depends = Depends(require_root_admin), d
     db.add(plan)
     db.commit()
     db.refresh(plan)
+    invalidate_price_catalog()
     return plan
 
 
@@ -104,6 +104,7 @@ def update_plan(plan_id: int, payload: PlanUpdate, _: Depends = Depends(require_
     db.add(plan)
     db.commit()
     db.refresh(plan)
+    invalidate_price_catalog()
     return plan
 
 
@@ -114,5 +115,6 @@ def delete_plan(plan_id: int, _: Depends = Depends(require_root_admin), db: Sess
         raise HTTPException(status_code=404, detail="Plan not found")
     db.delete(plan)
     db.commit()
+    invalidate_price_catalog()
     return {"ok": True}
 
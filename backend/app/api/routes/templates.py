@@ -9,6 +9,7 @@ from app.models.template import Template, TemplateInbound, UserTemplate
 from app.models.plan_template import PlanTemplate, PlanTemplateItem, UserPlanTemplate
 from decimal import Decimal
 from pydantic import BaseModel
+from app.services.pricing import invalidate_price_catalog
 from app.schemas.template import TemplateCreate, TemplateRead, TemplateUpdate, AssignTemplateRequest
 
 
@@ -106,6 +107,7 @@ def create_plan_template(payload: PlanTemplateCreate, db: Session = Depends(get_
     for it in payload.items:
         db.add(PlanTemplateItem(template_id=t.id, plan_id=it.plan_id, price_override=it.price_override))
     db.commit()
+    invalidate_price_catalog()
     items = [PlanTemplateItemPayload(plan_id=it.plan_id, price_override=it.price_override) for it in db.query(PlanTemplateItem).filter(PlanTemplateItem.template_id == t.id).all()]
     return PlanTemplateRead(id=t.id, name=t.name, items=items)
 
@@ -129,6 +131,7 @@ def update_plan_template(template_id: int, payload: PlanTemplateUpdate, db: Sess
         for it in payload.items:
             db.add(PlanTemplateItem(template_id=t.id, plan_id=it.plan_id, price_override=it.price_override))
         db.commit()
+        invalidate_price_catalog()
     items = [PlanTemplateItemPayload(plan_id=it.plan_id, price_override=it.price_override) for it in db.query(PlanTemplateItem).filter(PlanTemplateItem.template_id == t.id).all()]
     return PlanTemplateRead(id=t.id, name=t.name, items=items)
 
@@ -141,6 +144,7 @@ def delete_plan_template(template_id: int, db: Session = Depends(get_db), _: Dep
     db.query(PlanTemplateItem).filter(PlanTemplateItem.template_id == t.id).delete()
     db.delete(t)
     db.commit()
+    invalidate_price_catalog()
     return {"ok": True}
 
 
@@ -159,6 +163,7 @@ def assign_plan_template(payload: AssignPlanTemplatePayload, db: Session = Depen
         rec.template_id = payload.template_id
         db.add(rec)
     db.commit()
+    invalidate_price_catalog()
     return {"ok": True}
 
 
@@ -6,6 +6,7 @@ from app.db.session import get_db
 from app.models.user import User
 from app.schemas.user import UserCreate, UserRead, UserUpdate
 from app.core.auth import require_roles, get_current_user
+from app.services.principal_cache import invalidate_principal
 from app.core.security import hash_password
 from app.core.config import get_settings
 import httpx
@@ -141,6 +142,7 @@ def update_user(user_id: int, payload: UserUpdate, db: Session = Depends(get_db)
     db.add(user)
     db.commit()
     db.refresh(user)
+    invalidate_principal(user.id)
     record_audit_event(db, user_id=current_user.id, action="update_user", target=str(user.id))
     return user
 
@@ -154,6 +156,7 @@ def disable_user(user_id: int, db: Session = Depends(get_db), current_user: User
     db.add(user)
     db.commit()
     db.refresh(user)
+    invalidate_principal(user.id)
     record_audit_event(db, user_id=current_user.id, action="disable_user", target=str(user.id))
     return user
 
@@ -167,6 +170,7 @@ def enable_user(user_id: int, db: Session = Depends(get_db), current_user: User
     db.add(user)
     db.commit()
     db.refresh(user)
+    invalidate_principal(user.id)
     record_audit_event(db, user_id=current_user.id, action="enable_user", target=str(user.id))
     return user
 
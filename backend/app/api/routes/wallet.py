@@ -1,56 +1,82 @@
-from fastapi import APIRouter, Depends, HTTPException
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
 from sqlalchemy.orm import Session
-from typing import List
+from typing import Optional
 
 from app.db.session import get_db
 from app.core.auth import get_current_user, require_root_admin
-from app.models.wallet import Wallet, WalletTransaction
 from app.models.user import User
-from app.schemas.wallet import WalletRead, WalletAdjustRequest, WalletTransactionRead, WalletTransactionsResponse
+from app.services import wallet as wallet_service
+from app.schemas.wallet import WalletRead, WalletAdjustRequest, WalletDayRead, WalletSummaryRead, WalletTransactionRead, WalletTransactionsResponse
 
 
 router = APIRouter()
 
 
-def _get_or_create_wallet(db: Session, user_id: int) -> Wallet:
-    w = db.query(Wallet).filter(Wallet.user_id == user_id).first()
-    if not w:
-        w = Wallet(user_id=user_id, balance=0)
-        db.add(w)
-        db.commit()
-        db.refresh(w)
-    return w
-
-
 @router.get("/wallet/me", response_model=WalletRead)
 def get_my_wallet(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    w = _get_or_create_wallet(db, current_user.id)
-    return WalletRead(balance=w.balance)
+    return WalletRead(balance=wallet_service.balance(db, current_user.id))
 
 
 @router.get("/wallet/me/transactions", response_model=WalletTransactionsResponse)
-def get_my_wallet_txs(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    txs = db.query(WalletTransaction).filter(WalletTransaction.user_id == current_user.id).order_by(WalletTransaction.id.desc()).all()
-    return WalletTransactionsResponse(items=[WalletTransactionRead.from_orm(t) for t in txs])
+def get_my_wallet_txs(
+    limit: int = Query(100, ge=1, le=500),
+    before_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Newest first with the running balance after each transaction; page with `next_before_id`."""
+    txs = wallet_service.ledger_page(db, current_user.id, limit + 1, before_id, since, until)
+    next_before_id = txs[limit - 1].id if len(txs) > limit else None
+    return WalletTransactionsResponse(items=[WalletTransactionRead.model_validate(t) for t in txs[:limit]], next_before_id=next_before_id)
+
+
+@router.get("/wallet/me/summary", response_model=WalletSummaryRead)
+def get_my_wallet_summary(
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Debit/credit totals per UTC day from the rollup table; defaults to the last 30 days."""
+    until = until or datetime.now(tz=timezone.utc).date()
+    since = since or until - timedelta(days=29)
+    if since > until:
+        raise HTTPException(status_code=400, detail="since must not be after until")
+    if (until - since).days > 366:
+        raise HTTPException(status_code=400, detail="At most 366 days per summary")
+    days = [WalletDayRead.model_validate(r) for r in wallet_service.daily_rollups(db, current_user.id, since, until)]
+    return WalletSummaryRead(
+        balance=wallet_service.balance(db, current_user.id),
+        since=since,
+        until=until,
+        debits=sum((d.debits for d in days), Decimal("0")),
+        credits=sum((d.credits for d in days), Decimal("0")),
+        tx_count=sum(d.tx_count for d in days),
+        days=days,
+    )
 
 
 @router.get("/wallet/{user_id}", response_model=WalletRead)
 def get_user_wallet(user_id: int, db: Session = Depends(get_db), _: User = Depends(require_root_admin)):
-    w = _get_or_create_wallet(db, user_id)
-    return WalletRead(balance=w.balance)
+    return WalletRead(balance=wallet_service.balance(db, user_id))
 
 
 @router.post("/wallet/{user_id}/adjust", response_model=WalletRead)
-def adjust_wallet(user_id: int, payload: WalletAdjustRequest, db: Session = Depends(get_db), _: User = Depends(require_root_admin)):
+def adjust_wallet(
+    user_id: int,
+    payload: WalletAdjustRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=128),
+    db: Session = Depends(get_db),
+    _: User = Depends(require_root_admin),
+):
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    w = _get_or_create_wallet(db, user_id)
-    w.balance = (w.balance or 0) + payload.amount
-    tx = WalletTransaction(user_id=user_id, amount=payload.amount, reason=payload.reason)
-    db.add(w)
-    db.add(tx)
-    db.commit()
-    db.refresh(w)
-    return WalletRead(balance=w.balance)
-
+    try:
+        return WalletRead(balance=wallet_service.adjust(db, user_id, payload.amount, payload.reason, idempotency_key))
+    except wallet_service.IdempotencyConflict:
+        raise HTTPException(status_code=422, detail="This Idempotency-Key was already used for a different request")
@@ -1,7 +1,9 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from functools import partial
+from fastapi import APIRouter, WebSocket
 from jose import jwt, JWTError
 from app.core.config import get_settings
-from app.services.redis_client import get_redis
+from app.services import notifications
+from app.services.notification_hub import hub
 
 router = APIRouter()
 settings = get_settings()
@@ -23,21 +25,7 @@ async def websocket_notifications(ws: WebSocket):
     except JWTError:
         await ws.close(code=4401)
         return
-    redis = get_redis()
-    pubsub = redis.pubsub()
-    channel = f"notifications:{user_id}"
-    await pubsub.subscribe(channel)
-    try:
-        while True:
-            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=10.0)
-            if message and message.get("type") == "message":
-                data = message.get("data")
-                await ws.send_text(data)
-    except WebSocketDisconnect:
-        pass
-    finally:
-        try:
-            await pubsub.unsubscribe(channel)
-            await pubsub.aclose()
-        finally:
-            await redis.aclose()
\ No newline at end of file
+    # Dashboards pass the id of the last message they saw to get what they missed
+    last_id = ws.query_params.get("last_id")
+    backlog = partial(notifications.replay, user_id, last_id) if last_id else None
+    await hub.serve(ws, str(user_id), backlog=backlog, on_message=partial(notifications.handle_client_message, int(user_id)))
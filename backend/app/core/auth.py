@@ -6,9 +6,7 @@ from sqlalchemy.orm import Session
 
 from app.core.config import get_settings
 from app.db.session import get_db
-from sqlalchemy.orm import Session
-from app.models.root_admin import RootAdmin
-from app.models.user import User
+from app.services.principal_cache import Principal, principal_cache
 
 settings = get_settings()
 
@@ -18,7 +16,7 @@ reuseable_oauth = OAuth2PasswordBearer(
 )
 
 
-def get_current_user(db: Session = Depends(get_db), token: str = Depends(reuseable_oauth)) -> User:
+def get_current_user(db: Session = Depends(get_db), token: str = Depends(reuseable_oauth)) -> Principal:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -34,14 +32,15 @@ def get_current_user(db: Session = Depends(get_db), token: str = Depends(reuseab
     except JWTError:
         raise credentials_exception
 
-    user = db.query(User).filter(User.id == int(subject)).first()
+    # Served from the principal cache; the session only connects on a miss
+    user = principal_cache.get(db, int(subject))
     if user is None or not user.is_active:
         raise credentials_exception
     return user
 
 
 def require_roles(allowed_roles: Sequence[str]):
-    def dependency(user: User = Depends(get_current_user)) -> User:
+    def dependency(user: Principal = Depends(get_current_user)) -> Principal:
         if user.role not in allowed_roles:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Insufficient permissions")
         return user
@@ -49,15 +48,8 @@ def require_roles(allowed_roles: Sequence[str]):
     return dependency
 
 
-def require_root_admin(user: User = Depends(get_current_user), db: Session = Depends(get_db)) -> User:
-    # Root admin if:
-    # 1) user is admin AND email is in ROOT_ADMIN_EMAILS, OR
-    # 2) user is admin AND exists in root_admins table
-    if user.role != "admin":
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Root admin only")
-    emails = {e.strip().lower() for e in settings.root_admin_emails.split(",") if e.strip()}
-    is_env_root = user.email.lower() in emails
-    is_db_root = db.query(RootAdmin).filter(RootAdmin.user_id == user.id).first() is not None
-    if not (is_env_root or is_db_root):
+def require_root_admin(user: Principal = Depends(get_current_user)) -> Principal:
+    # Root admin: an admin whose email is in ROOT_ADMIN_EMAILS or who is in root_admins (see principal_cache)
+    if not user.is_root_admin:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Root admin only")
-    return user
\ No newline at end of file
+    return user
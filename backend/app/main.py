@@ -3,7 +3,9 @@ from fastapi.middleware.cors import CORSMiddleware
 from slowapi.middleware import SlowAPIMiddleware
 from fastapi.responses import ORJSONResponse
 from fastapi.responses import JSONResponse
+import asyncio
 import logging
+import time
 import uuid
 import traceback
 
@@ -36,15 +38,34 @@ app.add_middleware(SlowAPIMiddleware)
 from app.api.routes import auth, users, configs, audit, control, monitoring, ws, notifications, panels, plans, wallet, templates  # noqa: E402
 from app.api.routes import plan_categories  # noqa: E402
 from app.api.routes import backup  # noqa: E402
+from app.api.routes import panel_jobs  # noqa: E402
+from app.api.routes import nodes  # noqa: E402
+from app.api.routes import metrics  # noqa: E402
 from app.services.backup import schedule_backup_task  # noqa: E402
+from app.services.panel_http import close_panel_clients  # noqa: E402
+from app.services.panel_user_sync import schedule_panel_user_sync  # noqa: E402
+from app.db.session import async_engine  # noqa: E402
+from app.services.cache_invalidation import schedule_cache_invalidation  # noqa: E402
+from app.services.audit import schedule_audit_writer, stop_audit_writer  # noqa: E402
+from app.services.audit_partitions import schedule_audit_maintenance  # noqa: E402
+from app.services.wallet import schedule_wallet_hold_sweeper  # noqa: E402
+from app.services.redis_client import close_redis, init_redis  # noqa: E402
+from app.services.notification_hub import hub, schedule_notification_hub  # noqa: E402
+from app.services.notifications import schedule_notification_status_writer, stop_notification_status_writer  # noqa: E402
+from app.services.node_commands import schedule_node_command_bus  # noqa: E402
+from app.services import node_heartbeats  # noqa: E402
+from app.services.metrics import HTTP_REQUEST_SECONDS, schedule_loop_lag_probe  # noqa: E402
+from app.services.pricing import warm_price_catalog  # noqa: E402
 
 app.include_router(auth.router, prefix=settings.api_prefix, tags=["auth"])
 app.include_router(users.router, prefix=settings.api_prefix, tags=["users"])
 app.include_router(configs.router, prefix=settings.api_prefix, tags=["configs"])
 app.include_router(audit.router, prefix=settings.api_prefix, tags=["audit"])
 app.include_router(control.router, prefix=settings.api_prefix, tags=["control"])
+app.include_router(nodes.router, prefix=settings.api_prefix, tags=["nodes"])
 app.include_router(monitoring.router, prefix=settings.api_prefix, tags=["monitoring"])
 app.include_router(panels.router, prefix=settings.api_prefix, tags=["panels"])
+app.include_router(panel_jobs.router, prefix=settings.api_prefix, tags=["panel-jobs"])
 app.include_router(plans.router, prefix=settings.api_prefix, tags=["plans"])
 app.include_router(wallet.router, prefix=settings.api_prefix, tags=["wallet"])
 app.include_router(templates.router, prefix=settings.api_prefix, tags=["templates"])
@@ -58,6 +79,105 @@ except Exception:
     pass
 app.include_router(notifications.router, prefix=settings.api_prefix, tags=["notifications"])
 app.include_router(ws.router, tags=["ws"])  # path defined inside router
+app.include_router(metrics.router, tags=["metrics"])  # /metrics, where Prometheus looks by default
+
+
+@app.on_event("startup")
+async def open_redis_pool() -> None:
+    await init_redis()
+
+
+@app.on_event("startup")
+async def start_notification_hub() -> None:
+    schedule_notification_hub()
+
+
+@app.on_event("startup")
+async def start_notification_status_writer() -> None:
+    schedule_notification_status_writer()
+
+
+@app.on_event("startup")
+async def start_node_command_bus() -> None:
+    schedule_node_command_bus()
+
+
+@app.on_event("startup")
+async def start_node_heartbeat_flusher() -> None:
+    node_heartbeats.schedule_node_heartbeat_flusher()
+
+
+@app.on_event("startup")
+async def start_loop_lag_probe() -> None:
+    schedule_loop_lag_probe()
+
+
+@app.on_event("startup")
+async def load_price_catalog() -> None:
+    await warm_price_catalog()
+
+
+@app.on_event("startup")
+async def start_panel_user_sync() -> None:
+    schedule_panel_user_sync()
+
+
+@app.on_event("startup")
+async def start_cache_invalidation() -> None:
+    schedule_cache_invalidation()
+
+
+@app.on_event("startup")
+async def start_audit_writer() -> None:
+    schedule_audit_writer()
+
+
+@app.on_event("startup")
+async def start_audit_maintenance() -> None:
+    schedule_audit_maintenance()
+
+
+@app.on_event("startup")
+async def start_wallet_hold_sweeper() -> None:
+    schedule_wallet_hold_sweeper()
+
+
+@app.on_event("shutdown")
+async def flush_node_heartbeats() -> None:
+    try:
+        await node_heartbeats.flush()
+    except Exception:
+        logging.getLogger("app").warning("node_heartbeat final_flush_failed")
+
+
+@app.on_event("shutdown")
+async def flush_audit_writer() -> None:
+    await asyncio.to_thread(stop_audit_writer)
+
+
+@app.on_event("shutdown")
+async def shutdown_panel_clients() -> None:
+    await close_panel_clients()
+
+
+@app.on_event("shutdown")
+async def dispose_async_engine() -> None:
+    await async_engine.dispose()
+
+
+@app.on_event("shutdown")
+async def stop_notification_hub() -> None:
+    await hub.stop()
+
+
+@app.on_event("shutdown")
+async def flush_notification_status() -> None:
+    await stop_notification_status_writer()
+
+
+@app.on_event("shutdown")
+async def close_redis_pool() -> None:
+    await close_redis()
 
 
 @app.get("/")
@@ -65,6 +185,22 @@ async def root():
     return {"message": "Marzban Admin Panel API"}
 
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Time each request under its route template, so /users/1 and /users/2 share one series."""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        HTTP_REQUEST_SECONDS.labels(
+            request.method, getattr(route, "path", "unmatched"), str(status)
+        ).observe(time.perf_counter() - start)
+
+
 @app.middleware("http")
 async def add_trace_and_log_exceptions(request: Request, call_next):
     """Attach a per-request trace_id and log unhandled exceptions with it.
@@ -0,0 +1,24 @@
+"""add discovery cache to panels
+
+Revision ID: 20261017_0016
+Revises: 20250911_0015
+Create Date: 2026-10-17 00:16:00
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = "20261017_0016"
+down_revision = "20250911_0015"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("panels", sa.Column("discovery", postgresql.JSONB(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("panels", "discovery")
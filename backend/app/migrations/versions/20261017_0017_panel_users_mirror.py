@@ -0,0 +1,54 @@
+"""panel users mirror and sync state
+
+Revision ID: 20261017_0017
+Revises: 20261017_0016
+Create Date: 2026-10-17 00:17:00
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "20261017_0017"
+down_revision = "20261017_0016"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "panel_users",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("panel_id", sa.Integer(), sa.ForeignKey("panels.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("owner", sa.String(length=255), nullable=False),
+        sa.Column("username", sa.String(length=255), nullable=False),
+        sa.Column("status", sa.String(length=32), nullable=True),
+        sa.Column("data_limit", sa.BigInteger(), nullable=True),
+        sa.Column("expire", sa.BigInteger(), nullable=True),
+        sa.Column("subscription_url", sa.String(length=1024), nullable=True),
+        sa.Column("synced_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+        sa.UniqueConstraint("panel_id", "owner", "username", name="uq_panel_users_owner_username"),
+    )
+    op.create_index("ix_panel_users_id", "panel_users", ["id"], unique=False)
+    op.create_index("ix_panel_users_panel_username", "panel_users", ["panel_id", "username"], unique=False)
+
+    op.create_table(
+        "panel_user_syncs",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("panel_id", sa.Integer(), sa.ForeignKey("panels.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("owner", sa.String(length=255), nullable=False),
+        sa.Column("synced_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("user_count", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("last_error", sa.String(length=512), nullable=True),
+        sa.Column("last_attempt_at", sa.DateTime(timezone=True), nullable=True),
+        sa.UniqueConstraint("panel_id", "owner", name="uq_panel_user_syncs_owner"),
+    )
+    op.create_index("ix_panel_user_syncs_id", "panel_user_syncs", ["id"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_panel_user_syncs_id", table_name="panel_user_syncs")
+    op.drop_table("panel_user_syncs")
+    op.drop_index("ix_panel_users_panel_username", table_name="panel_users")
+    op.drop_index("ix_panel_users_id", table_name="panel_users")
+    op.drop_table("panel_users")
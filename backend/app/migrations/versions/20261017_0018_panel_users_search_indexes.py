@@ -0,0 +1,30 @@
+"""indexes for panel_users prefix search and expiry filter
+
+Revision ID: 20261017_0018
+Revises: 20261017_0017
+Create Date: 2026-10-17 00:18:00
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "20261017_0018"
+down_revision = "20261017_0017"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_panel_users_owner_lower_username",
+        "panel_users",
+        ["panel_id", "owner", sa.text("lower(username) text_pattern_ops")],
+        unique=False,
+    )
+    op.create_index("ix_panel_users_owner_expire", "panel_users", ["panel_id", "owner", "expire"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_panel_users_owner_expire", table_name="panel_users")
+    op.drop_index("ix_panel_users_owner_lower_username", table_name="panel_users")
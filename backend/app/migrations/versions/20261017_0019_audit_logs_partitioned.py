@@ -0,0 +1,94 @@
+"""partition audit_logs by month on created_at
+
+Revision ID: 20261017_0019
+Revises: 20261017_0018
+Create Date: 2026-10-17 00:19:00
+"""
+
+from alembic import op
+
+
+revision = "20261017_0019"
+down_revision = "20261017_0018"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE audit_logs RENAME TO audit_logs_unpartitioned")
+    op.execute("ALTER INDEX audit_logs_pkey RENAME TO audit_logs_unpartitioned_pkey")
+    op.execute("ALTER SEQUENCE audit_logs_id_seq OWNED BY NONE")
+    op.execute("ALTER SEQUENCE audit_logs_id_seq AS bigint")
+    # The partition key has to be part of the primary key
+    op.execute(
+        """
+        CREATE TABLE audit_logs (
+            id BIGINT NOT NULL DEFAULT nextval('audit_logs_id_seq'),
+            user_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
+            action VARCHAR(120) NOT NULL,
+            target VARCHAR(255),
+            meta JSONB,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+        """
+    )
+    op.execute("ALTER SEQUENCE audit_logs_id_seq OWNED BY audit_logs.id")
+    # Catches rows outside every monthly partition until services.audit_partitions creates theirs
+    op.execute("CREATE TABLE audit_logs_default PARTITION OF audit_logs DEFAULT")
+    # One partition per month from the oldest existing row through two months ahead
+    op.execute(
+        """
+        DO $$
+        DECLARE
+            m date := date_trunc('month', LEAST(COALESCE((SELECT min(created_at) FROM audit_logs_unpartitioned), now()), now()) AT TIME ZONE 'UTC')::date;
+            last date := (date_trunc('month', now() AT TIME ZONE 'UTC') + interval '2 months')::date;
+        BEGIN
+            WHILE m <= last LOOP
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF audit_logs FOR VALUES FROM (%L) TO (%L)',
+                    'audit_logs_y' || to_char(m, 'YYYY') || 'm' || to_char(m, 'MM'),
+                    m::timestamp AT TIME ZONE 'UTC',
+                    (m + interval '1 month')::timestamp AT TIME ZONE 'UTC'
+                );
+                m := (m + interval '1 month')::date;
+            END LOOP;
+        END $$
+        """
+    )
+    op.execute(
+        "INSERT INTO audit_logs (id, user_id, action, target, meta, created_at) "
+        "SELECT id, user_id, action, target, meta, created_at FROM audit_logs_unpartitioned"
+    )
+    op.execute("DROP TABLE audit_logs_unpartitioned")
+    # Listing is newest-first by id with optional equality filters, so each index ends in id
+    op.create_index("ix_audit_logs_user_id_id", "audit_logs", ["user_id", "id"], unique=False)
+    op.create_index("ix_audit_logs_action_id", "audit_logs", ["action", "id"], unique=False)
+    op.create_index("ix_audit_logs_target_id", "audit_logs", ["target", "id"], unique=False)
+    op.create_index("ix_audit_logs_created_at_id", "audit_logs", ["created_at", "id"], unique=False)
+
+
+def downgrade() -> None:
+    op.execute("ALTER SEQUENCE audit_logs_id_seq OWNED BY NONE")
+    op.execute("ALTER TABLE audit_logs RENAME TO audit_logs_partitioned")
+    op.execute("ALTER INDEX audit_logs_pkey RENAME TO audit_logs_partitioned_pkey")
+    op.execute(
+        """
+        CREATE TABLE audit_logs (
+            id INTEGER PRIMARY KEY DEFAULT nextval('audit_logs_id_seq'),
+            user_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
+            action VARCHAR(120) NOT NULL,
+            target VARCHAR(255),
+            meta JSONB,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        """
+    )
+    op.execute(
+        "INSERT INTO audit_logs (id, user_id, action, target, meta, created_at) "
+        "SELECT id, user_id, action, target, meta, created_at FROM audit_logs_partitioned"
+    )
+    op.execute("DROP TABLE audit_logs_partitioned CASCADE")
+    op.execute("ALTER SEQUENCE audit_logs_id_seq AS integer")
+    op.execute("ALTER SEQUENCE audit_logs_id_seq OWNED BY audit_logs.id")
+    op.create_index("ix_audit_logs_id", "audit_logs", ["id"], unique=False)
@@ -0,0 +1,44 @@
+"""wallet holds and idempotency keys
+
+Revision ID: 20261017_0020
+Revises: 20261017_0019
+Create Date: 2026-10-17 00:20:00
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "20261017_0020"
+down_revision = "20261017_0019"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("wallet_transactions", sa.Column("idempotency_key", sa.String(length=128), nullable=True))
+    op.create_unique_constraint("uq_wallet_transactions_user_idempotency_key", "wallet_transactions", ["user_id", "idempotency_key"])
+    op.create_table(
+        "wallet_holds",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("amount", sa.Numeric(14, 2), nullable=False),
+        sa.Column("reason", sa.String(length=255), nullable=True),
+        sa.Column("status", sa.String(length=16), nullable=False, server_default="held"),
+        sa.Column("idempotency_key", sa.String(length=128), nullable=True),
+        sa.Column("transaction_id", sa.Integer(), sa.ForeignKey("wallet_transactions.id", ondelete="SET NULL"), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+        sa.Column("settled_at", sa.DateTime(timezone=True), nullable=True),
+        sa.UniqueConstraint("user_id", "idempotency_key", name="uq_wallet_holds_user_idempotency_key"),
+    )
+    op.create_index("ix_wallet_holds_user_id", "wallet_holds", ["user_id"], unique=False)
+    # The stale-hold sweeper only looks at open holds
+    op.create_index("ix_wallet_holds_open_created_at", "wallet_holds", ["created_at"], unique=False, postgresql_where=sa.text("status = 'held'"))
+
+
+def downgrade() -> None:
+    op.drop_index("ix_wallet_holds_open_created_at", table_name="wallet_holds")
+    op.drop_index("ix_wallet_holds_user_id", table_name="wallet_holds")
+    op.drop_table("wallet_holds")
+    op.drop_constraint("uq_wallet_transactions_user_idempotency_key", "wallet_transactions", type_="unique")
+    op.drop_column("wallet_transactions", "idempotency_key")
@@ -0,0 +1,55 @@
+"""wallet ledger running balance and daily rollups
+
+Revision ID: 20261017_0021
+Revises: 20261017_0020
+Create Date: 2026-10-17 00:21:00
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "20261017_0021"
+down_revision = "20261017_0020"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("wallet_transactions", sa.Column("balance_after", sa.Numeric(14, 2), nullable=True))
+    op.execute(
+        """
+        UPDATE wallet_transactions t SET balance_after = s.running
+        FROM (SELECT id, sum(amount) OVER (PARTITION BY user_id ORDER BY id) AS running FROM wallet_transactions) s
+        WHERE t.id = s.id
+        """
+    )
+    op.create_index("ix_wallet_transactions_user_id_id", "wallet_transactions", ["user_id", "id"], unique=False)
+    op.create_index("ix_wallet_transactions_user_id_created_at", "wallet_transactions", ["user_id", "created_at"], unique=False)
+
+    op.create_table(
+        "wallet_daily_rollups",
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("day", sa.Date(), primary_key=True),
+        sa.Column("debits", sa.Numeric(16, 2), nullable=False, server_default="0"),
+        sa.Column("credits", sa.Numeric(16, 2), nullable=False, server_default="0"),
+        sa.Column("tx_count", sa.Integer(), nullable=False, server_default="0"),
+    )
+    op.execute(
+        """
+        INSERT INTO wallet_daily_rollups (user_id, day, debits, credits, tx_count)
+        SELECT user_id, (created_at AT TIME ZONE 'UTC')::date,
+               COALESCE(sum(-amount) FILTER (WHERE amount < 0), 0),
+               COALESCE(sum(amount) FILTER (WHERE amount > 0), 0),
+               count(*)
+        FROM wallet_transactions
+        GROUP BY 1, 2
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("wallet_daily_rollups")
+    op.drop_index("ix_wallet_transactions_user_id_created_at", table_name="wallet_transactions")
+    op.drop_index("ix_wallet_transactions_user_id_id", table_name="wallet_transactions")
+    op.drop_column("wallet_transactions", "balance_after")
@@ -0,0 +1,50 @@
+"""panel write jobs
+
+Revision ID: 20261017_0022
+Revises: 20261017_0021
+Create Date: 2026-10-17 00:22:00
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = "20261017_0022"
+down_revision = "20261017_0021"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "panel_jobs",
+        sa.Column("id", sa.String(length=32), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("panel_id", sa.Integer(), sa.ForeignKey("panels.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("kind", sa.String(length=32), nullable=False),
+        sa.Column("params", postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+        sa.Column("status", sa.String(length=16), nullable=False, server_default="queued"),
+        sa.Column("hold_id", sa.Integer(), sa.ForeignKey("wallet_holds.id", ondelete="SET NULL"), nullable=True),
+        sa.Column("idempotency_key", sa.String(length=128), nullable=True),
+        sa.Column("result", postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+        sa.Column("error", sa.String(length=1024), nullable=True),
+        sa.Column("attempts", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+        sa.Column("enqueued_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("started_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("finished_at", sa.DateTime(timezone=True), nullable=True),
+        sa.UniqueConstraint("user_id", "idempotency_key", name="uq_panel_jobs_user_idempotency_key"),
+    )
+    op.create_index("ix_panel_jobs_user_id_created_at", "panel_jobs", ["user_id", "created_at"], unique=False)
+    # The relay and reaper only scan unfinished jobs
+    op.create_index(
+        "ix_panel_jobs_open", "panel_jobs", ["status", "enqueued_at"], unique=False,
+        postgresql_where=sa.text("status IN ('queued', 'running')"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_panel_jobs_open", table_name="panel_jobs")
+    op.drop_index("ix_panel_jobs_user_id_created_at", table_name="panel_jobs")
+    op.drop_table("panel_jobs")
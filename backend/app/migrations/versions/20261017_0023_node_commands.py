@@ -0,0 +1,50 @@
+"""node control commands
+
+Revision ID: 20261017_0023
+Revises: 20261017_0022
+Create Date: 2026-10-17 00:23:00
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = "20261017_0023"
+down_revision = "20261017_0022"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "node_commands",
+        sa.Column("id", sa.String(length=32), primary_key=True),
+        sa.Column("batch_id", sa.String(length=32), nullable=False),
+        sa.Column("node", sa.String(length=120), nullable=False),
+        sa.Column("command", sa.String(length=120), nullable=False),
+        sa.Column("params", postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+        sa.Column("status", sa.String(length=16), nullable=False, server_default="pending"),
+        sa.Column("stream_id", sa.String(length=32), nullable=True),
+        sa.Column("result", postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+        sa.Column("error", sa.String(length=1024), nullable=True),
+        sa.Column("created_by", sa.Integer(), sa.ForeignKey("users.id", ondelete="SET NULL"), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+        sa.Column("expires_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("delivered_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("finished_at", sa.DateTime(timezone=True), nullable=True),
+    )
+    op.create_index("ix_node_commands_batch_id", "node_commands", ["batch_id"], unique=False)
+    op.create_index("ix_node_commands_node_created_at", "node_commands", ["node", "created_at"], unique=False)
+    # The reconciler only looks at commands still waiting on a node
+    op.create_index(
+        "ix_node_commands_open", "node_commands", ["node", "status"], unique=False,
+        postgresql_where=sa.text("status IN ('pending', 'delivered')"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_node_commands_open", table_name="node_commands")
+    op.drop_index("ix_node_commands_node_created_at", table_name="node_commands")
+    op.drop_index("ix_node_commands_batch_id", table_name="node_commands")
+    op.drop_table("node_commands")
@@ -0,0 +1,42 @@
+"""node heartbeat metrics
+
+Revision ID: 20261017_0024
+Revises: 20261017_0023
+Create Date: 2026-10-17 00:24:00
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "20261017_0024"
+down_revision = "20261017_0023"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "node_metrics",
+        sa.Column("node_id", sa.Integer(), sa.ForeignKey("admins_nodes.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("period_seconds", sa.SmallInteger(), primary_key=True),
+        sa.Column("bucket_start", sa.DateTime(timezone=True), primary_key=True),
+        sa.Column("samples", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("cpu_sum", sa.Float(), nullable=False, server_default="0"),
+        sa.Column("cpu_max", sa.Float(), nullable=False, server_default="0"),
+        sa.Column("rx_bps_sum", sa.BigInteger(), nullable=False, server_default="0"),
+        sa.Column("tx_bps_sum", sa.BigInteger(), nullable=False, server_default="0"),
+        sa.Column("rx_bps_max", sa.BigInteger(), nullable=False, server_default="0"),
+        sa.Column("tx_bps_max", sa.BigInteger(), nullable=False, server_default="0"),
+        sa.Column("connections_sum", sa.BigInteger(), nullable=False, server_default="0"),
+        sa.Column("connections_max", sa.Integer(), nullable=False, server_default="0"),
+    )
+    op.create_index("ix_node_metrics_period_bucket", "node_metrics", ["period_seconds", "bucket_start"], unique=False)
+    # The offline sweep scans nodes by last_seen
+    op.create_index("ix_admins_nodes_last_seen", "admins_nodes", ["last_seen"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_admins_nodes_last_seen", table_name="admins_nodes")
+    op.drop_index("ix_node_metrics_period_bucket", table_name="node_metrics")
+    op.drop_table("node_metrics")
@@ -0,0 +1,31 @@
+"""panel jobs reconciling state in the open-jobs index
+
+Revision ID: 20261017_0025
+Revises: 20261017_0024
+Create Date: 2026-10-17 00:25:00
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "20261017_0025"
+down_revision = "20261017_0024"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.drop_index("ix_panel_jobs_open", table_name="panel_jobs")
+    op.create_index(
+        "ix_panel_jobs_open", "panel_jobs", ["status", "enqueued_at"], unique=False,
+        postgresql_where=sa.text("status IN ('queued', 'running', 'reconciling')"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_panel_jobs_open", table_name="panel_jobs")
+    op.create_index(
+        "ix_panel_jobs_open", "panel_jobs", ["status", "enqueued_at"], unique=False,
+        postgresql_where=sa.text("status IN ('queued', 'running')"),
+    )
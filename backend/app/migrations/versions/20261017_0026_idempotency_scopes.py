@@ -0,0 +1,66 @@
+"""idempotency keys scoped per operation, with a request fingerprint
+
+Revision ID: 20261017_0026
+Revises: 20261017_0025
+Create Date: 2026-10-17 00:26:00
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "20261017_0026"
+down_revision = "20261017_0025"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    for table in ("wallet_transactions", "wallet_holds"):
+        op.add_column(table, sa.Column("idempotency_scope", sa.String(length=32), nullable=False, server_default=""))
+        op.add_column(table, sa.Column("request_hash", sa.String(length=64), nullable=True))
+    op.add_column("panel_jobs", sa.Column("request_hash", sa.String(length=64), nullable=True))
+    # Keys already in use keep answering retries: holds were only keyed by create and extend,
+    # keyed transactions only by admin adjustments
+    op.execute(
+        """
+        UPDATE wallet_holds SET idempotency_scope = CASE
+            WHEN reason LIKE 'Create user%' THEN 'create_user'
+            WHEN reason LIKE 'Extend user%' THEN 'extend'
+            ELSE 'hold' END
+        WHERE idempotency_key IS NOT NULL
+        """
+    )
+    op.execute("UPDATE wallet_transactions SET idempotency_scope = 'adjust' WHERE idempotency_key IS NOT NULL")
+    op.drop_constraint("uq_wallet_transactions_user_idempotency_key", "wallet_transactions", type_="unique")
+    op.create_unique_constraint(
+        "uq_wallet_transactions_user_idempotency_key", "wallet_transactions", ["user_id", "idempotency_scope", "idempotency_key"]
+    )
+    op.drop_constraint("uq_wallet_holds_user_idempotency_key", "wallet_holds", type_="unique")
+    op.create_unique_constraint("uq_wallet_holds_user_idempotency_key", "wallet_holds", ["user_id", "idempotency_scope", "idempotency_key"])
+    op.drop_constraint("uq_panel_jobs_user_idempotency_key", "panel_jobs", type_="unique")
+    op.create_unique_constraint("uq_panel_jobs_user_idempotency_key", "panel_jobs", ["user_id", "kind", "idempotency_key"])
+
+
+def downgrade() -> None:
+    # Keys now repeated across scopes cannot be unique per user again; the older rows keep theirs
+    for table, scope in (("wallet_transactions", "idempotency_scope"), ("wallet_holds", "idempotency_scope"), ("panel_jobs", "kind")):
+        op.execute(
+            f"""
+            UPDATE {table} t SET idempotency_key = NULL
+            WHERE idempotency_key IS NOT NULL AND EXISTS (
+                SELECT 1 FROM {table} o
+                WHERE o.user_id = t.user_id AND o.idempotency_key = t.idempotency_key AND o.{scope} <> t.{scope} AND o.id < t.id
+            )
+            """
+        )
+    op.drop_constraint("uq_panel_jobs_user_idempotency_key", "panel_jobs", type_="unique")
+    op.create_unique_constraint("uq_panel_jobs_user_idempotency_key", "panel_jobs", ["user_id", "idempotency_key"])
+    op.drop_constraint("uq_wallet_holds_user_idempotency_key", "wallet_holds", type_="unique")
+    op.create_unique_constraint("uq_wallet_holds_user_idempotency_key", "wallet_holds", ["user_id", "idempotency_key"])
+    op.drop_constraint("uq_wallet_transactions_user_idempotency_key", "wallet_transactions", type_="unique")
+    op.create_unique_constraint("uq_wallet_transactions_user_idempotency_key", "wallet_transactions", ["user_id", "idempotency_key"])
+    op.drop_column("panel_jobs", "request_hash")
+    for table in ("wallet_holds", "wallet_transactions"):
+        op.drop_column(table, "request_hash")
+        op.drop_column(table, "idempotency_scope")
@@ -0,0 +1,26 @@
+"""partial index for unread notifications per user
+
+Revision ID: 20261017_0027
+Revises: 20261017_0026
+Create Date: 2026-10-17 00:27:00
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "20261017_0027"
+down_revision = "20261017_0026"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_notifications_unread", "notifications", ["to_user", "id"], unique=False,
+        postgresql_where=sa.text("status <> 'read'"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_notifications_unread", table_name="notifications")
@@ -0,0 +1,34 @@
+"""per-metric sample counts on node_metrics
+
+Revision ID: 20261017_0028
+Revises: 20261017_0027
+Create Date: 2026-10-17 00:28:00
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "20261017_0028"
+down_revision = "20261017_0027"
+branch_labels = None
+depends_on = None
+
+METRICS = ("cpu", "rx_bps", "tx_bps", "connections")
+
+
+def upgrade() -> None:
+    for name in METRICS:
+        op.add_column(
+            "node_metrics",
+            sa.Column(f"{name}_samples", sa.Integer(), nullable=False, server_default="0"),
+        )
+    # Older buckets counted every heartbeat for every metric
+    op.execute(
+        "UPDATE node_metrics SET " + ", ".join(f"{name}_samples = samples" for name in METRICS)
+    )
+
+
+def downgrade() -> None:
+    for name in METRICS:
+        op.drop_column("node_metrics", f"{name}_samples")
@@ -0,0 +1,24 @@
+"""result of the paid-for operation on wallet_holds
+
+Revision ID: 20261017_0029
+Revises: 20261017_0028
+Create Date: 2026-10-17 00:29:00
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = "20261017_0029"
+down_revision = "20261017_0028"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("wallet_holds", sa.Column("result", postgresql.JSONB(astext_type=sa.Text()), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("wallet_holds", "result")
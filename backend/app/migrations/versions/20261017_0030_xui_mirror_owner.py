@@ -0,0 +1,26 @@
+"""drop XUI mirror rows stored under operator accounts
+
+Revision ID: 20261017_0030
+Revises: 20261017_0029
+Create Date: 2026-10-17 00:30:00
+"""
+
+from alembic import op
+
+
+revision = "20261017_0030"
+down_revision = "20261017_0029"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Only the admin view of an XUI panel is synced; the next sync brings these users back under it
+    op.execute(
+        "DELETE FROM panel_users m USING panels p "
+        "WHERE m.panel_id = p.id AND p.type = 'xui' AND m.owner <> p.username"
+    )
+
+
+def downgrade() -> None:
+    pass
@@ -9,5 +9,5 @@ class AdminNode(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(120), nullable=False, unique=True)
     status = Column(String(32), nullable=False, default="offline")
-    last_seen = Column(DateTime(timezone=True), nullable=True)
+    last_seen = Column(DateTime(timezone=True), nullable=True, index=True)
     meta = Column("metadata", JSONB, nullable=True)
\ No newline at end of file
@@ -0,0 +1,35 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.sql import func, text
+from app.db.base import Base
+
+
+class NodeCommand(Base):
+    """One command for one node, carried by the node's control stream (see services.node_commands).
+
+    pending -> delivered -> acked | failed, or timed_out if the node never answered in time.
+    """
+
+    __tablename__ = "node_commands"
+
+    id = Column(String(32), primary_key=True)
+    # Commands sent together share a batch id
+    batch_id = Column(String(32), nullable=False, index=True)
+    node = Column(String(120), nullable=False)
+    command = Column(String(120), nullable=False)
+    params = Column(JSONB, nullable=True)
+    status = Column(String(16), nullable=False, default="pending")
+    # Entry id in the node's stream; NULL until the dispatch reached Redis
+    stream_id = Column(String(32), nullable=True)
+    result = Column(JSONB, nullable=True)
+    error = Column(String(1024), nullable=True)
+    created_by = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    delivered_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index("ix_node_commands_node_created_at", "node", "created_at"),
+        Index("ix_node_commands_open", "node", "status", postgresql_where=text("status IN ('pending', 'delivered')")),
+    )
@@ -0,0 +1,35 @@
+from sqlalchemy import BigInteger, Column, DateTime, Float, ForeignKey, Index, Integer, SmallInteger
+from app.db.base import Base
+
+
+class NodeMetric(Base):
+    """Heartbeat metrics for one node folded into a fixed bucket (60s or 3600s).
+
+    Sums and maxima rather than averages, so flushes from several API workers merge exactly.
+    `samples` counts heartbeats with any metric; each metric has its own count, as nodes may
+    leave some out, and its average is <metric>_sum / <metric>_samples.
+    """
+
+    __tablename__ = "node_metrics"
+
+    node_id = Column(Integer, ForeignKey("admins_nodes.id", ondelete="CASCADE"), primary_key=True)
+    period_seconds = Column(SmallInteger, primary_key=True)
+    bucket_start = Column(DateTime(timezone=True), primary_key=True)
+    samples = Column(Integer, nullable=False, default=0)
+    cpu_samples = Column(Integer, nullable=False, default=0)
+    cpu_sum = Column(Float, nullable=False, default=0)
+    cpu_max = Column(Float, nullable=False, default=0)
+    rx_bps_samples = Column(Integer, nullable=False, default=0)
+    rx_bps_sum = Column(BigInteger, nullable=False, default=0)
+    rx_bps_max = Column(BigInteger, nullable=False, default=0)
+    tx_bps_samples = Column(Integer, nullable=False, default=0)
+    tx_bps_sum = Column(BigInteger, nullable=False, default=0)
+    tx_bps_max = Column(BigInteger, nullable=False, default=0)
+    connections_samples = Column(Integer, nullable=False, default=0)
+    connections_sum = Column(BigInteger, nullable=False, default=0)
+    connections_max = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        # Retention deletes by resolution and age across all nodes
+        Index("ix_node_metrics_period_bucket", "period_seconds", "bucket_start"),
+    )
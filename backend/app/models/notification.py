@@ -1,6 +1,6 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index
 from sqlalchemy.dialects.postgresql import JSONB
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 from app.db.base import Base
 
 
@@ -11,4 +11,9 @@ class Notification(Base):
     to_user = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     payload = Column(JSONB, nullable=False)
     status = Column(String(50), nullable=False, default="new")
-    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
\ No newline at end of file
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    __table_args__ = (
+        # Unread counts and the Redis unread-set rebuild (services.notifications)
+        Index("ix_notifications_unread", "to_user", "id", postgresql_where=text("status <> 'read'")),
+    )
@@ -1,4 +1,5 @@
 from sqlalchemy import Column, Integer, String, Boolean
+from sqlalchemy.dialects.postgresql import JSONB
 from app.db.base import Base
 
 
@@ -14,4 +15,5 @@ class Panel(Base):
     inbound_tag = Column(String(255), nullable=True)
     is_default = Column(Boolean, nullable=False, default=False, server_default='false')
     type = Column(String(32), nullable=False, default="marzban", server_default='marzban')
-
+    # Learned login path / endpoints / payload variants (see services.panel_discovery)
+    discovery = Column(JSONB, nullable=True)
@@ -0,0 +1,41 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, UniqueConstraint, Index
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.sql import func, text
+from app.db.base import Base
+
+
+class PanelJob(Base):
+    """A panel write run by the job worker (see services.panel_jobs).
+
+    The row is the outbox: it is committed together with the wallet hold that pays for it
+    and pushed to Redis afterwards. queued -> running -> succeeded | failed; a run that timed out
+    or whose worker died goes through reconciling, where the panel is checked before the hold
+    is charged or released.
+    """
+
+    __tablename__ = "panel_jobs"
+
+    id = Column(String(32), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    panel_id = Column(Integer, ForeignKey("panels.id", ondelete="CASCADE"), nullable=False)
+    kind = Column(String(32), nullable=False)
+    # Everything the worker needs, resolved and authorized when the request was accepted
+    params = Column(JSONB, nullable=False)
+    status = Column(String(16), nullable=False, default="queued")
+    hold_id = Column(Integer, ForeignKey("wallet_holds.id", ondelete="SET NULL"), nullable=True)
+    # Unique per user and kind; request_hash tells a retry from another request reusing the key
+    idempotency_key = Column(String(128), nullable=True)
+    request_hash = Column(String(64), nullable=True)
+    result = Column(JSONB, nullable=True)
+    error = Column(String(1024), nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    enqueued_at = Column(DateTime(timezone=True), nullable=True)
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "kind", "idempotency_key", name="uq_panel_jobs_user_idempotency_key"),
+        Index("ix_panel_jobs_user_id_created_at", "user_id", "created_at"),
+        Index("ix_panel_jobs_open", "status", "enqueued_at", postgresql_where=text("status IN ('queued', 'running', 'reconciling')")),
+    )
@@ -0,0 +1,43 @@
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, ForeignKey, UniqueConstraint, Index
+from sqlalchemy.sql import func
+from app.db.base import Base
+
+
+class PanelUserMirror(Base):
+    """Local copy of a panel's users as seen by one panel account (see services.panel_user_sync)."""
+
+    __tablename__ = "panel_users"
+
+    id = Column(Integer, primary_key=True, index=True)
+    panel_id = Column(Integer, ForeignKey("panels.id", ondelete="CASCADE"), nullable=False)
+    # Panel account the list was fetched with; Marzban scopes users per admin
+    owner = Column(String(255), nullable=False)
+    username = Column(String(255), nullable=False)
+    status = Column(String(32), nullable=True)
+    data_limit = Column(BigInteger, nullable=True)
+    expire = Column(BigInteger, nullable=True)
+    subscription_url = Column(String(1024), nullable=True)
+    synced_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("panel_id", "owner", "username", name="uq_panel_users_owner_username"),
+        Index("ix_panel_users_panel_username", "panel_id", "username"),
+    )
+
+
+class PanelUserSync(Base):
+    """Freshness of the mirror for one (panel, account)."""
+
+    __tablename__ = "panel_user_syncs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    panel_id = Column(Integer, ForeignKey("panels.id", ondelete="CASCADE"), nullable=False)
+    owner = Column(String(255), nullable=False)
+    synced_at = Column(DateTime(timezone=True), nullable=True)
+    user_count = Column(Integer, nullable=False, default=0, server_default="0")
+    last_error = Column(String(512), nullable=True)
+    last_attempt_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("panel_id", "owner", name="uq_panel_user_syncs_owner"),
+    )
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, Numeric, DateTime, ForeignKey, String
+from sqlalchemy import Column, Integer, Numeric, Date, DateTime, ForeignKey, String, UniqueConstraint, Index
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.sql import func
 from app.db.base import Base
 
@@ -20,4 +21,55 @@ class WalletTransaction(Base):
     amount = Column(Numeric(14, 2), nullable=False)  # positive=credit, negative=debit
     reason = Column(String(255), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    # Running sum of this user's ledger up to and including this row
+    balance_after = Column(Numeric(14, 2), nullable=True)
+    # Client-supplied Idempotency-Key, unique per user and operation (scope); a retry of the same
+    # request (same request_hash) returns this row instead of posting again
+    idempotency_key = Column(String(128), nullable=True)
+    idempotency_scope = Column(String(32), nullable=False, default="", server_default="")
+    request_hash = Column(String(64), nullable=True)
 
+    __table_args__ = (
+        UniqueConstraint("user_id", "idempotency_scope", "idempotency_key", name="uq_wallet_transactions_user_idempotency_key"),
+        Index("ix_wallet_transactions_user_id_id", "user_id", "id"),
+        Index("ix_wallet_transactions_user_id_created_at", "user_id", "created_at"),
+    )
+
+
+class WalletDailyRollup(Base):
+    """Per-user, per-UTC-day debit and credit totals, kept up to date as transactions are posted."""
+
+    __tablename__ = "wallet_daily_rollups"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    debits = Column(Numeric(16, 2), nullable=False, default=0)
+    credits = Column(Numeric(16, 2), nullable=False, default=0)
+    tx_count = Column(Integer, nullable=False, default=0)
+
+
+class WalletHold(Base):
+    """Money taken from a wallet for an operation still in flight (see services.wallet).
+
+    held -> committed (a debit transaction is posted) or released (the amount goes back).
+    """
+
+    __tablename__ = "wallet_holds"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    amount = Column(Numeric(14, 2), nullable=False)
+    reason = Column(String(255), nullable=True)
+    status = Column(String(16), nullable=False, default="held")
+    idempotency_key = Column(String(128), nullable=True)
+    idempotency_scope = Column(String(32), nullable=False, default="", server_default="")
+    request_hash = Column(String(64), nullable=True)
+    transaction_id = Column(Integer, ForeignKey("wallet_transactions.id", ondelete="SET NULL"), nullable=True)
+    # What the paid-for operation answered, for replaying it to a retry with the same key
+    result = Column(JSONB, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    settled_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "idempotency_scope", "idempotency_key", name="uq_wallet_holds_user_idempotency_key"),
+    )
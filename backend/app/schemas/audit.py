@@ -1,3 +1,4 @@
+from datetime import datetime
 from pydantic import BaseModel
 from typing import Optional, Any
 
@@ -8,6 +9,7 @@ class AuditLogRead(BaseModel):
     action: str
     target: Optional[str]
     meta: Optional[Any]
+    created_at: datetime
 
     class Config:
         from_attributes = True
\ No newline at end of file
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Any
+from pydantic import BaseModel, Field, model_validator
+from typing import Any, List, Optional
 
 
 class NotificationRead(BaseModel):
@@ -9,4 +9,29 @@ class NotificationRead(BaseModel):
     status: str
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+
+class NotificationMarkRequest(BaseModel):
+    ids: List[int] = Field(..., max_length=500)
+
+
+class NotificationSegment(BaseModel):
+    """Exactly one selector: a role, a plan template, a panel's assigned users, or explicit ids."""
+    role: Optional[str] = None
+    plan_template_id: Optional[int] = None
+    panel_id: Optional[int] = None
+    user_ids: Optional[List[int]] = Field(default=None, max_length=50000)
+    include_inactive: bool = False
+
+    @model_validator(mode="after")
+    def _one_selector(self):
+        chosen = [f for f in ("role", "plan_template_id", "panel_id", "user_ids") if getattr(self, f) is not None]
+        if len(chosen) != 1:
+            raise ValueError("Specify exactly one of role, plan_template_id, panel_id, user_ids")
+        return self
+
+
+class NotificationBroadcastRequest(BaseModel):
+    segment: NotificationSegment
+    payload: Any
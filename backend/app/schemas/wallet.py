@@ -1,5 +1,6 @@
+from datetime import date, datetime
 from pydantic import BaseModel, condecimal
-from typing import List
+from typing import List, Optional
 
 
 class WalletRead(BaseModel):
@@ -15,7 +16,8 @@ class WalletTransactionRead(BaseModel):
     id: int
     amount: condecimal(max_digits=14, decimal_places=2)
     reason: str | None = None
-    created_at: str
+    balance_after: Optional[condecimal(max_digits=14, decimal_places=2)] = None
+    created_at: datetime
 
     class Config:
         from_attributes = True
@@ -23,4 +25,26 @@ class WalletTransactionRead(BaseModel):
 
 class WalletTransactionsResponse(BaseModel):
     items: List[WalletTransactionRead]
+    # Pass as before_id to fetch the next (older) page; None on the last page
+    next_before_id: Optional[int] = None
+
+
+class WalletDayRead(BaseModel):
+    day: date
+    debits: condecimal(max_digits=16, decimal_places=2)
+    credits: condecimal(max_digits=16, decimal_places=2)
+    tx_count: int
+
+    class Config:
+        from_attributes = True
+
+
+class WalletSummaryRead(BaseModel):
+    balance: condecimal(max_digits=14, decimal_places=2)
+    since: date
+    until: date
+    debits: condecimal(max_digits=16, decimal_places=2)
+    credits: condecimal(max_digits=16, decimal_places=2)
+    tx_count: int
+    days: List[WalletDayRead]
 
@@ -9,6 +9,7 @@ from app.core.security import hash_password
 from app.db.session import SessionLocal
 from app.models.user import User
 from app.models.root_admin import RootAdmin
+from app.services.principal_cache import invalidate_principal
 
 
 def ensure_admin(email: str, password: str, name: str, phone: str | None) -> User:
@@ -66,6 +67,8 @@ def main(argv: list[str]) -> int:
             print(f"Granted root admin privileges to user id={user.id}")
     finally:
         db.close()
+    # Running API workers may hold the old role/root flag for this user
+    invalidate_principal(user.id)
     return 0
 
 
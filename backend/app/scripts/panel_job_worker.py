@@ -0,0 +1,75 @@
+"""Run panel write jobs queued by the API (see services.panel_jobs).
+
+    python -m app.scripts.panel_job_worker
+
+Run as many processes as needed; each takes up to PANEL_JOB_WORKER_CONCURRENCY jobs at once.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import signal
+
+from app.core.config import get_settings
+from app.core.logging import configure_logging
+from app.db.session import async_engine
+from app.services.panel_http import close_panel_clients
+from app.services.panel_jobs import QUEUE, relay_once, run_job
+from app.services.redis_client import close_redis, get_redis
+
+logger = logging.getLogger("app")
+
+
+async def _consume(stop: asyncio.Event) -> None:
+    r = get_redis()
+    while not stop.is_set():
+        try:
+            item = await r.brpop(QUEUE, timeout=2)
+        except Exception as e:
+            logger.warning("panel_job_worker pop_failed err=%s", str(e))
+            await asyncio.sleep(2)
+            continue
+        if item is None:
+            continue
+        _, job_id = item
+        try:
+            await run_job(job_id)
+        except Exception:
+            # The job stays running; once it is overdue the relay checks the panel and settles it
+            logger.exception("panel_job_worker run_failed id=%s", job_id)
+
+
+async def _relay(stop: asyncio.Event, interval: float) -> None:
+    while not stop.is_set():
+        try:
+            await relay_once()
+        except Exception as e:
+            logger.warning("panel_job_worker relay_failed err=%s", str(e))
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def main() -> None:
+    settings = get_settings()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    concurrency = max(1, settings.panel_job_worker_concurrency)
+    logger.info("panel_job_worker start concurrency=%s", concurrency)
+    try:
+        # Consumers finish the job in hand before exiting
+        await asyncio.gather(_relay(stop, 15.0), *(_consume(stop) for _ in range(concurrency)))
+    finally:
+        await close_panel_clients()
+        await close_redis()
+        await async_engine.dispose()
+    logger.info("panel_job_worker stopped")
+
+
+if __name__ == "__main__":
+    configure_logging()
+    asyncio.run(main())
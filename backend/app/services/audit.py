@@ -1,11 +1,305 @@
-from sqlalchemy.orm import Session
+import fcntl
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
 from typing import Any, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.orm import Session
+
+from app.core.config import get_settings
+from app.db.session import SessionLocal
 from app.models.audit_log import AuditLog
 
+logger = logging.getLogger("app")
+_settings = get_settings()
+
+# The database is down or unreachable, as opposed to rejecting the rows themselves
+_UNAVAILABLE = (OperationalError, InterfaceError)
+
+
+def rejected_path() -> str:
+    """Where spooled rows the database refused are kept, next to the spool: spool.rejected.jsonl."""
+    root, ext = os.path.splitext(_settings.audit_spool_path)
+    return f"{root}.rejected{ext or '.jsonl'}"
+
+
+def _write_lines(f, rows: list[Any]) -> None:
+    for row in rows:
+        # Unparsable spool lines are carried as the raw string
+        f.write(row if isinstance(row, str) else json.dumps({**row, "created_at": row["created_at"].isoformat()}, default=str) + "\n")
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def _spool(rows: list[Any], path: Optional[str] = None) -> None:
+    """Append rows to the spool file; several workers share it, so appends hold an flock."""
+    path = path or _settings.audit_spool_path
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            _write_lines(f, rows)
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _insert(db: Session, rows: list[dict]) -> None:
+    size = max(1, _settings.audit_batch_size)
+    for i in range(0, len(rows), size):
+        db.execute(insert(AuditLog).values(rows[i:i + size]))
+
+
+class AuditWriter:
+    """Write-behind buffer for audit events.
+
+    Requests only enqueue, without ever waiting: `submit` is called on the event loop (through
+    `db.run_sync`). A daemon thread drains the queue into one multi-row INSERT per `batch_size`
+    events or `interval` seconds, whichever comes first. When the queue is full, events go to a
+    second thread that appends them to the spool file, so a slow database or disk slows audit
+    persistence, not requests. Batches the database rejects are spooled too and replayed once
+    a later batch goes through.
+    """
+
+    def __init__(self, max_size: int, batch_size: int, interval: float) -> None:
+        self.batch_size = max(1, batch_size)
+        self.interval = interval
+        self._queue: queue.Queue[dict] = queue.Queue(maxsize=max(1, max_size))
+        # Unbounded, but only filled while the queue is full and drained straight to disk
+        self._overflow: queue.SimpleQueue[dict] = queue.SimpleQueue()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._spooler: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+        self._spooler = threading.Thread(target=self._run_spooler, name="audit-spooler", daemon=True)
+        self._spooler.start()
+
+    def submit(self, row: dict) -> None:
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            logger.warning("audit queue_full action=%s spooled=1", row.get("action"))
+            self._overflow.put(row)
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Flush what is queued and stop; anything the threads could not write in time is spooled."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+        if self._spooler is not None:
+            self._spooler.join(timeout)
+            self._spooler = None
+        leftover = self._drain(self._queue.qsize()) + self._drain_overflow()
+        if leftover:
+            _spool(leftover)
+
+    def _drain(self, limit: int) -> list[dict]:
+        rows: list[dict] = []
+        while len(rows) < limit:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def _drain_overflow(self) -> list[dict]:
+        rows: list[dict] = []
+        while True:
+            try:
+                rows.append(self._overflow.get_nowait())
+            except queue.Empty:
+                return rows
+
+    def _run_spooler(self) -> None:
+        while not self._stop.is_set():
+            try:
+                rows = [self._overflow.get(timeout=self.interval)]
+            except queue.Empty:
+                continue
+            rows += self._drain_overflow()
+            try:
+                _spool(rows)
+            except Exception as e:
+                logger.error("audit spool_failed rows=%s err=%s", len(rows), str(e))
+
+    def _next_batch(self) -> list[dict]:
+        try:
+            rows = [self._queue.get(timeout=self.interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.interval
+        while len(rows) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                rows.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return rows
+
+    def _run(self) -> None:
+        replay_due = True
+        while not (self._stop.is_set() and self._queue.empty()):
+            rows = self._next_batch() if not self._stop.is_set() else self._drain(self.batch_size)
+            # A successful write means the database is reachable; pick up what was spooled meanwhile
+            if rows and self._write(rows):
+                replay_due = True
+            if replay_due and not self._stop.is_set():
+                replay_spool()
+                replay_due = False
+
+    def _write(self, rows: list[dict]) -> bool:
+        db = SessionLocal()
+        try:
+            _insert(db, rows)
+            db.commit()
+            return True
+        except Exception as e:
+            db.rollback()
+            logger.warning("audit flush_failed rows=%s spooled=1 err=%s", len(rows), str(e))
+            try:
+                _spool(rows)
+            except Exception as e2:
+                logger.error("audit spool_failed rows=%s err=%s", len(rows), str(e2))
+            return False
+        finally:
+            db.close()
+
+
+def _commit_rows(rows: list[dict]) -> None:
+    db = SessionLocal()
+    try:
+        db.execute(insert(AuditLog).values(rows))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def _replay_rows(rows: list[dict]) -> tuple[int, list[dict], list[dict]]:
+    """Insert rows one batch per transaction; a batch the database rejects is retried row by row.
+
+    Returns (inserted, rejected, left): rows the database refused, and rows not tried because
+    it became unreachable.
+    """
+    size = max(1, _settings.audit_batch_size)
+    inserted, rejected = 0, []
+    for i in range(0, len(rows), size):
+        chunk = rows[i:i + size]
+        try:
+            _commit_rows(chunk)
+            inserted += len(chunk)
+            continue
+        except _UNAVAILABLE as e:
+            logger.warning("audit replay_failed rows=%s err=%s", len(rows) - i, str(e))
+            return inserted, rejected, rows[i:]
+        except Exception:
+            pass
+        for j, row in enumerate(chunk):
+            try:
+                _commit_rows([row])
+                inserted += 1
+            except _UNAVAILABLE as e:
+                logger.warning("audit replay_failed rows=%s err=%s", len(rows) - i - j, str(e))
+                return inserted, rejected, rows[i + j:]
+            except Exception as e:
+                logger.error("audit replay_rejected action=%s err=%s", row.get("action"), str(e))
+                rejected.append(row)
+    return inserted, rejected, []
+
+
+def replay_spool() -> bool:
+    """Insert spooled rows and rewrite the spool with what is left; True when nothing is.
+
+    Rows the database rejects, and lines that no longer parse, go to rejected_path() so one
+    bad row cannot hold back every event spooled after it.
+    """
+    path = _settings.audit_spool_path
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return True
+    with open(path, "r+", encoding="utf-8") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            rows, broken = [], []
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    row = json.loads(line)
+                    row["created_at"] = datetime.fromisoformat(row["created_at"])
+                except (ValueError, TypeError, KeyError):
+                    # A torn last line from a crash mid-append
+                    broken.append(line + "\n")
+                    continue
+                rows.append(row)
+            inserted, rejected, left = _replay_rows(rows)
+            if inserted:
+                logger.info("audit replayed rows=%s", inserted)
+            if rejected or broken:
+                try:
+                    _spool(broken + rejected, rejected_path())
+                    logger.error("audit rows_rejected rows=%s path=%s", len(rejected) + len(broken), rejected_path())
+                except Exception as e:
+                    # Keep them in the spool rather than lose them
+                    logger.error("audit spool_failed rows=%s err=%s", len(rejected) + len(broken), str(e))
+                    left = broken + rejected + left
+            f.seek(0)
+            f.truncate()
+            if left:
+                _write_lines(f, left)
+            return not left
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+audit_writer = AuditWriter(
+    max_size=_settings.audit_queue_max,
+    batch_size=_settings.audit_batch_size,
+    interval=_settings.audit_flush_interval_ms / 1000.0,
+)
+
 
 def record_audit_event(db: Session, user_id: Optional[int], action: str, target: Optional[str] = None, meta: Optional[Any] = None) -> AuditLog:
-    log = AuditLog(user_id=user_id, action=action, target=target, meta=meta)
-    db.add(log)
-    db.commit()
-    db.refresh(log)
-    return log
\ No newline at end of file
+    """Queue an audit event for the background writer.
+
+    The returned row is not persisted yet (no id). Processes that never start the writer,
+    such as scripts, still insert through `db` right away.
+    """
+    row = {"user_id": user_id, "action": action, "target": target, "meta": meta, "created_at": datetime.now(tz=timezone.utc)}
+    if not audit_writer.running:
+        log = AuditLog(**row)
+        db.add(log)
+        db.commit()
+        db.refresh(log)
+        return log
+    audit_writer.submit(row)
+    return AuditLog(**row)
+
+
+def schedule_audit_writer() -> None:
+    audit_writer.start()
+
+
+def stop_audit_writer() -> None:
+    audit_writer.stop()
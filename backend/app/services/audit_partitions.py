@@ -0,0 +1,146 @@
+import asyncio
+import gzip
+import logging
+import os
+import re
+from datetime import datetime, timezone
+
+from sqlalchemy import func, select, text
+from sqlalchemy.engine import Connection
+
+from app.core.config import get_settings
+from app.db.session import engine
+
+logger = logging.getLogger("app")
+_settings = get_settings()
+
+# Partitions are named audit_logs_yYYYYmMM and cover one UTC calendar month
+_PARTITION = re.compile(r"^audit_logs_y(\d{4})m(\d{2})$")
+# Only one worker runs maintenance at a time
+_LOCK_KEY = 0x61756469
+
+
+def _add_months(year: int, month: int, n: int) -> tuple[int, int]:
+    index = year * 12 + (month - 1) + n
+    return index // 12, index % 12 + 1
+
+
+def partition_name(year: int, month: int) -> str:
+    return f"audit_logs_y{year:04d}m{month:02d}"
+
+
+def _bounds(year: int, month: int) -> tuple[str, str]:
+    ny, nm = _add_months(year, month, 1)
+    return datetime(year, month, 1, tzinfo=timezone.utc).isoformat(), datetime(ny, nm, 1, tzinfo=timezone.utc).isoformat()
+
+
+def ensure_partitions(conn: Connection, months_ahead: int) -> list[str]:
+    """Create the partitions for this month and the next `months_ahead`.
+
+    Rows that already landed in the default partition for such a month are moved into the
+    new partition in the same transaction, since Postgres refuses to add a partition whose
+    range overlaps rows in the default one.
+    """
+    now = datetime.now(tz=timezone.utc)
+    created = []
+    for i in range(months_ahead + 1):
+        year, month = _add_months(now.year, now.month, i)
+        name = partition_name(year, month)
+        if conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is not None:
+            continue
+        lo, hi = _bounds(year, month)
+        conn.execute(text(f'CREATE TABLE "{name}" (LIKE audit_logs INCLUDING DEFAULTS)'))
+        conn.execute(
+            text(f'WITH moved AS (DELETE FROM audit_logs_default WHERE created_at >= :lo AND created_at < :hi RETURNING *) INSERT INTO "{name}" SELECT * FROM moved'),
+            {"lo": lo, "hi": hi},
+        )
+        conn.execute(text(f"ALTER TABLE audit_logs ATTACH PARTITION \"{name}\" FOR VALUES FROM ('{lo}') TO ('{hi}')"))
+        conn.commit()
+        created.append(name)
+    return created
+
+
+def _export(conn: Connection, name: str, archive_dir: str) -> str:
+    """Stream one partition to <archive_dir>/<name>.csv.gz with COPY."""
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{name}.csv.gz")
+    tmp = path + ".part"
+    raw = conn.connection.driver_connection
+    with gzip.open(tmp, "wb") as gz:
+        with raw.cursor() as cur:
+            with cur.copy(f'COPY "{name}" TO STDOUT WITH (FORMAT csv, HEADER)') as copy:
+                for chunk in copy:
+                    gz.write(chunk)
+    with open(tmp, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return path
+
+
+def archive_expired(conn: Connection, retention_months: int, archive_dir: str) -> list[str]:
+    """Detach partitions older than `retention_months`, archive them compressed and drop them.
+
+    Also picks up partitions left detached by a run that failed after detaching.
+    """
+    now = datetime.now(tz=timezone.utc)
+    keep_from = _add_months(now.year, now.month, -retention_months)
+    rows = conn.execute(
+        text(
+            "SELECT relname, relispartition FROM pg_class "
+            "WHERE relkind = 'r' AND relname ~ '^audit_logs_y[0-9]{4}m[0-9]{2}$' AND pg_table_is_visible(oid) "
+            "ORDER BY relname"
+        )
+    ).all()
+    conn.commit()
+    archived = []
+    for name, attached in rows:
+        m = _PARTITION.match(name)
+        if not m or (int(m.group(1)), int(m.group(2))) >= keep_from:
+            continue
+        if attached:
+            conn.execute(text(f'ALTER TABLE audit_logs DETACH PARTITION "{name}"'))
+            conn.commit()
+        path = _export(conn, name, archive_dir)
+        conn.execute(text(f'DROP TABLE "{name}"'))
+        conn.commit()
+        logger.info("audit_partition archived name=%s path=%s", name, path)
+        archived.append(name)
+    return archived
+
+
+def run_audit_maintenance() -> None:
+    with engine.connect() as conn:
+        locked = conn.execute(select(func.pg_try_advisory_lock(_LOCK_KEY))).scalar()
+        conn.commit()
+        if not locked:
+            return
+        try:
+            created = ensure_partitions(conn, _settings.audit_partitions_ahead)
+            if created:
+                logger.info("audit_partition created names=%s", ",".join(created))
+            if _settings.audit_retention_months > 0:
+                archive_expired(conn, _settings.audit_retention_months, _settings.audit_archive_path)
+        finally:
+            conn.rollback()
+            conn.execute(select(func.pg_advisory_unlock(_LOCK_KEY)))
+            conn.commit()
+
+
+_scheduler_started = False
+
+
+def schedule_audit_maintenance() -> None:
+    global _scheduler_started
+    if _scheduler_started or _settings.audit_maintenance_interval_seconds <= 0:
+        return
+    _scheduler_started = True
+    asyncio.create_task(_maintenance_loop())
+
+
+async def _maintenance_loop() -> None:
+    while True:
+        try:
+            await asyncio.to_thread(run_audit_maintenance)
+        except Exception as e:
+            logger.warning("audit_partition maintenance_failed err=%s", str(e))
+        await asyncio.sleep(_settings.audit_maintenance_interval_seconds)
@@ -0,0 +1,80 @@
+import asyncio
+import logging
+from typing import Callable, Optional
+
+import redis
+
+from app.core.config import get_settings
+from app.services.redis_client import get_redis
+
+logger = logging.getLogger("app")
+_settings = get_settings()
+
+# One channel for every in-process cache; messages are "<cache>:<key>" with "*" for everything
+CHANNEL = "cache:invalidate"
+
+_handlers: dict[str, Callable[[Optional[str]], None]] = {}
+_publisher: Optional[redis.Redis] = None
+
+
+def register(cache: str, handler: Callable[[Optional[str]], None]) -> None:
+    """`handler(key)` drops `key` from the local cache, or everything when key is None."""
+    _handlers[cache] = handler
+
+
+def _dispatch(cache: str, key: Optional[str]) -> None:
+    handler = _handlers.get(cache)
+    if handler is not None:
+        handler(key)
+
+
+def broadcast(cache: str, key: Optional[str] = None) -> None:
+    """Invalidate here, then tell the other workers.
+
+    Synchronous so sync routes can call it right after their commit. Publishing is
+    best-effort: if Redis is down the other workers catch up when their entries expire.
+    """
+    global _publisher
+    _dispatch(cache, key)
+    try:
+        if _publisher is None:
+            _publisher = redis.Redis.from_url(_settings.redis_url, socket_timeout=1, socket_connect_timeout=1)
+        _publisher.publish(CHANNEL, f"{cache}:{'*' if key is None else key}")
+    except Exception as e:
+        logger.warning("cache_invalidate publish_failed cache=%s key=%s err=%s", cache, key, str(e))
+
+
+_listener_started = False
+
+
+def schedule_cache_invalidation() -> None:
+    global _listener_started
+    if _listener_started:
+        return
+    _listener_started = True
+    asyncio.create_task(_listen_loop())
+
+
+async def _listen_loop() -> None:
+    while True:
+        pubsub = get_redis().pubsub()
+        try:
+            await pubsub.subscribe(CHANNEL)
+            # Anything may have changed while we were not listening
+            for cache in list(_handlers):
+                _dispatch(cache, None)
+            async for message in pubsub.listen():
+                if message.get("type") != "message":
+                    continue
+                cache, _, key = str(message.get("data") or "").partition(":")
+                _dispatch(cache, None if key == "*" else key)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("cache_invalidate listener_error err=%s", str(e))
+        finally:
+            try:
+                await pubsub.aclose()
+            except Exception:
+                pass
+        await asyncio.sleep(5)
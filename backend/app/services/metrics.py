@@ -0,0 +1,162 @@
+"""Prometheus metrics for this process, exposed at GET /metrics.
+
+Request and panel-call series are recorded as they happen; pool, threadpool and loop gauges are
+read at scrape time by `_RuntimeCollector`, so they cost nothing between scrapes.
+"""
+
+import asyncio
+import logging
+import re
+import time
+from typing import Iterator, Optional
+
+from anyio import to_thread
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+from app.core.config import get_settings
+from app.db.session import async_engine, engine
+from app.services.redis_client import redis_pool_stats
+
+logger = logging.getLogger("app")
+_settings = get_settings()
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "API request latency by route template and status",
+    ["method", "route", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+
+PANEL_CALL_SECONDS = Histogram(
+    "panel_call_duration_seconds",
+    "Upstream panel call latency until response headers",
+    ["panel_id", "adapter", "endpoint"],
+    buckets=(0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0),
+)
+
+PANEL_CALL_ERRORS = Counter(
+    "panel_call_errors_total",
+    "Upstream panel calls answered with 4xx/5xx or failed in transport",
+    ["panel_id", "adapter", "endpoint", "kind"],
+)
+
+EVENT_LOOP_LAG = Gauge("event_loop_lag_seconds", "How late the loop-lag probe woke up on its last tick")
+
+# Path segments that name a user, client or inbound; they become placeholders so every panel user
+# does not get a series of its own
+_NAMED = {"user", "updateClient", "delClient", "getClientTraffics", "resetClientTraffic", "clientIps"}
+_NUMERIC = re.compile(r"^\d+$")
+
+
+def panel_endpoint(path: str, prefix: str = "") -> str:
+    """`/api/user/alice/usage` -> `/api/user/{name}/usage`, with the panel's own base path removed."""
+    if prefix and path.startswith(prefix):
+        path = path[len(prefix):]
+    parts = path.split("/")
+    for i, part in enumerate(parts):
+        if _NUMERIC.match(part):
+            parts[i] = "{id}"
+        elif i > 0 and parts[i - 1] in _NAMED and part:
+            parts[i] = "{name}"
+    return "/".join(parts) or "/"
+
+
+def observe_panel_call(
+    panel_id: str,
+    adapter: str,
+    endpoint: str,
+    seconds: float,
+    status: Optional[int] = None,
+    error: Optional[str] = None,
+) -> None:
+    PANEL_CALL_SECONDS.labels(panel_id, adapter, endpoint).observe(seconds)
+    if error is not None:
+        PANEL_CALL_ERRORS.labels(panel_id, adapter, endpoint, error).inc()
+    elif status is not None and status >= 400:
+        PANEL_CALL_ERRORS.labels(panel_id, adapter, endpoint, f"{status // 100}xx").inc()
+
+
+class _RuntimeCollector(Collector):
+    """DB and Redis pool usage, threadpool saturation; collected on the loop thread during a scrape."""
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        size = GaugeMetricFamily("db_pool_size", "Configured SQLAlchemy pool size", labels=["engine"])
+        checked_out = GaugeMetricFamily("db_pool_checked_out", "Connections currently checked out", labels=["engine"])
+        overflow = GaugeMetricFamily("db_pool_overflow", "Connections open beyond the pool size", labels=["engine"])
+        for name, pool in (("sync", engine.pool), ("async", async_engine.sync_engine.pool)):
+            size.add_metric([name], pool.size())
+            checked_out.add_metric([name], pool.checkedout())
+            # QueuePool starts at -pool_size; only the part above zero is real overflow
+            overflow.add_metric([name], max(pool.overflow(), 0))
+        yield from (size, checked_out, overflow)
+
+        redis = redis_pool_stats()
+        yield GaugeMetricFamily("redis_pool_max_connections", "Redis pool capacity", value=redis["max_connections"])
+        # Read from redis-py internals; left out if an upgrade renamed them
+        if redis["in_use"] is not None:
+            yield GaugeMetricFamily("redis_pool_in_use", "Redis connections checked out", value=redis["in_use"])
+        if redis["idle"] is not None:
+            yield GaugeMetricFamily("redis_pool_idle", "Redis connections open and idle", value=redis["idle"])
+
+        in_use = GaugeMetricFamily("threadpool_in_use", "Worker threads busy", labels=["pool"])
+        limit = GaugeMetricFamily("threadpool_limit", "Worker threads allowed", labels=["pool"])
+        queued = GaugeMetricFamily("threadpool_queued", "Calls waiting for a worker thread", labels=["pool"])
+        try:
+            # Sync route handlers and dependencies run here
+            limiter = to_thread.current_default_thread_limiter()
+            in_use.add_metric(["anyio"], limiter.borrowed_tokens)
+            limit.add_metric(["anyio"], limiter.total_tokens)
+            queued.add_metric(["anyio"], limiter.statistics().tasks_waiting)
+        except RuntimeError:
+            pass
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        # asyncio.to_thread (DB writers, flushers) uses the loop's default executor, created on first use
+        executor = getattr(loop, "_default_executor", None) if loop is not None else None
+        stats = _executor_stats(executor) if executor is not None else None
+        if stats is not None:
+            in_use.add_metric(["asyncio"], stats[0])
+            limit.add_metric(["asyncio"], stats[1])
+            queued.add_metric(["asyncio"], stats[2])
+        yield from (in_use, limit, queued)
+
+
+def _executor_stats(executor) -> Optional[tuple[int, int, int]]:
+    """(busy, max, queued) for a ThreadPoolExecutor, from its private attributes.
+
+    None when a Python version no longer has them, so a scrape loses these series, not the rest.
+    """
+    try:
+        idle = executor._idle_semaphore._value
+        return max(len(executor._threads) - idle, 0), executor._max_workers, executor._work_queue.qsize()
+    except AttributeError:
+        return None
+
+
+REGISTRY.register(_RuntimeCollector())
+
+
+_loop_lag_started = False
+
+
+def schedule_loop_lag_probe() -> None:
+    global _loop_lag_started
+    if _loop_lag_started:
+        return
+    _loop_lag_started = True
+    asyncio.create_task(_loop_lag_probe())
+
+
+async def _loop_lag_probe() -> None:
+    interval = _settings.metrics_loop_lag_interval_seconds
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(time.perf_counter() - start - interval, 0.0)
+        EVENT_LOOP_LAG.set(lag)
+        if lag > 1.0:
+            logger.warning("event_loop lag_seconds=%.3f", lag)
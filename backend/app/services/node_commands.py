@@ -0,0 +1,275 @@
+"""Command bus to nodes over Redis Streams.
+
+Each node reads its own stream with a consumer group named after the node, so commands wait
+in Redis while the node is offline and an unacknowledged read stays in the group's pending
+list. Node side:
+
+    XGROUP CREATE control:stream:<node> <node> 0 MKSTREAM        (ignore BUSYGROUP)
+    XREADGROUP GROUP <node> <node> BLOCK 5000 STREAMS control:stream:<node> >
+        -> fields: id, batch_id, command, params (JSON), expires_at (unix seconds)
+    ... run it unless expires_at has passed ...
+    XADD control:results * id <id> node <node> status acked|failed [result <JSON>] [error <text>]
+    XACK control:stream:<node> <node> <entry id>
+
+The API records every command in node_commands and keeps its status current: entries seen in a
+node's pending list are "delivered", results come from control:results, and anything still open
+at expires_at becomes "timed_out" and is deleted from the stream so a node coming back later
+does not run it.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional
+
+import orjson
+from redis.exceptions import ResponseError
+from sqlalchemy import String, column, func, insert, select, update, values
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import Session
+
+from app.core.config import get_settings
+from app.db.session import AsyncSessionLocal
+from app.models.admins_nodes import AdminNode
+from app.models.node_command import NodeCommand
+from app.services.redis_client import get_redis
+
+logger = logging.getLogger("app")
+_settings = get_settings()
+
+RESULTS = "control:results"
+RESULTS_GROUP = "api"
+OPEN = ("pending", "delivered")
+_CONSUMER = f"{socket.gethostname()}-{os.getpid()}"
+
+
+def stream_key(node: str) -> str:
+    return f"control:stream:{node}"
+
+
+def command_view(c: NodeCommand) -> dict[str, Any]:
+    return {
+        "id": c.id,
+        "batch_id": c.batch_id,
+        "node": c.node,
+        "command": c.command,
+        "params": c.params,
+        "status": c.status,
+        "result": c.result,
+        "error": c.error,
+        "created_at": c.created_at.isoformat() if c.created_at else None,
+        "expires_at": c.expires_at.isoformat() if c.expires_at else None,
+        "delivered_at": c.delivered_at.isoformat() if c.delivered_at else None,
+        "finished_at": c.finished_at.isoformat() if c.finished_at else None,
+    }
+
+
+def resolve_nodes(db: Session, names: Optional[list[str]] = None, group: Optional[str] = None) -> tuple[list[str], list[str]]:
+    """(known node names, unknown names). `group` matches nodes whose metadata has that "group"."""
+    q = select(AdminNode.name)
+    if names is not None:
+        q = q.where(AdminNode.name.in_(set(names)))
+    elif group is not None:
+        q = q.where(AdminNode.meta["group"].astext == group)
+    found = list(db.scalars(q.order_by(AdminNode.name.asc())))
+    missing = sorted(set(names) - set(found)) if names is not None else []
+    return found, missing
+
+
+def create_batch(
+    db: Session,
+    nodes: list[str],
+    command: str,
+    params: Optional[dict[str, Any]],
+    timeout_seconds: int,
+    user_id: Optional[int],
+) -> tuple[str, list[NodeCommand]]:
+    """Record one command per node with a single multi-row INSERT; dispatch happens after commit."""
+    batch_id = uuid.uuid4().hex
+    expires_at = datetime.now(tz=timezone.utc) + timedelta(seconds=timeout_seconds)
+    rows = [
+        {
+            "id": uuid.uuid4().hex,
+            "batch_id": batch_id,
+            "node": node,
+            "command": command,
+            "params": params,
+            "status": "pending",
+            "created_by": user_id,
+            "expires_at": expires_at,
+        }
+        for node in nodes
+    ]
+    commands = list(db.scalars(insert(NodeCommand).returning(NodeCommand), rows)) if rows else []
+    db.commit()
+    return batch_id, commands
+
+
+async def dispatch(commands: list[NodeCommand]) -> int:
+    """XADD every command to its node's stream in one pipeline and record the entry ids."""
+    if not commands:
+        return 0
+    async with get_redis().pipeline(transaction=False) as pipe:
+        for node in {c.node for c in commands}:
+            # Creating the group first means a node that has never connected still gets the backlog
+            pipe.xgroup_create(stream_key(node), node, id="0", mkstream=True)
+        for c in commands:
+            pipe.xadd(
+                stream_key(c.node),
+                {
+                    "id": c.id,
+                    "batch_id": c.batch_id,
+                    "command": c.command,
+                    "params": orjson.dumps(c.params).decode(),
+                    "expires_at": int(c.expires_at.timestamp()),
+                },
+                maxlen=_settings.control_stream_maxlen,
+                approximate=True,
+            )
+        replies = await pipe.execute(raise_on_error=False)
+    added = replies[len(replies) - len(commands):]
+    rows = [(c.id, sid) for c, sid in zip(commands, added) if isinstance(sid, str)]
+    for c, sid in zip(commands, added):
+        if isinstance(sid, Exception):
+            logger.warning("node_command dispatch_failed id=%s node=%s err=%s", c.id, c.node, str(sid))
+    if rows:
+        v = values(column("id", String), column("stream_id", String), name="v").data(rows)
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(NodeCommand).where(NodeCommand.id == v.c.id).values(stream_id=v.c.stream_id))
+            await db.commit()
+    return len(rows)
+
+
+_results_group_ready = False
+
+
+async def _read_results(block_ms: int) -> int:
+    """Apply one batch of node results: this consumer's unacked backlog first, then new entries."""
+    global _results_group_ready
+    r = get_redis()
+    if not _results_group_ready:
+        try:
+            await r.xgroup_create(RESULTS, RESULTS_GROUP, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        _results_group_ready = True
+    entries = []
+    for start in ("0", ">"):
+        reply = await r.xreadgroup(RESULTS_GROUP, _CONSUMER, {RESULTS: start}, count=500, block=None if start == "0" else block_ms)
+        entries = reply[0][1] if reply else []
+        if entries:
+            break
+    if not entries:
+        # Take over results a dead API worker read but never applied
+        entries = (await r.xautoclaim(RESULTS, RESULTS_GROUP, _CONSUMER, min_idle_time=60000, start_id="0-0", count=500))[1]
+    if not entries:
+        return 0
+    rows = []
+    for _, fields in entries:
+        if not fields or fields.get("status") not in ("acked", "failed"):
+            continue
+        try:
+            result = orjson.loads(fields["result"]) if fields.get("result") else None
+        except orjson.JSONDecodeError:
+            result = {"raw": fields["result"]}
+        rows.append((fields.get("id", ""), fields.get("node", ""), fields["status"], result, (fields.get("error") or "")[:1024] or None))
+    if rows:
+        v = values(
+            column("id", String), column("node", String), column("status", String), column("result", JSONB), column("error", String), name="v"
+        ).data(rows)
+        async with AsyncSessionLocal() as db:
+            # A late answer still wins over timed_out: the node did run the command
+            await db.execute(
+                update(NodeCommand)
+                .where(NodeCommand.id == v.c.id, NodeCommand.node == v.c.node, NodeCommand.status.in_(OPEN + ("timed_out",)))
+                .values(status=v.c.status, result=v.c.result, error=v.c.error, finished_at=func.now())
+            )
+            await db.commit()
+    await r.xack(RESULTS, RESULTS_GROUP, *[sid for sid, _ in entries])
+    return len(rows)
+
+
+async def _reconcile() -> None:
+    """Mark delivered, time out overdue commands, and re-dispatch any whose XADD never happened."""
+    now = datetime.now(tz=timezone.utc)
+    async with AsyncSessionLocal() as db:
+        expired = (
+            await db.execute(
+                update(NodeCommand)
+                .where(NodeCommand.status.in_(OPEN), NodeCommand.expires_at < now)
+                .values(status="timed_out", finished_at=now, error="Node did not answer before the command expired")
+                .returning(NodeCommand.node, NodeCommand.stream_id)
+            )
+        ).all()
+        await db.commit()
+        waiting = (await db.execute(select(NodeCommand.node, NodeCommand.stream_id).where(NodeCommand.status == "pending"))).all()
+        undispatched = list(
+            await db.scalars(
+                select(NodeCommand)
+                .where(NodeCommand.status == "pending", NodeCommand.stream_id.is_(None), NodeCommand.created_at < now - timedelta(seconds=30))
+                .limit(500)
+            )
+        )
+    r = get_redis()
+    if expired:
+        async with r.pipeline(transaction=False) as pipe:
+            for node, sid in expired:
+                if sid:
+                    pipe.xack(stream_key(node), node, sid)
+                    pipe.xdel(stream_key(node), sid)
+            await pipe.execute(raise_on_error=False)
+    nodes = sorted({node for node, sid in waiting if sid})
+    if nodes:
+        # A node's pending list holds what it has read but not acknowledged yet
+        async with r.pipeline(transaction=False) as pipe:
+            for node in nodes:
+                pipe.xpending_range(stream_key(node), node, min="-", max="+", count=1000)
+            replies = await pipe.execute(raise_on_error=False)
+        read = [(node, p["message_id"]) for node, reply in zip(nodes, replies) if isinstance(reply, list) for p in reply]
+        if read:
+            v = values(column("node", String), column("stream_id", String), name="v").data(read)
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(NodeCommand)
+                    .where(NodeCommand.node == v.c.node, NodeCommand.stream_id == v.c.stream_id, NodeCommand.status == "pending")
+                    .values(status="delivered", delivered_at=now)
+                )
+                await db.commit()
+    if undispatched:
+        await dispatch(undispatched)
+
+
+_bus_started = False
+
+
+def schedule_node_command_bus() -> None:
+    global _bus_started
+    if _bus_started:
+        return
+    _bus_started = True
+    asyncio.create_task(_results_loop())
+    asyncio.create_task(_reconcile_loop())
+
+
+async def _results_loop() -> None:
+    while True:
+        try:
+            await _read_results(block_ms=5000)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("node_command results_failed err=%s", str(e))
+            await asyncio.sleep(5)
+
+
+async def _reconcile_loop() -> None:
+    while True:
+        await asyncio.sleep(_settings.control_reconcile_interval_seconds)
+        try:
+            await _reconcile()
+        except Exception as e:
+            logger.warning("node_command reconcile_failed err=%s", str(e))
@@ -0,0 +1,252 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional
+
+from sqlalchemy import case, delete, func, literal, update
+from sqlalchemy.dialects.postgresql import JSONB, insert
+from sqlalchemy.orm import Session
+
+from app.core.config import get_settings
+from app.db.session import SessionLocal
+from app.models.admins_nodes import AdminNode
+from app.models.node_metric import NodeMetric
+
+logger = logging.getLogger("app")
+_settings = get_settings()
+
+# Minute buckets for recent detail, hour buckets for history; both are updated on every flush
+PERIODS = (60, 3600)
+
+
+# Metrics a heartbeat may carry; each keeps its own sample count, so one a node leaves out
+# does not pull that metric's average toward zero
+METRICS = ("cpu", "rx_bps", "tx_bps", "connections")
+
+
+@dataclass
+class _Bucket:
+    samples: int = 0
+    cpu_samples: int = 0
+    cpu_sum: float = 0.0
+    cpu_max: float = 0.0
+    rx_bps_samples: int = 0
+    rx_bps_sum: int = 0
+    rx_bps_max: int = 0
+    tx_bps_samples: int = 0
+    tx_bps_sum: int = 0
+    tx_bps_max: int = 0
+    connections_samples: int = 0
+    connections_sum: int = 0
+    connections_max: int = 0
+
+    def add(self, values: dict[str, float]) -> None:
+        """Fold in the metrics one heartbeat reported; absent ones are not counted."""
+        self.samples += 1
+        for name, value in values.items():
+            setattr(self, f"{name}_samples", getattr(self, f"{name}_samples") + 1)
+            setattr(self, f"{name}_sum", getattr(self, f"{name}_sum") + value)
+            setattr(self, f"{name}_max", max(getattr(self, f"{name}_max"), value))
+
+    def merge(self, other: "_Bucket") -> None:
+        self.samples += other.samples
+        for name in METRICS:
+            setattr(self, f"{name}_samples", getattr(self, f"{name}_samples") + getattr(other, f"{name}_samples"))
+            setattr(self, f"{name}_sum", getattr(self, f"{name}_sum") + getattr(other, f"{name}_sum"))
+            setattr(self, f"{name}_max", max(getattr(self, f"{name}_max"), getattr(other, f"{name}_max")))
+
+
+# Heartbeats since the last flush: the latest state per node, and metrics per (node, period, bucket)
+_latest: dict[str, dict[str, Any]] = {}
+_buckets: dict[tuple[str, int, datetime], _Bucket] = {}
+
+
+def _bucket_start(ts: datetime, period: int) -> datetime:
+    epoch = int(ts.timestamp())
+    return datetime.fromtimestamp(epoch - epoch % period, tz=timezone.utc)
+
+
+def record(
+    name: str,
+    status: str = "online",
+    meta: Optional[dict[str, Any]] = None,
+    cpu: Optional[float] = None,
+    rx_bps: Optional[int] = None,
+    tx_bps: Optional[int] = None,
+    connections: Optional[int] = None,
+) -> None:
+    """Fold one heartbeat into memory; nothing touches the database until the next flush.
+
+    `meta` is what the node says about itself and is kept under metadata["reported"]; the
+    other metadata keys (e.g. the "group" commands target) are set by admins only.
+    """
+    now = datetime.now(tz=timezone.utc)
+    state = _latest.get(name)
+    if state is None:
+        _latest[name] = {"status": status, "last_seen": now, "reported": dict(meta or {})}
+    else:
+        state["status"], state["last_seen"] = status, now
+        if meta:
+            state["reported"].update(meta)
+    values = {k: v for k, v in zip(METRICS, (cpu, rx_bps, tx_bps, connections)) if v is not None}
+    if not values:
+        return
+    for period in PERIODS:
+        key = (name, period, _bucket_start(now, period))
+        bucket = _buckets.get(key)
+        if bucket is None:
+            bucket = _buckets[key] = _Bucket()
+        bucket.add(values)
+
+
+# Rows per INSERT, keeping each statement well under the driver's bind parameter limit
+_CHUNK = 2000
+
+
+def _upsert_nodes(db: Session, latest: dict[str, dict[str, Any]]) -> dict[str, int]:
+    rows = [{"name": name, "status": s["status"], "last_seen": s["last_seen"], "meta": {"reported": s["reported"]}} for name, s in latest.items()]
+    ids: dict[str, int] = {}
+    for i in range(0, len(rows), _CHUNK):
+        ids.update(_upsert_node_rows(db, rows[i:i + _CHUNK]))
+    return ids
+
+
+def _upsert_node_rows(db: Session, rows: list[dict[str, Any]]) -> dict[str, int]:
+    stmt = insert(AdminNode).values(rows)
+    newer = stmt.excluded.last_seen >= func.coalesce(AdminNode.last_seen, stmt.excluded.last_seen)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[AdminNode.name],
+        set_={
+            # Another worker may have flushed a later heartbeat for the same node already
+            "status": case((newer, stmt.excluded.status), else_=AdminNode.status),
+            "last_seen": func.greatest(AdminNode.last_seen, stmt.excluded.last_seen),
+            # Only the "reported" key is the node's to change
+            "metadata": func.coalesce(AdminNode.meta, literal({}, JSONB)).op("||")(
+                func.jsonb_build_object(
+                    "reported",
+                    func.coalesce(AdminNode.meta["reported"], literal({}, JSONB)).op("||")(stmt.excluded["metadata"]["reported"]),
+                )
+            ),
+        },
+    )
+    return {row.name: row.id for row in db.execute(stmt.returning(AdminNode.id, AdminNode.name))}
+
+
+def _upsert_metrics(db: Session, buckets: dict[tuple[str, int, datetime], _Bucket], ids: dict[str, int]) -> None:
+    rows = [
+        {"node_id": ids[name], "period_seconds": period, "bucket_start": start, **vars(b)}
+        for (name, period, start), b in buckets.items()
+        if name in ids
+    ]
+    for i in range(0, len(rows), _CHUNK):
+        _upsert_metric_rows(db, rows[i:i + _CHUNK])
+
+
+def _upsert_metric_rows(db: Session, rows: list[dict[str, Any]]) -> None:
+    stmt = insert(NodeMetric).values(rows)
+    x = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[NodeMetric.node_id, NodeMetric.period_seconds, NodeMetric.bucket_start],
+        set_={
+            "samples": NodeMetric.samples + x.samples,
+            **{
+                col: getattr(NodeMetric, col) + x[col]
+                for name in METRICS
+                for col in (f"{name}_samples", f"{name}_sum")
+            },
+            **{f"{name}_max": func.greatest(getattr(NodeMetric, f"{name}_max"), x[f"{name}_max"]) for name in METRICS},
+        },
+    )
+    db.execute(stmt)
+
+
+def _take() -> tuple[dict[str, dict[str, Any]], dict[tuple[str, int, datetime], _Bucket]]:
+    global _latest, _buckets
+    taken = _latest, _buckets
+    _latest, _buckets = {}, {}
+    return taken
+
+
+def _restore(latest: dict[str, dict[str, Any]], buckets: dict[tuple[str, int, datetime], _Bucket]) -> None:
+    # Heartbeats that arrived since the failed flush are newer and win
+    for name, state in latest.items():
+        _latest.setdefault(name, state)
+    for key, b in buckets.items():
+        cur = _buckets.get(key)
+        if cur is None:
+            _buckets[key] = b
+        else:
+            cur.merge(b)
+
+
+def write(latest: dict[str, dict[str, Any]], buckets: dict[tuple[str, int, datetime], _Bucket]) -> int:
+    """One transaction for a whole flush: a node upsert and a metrics upsert, whatever the node count."""
+    with SessionLocal() as db:
+        # Sorted so concurrent flushes from several workers lock rows in the same order
+        ids = _upsert_nodes(db, dict(sorted(latest.items())))
+        _upsert_metrics(db, dict(sorted(buckets.items(), key=lambda kv: kv[0])), ids)
+        db.commit()
+    return len(latest)
+
+
+async def flush() -> int:
+    """Write what was coalesced since the last flush; on failure it is kept for the next one."""
+    latest, buckets = _take()
+    if not latest:
+        return 0
+    try:
+        return await asyncio.to_thread(write, latest, buckets)
+    except Exception:
+        _restore(latest, buckets)
+        raise
+
+
+def run_node_maintenance() -> None:
+    """Mark silent nodes offline and drop metric buckets past their retention."""
+    now = datetime.now(tz=timezone.utc)
+    with SessionLocal() as db:
+        db.execute(
+            update(AdminNode)
+            .where(AdminNode.status != "offline", AdminNode.last_seen < now - timedelta(seconds=_settings.node_offline_after_seconds))
+            .values(status="offline")
+        )
+        db.execute(
+            delete(NodeMetric).where(
+                NodeMetric.period_seconds == 60, NodeMetric.bucket_start < now - timedelta(days=_settings.node_metrics_minute_retention_days)
+            )
+        )
+        db.execute(
+            delete(NodeMetric).where(
+                NodeMetric.period_seconds == 3600, NodeMetric.bucket_start < now - timedelta(days=_settings.node_metrics_hour_retention_days)
+            )
+        )
+        db.commit()
+
+
+_flusher_started = False
+
+
+def schedule_node_heartbeat_flusher() -> None:
+    global _flusher_started
+    if _flusher_started:
+        return
+    _flusher_started = True
+    asyncio.create_task(_flush_loop())
+
+
+async def _flush_loop() -> None:
+    ticks = 0
+    while True:
+        await asyncio.sleep(_settings.node_heartbeat_flush_seconds)
+        try:
+            await flush()
+        except Exception as e:
+            logger.warning("node_heartbeat flush_failed pending=%s err=%s", len(_latest), str(e))
+        ticks += 1
+        if ticks * _settings.node_heartbeat_flush_seconds >= 60:
+            ticks = 0
+            try:
+                await asyncio.to_thread(run_node_maintenance)
+            except Exception as e:
+                logger.warning("node_heartbeat maintenance_failed err=%s", str(e))
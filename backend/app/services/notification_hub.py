@@ -0,0 +1,194 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional
+
+import orjson
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+from app.core.config import get_settings
+from app.services.notifications import parse_stream_id
+from app.services.redis_client import get_redis
+
+logger = logging.getLogger("app")
+_settings = get_settings()
+
+PATTERN = "notifications:*"
+_PREFIX = "notifications:"
+_PING = orjson.dumps({"type": "ping"}).decode()
+
+
+class _Socket:
+    """One browser connection: a bounded outbox drained by its own sender."""
+
+    __slots__ = ("ws", "user_id", "queue", "evicted", "replayed_to")
+
+    def __init__(self, ws: WebSocket, user_id: str, maxsize: int):
+        self.ws = ws
+        self.user_id = user_id
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize=maxsize)
+        self.evicted = False
+        # Stream id of the last replayed message; live copies up to it are skipped
+        self.replayed_to: Optional[tuple[int, int]] = None
+
+
+def _message_id(data: str) -> Optional[tuple[int, int]]:
+    try:
+        msg = orjson.loads(data)
+    except orjson.JSONDecodeError:
+        return None
+    return parse_stream_id(msg.get("id")) if isinstance(msg, dict) else None
+
+
+class NotificationHub:
+    """Per-worker fan-out: one Redis pattern subscription feeds every local socket.
+
+    Redis connections no longer grow with the number of open dashboards. A socket that
+    cannot keep up (its outbox fills, or a send stalls) is closed rather than allowed to
+    buffer without bound; the client reconnects and resumes from the last id it saw.
+    """
+
+    def __init__(self) -> None:
+        self._sockets: dict[str, set[_Socket]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.evictions = 0
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._listen_loop())
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "users": len(self._sockets),
+            "sockets": sum(len(s) for s in self._sockets.values()),
+            "evictions": self.evictions,
+        }
+
+    def dispatch(self, user_id: str, data: str) -> None:
+        for sock in list(self._sockets.get(user_id, ())):
+            try:
+                sock.queue.put_nowait(data)
+            except asyncio.QueueFull:
+                self._evict(sock, "queue_full")
+
+    def _evict(self, sock: _Socket, why: str) -> None:
+        if sock.evicted:
+            return
+        sock.evicted = True
+        self.evictions += 1
+        logger.warning("ws_hub evict user_id=%s reason=%s", sock.user_id, why)
+        # Wake the sender so it notices and closes the socket
+        while not sock.queue.empty():
+            sock.queue.get_nowait()
+        sock.queue.put_nowait("")
+
+    async def _listen_loop(self) -> None:
+        while True:
+            pubsub = get_redis().pubsub()
+            try:
+                await pubsub.psubscribe(PATTERN)
+                async for message in pubsub.listen():
+                    if message.get("type") != "pmessage":
+                        continue
+                    channel = message.get("channel") or ""
+                    if channel.startswith(_PREFIX):
+                        self.dispatch(channel[len(_PREFIX):], message.get("data") or "")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("ws_hub listener_error err=%s", str(e))
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+            await asyncio.sleep(2)
+
+    async def serve(
+        self,
+        ws: WebSocket,
+        user_id: str,
+        backlog: Optional[Callable[[], Awaitable[list[str]]]] = None,
+        on_message: Optional[Callable[[str], None]] = None,
+    ) -> None:
+        """Run an accepted socket until the client leaves or is evicted.
+
+        `backlog` is fetched after the socket is registered, so nothing published meanwhile
+        is missed, and sent before any live message. `on_message` gets each client message.
+        """
+        sock = _Socket(ws, user_id, _settings.ws_send_queue_max)
+        self._sockets.setdefault(user_id, set()).add(sock)
+        sender = receiver = None
+        try:
+            if backlog is not None:
+                timeout = _settings.ws_send_timeout_seconds
+                for data in await backlog():
+                    await asyncio.wait_for(ws.send_text(data), timeout=timeout)
+                    sock.replayed_to = _message_id(data) or sock.replayed_to
+            sender = asyncio.create_task(self._send_loop(sock))
+            receiver = asyncio.create_task(self._receive_loop(sock, on_message))
+            await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+        except (asyncio.TimeoutError, WebSocketDisconnect):
+            pass
+        finally:
+            tasks = [t for t in (sender, receiver) if t is not None]
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            peers = self._sockets.get(user_id)
+            if peers is not None:
+                peers.discard(sock)
+                if not peers:
+                    del self._sockets[user_id]
+        if sock.evicted:
+            try:
+                await asyncio.wait_for(ws.close(code=1013), timeout=_settings.ws_send_timeout_seconds)
+            except Exception:
+                pass
+
+    async def _send_loop(self, sock: _Socket) -> None:
+        heartbeat = _settings.ws_heartbeat_seconds
+        timeout = _settings.ws_send_timeout_seconds
+        while True:
+            try:
+                data = await asyncio.wait_for(sock.queue.get(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing idle sockets and finds dead peers
+                data = _PING
+            if sock.evicted:
+                return
+            if sock.replayed_to is not None and data is not _PING:
+                seen = _message_id(data)
+                if seen is not None and seen <= sock.replayed_to:
+                    continue
+                sock.replayed_to = None
+            try:
+                await asyncio.wait_for(sock.ws.send_text(data), timeout=timeout)
+            except asyncio.TimeoutError:
+                self._evict(sock, "send_timeout")
+                return
+
+    async def _receive_loop(self, sock: _Socket, on_message: Optional[Callable[[str], None]]) -> None:
+        # Reading is also how a disconnect shows up
+        try:
+            while True:
+                text = await sock.ws.receive_text()
+                if on_message is not None:
+                    on_message(text)
+        except WebSocketDisconnect:
+            return
+
+
+hub = NotificationHub()
+
+
+def schedule_notification_hub() -> None:
+    hub.start()
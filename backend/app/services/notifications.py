@@ -0,0 +1,338 @@
+import asyncio
+import logging
+import re
+from typing import Any, Iterable, Optional
+
+import orjson
+from sqlalchemy import Integer, String, any_, column, insert, literal, or_, select, update, values
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
+from sqlalchemy.orm import Session
+
+from app.core.config import get_settings
+from app.db.session import AsyncSessionLocal
+from app.models.notification import Notification
+from app.models.plan_template import UserPlanTemplate
+from app.models.template import Template, UserTemplate
+from app.models.user import User
+from app.models.user_panel_credentials import UserPanelCredential
+from app.schemas.notification import NotificationSegment
+from app.services.redis_client import get_redis
+
+logger = logging.getLogger("app")
+_settings = get_settings()
+
+# Every message for a user is appended to a capped stream and published on their channel in one
+# script call, so the id a live socket sees is the id a reconnecting socket resumes from.
+# Stored entries omit the id; it is spliced in front of the other fields when read back.
+# Messages backed by a notifications row also add that row's id to the user's unread set.
+_DELIVER = """
+local id = redis.call('XADD', KEYS[1], 'MAXLEN', '~', ARGV[1], '*', 'data', ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+if ARGV[5] ~= '' then
+  redis.call('SADD', KEYS[2], ARGV[5])
+end
+redis.call('PUBLISH', ARGV[4], '{"id":"' .. id .. '",' .. string.sub(ARGV[2], 2))
+return id
+"""
+# The unread set is a cache of `notifications WHERE status <> 'read'`. Its "*" member means it
+# was loaded from the database; without it (new user, Redis restart, expiry, a delivery that
+# failed after its row was stored) the set only holds ids delivered since, so the next read
+# loads the rest. Loading adds to what is there, and SADD is sent in slices to stay under Lua's
+# argument limit. The generation key is bumped by every read-receipt flush: a load whose
+# database snapshot predates a flush is dropped, as it could re-add ids the flush just removed.
+# The expiry set on load is a backstop for drift nothing invalidated.
+_UNREAD_COMPLETE = "*"
+_LOAD_UNREAD = """
+if redis.call('SISMEMBER', KEYS[1], '*') == 0 then
+  if (redis.call('GET', KEYS[2]) or '') ~= ARGV[2] then
+    return -1
+  end
+  redis.call('SADD', KEYS[1], '*')
+  for i = 3, #ARGV, 1000 do
+    redis.call('SADD', KEYS[1], unpack(ARGV, i, math.min(i + 999, #ARGV)))
+  end
+  redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return redis.call('SCARD', KEYS[1]) - 1
+"""
+# Pipelined fan-out is sent in chunks so one broadcast cannot buffer unbounded replies
+_FANOUT_CHUNK = 1000
+_STREAM_ID = re.compile(r"^\d+-\d+$")
+# Statuses only move forward
+_RANK = {"new": 0, "delivered": 1, "read": 2}
+
+
+def stream_key(user_id: int | str) -> str:
+    return f"notifications:stream:{user_id}"
+
+
+def channel(user_id: int | str) -> str:
+    return f"notifications:{user_id}"
+
+
+def unread_key(user_id: int | str) -> str:
+    return f"notifications:unread:{user_id}"
+
+
+def unread_gen_key(user_id: int | str) -> str:
+    return f"notifications:unread:{user_id}:gen"
+
+
+def parse_stream_id(value: Optional[str]) -> Optional[tuple[int, int]]:
+    if not value or not _STREAM_ID.match(value):
+        return None
+    ms, seq = value.split("-")
+    return int(ms), int(seq)
+
+
+def _with_id(stream_id: str, data: str) -> str:
+    return f'{{"id":"{stream_id}",{data[1:]}'
+
+
+_script = None
+
+
+def _deliver_script():
+    global _script
+    if _script is None:
+        _script = get_redis().register_script(_DELIVER)
+    return _script
+
+
+def _deliver_args(user_id: int, data: str, notification_id: Optional[int]) -> dict[str, list]:
+    return {
+        "keys": [stream_key(user_id), unread_key(user_id)],
+        "args": [
+            _settings.notification_stream_maxlen,
+            data,
+            _settings.notification_stream_ttl_seconds,
+            channel(user_id),
+            "" if notification_id is None else notification_id,
+        ],
+    }
+
+
+async def deliver(user_id: int, message: dict[str, Any], notification_id: Optional[int] = None) -> str:
+    """Append `message` (needs a "type") to the user's stream and push it to their sockets; returns its id."""
+    return await _deliver_script()(**_deliver_args(user_id, orjson.dumps(message).decode(), notification_id), client=get_redis())
+
+
+async def fan_out(rows: list[tuple[int, int]], payload: Any) -> int:
+    """Deliver one notification to many users: `rows` are (notification_id, user_id) pairs.
+
+    The payload is serialized once and every delivery for a chunk goes out in one pipeline.
+    """
+    body = orjson.dumps(payload).decode()
+    script = _deliver_script()
+    sent = 0
+    for i in range(0, len(rows), _FANOUT_CHUNK):
+        async with get_redis().pipeline(transaction=False) as pipe:
+            for nid, uid in rows[i:i + _FANOUT_CHUNK]:
+                data = f'{{"type":"notification","notification_id":{nid},"payload":{body}}}'
+                await script(**_deliver_args(uid, data, nid), client=pipe)
+            sent += len(await pipe.execute())
+    return sent
+
+
+async def invalidate_unread(user_ids: Iterable[int]) -> None:
+    """Best effort: make the next unread_count for these users reload from the database.
+
+    For rows stored whose delivery failed, so their ids never reached the unread set.
+    """
+    uids = sorted(set(user_ids))
+    try:
+        for i in range(0, len(uids), _FANOUT_CHUNK):
+            async with get_redis().pipeline(transaction=False) as pipe:
+                for uid in uids[i:i + _FANOUT_CHUNK]:
+                    pipe.srem(unread_key(uid), _UNREAD_COMPLETE)
+                await pipe.execute()
+    except Exception as e:
+        # The expiry on the set still forces a reload eventually
+        logger.warning("notification unread_invalidate_failed users=%s err=%s", len(uids), str(e))
+
+
+_load_script = None
+
+
+async def unread_count(user_id: int) -> int:
+    """Unread notifications for the user; the first call after the set went missing loads it from the database."""
+    global _load_script
+    r = get_redis()
+    key, gen_key = unread_key(user_id), unread_gen_key(user_id)
+    async with r.pipeline(transaction=True) as pipe:
+        pipe.sismember(key, _UNREAD_COMPLETE)
+        pipe.scard(key)
+        pipe.get(gen_key)
+        complete, count, gen = await pipe.execute()
+    if complete:
+        return count - 1
+    async with AsyncSessionLocal() as db:
+        ids = list(await db.scalars(select(Notification.id).where(Notification.to_user == user_id, Notification.status != "read")))
+    if _load_script is None:
+        _load_script = r.register_script(_LOAD_UNREAD)
+    loaded = await _load_script(keys=[key, gen_key], args=[_settings.notification_unread_ttl_seconds, gen or "", *ids])
+    # A flush landed after our snapshot; answer from it and let the next read load again
+    return len(ids) if loaded < 0 else loaded
+
+
+async def replay(user_id: int | str, last_id: str) -> list[str]:
+    """Messages after `last_id`, oldest first.
+
+    If some of them were already trimmed (or the whole stream expired), the list starts with
+    {"type": "resync"} so the client refetches /notifications instead.
+    """
+    after = parse_stream_id(last_id)
+    resync = orjson.dumps({"type": "resync"}).decode()
+    if after is None:
+        return [resync]
+    r = get_redis()
+    key = stream_key(user_id)
+    async with r.pipeline(transaction=True) as pipe:
+        pipe.xinfo_stream(key)
+        pipe.xrange(key, min=f"({last_id}", max="+")
+        info, entries = await pipe.execute(raise_on_error=False)
+    if isinstance(info, Exception):
+        # No stream: everything the client could have missed has expired
+        return [resync]
+    if isinstance(entries, Exception):
+        raise entries
+    out = [_with_id(sid, fields.get("data", "{}")) for sid, fields in entries]
+    # Redis 7 tracks the newest id ever trimmed, which tells exactly whether we lost any
+    trimmed = parse_stream_id(info.get("max-deleted-entry-id"))
+    if trimmed is not None and trimmed > after:
+        out.insert(0, resync)
+    return out
+
+
+def _segment_users(segment: NotificationSegment):
+    q = select(User.id)
+    if segment.role is not None:
+        q = q.where(User.role == segment.role)
+    elif segment.plan_template_id is not None:
+        q = q.where(User.id.in_(select(UserPlanTemplate.user_id).where(UserPlanTemplate.template_id == segment.plan_template_id)))
+    elif segment.panel_id is not None:
+        # Assigned through a template on the panel, or holding their own account on it
+        via_template = select(UserTemplate.user_id).join(Template, Template.id == UserTemplate.template_id).where(Template.panel_id == segment.panel_id)
+        via_account = select(UserPanelCredential.user_id).where(UserPanelCredential.panel_id == segment.panel_id)
+        q = q.where(or_(User.id.in_(via_template), User.id.in_(via_account)))
+    else:
+        # One array parameter rather than one bind per id
+        q = q.where(User.id == any_(literal(sorted(set(segment.user_ids)), ARRAY(Integer))))
+    if not segment.include_inactive:
+        q = q.where(User.is_active.is_(True))
+    return q
+
+
+def insert_broadcast(db: Session, segment: NotificationSegment, payload: Any) -> list[tuple[int, int]]:
+    """One INSERT ... SELECT for the whole segment; returns (notification_id, user_id) pairs."""
+    users = _segment_users(segment).subquery()
+    stmt = (
+        insert(Notification)
+        .from_select(
+            ["to_user", "payload", "status"],
+            select(users.c.id, literal(payload, JSONB), literal("new")),
+        )
+        .returning(Notification.id, Notification.to_user)
+    )
+    rows = [(r.id, r.to_user) for r in db.execute(stmt)]
+    db.commit()
+    return rows
+
+
+# Read/ack receipts are buffered per process and written in one UPDATE per flush. Only touch it
+# from the event loop (async routes, socket handlers): flush_status swaps it without a lock.
+_pending: dict[int, tuple[int, str]] = {}
+
+
+def mark(user_id: int, ids: Iterable[Any], status: str) -> int:
+    """Queue a status change for the caller's notifications; returns how many ids were taken."""
+    taken = 0
+    for raw in ids:
+        try:
+            nid = int(raw)
+        except (TypeError, ValueError):
+            continue
+        current = _pending.get(nid)
+        if current is None or _RANK[status] > _RANK[current[1]]:
+            _pending[nid] = (user_id, status)
+        taken += 1
+    return taken
+
+
+async def flush_status() -> int:
+    global _pending
+    if not _pending:
+        return 0
+    batch, _pending = _pending, {}
+    rows = [(nid, uid, status) for nid, (uid, status) in batch.items()]
+    v = values(column("id", Integer), column("user_id", Integer), column("status", String), name="v").data(rows)
+    stmt = (
+        update(Notification)
+        .where(Notification.id == v.c.id, Notification.to_user == v.c.user_id)
+        # A late "delivered" must not undo "read"
+        .where(or_(v.c.status == "read", Notification.status == "new"))
+        .values(status=v.c.status)
+    )
+    try:
+        async with AsyncSessionLocal() as db:
+            await db.execute(stmt)
+            await db.commit()
+        read: dict[int, list[int]] = {}
+        for nid, uid, status in rows:
+            if status == "read":
+                read.setdefault(uid, []).append(nid)
+        if read:
+            async with get_redis().pipeline(transaction=False) as pipe:
+                for uid, nids in read.items():
+                    pipe.srem(unread_key(uid), *nids)
+                    pipe.incr(unread_gen_key(uid))
+                    pipe.expire(unread_gen_key(uid), _settings.notification_unread_ttl_seconds)
+                await pipe.execute()
+    except Exception:
+        # Put the batch back unless newer receipts replaced it meanwhile
+        for nid, (uid, status) in batch.items():
+            current = _pending.get(nid)
+            if current is None or _RANK[status] > _RANK[current[1]]:
+                _pending[nid] = (uid, status)
+        raise
+    return len(rows)
+
+
+_writer_started = False
+
+
+def schedule_notification_status_writer() -> None:
+    global _writer_started
+    if _writer_started:
+        return
+    _writer_started = True
+    asyncio.create_task(_status_loop())
+
+
+async def _status_loop() -> None:
+    while True:
+        await asyncio.sleep(_settings.notification_status_flush_ms / 1000)
+        try:
+            await flush_status()
+        except Exception as e:
+            logger.warning("notification_status flush_failed pending=%s err=%s", len(_pending), str(e))
+
+
+async def stop_notification_status_writer() -> None:
+    try:
+        await flush_status()
+    except Exception as e:
+        logger.warning("notification_status final_flush_failed dropped=%s err=%s", len(_pending), str(e))
+
+
+def handle_client_message(user_id: int, text: str) -> None:
+    """Socket messages: {"type": "ack" | "read", "ids": [notification ids]}; anything else is ignored."""
+    try:
+        msg = orjson.loads(text)
+    except orjson.JSONDecodeError:
+        return
+    if not isinstance(msg, dict) or not isinstance(msg.get("ids"), list):
+        return
+    status = {"ack": "delivered", "read": "read"}.get(str(msg.get("type")))
+    if status:
+        mark(user_id, msg["ids"][:500], status)
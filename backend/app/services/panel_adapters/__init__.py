@@ -0,0 +1,48 @@
+from typing import Optional
+
+from app.models.panel import Panel
+from app.services.panel_adapters.base import (
+    CreatedPanelUser,
+    InboundInfo,
+    PanelAdapter,
+    PanelError,
+    PanelUser,
+    PanelUserDetail,
+    PlanLimits,
+    USER_SORT_FIELDS,
+    UserQuery,
+)
+from app.services.panel_adapters.marzban import MarzbanAdapter
+from app.services.panel_adapters.xui import XuiAdapter
+
+ADAPTERS: dict[str, type[PanelAdapter]] = {
+    MarzbanAdapter.type: MarzbanAdapter,
+    XuiAdapter.type: XuiAdapter,
+}
+
+
+def adapter_class(panel_type: Optional[str]) -> type[PanelAdapter]:
+    return ADAPTERS.get((panel_type or "marzban").lower(), MarzbanAdapter)
+
+
+def get_adapter(panel: Panel, username: Optional[str] = None, password: Optional[str] = None) -> PanelAdapter:
+    """Adapter for `panel`, using the given credentials or the panel's own admin account."""
+    return adapter_class(getattr(panel, "type", None))(panel, username, password)
+
+
+__all__ = [
+    "ADAPTERS",
+    "CreatedPanelUser",
+    "InboundInfo",
+    "MarzbanAdapter",
+    "PanelAdapter",
+    "PanelError",
+    "PanelUser",
+    "PanelUserDetail",
+    "PlanLimits",
+    "USER_SORT_FIELDS",
+    "UserQuery",
+    "XuiAdapter",
+    "adapter_class",
+    "get_adapter",
+]
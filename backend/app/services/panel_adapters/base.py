@@ -0,0 +1,258 @@
+import asyncio
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Literal, Optional, TypeVar, Union
+
+import httpx
+from pydantic import BaseModel
+
+from app.models.panel import Panel
+from app.services.panel_http import panel_client
+
+
+class PanelError(Exception):
+    """A panel call failed; `status_code` is what the API should answer with."""
+
+    def __init__(self, detail: str, status_code: int = 502, raw: Optional[dict] = None):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+        self.raw = raw
+
+
+class InboundInfo(BaseModel):
+    id: str
+    tag: Optional[str] = None
+    remark: Optional[str] = None
+    protocol: Optional[str] = None
+
+
+class PanelUser(BaseModel):
+    username: str
+    status: Optional[str] = None
+    data_limit: Optional[int] = None
+    expire: Optional[int] = None
+    subscription_url: Optional[str] = None
+
+
+class PanelUserDetail(PanelUser):
+    used: Optional[int] = None
+    remaining: Optional[int] = None
+    expires_in: Optional[int] = None
+
+
+# Sortable fields for user listings; prefix with "-" for descending
+USER_SORT_FIELDS = ("username", "status", "data_limit", "expire")
+
+
+class UserQuery(BaseModel):
+    """Paging, filtering and sorting for user listings. `search` is a username prefix."""
+
+    offset: int = 0
+    limit: Optional[int] = None
+    status: Optional[str] = None
+    search: Optional[str] = None
+    expiring_before: Optional[int] = None
+    sort: Optional[str] = None
+
+    @property
+    def filtered(self) -> bool:
+        return bool(self.status or self.search or self.expiring_before is not None)
+
+    def sort_key(self) -> tuple[Optional[str], bool]:
+        """(field, descending); raises ValueError for unknown fields."""
+        if not self.sort:
+            return None, False
+        field = self.sort.lstrip("-")
+        if field not in USER_SORT_FIELDS:
+            raise ValueError(f"sort must be one of {', '.join(USER_SORT_FIELDS)} (prefix '-' for descending)")
+        return field, self.sort.startswith("-")
+
+    def matches(self, user: PanelUser) -> bool:
+        if self.status and (user.status or "") != self.status:
+            return False
+        if self.search and not user.username.lower().startswith(self.search.lower()):
+            return False
+        if self.expiring_before is not None and not (user.expire and 0 < user.expire < self.expiring_before):
+            return False
+        return True
+
+    def apply(self, users: list[PanelUser]) -> tuple[list[PanelUser], int]:
+        """Filter, sort and page `users` in memory; returns (page, total matching)."""
+        out = [u for u in users if self.matches(u)] if self.filtered else list(users)
+        field, desc = self.sort_key()
+        if field:
+            # Missing values sort last in both directions
+            present = [u for u in out if getattr(u, field) is not None]
+            missing = [u for u in out if getattr(u, field) is None]
+            present.sort(key=lambda u: getattr(u, field), reverse=desc)
+            out = present + missing
+        total = len(out)
+        end = None if self.limit is None else self.offset + self.limit
+        return out[self.offset:end], total
+
+
+class CreatedPanelUser(BaseModel):
+    username: str
+    subscription_url: Optional[str] = None
+    expire: Optional[int] = None
+    data_limit: Optional[int] = None
+    raw: Optional[dict] = None
+
+
+class PlanLimits(BaseModel):
+    """Quota and duration to apply; None means unlimited."""
+
+    data_limit_mb: Optional[int] = None
+    duration_days: Optional[int] = None
+
+    @classmethod
+    def from_plan(cls, plan: Any) -> "PlanLimits":
+        return cls(
+            data_limit_mb=None if plan.is_data_unlimited else max(0, int(plan.data_quota_mb or 0)),
+            duration_days=None if plan.is_duration_unlimited else max(1, int(plan.duration_days or 0)),
+        )
+
+    @property
+    def data_limit_bytes(self) -> int:
+        # 0 is "unlimited" for both panel types
+        return 0 if self.data_limit_mb is None else int(self.data_limit_mb) * (1024 ** 2)
+
+    def expire_timestamp(self) -> Optional[int]:
+        """Unix expiry counted from now, or None when unlimited."""
+        if self.duration_days is None:
+            return None
+        return int(datetime.now(tz=timezone.utc).timestamp()) + self.duration_days * 86400
+
+
+T = TypeVar("T")
+
+
+async def bounded(
+    usernames: list[str], op: Callable[[str], Awaitable[T]], concurrency: int = 8
+) -> list[Union[T, PanelError]]:
+    """Run `op` for every username with at most `concurrency` in flight; failures come back as PanelError."""
+    sem = asyncio.Semaphore(max(1, concurrency))
+
+    async def one(name: str) -> Union[T, PanelError]:
+        async with sem:
+            try:
+                return await op(name)
+            except PanelError as e:
+                return e
+            except Exception as e:
+                return PanelError(str(e))
+
+    return list(await asyncio.gather(*(one(n) for n in usernames)))
+
+
+class PanelAdapter(ABC):
+    """Protocol-specific access to one panel with one set of credentials.
+
+    Adapters share the per-origin connection pool (services.panel_http) and the session
+    cache (services.panel_auth), so constructing one per request is cheap.
+    """
+
+    type: str = ""
+    timeout: float = 20.0
+    follow_redirects: bool = False
+
+    def __init__(self, panel: Panel, username: Optional[str] = None, password: Optional[str] = None):
+        self.panel = panel
+        self.base_url: str = panel.base_url
+        self.username: str = username if username is not None else panel.username
+        self.password: str = password if password is not None else panel.password
+
+    def url(self, path: str) -> str:
+        return self.base_url.rstrip("/") + path
+
+    @abstractmethod
+    def auth(self) -> httpx.Auth:
+        ...
+
+    def client(self, timeout: Optional[float] = None) -> httpx.AsyncClient:
+        return panel_client(
+            self.base_url,
+            timeout=timeout or self.timeout,
+            follow_redirects=self.follow_redirects,
+            auth=self.auth(),
+            panel_id=self.panel.id,
+            adapter=self.type,
+        )
+
+    @abstractmethod
+    async def login(self) -> None:
+        """Make sure a session exists; raises PanelError when the panel rejects the credentials."""
+
+    @abstractmethod
+    async def list_inbounds(self) -> list[InboundInfo]:
+        ...
+
+    @abstractmethod
+    async def list_users(self) -> list[PanelUser]:
+        ...
+
+    async def query_users(self, query: UserQuery) -> tuple[list[PanelUser], Optional[int]]:
+        """One page of users matching `query` and the total; filtered in memory unless the panel can do it."""
+        return query.apply(await self.list_users())
+
+    async def iter_users(self, page_size: int = 500) -> AsyncIterator[list[PanelUser]]:
+        """Users in pages of about `page_size`; panels without server-side paging yield one page."""
+        yield await self.list_users()
+
+    async def stream_users(self) -> AsyncIterator[PanelUser]:
+        """Users one at a time, for exports; adapters that can parse the panel body incrementally override this."""
+        async for page in self.iter_users():
+            for user in page:
+                yield user
+
+    @abstractmethod
+    async def get_user(self, username: str) -> PanelUserDetail:
+        ...
+
+    @abstractmethod
+    async def create_user(self, username: str, limits: PlanLimits, inbounds: list[str]) -> CreatedPanelUser:
+        """Create `username`; `inbounds` are tags (Marzban) or inbound ids (XUI, first one is used)."""
+
+    async def create_users(
+        self, usernames: list[str], limits: PlanLimits, inbounds: list[str], concurrency: int = 8
+    ) -> list[Union[CreatedPanelUser, PanelError]]:
+        """Create several users with at most `concurrency` in flight.
+
+        Results line up with `usernames`; a failed item is returned as its PanelError instead of raised.
+        """
+        return await bounded(usernames, lambda name: self.create_user(name, limits, inbounds), concurrency)
+
+    @abstractmethod
+    async def set_status(self, username: str, status: Literal["active", "disabled"]) -> None:
+        ...
+
+    @abstractmethod
+    async def extend(self, username: str, limits: PlanLimits, inbounds: Optional[list[str]] = None) -> None:
+        """Reset quota and expiry from now according to `limits`; `inbounds` optionally replaces the user's inbounds."""
+
+    async def set_status_many(
+        self, usernames: list[str], status: Literal["active", "disabled"], concurrency: int = 8
+    ) -> list[Optional[PanelError]]:
+        """set_status for each of `usernames`; None where it worked, the PanelError where it did not."""
+        results = await bounded(usernames, lambda name: self.set_status(name, status), concurrency)
+        return [r if isinstance(r, PanelError) else None for r in results]
+
+    async def extend_many(
+        self, usernames: list[str], limits: PlanLimits, inbounds: Optional[list[str]] = None, concurrency: int = 8
+    ) -> list[Optional[PanelError]]:
+        """extend for each of `usernames`; None where it worked, the PanelError where it did not."""
+        results = await bounded(usernames, lambda name: self.extend(name, limits, inbounds), concurrency)
+        return [r if isinstance(r, PanelError) else None for r in results]
+
+    @abstractmethod
+    async def delete_user(self, username: str) -> int:
+        """Delete `username`; returns the panel's HTTP status."""
+
+    async def list_hosts(self) -> list[str]:
+        return []
+
+    @classmethod
+    @abstractmethod
+    async def probe(cls, base_url: str, username: str, password: str) -> tuple[bool, Optional[str], Optional[int], Optional[str]]:
+        """Uncached credential check for the "test panel" form: (ok, endpoint, status, info)."""
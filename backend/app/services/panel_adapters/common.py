@@ -0,0 +1,348 @@
+import base64
+import json
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Iterable, Optional
+
+import ijson
+from ijson.common import ObjectBuilder
+from urllib.parse import urlparse, urlunparse
+
+
+def join_url(base_url: str, path: str) -> str:
+    b = (base_url or "").rstrip("/")
+    p = path if path.startswith("/") else "/" + path
+    lb = b.lower()
+    if lb.endswith("/xui") and p.startswith("/xui/"):
+        b = b[:-4]
+    elif lb.endswith("/panel") and p.startswith("/panel/"):
+        b = b[:-6]
+    return b + p
+
+
+def build_payload_variants(username: str, bytes_limit: int, expire_at: Optional[datetime]) -> list[dict]:
+    # Try multiple payload shapes commonly used
+    variants: list[dict] = []
+    if expire_at is not None:
+        expire_days = max(1, int((expire_at - datetime.now(tz=timezone.utc)).total_seconds() // 86400))
+        iso = expire_at.isoformat()
+        variants.extend([
+            {"username": username, "data_limit": bytes_limit, "expire": expire_days},
+            {"username": username, "data_limit": bytes_limit, "expire_in_days": expire_days},
+            {"username": username, "data_limit": bytes_limit, "expire_at": iso},
+            {"username": username, "limit": bytes_limit, "expire": expire_days},
+            {"username": username, "quota": bytes_limit, "expire_days": expire_days},
+        ])
+    variants.append({"username": username, "data_limit": bytes_limit})
+    return variants
+
+
+def extract_subscription_url(base_url: str, data: dict) -> Optional[str]:
+    # Try common keys
+    for key in [
+        "subscription_url",
+        "subscription",
+        "sub_link",
+        "link",
+        "subscriptionLink",
+        "subUrl",
+    ]:
+        if isinstance(data, dict) and data.get(key):
+            return str(data[key])
+    # Try nested
+    user = data.get("user") if isinstance(data, dict) else None
+    if isinstance(user, dict):
+        for key in ["subscription_url", "subscription", "link"]:
+            if user.get(key):
+                return str(user[key])
+    # Construct from token if provided
+    token = data.get("subscription_token") or (user.get("subscription_token") if isinstance(user, dict) else None)
+    if token:
+        return base_url.rstrip("/") + "/sub/" + str(token)
+    return None
+
+
+def canonicalize_subscription_url(base_url: str, subscription_url: Optional[str]) -> Optional[str]:
+    if not subscription_url:
+        return None
+    try:
+        b = urlparse(base_url)
+        s = urlparse(subscription_url)
+        # Try to extract token from path if contains '/sub/'
+        token = None
+        if "/sub/" in s.path:
+            token = s.path.split("/sub/", 1)[1].split("/", 1)[0]
+        # Build canonical path
+        if token:
+            path = f"/sub/{token}"
+            return urlunparse((b.scheme, b.netloc, path, "", s.query, ""))
+        # Otherwise, just swap scheme/host to base_url
+        return urlunparse((b.scheme, b.netloc, s.path or "/sub", "", s.query, ""))
+    except Exception:
+        return subscription_url
+
+
+def xui_build_share_link(base_url: str, inbound: dict, client_email: str, client_id: Optional[str]) -> Optional[str]:
+    try:
+        b = urlparse(base_url)
+        host = b.hostname or ""
+        proto = str(inbound.get("protocol") or "").lower()
+        port = str(inbound.get("port") or "")
+        stream = inbound.get("streamSettings") or {}
+        if isinstance(stream, str):
+            try:
+                stream = json.loads(stream)
+            except Exception:
+                stream = {}
+        network = str(stream.get("network") or "tcp").lower()
+        security = str(stream.get("security") or "").lower()
+        params: list[tuple[str, str]] = []
+        tag_name = client_email
+
+        if proto == "vless":
+            # vless://UUID@host:port?encryption=none&security=...&type=...&path=...&host=...&sni=...#name
+            uuid = client_id or ""
+            if not uuid:
+                return None
+            params.append(("encryption", "none"))
+            if security:
+                params.append(("security", security))
+                if security == "tls":
+                    tls = stream.get("tlsSettings") or {}
+                    sni = tls.get("serverName") or tls.get("server_name")
+                    if sni:
+                        params.append(("sni", str(sni)))
+                    alpn = tls.get("alpn")
+                    if isinstance(alpn, list) and alpn:
+                        params.append(("alpn", ",".join(alpn)))
+                if security == "reality":
+                    rs = stream.get("realitySettings") or {}
+                    pbk = rs.get("publicKey")
+                    if pbk:
+                        params.append(("pbk", str(pbk)))
+                    sid = rs.get("shortIds")
+                    if isinstance(sid, list) and sid:
+                        params.append(("sid", sid[0]))
+                    sni = None
+                    sn = rs.get("serverNames")
+                    if isinstance(sn, list) and sn:
+                        sni = sn[0]
+                    if sni:
+                        params.append(("sni", str(sni)))
+            # transport
+            params.append(("type", network))
+            if network == "ws":
+                ws = stream.get("wsSettings") or {}
+                path = ws.get("path") or "/"
+                params.append(("path", str(path)))
+                headers = ws.get("headers") or {}
+                hhost = headers.get("Host") or headers.get("host")
+                if hhost:
+                    params.append(("host", str(hhost)))
+            elif network == "grpc":
+                gs = stream.get("grpcSettings") or {}
+                service = gs.get("serviceName") or "grpc"
+                params.append(("serviceName", str(service)))
+
+            query = "&".join([f"{k}={str(v)}" for k, v in params])
+            return f"vless://{uuid}@{host}:{port}?{query}#{tag_name}"
+
+        if proto == "vmess":
+            # vmess base64(JSON)
+            uuid = client_id or ""
+            if not uuid:
+                return None
+            tls_flag = "tls" if security in ("tls", "reality") else ""
+            ws = stream.get("wsSettings") or {}
+            gs = stream.get("grpcSettings") or {}
+            vm = {
+                "v": "2",
+                "ps": tag_name,
+                "add": host,
+                "port": str(port),
+                "id": uuid,
+                "aid": "0",
+                "net": network,
+                "type": "",
+                "host": (ws.get("headers") or {}).get("Host") or "",
+                "path": ws.get("path") or "",
+                "tls": tls_flag,
+                "sni": (stream.get("tlsSettings") or {}).get("serverName") or "",
+                "alpn": ",".join((stream.get("tlsSettings") or {}).get("alpn") or []) if (stream.get("tlsSettings") or {}).get("alpn") else "",
+                "fp": (stream.get("realitySettings") or {}).get("fingerprint") or "",
+                "serviceName": gs.get("serviceName") or "",
+            }
+            b64 = base64.b64encode(json.dumps(vm, separators=(",", ":")).encode()).decode()
+            return f"vmess://{b64}"
+
+        # trojan minimal (if present)
+        if proto == "trojan":
+            pwd = client_id or ""
+            if not pwd:
+                return None
+            if security:
+                params.append(("security", security))
+            if network == "ws":
+                ws = stream.get("wsSettings") or {}
+                path = ws.get("path") or "/"
+                params.append(("type", "ws"))
+                params.append(("path", str(path)))
+                headers = ws.get("headers") or {}
+                hhost = headers.get("Host") or headers.get("host")
+                if hhost:
+                    params.append(("host", str(hhost)))
+            q = "&".join([f"{k}={str(v)}" for k, v in params])
+            return f"trojan://{pwd}@{host}:{port}?{q}#{tag_name}"
+    except Exception:
+        return None
+    return None
+
+
+def is_json(res) -> bool:
+    return res.headers.get("content-type", "").startswith("application/json")
+
+
+def xui_inbound_list(data: Any) -> list[dict]:
+    """Inbounds from an XUI listing, whichever of obj/inbounds/items/data/list the fork uses."""
+    candidates = None
+    if isinstance(data, dict):
+        for key in ("obj", "inbounds", "items", "data", "list"):
+            if isinstance(data.get(key), list):
+                candidates = data.get(key)
+                break
+        # sometimes nested under data: { data: { items: [...] } }
+        if candidates is None and isinstance(data.get("data"), dict):
+            for key in ("items", "inbounds", "list", "obj"):
+                if isinstance(data["data"].get(key), list):
+                    candidates = data["data"][key]
+                    break
+    elif isinstance(data, list):
+        candidates = data
+    return [it for it in (candidates or []) if isinstance(it, dict)]
+
+
+def xui_inbound_clients(inbound: dict) -> list[dict]:
+    # clients can be in settings.clients as JSON string or object, or at top level
+    clients: list = []
+    settings = inbound.get("settings")
+    if isinstance(settings, str):
+        try:
+            settings = json.loads(settings)
+        except Exception:
+            settings = None
+    if isinstance(settings, dict) and isinstance(settings.get("clients"), list):
+        clients = settings.get("clients")
+    if not clients and isinstance(inbound.get("clients"), list):
+        clients = inbound.get("clients")
+    return [c for c in clients if isinstance(c, dict)]
+
+
+def xui_client_email(client: dict) -> str:
+    return str(client.get("email") or client.get("name") or client.get("username") or "")
+
+
+def xui_client_id(client: dict) -> Optional[str]:
+    for k in ("id", "uuid", "clientId", "client_id"):
+        if isinstance(client.get(k), str):
+            return client.get(k)
+    return None
+
+
+def xui_client_expire(client: dict) -> Optional[int]:
+    expire_ms = client.get("expiryTime") or client.get("expire")
+    if isinstance(expire_ms, (int, float)):
+        # detect ms vs s
+        return int(expire_ms / 1000) if expire_ms > 10**10 else int(expire_ms)
+    return None
+
+
+def xui_client_data_limit(client: dict) -> Optional[int]:
+    data_limit = client.get("totalGB")
+    if isinstance(data_limit, str):
+        try:
+            data_limit = int(data_limit)
+        except Exception:
+            data_limit = None
+    # Map GB to bytes if small number
+    if isinstance(data_limit, (int, float)) and data_limit and data_limit < 10**9:
+        data_limit = int(data_limit) * (1024**3)
+    return data_limit if isinstance(data_limit, int) else None
+
+
+def inbound_remark(it: dict) -> Optional[str]:
+    remark = it.get("remark") or ":".join([str(it.get("protocol")) if it.get("protocol") else "", str(it.get("port")) if it.get("port") else ""]).strip(":")
+    return remark or None
+
+
+def marzban_inbound_objects(data: Any) -> list[dict]:
+    """Flatten Marzban /api/inbounds: a list, { items: [...] } or a dict of protocol -> [...]."""
+    normalized: list[dict] = []
+    if isinstance(data, list):
+        normalized = [x for x in data if isinstance(x, dict)]
+    elif isinstance(data, dict):
+        if isinstance(data.get("items"), list):
+            normalized = [x for x in data["items"] if isinstance(x, dict)]
+        else:
+            for v in data.values():
+                if isinstance(v, list):
+                    normalized.extend([x for x in v if isinstance(x, dict)])
+    return normalized
+
+
+def marzban_user_list(data: Any) -> list[dict]:
+    if isinstance(data, list):
+        src = data
+    elif isinstance(data, dict) and isinstance(data.get("items"), list):
+        src = data["items"]
+    elif isinstance(data, dict) and isinstance(data.get("users"), list):
+        src = data["users"]
+    else:
+        src = []
+    return [it for it in src if isinstance(it, dict)]
+
+
+class _AsyncByteReader:
+    """File-like `read(n)` over an async byte iterator, as ijson's async parser expects."""
+
+    def __init__(self, chunks: AsyncIterator[bytes]):
+        self._chunks = chunks.__aiter__()
+        self._buf = b""
+
+    async def read(self, n: int = -1) -> bytes:
+        while n < 0 or len(self._buf) < n:
+            try:
+                self._buf += await self._chunks.__anext__()
+            except StopAsyncIteration:
+                break
+        if n < 0:
+            out, self._buf = self._buf, b""
+        else:
+            out, self._buf = self._buf[:n], self._buf[n:]
+        return out
+
+
+async def iter_json_objects(chunks: AsyncIterator[bytes], prefixes: Iterable[str]) -> AsyncIterator[dict]:
+    """Yield each object found at one of the ijson `prefixes` (e.g. "users.item") while the body streams in.
+
+    Only the object being built is held in memory, so the size of the whole document does not matter.
+    """
+    wanted = set(prefixes)
+    builder: Optional[ObjectBuilder] = None
+    root = ""
+    depth = 0
+    async for prefix, event, value in ijson.parse_async(_AsyncByteReader(chunks), use_float=True):
+        if builder is None:
+            if event == "start_map" and prefix in wanted:
+                builder = ObjectBuilder()
+                root = prefix
+                depth = 0
+            else:
+                continue
+        builder.event(event, value)
+        if event in ("start_map", "start_array"):
+            depth += 1
+        elif event in ("end_map", "end_array"):
+            depth -= 1
+            if depth == 0 and prefix == root:
+                if isinstance(builder.value, dict):
+                    yield builder.value
+                builder = None
@@ -0,0 +1,649 @@
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Literal, Optional, Union
+
+import httpx
+
+from app.services.panel_auth import MarzbanTokenAuth, marzban_token
+from app.services.panel_discovery import panel_discovery
+from app.services.panel_http import panel_client
+from app.services.panel_adapters.base import (
+    CreatedPanelUser,
+    InboundInfo,
+    PanelAdapter,
+    PanelError,
+    PanelUser,
+    PanelUserDetail,
+    PlanLimits,
+    UserQuery,
+    bounded,
+)
+from app.services.panel_adapters.common import (
+    build_payload_variants,
+    canonicalize_subscription_url,
+    extract_subscription_url,
+    inbound_remark,
+    is_json,
+    iter_json_objects,
+    marzban_inbound_objects,
+    marzban_user_list,
+)
+
+
+class MarzbanAdapter(PanelAdapter):
+    type = "marzban"
+
+    def auth(self) -> httpx.Auth:
+        return MarzbanTokenAuth(self.base_url, self.username, self.password)
+
+    async def _token(self) -> str:
+        token = await marzban_token(self.base_url, self.username, self.password)
+        if not token:
+            raise PanelError("Login to panel failed")
+        return token
+
+    async def login(self) -> None:
+        await self._token()
+
+    async def _headers(self, json_body: bool = False) -> dict:
+        headers = {"Authorization": f"Bearer {await self._token()}"}
+        if json_body:
+            headers["Content-Type"] = "application/json"
+        return headers
+
+    async def _inbound_objects(self, client: httpx.AsyncClient, headers: dict) -> list[dict]:
+        res = await client.get(self.url("/api/inbounds"), headers=headers)
+        res.raise_for_status()
+        return marzban_inbound_objects(res.json())
+
+    @staticmethod
+    def _proxies_for(objects: list[dict], tags: set[str]) -> dict[str, list[str]]:
+        proto_to_tags: dict[str, list[str]] = {}
+        for it in objects:
+            tag = str(it.get("tag") or "").strip()
+            proto = str(it.get("protocol") or "").strip()
+            if tag and proto and tag in tags:
+                proto_to_tags.setdefault(proto, []).append(tag)
+        return proto_to_tags
+
+    async def list_inbounds(self) -> list[InboundInfo]:
+        headers = await self._headers()
+        async with panel_client(self.base_url, timeout=15.0, follow_redirects=True, auth=self.auth(), panel_id=self.panel.id, adapter=self.type) as client:
+            res = await client.get(self.url("/api/inbounds"), headers=headers)
+        if not is_json(res):
+            raise PanelError("Unexpected response")
+        data = res.json()
+        items: list[InboundInfo] = []
+        # Case 1: API returns a list of inbounds
+        if isinstance(data, list):
+            for it in data:
+                iid = str(it.get("tag") or it.get("id") or it.get("_id") or it.get("remark") or "")
+                items.append(InboundInfo(id=iid, tag=it.get("tag"), remark=inbound_remark(it), protocol=it.get("protocol")))
+        # Case 2: { items: [...] }
+        elif isinstance(data, dict) and isinstance(data.get("items"), list):
+            for it in data["items"]:
+                iid = str(it.get("tag") or it.get("id") or it.get("_id") or it.get("remark") or "")
+                items.append(InboundInfo(id=iid, tag=it.get("tag"), remark=inbound_remark(it), protocol=it.get("protocol")))
+        # Case 3: dict of arrays (e.g., { group1: [ {...}, ... ], group2: [...] })
+        elif isinstance(data, dict):
+            for key, value in data.items():
+                if isinstance(value, list):
+                    for it in value:
+                        if not isinstance(it, dict):
+                            continue
+                        iid = str(it.get("tag") or it.get("id") or it.get("_id") or it.get("remark") or key)
+                        items.append(InboundInfo(id=iid, tag=it.get("tag"), remark=inbound_remark(it), protocol=it.get("protocol") or key))
+        return items
+
+    async def list_hosts(self) -> list[str]:
+        headers = await self._headers()
+        async with self.client(timeout=15.0) as client:
+            res = await client.get(self.url("/api/hosts"), headers=headers)
+        if not is_json(res):
+            raise PanelError("Unexpected response")
+        data = res.json()
+        if isinstance(data, list):
+            return [str(h) for h in data]
+        if isinstance(data, dict):
+            for key in ("hosts", "items", "domains"):
+                if isinstance(data.get(key), list):
+                    return [str(h) for h in data[key]]
+        return []
+
+    def _to_user(self, it: dict) -> PanelUser:
+        return PanelUser(
+            username=str(it.get("username") or it.get("name") or ""),
+            status=it.get("status"),
+            data_limit=it.get("data_limit"),
+            expire=it.get("expire"),
+            subscription_url=canonicalize_subscription_url(self.base_url, it.get("subscription_url") or it.get("subscription") or None),
+        )
+
+    async def list_users(self) -> list[PanelUser]:
+        headers = await self._headers()
+        async with self.client() as client:
+            r = await client.get(self.url("/api/users"), headers=headers)
+        if not is_json(r):
+            raise PanelError("Unexpected response")
+        return [self._to_user(it) for it in marzban_user_list(r.json())]
+
+    async def query_users(self, query: UserQuery) -> tuple[list[PanelUser], Optional[int]]:
+        field, desc = query.sort_key()
+        params: dict = {}
+        if query.status:
+            params["status"] = query.status
+        if query.search:
+            params["search"] = query.search
+        if field and field != "status":
+            params["sort"] = ("-" if desc else "") + field
+        # Marzban searches by substring and cannot filter on expiry; page locally when those are asked for
+        local = bool(query.search) or query.expiring_before is not None or field == "status"
+        if not local:
+            params["offset"] = query.offset
+            if query.limit is not None:
+                params["limit"] = query.limit
+        headers = await self._headers()
+        async with self.client() as client:
+            r = await client.get(self.url("/api/users"), params=params, headers=headers)
+        if not is_json(r):
+            raise PanelError("Unexpected response")
+        data = r.json()
+        users = [self._to_user(it) for it in marzban_user_list(data)]
+        total = data.get("total") if isinstance(data, dict) else None
+        if local:
+            return query.apply(users)
+        if isinstance(total, int):
+            return users, total
+        # Builds without a total may ignore paging; only re-page what is clearly unpaged
+        if query.limit is not None and len(users) > query.limit:
+            return query.apply(users)
+        return users, None
+
+    async def iter_users(self, page_size: int = 500) -> AsyncIterator[list[PanelUser]]:
+        headers = await self._headers()
+        offset = 0
+        async with self.client() as client:
+            while True:
+                r = await client.get(self.url("/api/users"), params={"offset": offset, "limit": page_size}, headers=headers)
+                if not is_json(r):
+                    raise PanelError("Unexpected response")
+                data = r.json()
+                page = [self._to_user(it) for it in marzban_user_list(data)]
+                yield page
+                total = data.get("total") if isinstance(data, dict) else None
+                offset += len(page)
+                # Older builds ignore offset/limit and answer everything at once
+                if len(page) < page_size or len(page) > page_size or (isinstance(total, int) and offset >= total):
+                    return
+
+    async def stream_users(self) -> AsyncIterator[PanelUser]:
+        headers = await self._headers()
+        async with self.client() as client:
+            async with client.stream("GET", self.url("/api/users"), headers=headers) as r:
+                if not is_json(r):
+                    raise PanelError("Unexpected response")
+                async for it in iter_json_objects(r.aiter_bytes(), ("item", "items.item", "users.item")):
+                    yield self._to_user(it)
+
+    async def get_user(self, username: str) -> PanelUserDetail:
+        headers = await self._headers()
+        data_limit: Optional[int] = None
+        expire_ts: Optional[int] = None
+        status: Optional[str] = None
+        used: Optional[int] = None
+        subscription_url: Optional[str] = None
+        missing = False
+        async with self.client(timeout=15.0) as client:
+            # Fetch user core info
+            try:
+                ures = await client.get(self.url(f"/api/user/{username}"), headers=headers)
+                missing = ures.status_code == 404
+                if is_json(ures):
+                    u = ures.json()
+                    if isinstance(u, dict):
+                        if isinstance(u.get("data_limit"), int):
+                            data_limit = int(u.get("data_limit"))
+                        if isinstance(u.get("expire"), int):
+                            expire_ts = int(u.get("expire"))
+                        if isinstance(u.get("status"), str):
+                            status = u.get("status")
+                        # Prefer exact subscription_url if provided
+                        if isinstance(u.get("subscription_url"), str):
+                            subscription_url = u.get("subscription_url")
+                        elif isinstance(u.get("subscription"), str):
+                            subscription_url = u.get("subscription")
+                        for key in ("used_traffic", "lifetime_used_traffic"):
+                            if used is None and isinstance(u.get(key), int):
+                                used = int(u.get(key))
+            except Exception:
+                pass
+            if missing:
+                raise PanelError("User not found on Marzban", status_code=404)
+            # Fetch usage if not embedded
+            if used is None:
+                try:
+                    r = await client.get(self.url(f"/api/user/{username}/usage"), headers=headers)
+                    if is_json(r):
+                        j = r.json()
+                        if isinstance(j, dict):
+                            if isinstance(j.get("total"), int):
+                                used = int(j.get("total"))
+                            elif isinstance(j.get("download"), int) or isinstance(j.get("upload"), int):
+                                used = int(j.get("download") or 0) + int(j.get("upload") or 0)
+                except Exception:
+                    pass
+
+        remaining: Optional[int] = None
+        if data_limit is not None and data_limit > 0 and used is not None:
+            remaining = max(0, data_limit - used)
+        expires_in: Optional[int] = None
+        if expire_ts is not None and expire_ts > 0:
+            now = int(datetime.now(tz=timezone.utc).timestamp())
+            expires_in = max(0, expire_ts - now)
+        return PanelUserDetail(
+            username=username,
+            data_limit=data_limit,
+            used=used,
+            remaining=remaining,
+            expire=expire_ts,
+            expires_in=expires_in,
+            status=status,
+            subscription_url=canonicalize_subscription_url(self.base_url, subscription_url),
+        )
+
+    @staticmethod
+    def _expiry(limits: PlanLimits) -> tuple[Optional[datetime], Optional[int]]:
+        if limits.duration_days is None:
+            return None, None
+        expire_at = datetime.now(tz=timezone.utc) + timedelta(days=limits.duration_days)
+        return expire_at, int(expire_at.timestamp())
+
+    async def _proxies(self, client: httpx.AsyncClient, headers: dict, inbounds: list[str]) -> dict[str, list[str]]:
+        # Fetch panel inbounds to determine protocol for selected tags
+        try:
+            objects = await self._inbound_objects(client, headers)
+        except Exception as e:
+            raise PanelError(f"Failed to fetch inbounds: {e}")
+        return self._proxies_for(objects, set(inbounds))
+
+    async def _create(
+        self,
+        client: httpx.AsyncClient,
+        headers: dict,
+        username: str,
+        limits: PlanLimits,
+        proto_to_tags: dict[str, list[str]],
+    ) -> CreatedPanelUser:
+        bytes_limit = limits.data_limit_bytes
+        expire_at, expire_ts = self._expiry(limits)
+        body = {
+            "username": username,
+            "status": "active",
+            "data_limit": bytes_limit,
+            "data_limit_reset_strategy": "no_reset",
+            "proxies": {proto: {} for proto in proto_to_tags.keys()},
+            "inbounds": proto_to_tags,
+        }
+        if expire_ts is not None:
+            body["expire"] = expire_ts
+
+        url = self.url("/api/user")
+        try:
+            res = await client.post(url, json=body, headers=headers)
+        except Exception as e:
+            raise PanelError(str(e))
+
+        if is_json(res):
+            try:
+                data = res.json()
+            except Exception:
+                data = {}
+        else:
+            try:
+                raw_bytes = await res.aread()
+                raw_text = raw_bytes.decode("utf-8", errors="replace")
+            except Exception:
+                raw_text = ""
+            data = {"raw_text": raw_text}
+
+        if 200 <= res.status_code < 300:
+            sub_url = extract_subscription_url(self.base_url, data)
+            if not sub_url:
+                try:
+                    info = await client.get(self.url(f"/api/user/{username}"), headers=headers)
+                    if is_json(info):
+                        udata = info.json()
+                        # Prefer exact field
+                        if isinstance(udata, dict) and isinstance(udata.get("subscription_url"), str):
+                            sub_url = udata.get("subscription_url")
+                        elif isinstance(udata, dict) and isinstance(udata.get("subscription"), str):
+                            sub_url = udata.get("subscription")
+                except Exception:
+                    pass
+            return CreatedPanelUser(
+                username=username,
+                subscription_url=canonicalize_subscription_url(self.base_url, sub_url),
+                expire=expire_ts,
+                data_limit=bytes_limit or None,
+                raw=data if isinstance(data, dict) else None,
+            )
+
+        # Try alternative payload variants if initial failed (e.g., schema differences)
+        for body2 in build_payload_variants(username=username, bytes_limit=bytes_limit, expire_at=expire_at):
+            try:
+                res2 = await client.post(url, json=body2, headers=headers)
+            except Exception:
+                continue
+            if 200 <= res2.status_code < 300:
+                data2 = res2.json() if is_json(res2) else {}
+                return CreatedPanelUser(
+                    username=username,
+                    subscription_url=canonicalize_subscription_url(self.base_url, extract_subscription_url(self.base_url, data2)),
+                    expire=expire_ts,
+                    data_limit=bytes_limit or None,
+                    raw=data2 if isinstance(data2, dict) else None,
+                )
+        raise PanelError(f"Panel responded {res.status_code}", raw=(data if isinstance(data, dict) else {}))
+
+    async def create_user(self, username: str, limits: PlanLimits, inbounds: list[str]) -> CreatedPanelUser:
+        headers = await self._headers(json_body=True)
+        async with self.client() as client:
+            proto_to_tags = await self._proxies(client, headers, inbounds)
+            return await self._create(client, headers, username, limits, proto_to_tags)
+
+    async def create_users(
+        self, usernames: list[str], limits: PlanLimits, inbounds: list[str], concurrency: int = 8
+    ) -> list[Union[CreatedPanelUser, PanelError]]:
+        # One token, one pooled client and one inbound lookup for the whole batch
+        headers = await self._headers(json_body=True)
+        async with self.client() as client:
+            proto_to_tags = await self._proxies(client, headers, inbounds)
+            return await bounded(usernames, lambda name: self._create(client, headers, name, limits, proto_to_tags), concurrency)
+
+    async def _current(self, client: httpx.AsyncClient, username: str, headers: dict) -> dict:
+        try:
+            u = await client.get(self.url(f"/api/user/{username}"), headers=headers)
+            if is_json(u):
+                data = u.json()
+                if isinstance(data, dict):
+                    return data
+        except Exception:
+            pass
+        return {}
+
+    async def _try_matrix(
+        self,
+        client: httpx.AsyncClient,
+        kind: str,
+        headers: dict,
+        attempts: list[tuple[str, str, dict]],
+        confirm=None,
+        failure: str = "Panel request failed",
+    ) -> dict:
+        """Walk header x (method, url, body) until one is accepted; the winner is remembered per panel.
+
+        Returns the headers that worked, or raises PanelError with the last panel answer.
+        """
+        token = headers["Authorization"].split(" ", 1)[1]
+        # Try with two header styles: Bearer and Token
+        header_variants = [headers, {**headers, "Authorization": f"Token {token}"}]
+        matrix = [(h, a, hdrs, attempt) for h, hdrs in enumerate(header_variants) for a, attempt in enumerate(attempts)]
+        last_status: Optional[int] = None
+        last_text: Optional[str] = None
+        for h_idx, a_idx, hdrs, (method, target, body_try) in panel_discovery.ordered(self.panel, kind, matrix, key=lambda m: f"{m[0]}:{m[1]}"):
+            try:
+                res = await client.request(method, target, json=body_try, headers=hdrs)
+            except Exception as e:
+                last_status = 0
+                last_text = str(e)
+                continue
+            if 200 <= res.status_code < 300:
+                if confirm is None or await confirm():
+                    panel_discovery.remember(self.panel, kind, f"{h_idx}:{a_idx}")
+                    return hdrs
+                # If not confirmed, continue trying other variants
+            last_status = res.status_code
+            last_text = res.text[:200]
+        if not last_status or 200 <= last_status < 300:
+            # Unreachable, or accepted but never confirmed
+            last_status = 502
+        raise PanelError(last_text or failure, status_code=last_status)
+
+    async def _set_status(self, client: httpx.AsyncClient, headers: dict, username: str, status: Literal["active", "disabled"]) -> None:
+        url = self.url(f"/api/user/{username}")
+        # Fetch current user to preserve existing fields (but do NOT change expire)
+        now_ts = int(datetime.now(tz=timezone.utc).timestamp())
+        current_body = await self._current(client, username, headers)
+
+        # Canonical PATCH body (avoid touching expire; only toggle status)
+        body_base: dict = {
+            "status": status,
+            "data_limit": current_body.get("data_limit", 0),
+            "data_limit_reset_strategy": "no_reset",
+            "inbounds": current_body.get("inbounds") or {},
+            "proxies": current_body.get("proxies") or {},
+            "next_plan": {
+                "add_remaining_traffic": False,
+                "data_limit": 0,
+                "expire": 0,
+                "fire_on_either": True,
+            },
+            "note": current_body.get("note", ""),
+            "on_hold_expire_duration": 0,
+            "on_hold_timeout": current_body.get("on_hold_timeout", None),
+        }
+
+        # Helper to (re)fetch status and confirm
+        async def _confirm_status() -> bool:
+            j = await self._current(client, username, headers)
+            st = j.get("status")
+            expv = j.get("expire")
+            if status == "disabled":
+                return (st == "disabled") or (isinstance(expv, int) and expv == 0)
+            return (st == "active") or (isinstance(expv, int) and (expv or 0) > now_ts)
+
+        # Try multiple API patterns sequentially
+        attempts: list[tuple[str, str, dict]] = []
+        admin_url = self.url(f"/api/admin/user/{username}")
+        url_slash = url + "/"
+        # 1) PATCH with canonical body (status)
+        for target in (url, url_slash, admin_url):
+            attempts.append(("PATCH", target, body_base))
+        # 2) PATCH with enabled boolean
+        body_enabled = {**body_base, "enabled": status == "active"}
+        for target in (url, url_slash, admin_url):
+            attempts.append(("PATCH", target, body_enabled))
+        # 3) PATCH with active boolean
+        body_active = {**body_base, "active": status == "active"}
+        for target in (url, url_slash, admin_url):
+            attempts.append(("PATCH", target, body_active))
+        # 4) PUT variants (also without expire)
+        for target in (url, url_slash, admin_url):
+            attempts.append(("PUT", target, body_base))
+        # 5) Status endpoints
+        attempts.append(("POST", self.url(f"/api/user/{username}/status"), {"status": status}))
+        attempts.append(("PATCH", self.url(f"/api/user/{username}/status"), {"status": status}))
+        attempts.append(("POST", self.url(f"/api/admin/user/{username}/status"), {"status": status}))
+        # 6) Action endpoints enable/disable
+        if status == "disabled":
+            actions = (
+                f"/api/user/{username}/disable",
+                f"/api/user/{username}/deactivate",
+                f"/api/admin/user/{username}/disable",
+                f"/api/admin/user/{username}/deactivate",
+                f"/api/user/{username}/status/disabled",
+                f"/api/admin/user/{username}/status/disabled",
+            )
+        else:
+            actions = (
+                f"/api/user/{username}/enable",
+                f"/api/user/{username}/activate",
+                f"/api/admin/user/{username}/enable",
+                f"/api/admin/user/{username}/activate",
+            )
+        for path in actions:
+            attempts.append(("POST", self.url(path), {}))
+        # Last-resort: only if disabling and everything else fails, try forcing expire=0 once
+        if status == "disabled":
+            attempts.append(("PATCH", url, {**body_base, "expire": 0}))
+
+        await self._try_matrix(client, f"marzban_status_{status}", headers, attempts, confirm=_confirm_status, failure="Panel status change failed")
+
+    async def set_status(self, username: str, status: Literal["active", "disabled"]) -> None:
+        headers = await self._headers(json_body=True)
+        async with self.client() as client:
+            await self._set_status(client, headers, username, status)
+
+    async def set_status_many(
+        self, usernames: list[str], status: Literal["active", "disabled"], concurrency: int = 8
+    ) -> list[Optional[PanelError]]:
+        headers = await self._headers(json_body=True)
+        async with self.client() as client:
+            results = await bounded(usernames, lambda name: self._set_status(client, headers, name, status), concurrency)
+        return [r if isinstance(r, PanelError) else None for r in results]
+
+    async def _replacement_inbounds(self, client: httpx.AsyncClient, headers: dict, inbounds: Optional[list[str]]) -> Optional[dict[str, list[str]]]:
+        if inbounds is None:
+            return None
+        try:
+            return self._proxies_for(await self._inbound_objects(client, headers), set(inbounds))
+        except Exception:
+            return None
+
+    async def _extend(
+        self,
+        client: httpx.AsyncClient,
+        headers: dict,
+        username: str,
+        limits: PlanLimits,
+        inbounds_obj: Optional[dict[str, list[str]]],
+    ) -> None:
+        # Compute target expire RESET (always based on plan, from now)
+        target_expire_ts: Optional[int] = None
+        if limits.duration_days is not None:
+            target_expire_ts = int(datetime.now(tz=timezone.utc).timestamp()) + limits.duration_days * 86400
+
+        # Fetch current user to preserve fields and possibly inbounds/proxies
+        current_body = await self._current(client, username, headers)
+        proxies_obj = {proto: {} for proto in inbounds_obj.keys()} if inbounds_obj is not None else None
+
+        body_base: dict = {
+            "username": username,
+            # Data limit RESET based on plan (0 for unlimited)
+            "data_limit": limits.data_limit_bytes,
+            "data_limit_reset_strategy": "no_reset",
+            "status": current_body.get("status", "active"),
+            "next_plan": {
+                "add_remaining_traffic": False,
+                "data_limit": 0,
+                "expire": 0,
+                "fire_on_either": True,
+            },
+            "note": current_body.get("note", ""),
+            "on_hold_expire_duration": 0,
+            "on_hold_timeout": current_body.get("on_hold_timeout", None),
+        }
+        if target_expire_ts is not None:
+            body_base["expire"] = target_expire_ts
+        if proxies_obj is not None and inbounds_obj is not None:
+            body_base["proxies"] = proxies_obj
+            body_base["inbounds"] = inbounds_obj
+        else:
+            body_base["proxies"] = current_body.get("proxies") or {}
+            body_base["inbounds"] = current_body.get("inbounds") or {}
+
+        # Build variant bodies to handle API differences
+        variant_bodies: list[dict] = [body_base, {**body_base, "status": "active"}]
+        # Variant: use days fields for expire if limited
+        if target_expire_ts is not None:
+            body_expire_days = {k: v for k, v in body_base.items() if k != "expire"}
+            for k in ("expire_in_days", "expire_days", "duration_days"):
+                body_expire_days[k] = limits.duration_days
+            variant_bodies.append(body_expire_days)
+        # Variant: data_limit synonyms
+        dl = body_base.get("data_limit", 0)
+        variant_bodies.append({**body_base, "limit": dl, "quota": dl})
+
+        user_url = self.url(f"/api/user/{username}")
+        attempts: list[tuple[str, str, dict]] = []
+        for vb in variant_bodies:
+            attempts.append(("PATCH", user_url, vb))
+            attempts.append(("PATCH", user_url + "/", vb))
+            attempts.append(("PATCH", self.url(f"/api/admin/user/{username}"), vb))
+            attempts.append(("PUT", user_url, vb))
+            attempts.append(("PUT", self.url(f"/api/admin/user/{username}"), vb))
+            # Some panels update via POST /api/user as upsert
+            attempts.append(("POST", self.url("/api/user"), vb))
+
+        # Variant count depends on whether the plan has a duration, so learn them separately
+        kind = "marzban_extend_limited" if target_expire_ts is not None else "marzban_extend_unlimited"
+        hdrs = await self._try_matrix(client, kind, headers, attempts, failure="Panel extend failed")
+
+        # best-effort reset traffic counters via common endpoints (stop at the first that works)
+        for suffix in panel_discovery.ordered(self.panel, "marzban_reset", ("/reset", "/reset_traffic", "/reset-traffic")):
+            try:
+                rr = await client.post(user_url + suffix, headers=hdrs)
+            except Exception:
+                continue
+            if 200 <= rr.status_code < 300:
+                panel_discovery.remember(self.panel, "marzban_reset", suffix)
+                break
+
+    async def extend(self, username: str, limits: PlanLimits, inbounds: Optional[list[str]] = None) -> None:
+        headers = await self._headers(json_body=True)
+        async with self.client() as client:
+            inbounds_obj = await self._replacement_inbounds(client, headers, inbounds)
+            await self._extend(client, headers, username, limits, inbounds_obj)
+
+    async def extend_many(
+        self, usernames: list[str], limits: PlanLimits, inbounds: Optional[list[str]] = None, concurrency: int = 8
+    ) -> list[Optional[PanelError]]:
+        headers = await self._headers(json_body=True)
+        async with self.client() as client:
+            inbounds_obj = await self._replacement_inbounds(client, headers, inbounds)
+            results = await bounded(usernames, lambda name: self._extend(client, headers, name, limits, inbounds_obj), concurrency)
+        return [r if isinstance(r, PanelError) else None for r in results]
+
+    async def delete_user(self, username: str) -> int:
+        headers = await self._headers()
+        async with self.client(timeout=15.0) as client:
+            try:
+                res = await client.delete(self.url(f"/api/user/{username}"), headers=headers)
+            except Exception as e:
+                raise PanelError(str(e))
+        if 200 <= res.status_code < 300:
+            return res.status_code
+        raise PanelError(res.text[:200], status_code=res.status_code)
+
+    @classmethod
+    async def probe(cls, base_url: str, username: str, password: str) -> tuple[bool, Optional[str], Optional[int], Optional[str]]:
+        # Use official Marzban endpoint first
+        async with panel_client(base_url, timeout=10.0, follow_redirects=True, adapter=cls.type) as client:  # allow redirects
+            url = base_url.rstrip("/") + "/api/admin/token"
+            last_error = None
+            for method in ("form", "json"):
+                try:
+                    if method == "form":
+                        res = await client.post(url, data={"username": username, "password": password})
+                    else:
+                        res = await client.post(url, json={"username": username, "password": password})
+                except Exception as e:
+                    last_error = str(e)
+                    continue
+                if is_json(res):
+                    try:
+                        data = res.json()
+                    except Exception:
+                        data = {}
+                    token = data.get("access_token") or data.get("token")
+                    if token:
+                        return True, "/api/admin/token", res.status_code, token[:12] + "..."
+                    if res.status_code in (401, 403):
+                        return False, "/api/admin/token", res.status_code, "Unauthorized"
+            # fallback: reachability
+            try:
+                res = await client.get(base_url.rstrip("/") + "/docs")
+                if res.status_code == 200:
+                    return False, "/docs", 200, "Reachable, but login failed"
+            except Exception as e:
+                last_error = str(e)
+        return False, None, None, last_error
@@ -0,0 +1,542 @@
+import json
+import logging
+import secrets
+import string
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Literal, Optional, Union
+
+import httpx
+
+from app.services.panel_auth import XUI_LOGIN_PATHS, XuiCookieAuth, xui_cookies
+from app.services.panel_discovery import panel_discovery
+from app.services.panel_http import panel_client
+from app.services.panel_adapters.base import (
+    CreatedPanelUser,
+    InboundInfo,
+    PanelAdapter,
+    PanelError,
+    PanelUser,
+    PanelUserDetail,
+    PlanLimits,
+)
+from app.services.panel_adapters.common import (
+    inbound_remark,
+    is_json,
+    iter_json_objects,
+    join_url,
+    xui_build_share_link,
+    xui_client_data_limit,
+    xui_client_email,
+    xui_client_expire,
+    xui_client_id,
+    xui_inbound_clients,
+    xui_inbound_list,
+)
+
+logger = logging.getLogger("app")
+
+# Inbound listing endpoints seen across XUI forks; the short list is what most builds expose
+XUI_INBOUND_ENDPOINTS = (
+    "/xui/api/inbounds/list",
+    "/xui/api/inbounds",
+    "/xui/API/inbounds",
+    "/xui/inbound/list",
+    "/xui/inbounds/list",
+    "/panel/api/inbounds/list",
+    "/panel/inbounds/list",
+    "/panel/inbounds",
+    "/api/inbounds",
+)
+XUI_INBOUND_ENDPOINTS_COMMON = ("/xui/api/inbounds", "/xui/api/inbounds/list", "/xui/API/inbounds", "/panel/api/inbounds/list", "/panel/inbounds")
+
+_JSON = {"Accept": "application/json"}
+
+# Where inbound objects sit in the listing, mirroring common.xui_inbound_list, as ijson prefixes
+_INBOUND_PREFIXES = tuple(f"{k}.item" for k in ("obj", "inbounds", "items", "data", "list")) + tuple(
+    f"data.{k}.item" for k in ("items", "inbounds", "list", "obj")
+) + ("item",)
+
+
+def _rand_subid(n: int = 12) -> str:
+    alphabet = string.ascii_lowercase + string.digits
+    return "".join(secrets.choice(alphabet) for _ in range(n))
+
+
+def _accepted(res: httpx.Response) -> bool:
+    """2xx, and not an XUI envelope saying `success: false`."""
+    if not 200 <= res.status_code < 300:
+        return False
+    if is_json(res):
+        try:
+            j = res.json()
+        except Exception:
+            return True
+        if isinstance(j, dict) and j.get("success") is False:
+            return False
+    return True
+
+
+def _inbound_key(it: dict) -> str:
+    return str(it.get("id") or it.get("tag") or it.get("remark") or "")
+
+
+class XuiAdapter(PanelAdapter):
+    type = "xui"
+    follow_redirects = True
+
+    def _login_opts(self) -> dict:
+        return {
+            "login_paths": panel_discovery.ordered(self.panel, "xui_login", XUI_LOGIN_PATHS),
+            "on_login": lambda path: panel_discovery.remember(self.panel, "xui_login", path),
+        }
+
+    def auth(self) -> httpx.Auth:
+        return XuiCookieAuth(self.base_url, self.username, self.password, **self._login_opts())
+
+    async def login(self) -> None:
+        if not await xui_cookies(self.base_url, self.username, self.password, **self._login_opts()):
+            raise PanelError("Login to XUI failed")
+
+    async def _fetch_inbounds(self, client: httpx.AsyncClient, endpoints: tuple = XUI_INBOUND_ENDPOINTS_COMMON) -> Any:
+        # Learned endpoint first; the remaining ones are only probed if it stops answering JSON
+        for ep in panel_discovery.ordered(self.panel, "xui_inbounds", endpoints):
+            try:
+                res = await client.get(self.url(ep), headers=_JSON)
+                if is_json(res):
+                    data = res.json()
+                    panel_discovery.remember(self.panel, "xui_inbounds", ep)
+                    return data
+            except Exception:
+                continue
+        return None
+
+    async def _inbounds(self, client: httpx.AsyncClient) -> list[dict]:
+        return xui_inbound_list(await self._fetch_inbounds(client))
+
+    async def _find(self, client: httpx.AsyncClient, username: str) -> tuple[Optional[dict], Optional[dict]]:
+        for inbound in await self._inbounds(client):
+            for c in xui_inbound_clients(inbound):
+                if xui_client_email(c) == username:
+                    return inbound, c
+        return None, None
+
+    @staticmethod
+    def _to_user(c: dict) -> PanelUser:
+        enabled = c.get("enable")
+        return PanelUser(
+            username=xui_client_email(c),
+            status=("active" if enabled else "disabled") if isinstance(enabled, bool) else None,
+            data_limit=xui_client_data_limit(c),
+            expire=xui_client_expire(c),
+            subscription_url=None,
+        )
+
+    async def list_inbounds(self) -> list[InboundInfo]:
+        await self.login()
+        async with self.client(timeout=15.0) as client:
+            # fetch inbounds via all known XUI endpoints
+            data = await self._fetch_inbounds(client, XUI_INBOUND_ENDPOINTS)
+        items: list[InboundInfo] = []
+        for it in xui_inbound_list(data):
+            iid = str(it.get("id") or it.get("tag") or it.get("remark") or it.get("listen") or "")
+            tag = it.get("tag")
+            items.append(InboundInfo(id=iid, tag=str(tag) if tag else None, remark=inbound_remark(it), protocol=it.get("protocol")))
+        return items
+
+    async def list_users(self) -> list[PanelUser]:
+        await self.login()
+        async with self.client() as client:
+            inbounds = await self._inbounds(client)
+        return [self._to_user(c) for inbound in inbounds for c in xui_inbound_clients(inbound)]
+
+    async def stream_users(self) -> AsyncIterator[PanelUser]:
+        await self.login()
+        async with self.client() as client:
+            res: Optional[httpx.Response] = None
+            for ep in panel_discovery.ordered(self.panel, "xui_inbounds", XUI_INBOUND_ENDPOINTS_COMMON):
+                try:
+                    res = await client.send(client.build_request("GET", self.url(ep), headers=_JSON), stream=True)
+                except Exception:
+                    continue
+                if is_json(res):
+                    panel_discovery.remember(self.panel, "xui_inbounds", ep)
+                    break
+                await res.aclose()
+                res = None
+            if res is None:
+                raise PanelError("Unexpected response")
+            try:
+                # One inbound (with its clients) in memory at a time
+                async for inbound in iter_json_objects(res.aiter_bytes(), _INBOUND_PREFIXES):
+                    for c in xui_inbound_clients(inbound):
+                        yield self._to_user(c)
+            finally:
+                await res.aclose()
+
+    async def get_user(self, username: str) -> PanelUserDetail:
+        await self.login()
+        async with self.client(timeout=15.0) as client:
+            inbound, found = await self._find(client, username)
+        if not found:
+            raise PanelError("User not found on XUI", status_code=404)
+        # build share link if possible (trojan clients carry a password instead of an id)
+        ident = xui_client_id(found) or (found.get("password") if isinstance(found.get("password"), str) else None)
+        base = self._to_user(found)
+        return PanelUserDetail(
+            **base.model_dump(exclude={"username", "subscription_url"}),
+            username=username,
+            subscription_url=xui_build_share_link(self.base_url, inbound or {}, username, ident),
+        )
+
+    async def _add(
+        self, client: httpx.AsyncClient, username: str, limits: PlanLimits, inbound_id: str, confirm: bool = True
+    ) -> CreatedPanelUser:
+        """Add one client to `inbound_id`.
+
+        With `confirm` the inbound is re-fetched to check the client exists and to build its share link;
+        without it an accepted response is enough and the caller confirms (see create_users).
+        """
+        try:
+            inbound_id_int: Optional[int] = int(inbound_id)
+        except Exception:
+            inbound_id_int = None
+
+        client_id = str(uuid.uuid4())
+        # expiryTime in ms (0 for unlimited)
+        if limits.duration_days is None:
+            expiry_ms = 0
+        else:
+            expiry_ms = int((datetime.now(tz=timezone.utc) + timedelta(days=limits.duration_days)).timestamp() * 1000)
+        # traffic (0 unlimited). Try both GB and bytes variants
+        if limits.data_limit_mb is None:
+            total_gb_val = 0
+            total_bytes_val = 0
+        else:
+            total_gb_val = max(1, int(round(limits.data_limit_mb / 1024)))
+            total_bytes_val = limits.data_limit_bytes
+
+        base_client = {
+            "enable": True,
+            "email": username,
+            "limitIp": 0,
+            "flow": "",
+            "id": client_id,
+            "subId": _rand_subid(12),
+        }
+
+        attempts: list[tuple[str, dict, str]] = []
+        # JSON API variants
+        if inbound_id_int is not None:
+            # Common lowercase API paths
+            attempts.append(("/xui/api/inbounds/addClient", {"id": inbound_id_int, "client": {**base_client, "expiryTime": expiry_ms, "totalGB": total_gb_val}}, "json"))
+            attempts.append(("/xui/api/inbounds/addClient", {"id": inbound_id_int, "client": {**base_client, "expiryTime": expiry_ms, "totalGB": total_bytes_val}}, "json"))
+            attempts.append(("/xui/api/inbounds/addClient", {"id": inbound_id_int, "settings": {"clients": [{**base_client, "expiryTime": expiry_ms, "totalGB": total_gb_val}]}}, "json"))
+            attempts.append(("/xui/api/inbounds/addClient", {"id": inbound_id_int, "settings": {"clients": [{**base_client, "expiryTime": expiry_ms, "totalGB": total_bytes_val}]}}, "json"))
+            attempts.append(("/panel/api/inbounds/addClient", {"id": inbound_id_int, "client": {**base_client, "expiryTime": expiry_ms, "totalGB": total_gb_val}}, "json"))
+            # Uppercase API variants used by some forks
+            attempts.append(("/xui/API/inbounds/addClient", {"id": inbound_id_int, "client": {**base_client, "expiryTime": expiry_ms, "totalGB": total_gb_val}}, "json"))
+            attempts.append(("/xui/API/inbounds/addClient", {"id": inbound_id_int, "settings": {"clients": [{**base_client, "expiryTime": expiry_ms, "totalGB": total_gb_val}]}}, "json"))
+            attempts.append(("/panel/API/inbounds/addClient", {"id": inbound_id_int, "client": {**base_client, "expiryTime": expiry_ms, "totalGB": total_gb_val}}, "json"))
+        # Form variants
+        form_base = {"email": username, "enable": "true", "limitIp": "0", "flow": "", "id": client_id}
+        attempts.append(("/xui/inbound/addClient", {**form_base, "id": inbound_id, "expiryTime": str(expiry_ms), "totalGB": str(total_gb_val)}, "form"))
+        attempts.append(("/xui/inbound/addClient", {**form_base, "id": inbound_id, "expiryTime": str(expiry_ms), "totalGB": str(total_bytes_val)}, "form"))
+        attempts.append(("/panel/inbound/addClient", {**form_base, "id": inbound_id, "expiryTime": str(expiry_ms), "totalGB": str(total_gb_val)}, "form"))
+        # Form variant with 'settings' JSON string as required by some XUI builds
+        settings_str_gb = json.dumps({"clients": [{**base_client, "expiryTime": expiry_ms, "totalGB": total_gb_val}]})
+        settings_str_bytes = json.dumps({"clients": [{**base_client, "expiryTime": expiry_ms, "totalGB": total_bytes_val}]})
+        attempts.append(("/xui/api/inbounds/addClient", {"id": inbound_id, "settings": settings_str_gb}, "form"))
+        attempts.append(("/xui/api/inbounds/addClient", {"id": inbound_id, "settings": settings_str_bytes}, "form"))
+        # Some forks expose direct addClient without api segment
+        attempts.append(("/xui/addClient", {"id": inbound_id, "settings": settings_str_gb}, "form"))
+        attempts.append(("/panel/addClient", {"id": inbound_id, "settings": settings_str_gb}, "form"))
+
+        last_status = None
+        last_text = None
+        # Variant that created a client last time is tried first
+        add_kind = "xui_add_client_id" if inbound_id_int is not None else "xui_add_client"
+        for attempt_idx, (path, body, mode) in panel_discovery.ordered(self.panel, add_kind, list(enumerate(attempts)), key=lambda a: a[0]):
+            url = join_url(self.base_url, path)
+            try:
+                if mode == "json":
+                    res = await client.post(url, json=body, headers=_JSON)
+                else:
+                    res = await client.post(url, data=body, headers=_JSON)
+            except Exception as e:
+                last_status = 0
+                last_text = str(e)
+                logger.error("xui_add_client req_error panel_id=%s url=%s err=%s", self.panel.id, url, last_text)
+                continue
+            if not confirm and _accepted(res):
+                panel_discovery.remember(self.panel, add_kind, attempt_idx)
+                return CreatedPanelUser(
+                    username=username,
+                    subscription_url=None,
+                    expire=(expiry_ms // 1000) if expiry_ms else None,
+                    data_limit=(total_bytes_val if total_bytes_val else None),
+                    raw=(res.json() if is_json(res) else None),
+                )
+            if confirm and 200 <= res.status_code < 300:
+                # Try to confirm creation by re-fetching inbounds and locating the new client
+                sub_url = None
+                created_confirmed = False
+                try:
+                    inb = next((it for it in await self._inbounds(client) if _inbound_key(it) == str(inbound_id) or str(it.get("tag") or "") == str(inbound_id)), None)
+                    if inb:
+                        ident = None
+                        for c in xui_inbound_clients(inb):
+                            if xui_client_email(c) == username:
+                                created_confirmed = True
+                                ident = xui_client_id(c) or (c.get("password") if isinstance(c.get("password"), str) else None)
+                                break
+                        sub_url = xui_build_share_link(self.base_url, inb, username, ident)
+                except Exception:
+                    created_confirmed = False
+
+                # If confirmation failed, also accept explicit success flags from response JSON
+                if not created_confirmed:
+                    try:
+                        j = res.json()
+                        if isinstance(j, dict) and (j.get("success") is True or j.get("status") in ("ok", "success", 200)):
+                            created_confirmed = True
+                    except Exception:
+                        pass
+
+                if created_confirmed:
+                    panel_discovery.remember(self.panel, add_kind, attempt_idx)
+                    return CreatedPanelUser(
+                        username=username,
+                        subscription_url=sub_url,
+                        expire=(expiry_ms // 1000) if expiry_ms else None,
+                        data_limit=(total_bytes_val if total_bytes_val else None),
+                        raw=(res.json() if is_json(res) else None),
+                    )
+                # else: try next variant
+            last_status = res.status_code
+            last_text = res.text[:200]
+            logger.warning("xui_add_client resp_non2xx panel_id=%s url=%s status=%s body=%s", self.panel.id, url, last_status, last_text)
+        raise PanelError(f"XUI responded {last_status}", raw={"error": last_text or "unknown"})
+
+    async def create_user(self, username: str, limits: PlanLimits, inbounds: list[str]) -> CreatedPanelUser:
+        if not inbounds:
+            raise PanelError("No inbound selected for this panel", status_code=400)
+        await self.login()
+        async with self.client() as client:
+            return await self._add(client, username, limits, inbounds[0])
+
+    async def create_users(
+        self, usernames: list[str], limits: PlanLimits, inbounds: list[str], concurrency: int = 8
+    ) -> list[Union[CreatedPanelUser, PanelError]]:
+        # XUI rewrites the whole inbound settings blob on every addClient, so concurrent adds
+        # to one inbound lose each other; add one at a time over one session and confirm all
+        # of them with a single re-fetch at the end.
+        if not inbounds:
+            raise PanelError("No inbound selected for this panel", status_code=400)
+        inbound_id = inbounds[0]
+        await self.login()
+        results: list[Union[CreatedPanelUser, PanelError]] = []
+        async with self.client() as client:
+            for name in usernames:
+                try:
+                    results.append(await self._add(client, name, limits, inbound_id, confirm=False))
+                except PanelError as e:
+                    results.append(e)
+                except Exception as e:
+                    results.append(PanelError(str(e)))
+            if not any(isinstance(r, CreatedPanelUser) for r in results):
+                return results
+            try:
+                inb = next((it for it in await self._inbounds(client) if _inbound_key(it) == str(inbound_id) or str(it.get("tag") or "") == str(inbound_id)), None)
+            except Exception as e:
+                logger.warning("xui_bulk_add confirm_failed panel_id=%s err=%s", self.panel.id, str(e))
+                return results
+        if inb is None:
+            return results
+        present = {xui_client_email(c): c for c in xui_inbound_clients(inb)}
+        for i, r in enumerate(results):
+            if not isinstance(r, CreatedPanelUser):
+                continue
+            c = present.get(r.username)
+            if c is None:
+                results[i] = PanelError("Client missing after addClient", raw=r.raw)
+                continue
+            ident = xui_client_id(c) or (c.get("password") if isinstance(c.get("password"), str) else None)
+            r.subscription_url = xui_build_share_link(self.base_url, inb, r.username, ident)
+        return results
+
+    async def _client_op(
+        self,
+        client: httpx.AsyncClient,
+        kind: str,
+        attempts: list[tuple[str, Any, str]],
+        failure: str,
+    ) -> None:
+        """Post (path, body, json|form) variants until one is accepted; the winner is remembered per panel."""
+        last_status: Optional[int] = None
+        last_text: Optional[str] = None
+        for idx, (path, body, mode) in panel_discovery.ordered(self.panel, kind, list(enumerate(attempts)), key=lambda a: a[0]):
+            url = join_url(self.base_url, path)
+            try:
+                if mode == "json":
+                    res = await client.post(url, json=body, headers=_JSON)
+                else:
+                    res = await client.post(url, data=body, headers=_JSON)
+            except Exception as e:
+                last_status = 0
+                last_text = str(e)
+                continue
+            if _accepted(res):
+                panel_discovery.remember(self.panel, kind, idx)
+                return
+            last_status = res.status_code
+            last_text = res.text[:200]
+        if not last_status or 200 <= last_status < 300:
+            last_status = 502
+        raise PanelError(last_text or failure, status_code=last_status)
+
+    async def _update_client(self, client: httpx.AsyncClient, inbound: dict, c: dict, failure: str) -> None:
+        inbound_id = inbound.get("id")
+        ident = xui_client_id(c) or (c.get("password") if isinstance(c.get("password"), str) else None) or xui_client_email(c)
+        settings_str = json.dumps({"clients": [c]})
+        attempts: list[tuple[str, Any, str]] = [
+            (f"/panel/api/inbounds/updateClient/{ident}", {"id": inbound_id, "settings": settings_str}, "json"),
+            (f"/panel/api/inbounds/updateClient/{ident}", {"id": inbound_id, "settings": settings_str}, "form"),
+            (f"/xui/api/inbounds/updateClient/{ident}", {"id": inbound_id, "settings": settings_str}, "json"),
+            (f"/xui/API/inbounds/updateClient/{ident}", {"id": inbound_id, "settings": settings_str}, "json"),
+            (f"/xui/inbound/updateClient/{ident}", {"id": inbound_id, "settings": settings_str}, "form"),
+            (f"/panel/inbound/updateClient/{ident}", {"id": inbound_id, "settings": settings_str}, "form"),
+        ]
+        await self._client_op(client, "xui_update_client", attempts, failure)
+
+    async def set_status(self, username: str, status: Literal["active", "disabled"]) -> None:
+        await self.login()
+        async with self.client() as client:
+            inbound, found = await self._find(client, username)
+            if not found:
+                raise PanelError("User not found on XUI", status_code=404)
+            await self._update_client(client, inbound, {**found, "enable": status == "active"}, "Panel status change failed")
+
+    async def _extend_client(self, client: httpx.AsyncClient, inbound: dict, found: dict, username: str, limits: PlanLimits) -> None:
+        expiry_ms = 0
+        if limits.duration_days is not None:
+            expiry_ms = int((datetime.now(tz=timezone.utc) + timedelta(days=limits.duration_days)).timestamp() * 1000)
+        total = 0
+        if limits.data_limit_mb is not None:
+            current = found.get("totalGB")
+            # Keep the unit the panel already uses for this client (GB on older forks, bytes on 3x-ui)
+            if isinstance(current, (int, float)) and 0 < current < 10**9:
+                total = max(1, int(round(limits.data_limit_mb / 1024)))
+            else:
+                total = limits.data_limit_bytes
+        updated = {**found, "enable": True, "expiryTime": expiry_ms, "totalGB": total}
+        await self._update_client(client, inbound, updated, "Panel extend failed")
+
+        # best-effort reset traffic counters (stop at the first that works)
+        inbound_id = inbound.get("id")
+        for prefix in panel_discovery.ordered(self.panel, "xui_reset_client", ("/panel/api/inbounds", "/xui/api/inbounds", "/xui/inbound", "/panel/inbound")):
+            try:
+                rr = await client.post(join_url(self.base_url, f"{prefix}/{inbound_id}/resetClientTraffic/{username}"), headers=_JSON)
+            except Exception:
+                continue
+            if _accepted(rr):
+                panel_discovery.remember(self.panel, "xui_reset_client", prefix)
+                break
+
+    async def extend(self, username: str, limits: PlanLimits, inbounds: Optional[list[str]] = None) -> None:
+        # XUI clients live inside one inbound, so `inbounds` cannot move them and is ignored
+        await self.login()
+        async with self.client() as client:
+            inbound, found = await self._find(client, username)
+            if not found:
+                raise PanelError("User not found on XUI", status_code=404)
+            await self._extend_client(client, inbound, found, username, limits)
+
+    async def _each_client(
+        self, usernames: list[str], op: Callable[[httpx.AsyncClient, dict, dict, str], Awaitable[None]]
+    ) -> list[Optional[PanelError]]:
+        # One login and one inbound listing for the batch. Updates go one at a time: updateClient
+        # rewrites the inbound settings, so parallel writes to one inbound would undo each other.
+        await self.login()
+        results: list[Optional[PanelError]] = []
+        async with self.client() as client:
+            located: dict[str, tuple[dict, dict]] = {}
+            for inb in await self._inbounds(client):
+                for c in xui_inbound_clients(inb):
+                    located.setdefault(xui_client_email(c), (inb, c))
+            for name in usernames:
+                if name not in located:
+                    results.append(PanelError("User not found on XUI", status_code=404))
+                    continue
+                inbound, found = located[name]
+                try:
+                    await op(client, inbound, found, name)
+                    results.append(None)
+                except PanelError as e:
+                    results.append(e)
+                except Exception as e:
+                    results.append(PanelError(str(e)))
+        return results
+
+    async def set_status_many(
+        self, usernames: list[str], status: Literal["active", "disabled"], concurrency: int = 8
+    ) -> list[Optional[PanelError]]:
+        async def op(client: httpx.AsyncClient, inbound: dict, found: dict, name: str) -> None:
+            await self._update_client(client, inbound, {**found, "enable": status == "active"}, "Panel status change failed")
+
+        return await self._each_client(usernames, op)
+
+    async def extend_many(
+        self, usernames: list[str], limits: PlanLimits, inbounds: Optional[list[str]] = None, concurrency: int = 8
+    ) -> list[Optional[PanelError]]:
+        async def op(client: httpx.AsyncClient, inbound: dict, found: dict, name: str) -> None:
+            await self._extend_client(client, inbound, found, name, limits)
+
+        return await self._each_client(usernames, op)
+
+    async def delete_user(self, username: str) -> int:
+        await self.login()
+        async with self.client(timeout=15.0) as client:
+            inbound, found = await self._find(client, username)
+            if not found:
+                raise PanelError("User not found on XUI", status_code=404)
+            inbound_id = inbound.get("id")
+            ident = xui_client_id(found) or (found.get("password") if isinstance(found.get("password"), str) else None) or username
+            attempts: list[tuple[str, Any, str]] = [
+                (f"/panel/api/inbounds/{inbound_id}/delClient/{ident}", {}, "json"),
+                (f"/xui/api/inbounds/{inbound_id}/delClient/{ident}", {}, "json"),
+                (f"/xui/API/inbounds/{inbound_id}/delClient/{ident}", {}, "json"),
+                (f"/xui/inbound/{inbound_id}/delClient/{ident}", {}, "form"),
+                (f"/panel/inbound/{inbound_id}/delClient/{ident}", {}, "form"),
+            ]
+            await self._client_op(client, "xui_del_client", attempts, "Panel delete failed")
+        return 200
+
+    @classmethod
+    async def probe(cls, base_url: str, username: str, password: str) -> tuple[bool, Optional[str], Optional[int], Optional[str]]:
+        # X-UI typically uses cookie-based auth via /login or /xui/login
+        last_error = None
+        async with panel_client(base_url, timeout=10.0, follow_redirects=True, adapter=cls.type) as client:
+            for path in XUI_LOGIN_PATHS:
+                url = base_url.rstrip("/") + path
+                try:
+                    # Common fields for x-ui login
+                    res = await client.post(url, data={"username": username, "password": password})
+                except Exception as e:
+                    last_error = str(e)
+                    continue
+                # Check for set-cookie
+                sc = res.headers.get("set-cookie") or res.headers.get("Set-Cookie")
+                if sc and res.status_code in (200, 204, 302):
+                    # Return cookie preview as token_preview
+                    return True, path, res.status_code, (sc.split(";")[0][:24] + "...")
+                if res.status_code in (401, 403):
+                    return False, path, res.status_code, "Unauthorized"
+            # Fallback: check reachability
+            try:
+                chk = await client.get(base_url.rstrip("/") + "/xui/")
+                if chk.status_code == 200:
+                    return False, "/xui/", 200, "Reachable, but login failed"
+            except Exception as e:
+                last_error = str(e)
+        return False, None, None, last_error
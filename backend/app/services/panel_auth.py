@@ -0,0 +1,248 @@
+import asyncio
+import hashlib
+import time
+from typing import Any, Awaitable, Callable, Optional, Sequence
+
+import httpx
+from jose import jwt
+
+from app.core.config import get_settings
+from app.services.panel_http import panel_client
+
+_settings = get_settings()
+
+# Refresh a little before the panel would reject the credential
+_EXPIRY_SKEW_SECONDS = 30
+
+XUI_LOGIN_PATHS = ("/xui/login", "/login")
+
+
+def _panel_key(base_url: str) -> str:
+    return (base_url or "").rstrip("/").lower()
+
+
+def _fingerprint(password: str) -> str:
+    return hashlib.sha256((password or "").encode()).hexdigest()[:16]
+
+
+class PanelSessionCache:
+    """Caches panel credentials (bearer tokens or cookie jars) per (panel, username).
+
+    Logins are single-flight: concurrent callers for the same key wait on one lock and
+    reuse whatever the first caller obtained. Entries remember a fingerprint of the
+    password they were obtained with, so changed credentials never reuse a stale session.
+    """
+
+    def __init__(self) -> None:
+        self._entries: dict[tuple, tuple[Any, float, str]] = {}
+        self._locks: dict[tuple, asyncio.Lock] = {}
+
+    def _lock(self, key: tuple) -> asyncio.Lock:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[key] = lock
+        return lock
+
+    def peek(self, key: tuple, password: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if not entry:
+            return None
+        value, expires_at, fp = entry
+        if fp != _fingerprint(password) or time.monotonic() >= expires_at:
+            return None
+        return value
+
+    async def get(
+        self,
+        key: tuple,
+        password: str,
+        login: Callable[[], Awaitable[Optional[tuple[Any, float]]]],
+        stale: Optional[Any] = None,
+    ) -> Optional[Any]:
+        """Return a valid cached value, logging in at most once per key at a time.
+
+        `stale` is the value a caller just saw rejected (e.g. on 401); it is only
+        replaced if no other caller has refreshed it in the meantime.
+        """
+        value = self.peek(key, password)
+        if value is not None and (stale is None or value != stale):
+            return value
+        async with self._lock(key):
+            value = self.peek(key, password)
+            if value is not None and (stale is None or value != stale):
+                return value
+            result = await login()
+            if not result:
+                self._entries.pop(key, None)
+                return None
+            value, ttl = result
+            self._entries[key] = (value, time.monotonic() + max(1.0, ttl), _fingerprint(password))
+            return value
+
+    def invalidate(self, key: tuple) -> None:
+        self._entries.pop(key, None)
+
+    def invalidate_panel(self, base_url: str) -> None:
+        pk = _panel_key(base_url)
+        for key in [k for k in self._entries if k[1] == pk]:
+            self._entries.pop(key, None)
+
+
+panel_sessions = PanelSessionCache()
+
+
+def _token_ttl(token: str) -> float:
+    try:
+        exp = jwt.get_unverified_claims(token).get("exp")
+        if isinstance(exp, (int, float)):
+            return float(exp) - time.time() - _EXPIRY_SKEW_SECONDS
+    except Exception:
+        pass
+    return float(_settings.panel_token_ttl_seconds)
+
+
+async def _marzban_login(base_url: str, username: str, password: str) -> Optional[tuple[str, float]]:
+    async with panel_client(base_url, timeout=15.0, adapter="marzban") as client:
+        url = base_url.rstrip("/") + "/api/admin/token"
+        for method in ("form", "json"):
+            try:
+                if method == "form":
+                    res = await client.post(url, data={"username": username, "password": password})
+                else:
+                    res = await client.post(url, json={"username": username, "password": password})
+            except Exception:
+                continue
+            if res.headers.get("content-type", "").startswith("application/json"):
+                try:
+                    data = res.json()
+                except Exception:
+                    data = {}
+                token = data.get("access_token") or data.get("token")
+                if token:
+                    return token, _token_ttl(token)
+    return None
+
+
+async def marzban_token(base_url: str, username: str, password: str, stale: Optional[str] = None) -> Optional[str]:
+    key = ("marzban", _panel_key(base_url), username)
+    return await panel_sessions.get(key, password, lambda: _marzban_login(base_url, username, password), stale=stale)
+
+
+def _cookie_ttl(cookies: httpx.Cookies) -> float:
+    ttl = float(_settings.panel_session_ttl_seconds)
+    now = time.time()
+    for c in cookies.jar:
+        if c.expires:
+            ttl = min(ttl, c.expires - now - _EXPIRY_SKEW_SECONDS)
+    return ttl
+
+
+async def _xui_login(
+    base_url: str,
+    username: str,
+    password: str,
+    login_paths: Sequence[str] = XUI_LOGIN_PATHS,
+    on_login: Optional[Callable[[str], None]] = None,
+) -> Optional[tuple[httpx.Cookies, float]]:
+    login_variants = [
+        {"username": username, "password": password},
+        {"username": username, "password": password, "remember": "on"},
+        {"username": username, "password": password, "remember_me": "true"},
+    ]
+    async with panel_client(base_url, timeout=15.0, follow_redirects=True, adapter="xui") as client:
+        for path in login_paths:
+            for body in login_variants:
+                try:
+                    r = await client.post(base_url.rstrip("/") + path, data=body)
+                except Exception:
+                    continue
+                if r.status_code in (200, 204, 302) and (r.headers.get("set-cookie") or r.headers.get("Set-Cookie")):
+                    cookies = httpx.Cookies()
+                    cookies.update(client.cookies)
+                    if on_login:
+                        on_login(path)
+                    return cookies, _cookie_ttl(cookies)
+    return None
+
+
+async def xui_cookies(
+    base_url: str,
+    username: str,
+    password: str,
+    stale: Optional[httpx.Cookies] = None,
+    login_paths: Sequence[str] = XUI_LOGIN_PATHS,
+    on_login: Optional[Callable[[str], None]] = None,
+) -> Optional[httpx.Cookies]:
+    key = ("xui", _panel_key(base_url), username)
+    return await panel_sessions.get(
+        key, password, lambda: _xui_login(base_url, username, password, login_paths, on_login), stale=stale
+    )
+
+
+class MarzbanTokenAuth(httpx.Auth):
+    """Keeps the Authorization header on the cached token and re-logs in once on 401.
+
+    The header scheme set by the caller (Bearer/Token) is preserved.
+    """
+
+    def __init__(self, base_url: str, username: str, password: str):
+        self.base_url = base_url
+        self.username = username
+        self.password = password
+
+    async def async_auth_flow(self, request: httpx.Request):
+        header = request.headers.get("Authorization")
+        scheme = header.split(" ", 1)[0] if header else "Bearer"
+        token = await marzban_token(self.base_url, self.username, self.password)
+        if token:
+            request.headers["Authorization"] = f"{scheme} {token}"
+        response = yield request
+        if response.status_code == 401 and token:
+            fresh = await marzban_token(self.base_url, self.username, self.password, stale=token)
+            if fresh:
+                request.headers["Authorization"] = f"{scheme} {fresh}"
+                yield request
+
+
+def _xui_session_expired(response: httpx.Response) -> bool:
+    if response.status_code in (401, 403):
+        return True
+    if response.is_redirect:
+        return "login" in (response.headers.get("location") or "").lower()
+    return False
+
+
+class XuiCookieAuth(httpx.Auth):
+    """Sends the cached XUI session cookie and re-logs in once when the session is rejected."""
+
+    def __init__(
+        self,
+        base_url: str,
+        username: str,
+        password: str,
+        login_paths: Sequence[str] = XUI_LOGIN_PATHS,
+        on_login: Optional[Callable[[str], None]] = None,
+    ):
+        self.base_url = base_url
+        self.username = username
+        self.password = password
+        self.login_paths = login_paths
+        self.on_login = on_login
+
+    @staticmethod
+    def _apply(request: httpx.Request, cookies: httpx.Cookies) -> None:
+        request.headers["Cookie"] = "; ".join(f"{c.name}={c.value}" for c in cookies.jar)
+
+    async def async_auth_flow(self, request: httpx.Request):
+        cookies = await xui_cookies(self.base_url, self.username, self.password, login_paths=self.login_paths, on_login=self.on_login)
+        if cookies:
+            self._apply(request, cookies)
+        response = yield request
+        if cookies and _xui_session_expired(response):
+            fresh = await xui_cookies(
+                self.base_url, self.username, self.password, stale=cookies, login_paths=self.login_paths, on_login=self.on_login
+            )
+            if fresh:
+                self._apply(request, fresh)
+                yield request
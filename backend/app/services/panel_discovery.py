@@ -0,0 +1,93 @@
+import asyncio
+import logging
+from typing import Any, Callable, Optional, Sequence, TypeVar
+
+from sqlalchemy import update
+
+from app.db.session import AsyncSessionLocal, SessionLocal
+from app.models.panel import Panel
+
+T = TypeVar("T")
+
+logger = logging.getLogger("app")
+
+
+class PanelDiscovery:
+    """Remembers which login path, endpoint and payload variant worked for each panel.
+
+    Learned values live in memory and are persisted to `panels.discovery`, so a fresh
+    worker starts from what the others already found. Callers try the learned value
+    first and fall back to the full probe list only when it stops working.
+    """
+
+    def __init__(self) -> None:
+        self._learned: dict[int, dict[str, str]] = {}
+        self._pending: set[asyncio.Task] = set()
+
+    def _for(self, panel: Panel) -> dict[str, str]:
+        learned = self._learned.get(panel.id)
+        if learned is None:
+            stored = getattr(panel, "discovery", None)
+            learned = {str(k): str(v) for k, v in stored.items()} if isinstance(stored, dict) else {}
+            self._learned[panel.id] = learned
+        return learned
+
+    def get(self, panel: Panel, kind: str) -> Optional[str]:
+        return self._for(panel).get(kind)
+
+    def ordered(self, panel: Panel, kind: str, candidates: Sequence[T], key: Callable[[T], Any] = str) -> list[T]:
+        items = list(candidates)
+        learned = self.get(panel, kind)
+        if learned is None:
+            return items
+        for i, item in enumerate(items):
+            if str(key(item)) == learned:
+                return [item] + items[:i] + items[i + 1:]
+        return items
+
+    def remember(self, panel: Panel, kind: str, value: Any) -> None:
+        learned = self._for(panel)
+        value = str(value)
+        if learned.get(kind) == value:
+            return
+        learned[kind] = value
+        self._persist(panel.id, dict(learned))
+
+    def forget(self, panel: Panel, kind: str) -> None:
+        learned = self._for(panel)
+        if learned.pop(kind, None) is not None:
+            self._persist(panel.id, dict(learned))
+
+    def reset(self, panel_id: int) -> None:
+        self._learned.pop(panel_id, None)
+
+    def _persist(self, panel_id: int, data: dict[str, str]) -> None:
+        # Own short-lived session so the caller's unit of work is left untouched; from async code
+        # the write goes through the async engine in the background instead of blocking the loop
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None:
+            try:
+                with SessionLocal() as db:
+                    db.query(Panel).filter(Panel.id == panel_id).update({Panel.discovery: data})
+                    db.commit()
+            except Exception as e:
+                logger.warning("panel_discovery persist_failed panel_id=%s err=%s", panel_id, str(e))
+            return
+        task = loop.create_task(self._persist_async(panel_id, data))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    @staticmethod
+    async def _persist_async(panel_id: int, data: dict[str, str]) -> None:
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(update(Panel).where(Panel.id == panel_id).values(discovery=data))
+                await db.commit()
+        except Exception as e:
+            logger.warning("panel_discovery persist_failed panel_id=%s err=%s", panel_id, str(e))
+
+
+panel_discovery = PanelDiscovery()
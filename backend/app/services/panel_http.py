@@ -0,0 +1,137 @@
+import asyncio
+import time
+from typing import Optional
+from urllib.parse import urlparse
+
+import httpx
+
+from app.core.config import get_settings
+from app.services.metrics import observe_panel_call, panel_endpoint
+
+_settings = get_settings()
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except Exception:
+        return False
+    return True
+
+
+def _origin(base_url: str) -> str:
+    u = urlparse(base_url or "")
+    return f"{(u.scheme or 'http').lower()}://{(u.netloc or '').lower()}"
+
+
+class _SharedTransport(httpx.AsyncBaseTransport):
+    """Delegates to a registry-owned transport; closing a client must not close the pool.
+
+    Every request is timed into the panel call metrics under the client's panel id and adapter.
+    """
+
+    def __init__(self, inner: httpx.AsyncHTTPTransport, panel_id: str = "", adapter: str = "", prefix: str = ""):
+        self._inner = inner
+        self._panel_id = panel_id
+        self._adapter = adapter
+        self._prefix = prefix
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        endpoint = panel_endpoint(request.url.path, self._prefix)
+        start = time.perf_counter()
+        try:
+            response = await self._inner.handle_async_request(request)
+        except Exception as e:
+            observe_panel_call(self._panel_id, self._adapter, endpoint, time.perf_counter() - start, error=type(e).__name__)
+            raise
+        observe_panel_call(self._panel_id, self._adapter, endpoint, time.perf_counter() - start, status=response.status_code)
+        return response
+
+    async def aclose(self) -> None:
+        return None
+
+
+class PanelClientRegistry:
+    """One keep-alive connection pool per panel origin.
+
+    Clients handed out by `client()` are cheap: each gets its own cookie jar and
+    timeout, but all of them share the pooled transport of the panel's origin, so
+    consecutive calls to the same panel reuse the TCP/TLS connection.
+    """
+
+    def __init__(self) -> None:
+        self._transports: dict[str, httpx.AsyncHTTPTransport] = {}
+        self._lock = asyncio.Lock()
+        self._http2 = bool(_settings.panel_http2) and _http2_available()
+        self._limits = httpx.Limits(
+            max_connections=_settings.panel_http_max_connections,
+            max_keepalive_connections=_settings.panel_http_max_keepalive,
+            keepalive_expiry=_settings.panel_http_keepalive_expiry,
+        )
+
+    def transport(self, base_url: str) -> httpx.AsyncHTTPTransport:
+        key = _origin(base_url)
+        tr = self._transports.get(key)
+        if tr is None:
+            tr = httpx.AsyncHTTPTransport(verify=False, http2=self._http2, limits=self._limits, retries=1)
+            self._transports[key] = tr
+        return tr
+
+    def client(
+        self,
+        base_url: str,
+        timeout: float = 15.0,
+        follow_redirects: bool = False,
+        cookies: Optional[httpx.Cookies] = None,
+        auth: Optional[httpx.Auth] = None,
+        panel_id: Optional[int] = None,
+        adapter: str = "",
+    ) -> httpx.AsyncClient:
+        """`panel_id` and `adapter` label this client's calls in the metrics; logins and probes leave the id empty."""
+        transport = _SharedTransport(
+            self.transport(base_url),
+            panel_id="" if panel_id is None else str(panel_id),
+            adapter=adapter,
+            prefix=urlparse(base_url or "").path.rstrip("/"),
+        )
+        return httpx.AsyncClient(
+            transport=transport,
+            timeout=timeout,
+            follow_redirects=follow_redirects,
+            cookies=cookies,
+            auth=auth,
+        )
+
+    async def aclose(self) -> None:
+        async with self._lock:
+            transports = list(self._transports.values())
+            self._transports.clear()
+        for tr in transports:
+            try:
+                await tr.aclose()
+            except Exception:
+                pass
+
+    def stats(self) -> dict:
+        return {"origins": len(self._transports), "http2": self._http2}
+
+
+panel_clients = PanelClientRegistry()
+
+
+def panel_client(
+    base_url: str,
+    timeout: float = 15.0,
+    follow_redirects: bool = False,
+    cookies: Optional[httpx.Cookies] = None,
+    auth: Optional[httpx.Auth] = None,
+    panel_id: Optional[int] = None,
+    adapter: str = "",
+) -> httpx.AsyncClient:
+    return panel_clients.client(
+        base_url, timeout=timeout, follow_redirects=follow_redirects, cookies=cookies, auth=auth, panel_id=panel_id, adapter=adapter
+    )
+
+
+async def close_panel_clients() -> None:
+    await panel_clients.aclose()
@@ -0,0 +1,393 @@
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Any, Optional
+
+from sqlalchemy import delete, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.core.config import get_settings
+from app.db.session import AsyncSessionLocal
+from app.models.panel import Panel
+from app.models.panel_created_user import PanelCreatedUser
+from app.models.panel_job import PanelJob
+from app.models.user_panel_credentials import UserPanelCredential
+from app.models.wallet import WalletHold
+from app.services import notifications
+from app.services import wallet as wallet_service
+from app.services.audit import record_audit_event
+from app.services.panel_adapters import PanelError, PanelUser, PanelUserDetail, PlanLimits, get_adapter
+from app.services.panel_user_sync import mirror_owner, mirror_patch, mirror_put, mirror_remove
+from app.services.redis_client import get_redis
+
+logger = logging.getLogger("app")
+_settings = get_settings()
+
+QUEUE = "panel_jobs:queue"
+KINDS = ("create_user", "delete_user", "set_status", "extend")
+# Slack when comparing a panel's expiry with the one an extend would have set
+_EXPIRE_SLACK_SECONDS = 300
+
+
+def job_view(job: PanelJob) -> dict[str, Any]:
+    return {
+        "id": job.id,
+        "panel_id": job.panel_id,
+        "kind": job.kind,
+        "username": (job.params or {}).get("username"),
+        "status": job.status,
+        "result": job.result,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def submit(
+    db: Session,
+    user_id: int,
+    panel_id: int,
+    kind: str,
+    params: dict[str, Any],
+    price: Decimal = Decimal("0"),
+    reason: str = "",
+    idempotency_key: Optional[str] = None,
+    fingerprint: Optional[str] = None,
+) -> tuple[Optional[PanelJob], bool]:
+    """Outbox write: the wallet hold and the job row commit together, or not at all.
+
+    Returns (job, True) for a new job, (None, False) if the balance is short and
+    (earlier job, False) when `idempotency_key` was already used for this request and kind.
+    The key reused for a different request raises wallet.IdempotencyConflict.
+    """
+    fingerprint = fingerprint or wallet_service.request_hash({"panel_id": panel_id, "kind": kind, "params": params})
+    if idempotency_key:
+        existing = _by_key(db, user_id, kind, idempotency_key, fingerprint)
+        if existing is not None:
+            return existing, False
+    hold: Optional[WalletHold] = None
+    if price > 0:
+        hold = wallet_service.open_hold(db, user_id, price, reason)
+        if hold is None:
+            db.rollback()
+            return None, False
+    job = PanelJob(
+        id=uuid.uuid4().hex,
+        user_id=user_id,
+        panel_id=panel_id,
+        kind=kind,
+        params=params,
+        status="queued",
+        hold_id=hold.id if hold else None,
+        idempotency_key=idempotency_key,
+        request_hash=fingerprint,
+        attempts=0,
+    )
+    db.add(job)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return _by_key(db, user_id, kind, idempotency_key, fingerprint), False
+    return job, True
+
+
+def _by_key(db: Session, user_id: int, kind: str, key: str, fingerprint: str) -> Optional[PanelJob]:
+    job = db.execute(
+        select(PanelJob).where(PanelJob.user_id == user_id, PanelJob.kind == kind, PanelJob.idempotency_key == key)
+    ).scalar_one_or_none()
+    if job is not None and job.request_hash and job.request_hash != fingerprint:
+        db.rollback()
+        raise wallet_service.IdempotencyConflict(key)
+    return job
+
+
+async def push(job_ids: list[str]) -> None:
+    """Hand committed jobs to the workers. Jobs that miss this are picked up by the relay."""
+    if not job_ids:
+        return
+    await get_redis().lpush(QUEUE, *job_ids)
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(PanelJob).where(PanelJob.id.in_(job_ids)).values(enqueued_at=datetime.now(tz=timezone.utc)))
+        await db.commit()
+
+
+async def publish(job: PanelJob) -> None:
+    """Push the job's state to its owner's notification stream and sockets; best-effort."""
+    try:
+        await notifications.deliver(job.user_id, {"type": "panel_job", "job": job_view(job)})
+    except Exception as e:
+        logger.warning("panel_job publish_failed id=%s err=%s", job.id, str(e))
+
+
+def _credentials(db: Session, panel: Panel, user_id: int, account: str) -> tuple[str, str]:
+    # The account was authorized when the job was accepted; only its password is looked up here
+    if account == panel.username:
+        return panel.username, panel.password
+    rec = db.query(UserPanelCredential).filter(
+        UserPanelCredential.user_id == user_id, UserPanelCredential.panel_id == panel.id, UserPanelCredential.username == account
+    ).first()
+    if rec is None:
+        raise PanelError("Panel credentials for this job no longer exist", 403)
+    return rec.username, rec.password
+
+
+def _claim(db: Session, job_id: str) -> Optional[PanelJob]:
+    job = db.execute(
+        update(PanelJob)
+        .where(PanelJob.id == job_id, PanelJob.status == "queued")
+        .values(status="running", started_at=datetime.now(tz=timezone.utc), attempts=PanelJob.attempts + 1)
+        .returning(PanelJob)
+    ).scalar_one_or_none()
+    db.commit()
+    return job
+
+
+def _finish(db: Session, job: PanelJob, status: str, result: Optional[dict] = None, error: Optional[str] = None) -> None:
+    """Settle the job's hold (charge on success, compensating refund on failure) and record the outcome."""
+    hold = db.get(WalletHold, job.hold_id) if job.hold_id else None
+    if hold is not None:
+        if status == "succeeded":
+            wallet_service.commit_hold(db, hold)
+        elif not wallet_service.release_hold(db, hold) and hold.status == "committed":
+            # The worker died after charging, so the panel write had gone through
+            status, error = "succeeded", None
+    job.status = status
+    job.result = result
+    job.error = error[:1024] if error else None
+    job.finished_at = datetime.now(tz=timezone.utc)
+    db.commit()
+
+
+async def _audit(db, job: PanelJob, action: str, target: str, meta: dict) -> None:
+    # The panel write already happened; bookkeeping failures must not turn it into a refund
+    try:
+        await db.run_sync(record_audit_event, job.user_id, action, target=target, meta=meta)
+    except Exception:
+        await db.rollback()
+
+
+async def _record_created(db, job: PanelJob, user: PanelUser) -> None:
+    panel = await db.get(Panel, job.panel_id)
+    account = mirror_owner(panel, job.params["account"]) if panel is not None else job.params["account"]
+    await db.run_sync(mirror_put, job.panel_id, account, PanelUser(**user.model_dump(include=set(PanelUser.model_fields) - {"status"}), status="active"))
+    try:
+        db.add(PanelCreatedUser(panel_id=job.panel_id, username=user.username, subscription_url=user.subscription_url, created_by_user_id=job.user_id))
+        await db.commit()
+    except Exception:
+        await db.rollback()
+
+
+async def _execute(db, job: PanelJob) -> dict[str, Any]:
+    params = job.params
+    panel = await db.get(Panel, job.panel_id)
+    if panel is None:
+        raise PanelError("Panel not found", 404)
+    account = params["account"]
+    username, password = await db.run_sync(_credentials, panel, job.user_id, account)
+    adapter = get_adapter(panel, username, password)
+    name = params["username"]
+    meta = {"panel_id": job.panel_id, "job_id": job.id}
+    if job.kind == "create_user":
+        if await _panel_user(panel, name) is not None:
+            raise PanelError("Username already exists on the panel", 409)
+        # Reconciling only claims a user this job saw missing right before asking for it
+        job.params = params = {**params, "absent_before_create": True}
+        await db.commit()
+        created = await adapter.create_user(name, PlanLimits(**params["limits"]), params["inbounds"])
+        await _record_created(db, job, PanelUser(**created.model_dump(exclude={"raw"})))
+        await _audit(db, job, "create_config_user", name, {**meta, "plan_id": params.get("plan_id")})
+        return created.model_dump(exclude={"raw"})
+    if job.kind == "delete_user":
+        status = await adapter.delete_user(name)
+        await db.run_sync(mirror_remove, job.panel_id, name)
+        try:
+            await db.execute(delete(PanelCreatedUser).where(PanelCreatedUser.panel_id == job.panel_id, PanelCreatedUser.username == name))
+            await db.commit()
+        except Exception:
+            await db.rollback()
+        return {"status": status}
+    if job.kind == "set_status":
+        await adapter.set_status(name, params["status"])
+        await db.run_sync(mirror_patch, job.panel_id, name, status=params["status"])
+        await _audit(db, job, f"config_user_{params['status']}", name, meta)
+        return {"status": params["status"]}
+    if job.kind == "extend":
+        limits = PlanLimits(**params["limits"])
+        await adapter.extend(name, limits, params.get("inbounds"))
+        await db.run_sync(mirror_patch, job.panel_id, name, data_limit=limits.data_limit_bytes or None, expire=limits.expire_timestamp())
+        await _audit(db, job, "extend_config_user", name, {**meta, "plan_id": params.get("plan_id")})
+        return {"expire": limits.expire_timestamp(), "data_limit": limits.data_limit_bytes or None}
+    raise PanelError(f"Unknown job kind {job.kind}", 400)
+
+
+def _extended(job: PanelJob, user: PanelUserDetail) -> bool:
+    """Whether the panel shows the quota and expiry this extend would have set when it started.
+
+    A user that already had exactly these limits (e.g. unlimited both before and after) also
+    matches; the charge is kept then, as the user does hold what was paid for.
+    """
+    return _has_limits(job, user)
+
+
+def _created(job: PanelJob, user: PanelUserDetail) -> bool:
+    """Whether a user found under a create job's name is the one the job created.
+
+    Needs the job to have seen the name free before its create call, and the user to carry
+    the job's limits; otherwise the name may belong to someone else, who must not be charged
+    to (or shown to) this operator.
+    """
+    return bool(job.params.get("absent_before_create")) and _has_limits(job, user)
+
+
+def _has_limits(job: PanelJob, user: PanelUserDetail) -> bool:
+    limits = PlanLimits(**job.params["limits"])
+    if (user.data_limit or 0) != limits.data_limit_bytes:
+        return False
+    if limits.duration_days is None:
+        return not user.expire
+    target = int(job.started_at.timestamp()) + limits.duration_days * 86400
+    return user.expire is not None and user.expire >= target - _EXPIRE_SLACK_SECONDS
+
+
+async def _panel_user(panel: Panel, name: str) -> Optional[PanelUserDetail]:
+    """The user as the panel's own account sees it, or None if the panel has no such user."""
+    try:
+        return await get_adapter(panel).get_user(name)
+    except PanelError as e:
+        if e.status_code != 404:
+            raise
+        return None
+
+
+async def _observe(db, job: PanelJob) -> Optional[tuple[str, Optional[dict], Optional[str]]]:
+    """Read the user back from the panel to learn whether an interrupted job's write landed.
+
+    Returns (status, result, error) for `_finish`, or None when the panel cannot tell yet.
+    The panel's own credentials are used: the operator's account may be gone, and the
+    admin account sees every user.
+    """
+    panel = await db.get(Panel, job.panel_id)
+    if panel is None:
+        return "failed", None, "Panel was removed before the job could be confirmed"
+    name = job.params["username"]
+    try:
+        user = await _panel_user(panel, name)
+    except PanelError as e:
+        logger.warning("panel_job reconcile_failed id=%s panel_id=%s err=%s", job.id, job.panel_id, e.detail)
+        return None
+    except Exception as e:
+        logger.warning("panel_job reconcile_failed id=%s panel_id=%s err=%s", job.id, job.panel_id, str(e))
+        return None
+    if job.kind == "create_user":
+        if user is None:
+            return "failed", None, "Panel did not create the user"
+        if not _created(job, user):
+            return "failed", None, "Could not confirm the user on the panel was created by this job"
+        await _record_created(db, job, user)
+        return "succeeded", user.model_dump(), None
+    if job.kind == "delete_user":
+        return ("succeeded", {"status": 200}, None) if user is None else ("failed", None, "Panel did not delete the user")
+    if user is None:
+        return "failed", None, "User not found on the panel"
+    if job.kind == "set_status":
+        if (user.status or "").lower() == job.params["status"]:
+            return "succeeded", {"status": job.params["status"]}, None
+        return "failed", None, "Panel did not change the status"
+    if job.kind == "extend":
+        if _extended(job, user):
+            await db.run_sync(mirror_patch, job.panel_id, name, data_limit=user.data_limit or None, expire=user.expire)
+            return "succeeded", {"expire": user.expire, "data_limit": user.data_limit or None}, None
+        return "failed", None, "Panel did not apply the extension"
+    return "failed", None, f"Unknown job kind {job.kind}"
+
+
+async def reconcile(db, job: PanelJob) -> bool:
+    """Settle a reconciling job from what the panel shows; False if it has to wait for another pass."""
+    outcome = await _observe(db, job)
+    if outcome is None:
+        return False
+    status, result, error = outcome
+    logger.info("panel_job reconciled id=%s kind=%s panel_id=%s status=%s", job.id, job.kind, job.panel_id, status)
+    await db.run_sync(_finish, job, status, result, error)
+    await publish(job)
+    return True
+
+
+def _mark_reconciling(db: Session, job: PanelJob, error: str) -> None:
+    job.status = "reconciling"
+    job.error = error
+    db.commit()
+
+
+async def run_job(job_id: str) -> None:
+    async with AsyncSessionLocal() as db:
+        job = await db.run_sync(_claim, job_id)
+        if job is None:
+            # Already taken by another worker, finished, or pushed twice by the relay
+            return
+        await publish(job)
+        try:
+            result = await asyncio.wait_for(_execute(db, job), timeout=_settings.panel_job_timeout_seconds)
+        except asyncio.TimeoutError:
+            # The panel may have applied the write anyway; the relay checks before charging or refunding
+            logger.warning("panel_job timed_out id=%s kind=%s panel_id=%s", job.id, job.kind, job.panel_id)
+            await db.rollback()
+            await db.run_sync(_mark_reconciling, job, "Panel did not respond in time; checking whether the change was applied")
+        except Exception as e:
+            if isinstance(e, PanelError):
+                error = e.detail
+            else:
+                error = str(e) or type(e).__name__
+            logger.warning("panel_job failed id=%s kind=%s panel_id=%s err=%s", job.id, job.kind, job.panel_id, error)
+            await db.rollback()
+            await db.run_sync(_finish, job, "failed", None, error)
+        else:
+            logger.info("panel_job succeeded id=%s kind=%s panel_id=%s", job.id, job.kind, job.panel_id)
+            await db.run_sync(_finish, job, "succeeded", result)
+        await publish(job)
+
+
+def _unpushed(db: Session, requeue_after: timedelta) -> list[str]:
+    cutoff = datetime.now(tz=timezone.utc) - requeue_after
+    return list(
+        db.scalars(
+            select(PanelJob.id)
+            .where(PanelJob.status == "queued", or_(PanelJob.enqueued_at.is_(None), PanelJob.enqueued_at < cutoff))
+            .order_by(PanelJob.created_at.asc())
+            .limit(500)
+        )
+    )
+
+
+def _unsettled(db: Session, older_than: timedelta) -> list[PanelJob]:
+    """Jobs whose worker died mid-run, and timed-out jobs, once a late panel write would have landed."""
+    cutoff = datetime.now(tz=timezone.utc) - older_than
+    return list(
+        db.scalars(
+            select(PanelJob)
+            .where(PanelJob.status.in_(("running", "reconciling")), PanelJob.started_at < cutoff)
+            .order_by(PanelJob.started_at.asc())
+            .limit(100)
+        )
+    )
+
+
+async def relay_once() -> None:
+    """Re-push queued jobs whose push was lost, and settle interrupted jobs from what the panel shows."""
+    async with AsyncSessionLocal() as db:
+        # A queued job is popped within seconds unless the push never happened or the popping worker died
+        job_ids = await db.run_sync(_unpushed, timedelta(seconds=max(30, _settings.panel_job_timeout_seconds)))
+        unsettled = await db.run_sync(_unsettled, timedelta(seconds=_settings.panel_job_timeout_seconds * 2))
+        for job in unsettled:
+            if job.status == "running":
+                logger.warning("panel_job abandoned id=%s kind=%s panel_id=%s", job.id, job.kind, job.panel_id)
+                await db.run_sync(_mark_reconciling, job, "Worker stopped while running this job; checking whether the change was applied")
+                await publish(job)
+            # Unreachable panels keep the job (and its hold) open until a later pass can tell
+            await reconcile(db, job)
+    if job_ids:
+        await push(job_ids)
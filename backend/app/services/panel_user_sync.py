@@ -0,0 +1,304 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional
+
+from sqlalchemy import func, or_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.core.config import get_settings
+from app.db.session import AsyncSessionLocal
+from app.models.panel import Panel
+from app.models.panel_user_mirror import PanelUserMirror, PanelUserSync
+from app.models.user_panel_credentials import UserPanelCredential
+from app.services.panel_adapters import PanelUser, UserQuery, get_adapter
+
+logger = logging.getLogger("app")
+_settings = get_settings()
+
+_FIELDS = ("status", "data_limit", "expire", "subscription_url")
+# Rows per multi-row statement
+_CHUNK = 1000
+
+_locks: dict[tuple[int, str], asyncio.Lock] = {}
+
+
+def _lock(key: tuple[int, str]) -> asyncio.Lock:
+    lock = _locks.get(key)
+    if lock is None:
+        lock = asyncio.Lock()
+        _locks[key] = lock
+    return lock
+
+
+def _ensure_state(db: Session, panel_id: int, owner: str) -> PanelUserSync:
+    db.execute(
+        insert(PanelUserSync)
+        .values(panel_id=panel_id, owner=owner, user_count=0)
+        .on_conflict_do_nothing(constraint="uq_panel_user_syncs_owner")
+    )
+    return (
+        db.query(PanelUserSync)
+        .filter(PanelUserSync.panel_id == panel_id, PanelUserSync.owner == owner)
+        .populate_existing()
+        .one()
+    )
+
+
+def sync_state(db: Session, panel_id: int, owner: str) -> Optional[PanelUserSync]:
+    return db.query(PanelUserSync).filter(PanelUserSync.panel_id == panel_id, PanelUserSync.owner == owner).first()
+
+
+def query_mirror(db: Session, panel_id: int, owner: str, query: UserQuery) -> tuple[list[PanelUserMirror], int]:
+    """One page of mirrored users matching `query`, and the total number of matches."""
+    q = db.query(PanelUserMirror).filter(PanelUserMirror.panel_id == panel_id, PanelUserMirror.owner == owner)
+    if query.status:
+        q = q.filter(PanelUserMirror.status == query.status)
+    if query.search:
+        prefix = query.search.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        q = q.filter(func.lower(PanelUserMirror.username).like(prefix + "%", escape="\\"))
+    if query.expiring_before is not None:
+        q = q.filter(PanelUserMirror.expire > 0, PanelUserMirror.expire < query.expiring_before)
+    total = q.count()
+    field, desc = query.sort_key()
+    if field:
+        col = getattr(PanelUserMirror, field)
+        q = q.order_by(col.desc().nulls_last() if desc else col.asc().nulls_last(), PanelUserMirror.id.asc())
+    else:
+        q = q.order_by(PanelUserMirror.id.asc())
+    q = q.offset(query.offset)
+    if query.limit is not None:
+        q = q.limit(query.limit)
+    return q.all(), total
+
+
+def _row(panel_id: int, owner: str, user: PanelUser, now: datetime) -> dict[str, Any]:
+    return {
+        "panel_id": panel_id,
+        "owner": owner,
+        "username": user.username,
+        "status": user.status,
+        "data_limit": user.data_limit,
+        "expire": user.expire,
+        "subscription_url": user.subscription_url,
+        "synced_at": now,
+    }
+
+
+def _upsert(db: Session, rows: list[dict[str, Any]]) -> None:
+    for i in range(0, len(rows), _CHUNK):
+        stmt = insert(PanelUserMirror).values(rows[i:i + _CHUNK])
+        stmt = stmt.on_conflict_do_update(
+            constraint="uq_panel_users_owner_username",
+            set_={f: stmt.excluded[f] for f in _FIELDS + ("synced_at",)},
+        )
+        db.execute(stmt)
+
+
+def _apply(db: Session, panel_id: int, owner: str, fetched: dict[str, PanelUser], now: datetime) -> tuple[int, int]:
+    """Write only what changed since the last sync; returns (upserted, deleted)."""
+    existing = {
+        r.username: (r.status, r.data_limit, r.expire, r.subscription_url)
+        for r in db.query(
+            PanelUserMirror.username,
+            PanelUserMirror.status,
+            PanelUserMirror.data_limit,
+            PanelUserMirror.expire,
+            PanelUserMirror.subscription_url,
+        ).filter(PanelUserMirror.panel_id == panel_id, PanelUserMirror.owner == owner)
+    }
+    changed = [
+        _row(panel_id, owner, u, now)
+        for name, u in fetched.items()
+        if existing.get(name) != (u.status, u.data_limit, u.expire, u.subscription_url)
+    ]
+    gone = [name for name in existing if name not in fetched]
+    _upsert(db, changed)
+    for i in range(0, len(gone), _CHUNK):
+        db.query(PanelUserMirror).filter(
+            PanelUserMirror.panel_id == panel_id,
+            PanelUserMirror.owner == owner,
+            PanelUserMirror.username.in_(gone[i:i + _CHUNK]),
+        ).delete(synchronize_session=False)
+    return len(changed), len(gone)
+
+
+def _record_failure(db: Session, panel_id: int, owner: str, error: str) -> None:
+    state = _ensure_state(db, panel_id, owner)
+    state.last_error = error
+    db.commit()
+
+
+def _record_success(db: Session, panel_id: int, owner: str, fetched: dict[str, PanelUser], started: datetime) -> tuple[PanelUserSync, int, int]:
+    try:
+        upserted, deleted = _apply(db, panel_id, owner, fetched, started)
+        state = _ensure_state(db, panel_id, owner)
+        state.synced_at = started
+        state.user_count = len(fetched)
+        state.last_error = None
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return state, upserted, deleted
+
+
+async def sync_panel_users(db: AsyncSession, panel: Panel, username: str, password: str) -> PanelUserSync:
+    """Fetch `panel`'s users as `username` and bring the mirror in line with them.
+
+    Single-flight per (panel, account): a caller that arrives while a sync is running
+    waits for it and reuses its result instead of scraping the panel again.
+    """
+    lock = _lock((panel.id, username))
+    in_flight = lock.locked()
+    async with lock:
+        state = await db.run_sync(_ensure_state, panel.id, username)
+        if in_flight and state.synced_at is not None and not state.last_error:
+            await db.commit()
+            return state
+        started = datetime.now(tz=timezone.utc)
+        state.last_attempt_at = started
+        await db.commit()
+        fetched: dict[str, PanelUser] = {}
+        try:
+            async for page in get_adapter(panel, username, password).iter_users(_settings.panel_user_sync_page_size):
+                for u in page:
+                    if u.username:
+                        fetched[u.username] = u
+        except Exception as e:
+            error = str(getattr(e, "detail", None) or e)[:512]
+            await db.run_sync(_record_failure, panel.id, username, error)
+            logger.warning("panel_user_sync failed panel_id=%s owner=%s err=%s", panel.id, username, error)
+            raise
+        state, upserted, deleted = await db.run_sync(_record_success, panel.id, username, fetched, started)
+        logger.info(
+            "panel_user_sync ok panel_id=%s owner=%s users=%s upserted=%s deleted=%s ms=%s",
+            panel.id, username, len(fetched), upserted, deleted,
+            int((datetime.now(tz=timezone.utc) - started).total_seconds() * 1000),
+        )
+        return state
+
+
+# Write-through after panel writes so the mirror does not wait for the next sync.
+# Best-effort: a failure here is repaired by the next sync.
+
+def mirror_put(db: Session, panel_id: int, owner: str, *users: PanelUser) -> None:
+    if not users:
+        return
+    now = datetime.now(tz=timezone.utc)
+    try:
+        _upsert(db, [_row(panel_id, owner, u, now) for u in users])
+        db.commit()
+    except Exception:
+        db.rollback()
+
+
+def mirror_patch(db: Session, panel_id: int, username: str, **fields: Any) -> None:
+    mirror_patch_many(db, panel_id, [username], **fields)
+
+
+def mirror_patch_many(db: Session, panel_id: int, usernames: list[str], **fields: Any) -> None:
+    values = {**{getattr(PanelUserMirror, k): v for k, v in fields.items()}, PanelUserMirror.synced_at: datetime.now(tz=timezone.utc)}
+    try:
+        for i in range(0, len(usernames), _CHUNK):
+            db.query(PanelUserMirror).filter(
+                PanelUserMirror.panel_id == panel_id, PanelUserMirror.username.in_(usernames[i:i + _CHUNK])
+            ).update(values, synchronize_session=False)
+        db.commit()
+    except Exception:
+        db.rollback()
+
+
+def mirror_remove(db: Session, panel_id: int, username: str) -> None:
+    try:
+        db.query(PanelUserMirror).filter(PanelUserMirror.panel_id == panel_id, PanelUserMirror.username == username).delete(synchronize_session=False)
+        db.commit()
+    except Exception:
+        db.rollback()
+
+
+def mirror_owner(panel: Panel, account: str) -> str:
+    """The mirrored view a write through `account` belongs to.
+
+    XUI operators may create users with their own panel account, but only the admin view of an
+    XUI panel is synced and filtered on, so their rows are kept under the admin account.
+    """
+    return panel.username if (panel.type or "marzban") == "xui" else account
+
+
+def _accounts(db: Session) -> list[tuple[int, str, str]]:
+    """(panel_id, username, password) for every panel account whose view is mirrored."""
+    accounts: dict[tuple[int, str], str] = {}
+    panels = db.query(Panel).all()
+    for panel in panels:
+        accounts[(panel.id, panel.username)] = panel.password
+    marzban_ids = {p.id for p in panels if (p.type or "marzban") != "xui"}
+    # Operators on XUI act through the admin account, so only Marzban credentials add views
+    for rec in db.query(UserPanelCredential).filter(UserPanelCredential.panel_id.in_(marzban_ids)).all():
+        accounts.setdefault((rec.panel_id, rec.username), rec.password)
+    return [(pid, user, pwd) for (pid, user), pwd in accounts.items()]
+
+
+def _claim(db: Session, panel_id: int, owner: str, interval: int) -> bool:
+    # Conditional update so only one API worker process syncs an account per interval
+    _ensure_state(db, panel_id, owner)
+    now = datetime.now(tz=timezone.utc)
+    claimed = (
+        db.query(PanelUserSync)
+        .filter(
+            PanelUserSync.panel_id == panel_id,
+            PanelUserSync.owner == owner,
+            or_(PanelUserSync.last_attempt_at.is_(None), PanelUserSync.last_attempt_at < now - timedelta(seconds=interval)),
+        )
+        .update({PanelUserSync.last_attempt_at: now}, synchronize_session=False)
+    )
+    db.commit()
+    return claimed == 1
+
+
+def _due_accounts(db: Session, interval: int) -> list[tuple[int, str, str]]:
+    return [(pid, user, pwd) for pid, user, pwd in _accounts(db) if _claim(db, pid, user, interval)]
+
+
+async def _sync_account(panel_id: int, username: str, password: str, sem: asyncio.Semaphore) -> None:
+    async with sem:
+        async with AsyncSessionLocal() as db:
+            panel = await db.get(Panel, panel_id)
+            if not panel:
+                return
+            try:
+                await sync_panel_users(db, panel, username, password)
+            except Exception:
+                # Already logged and recorded on the sync state
+                pass
+
+
+async def sync_due_accounts(interval: int, sem: asyncio.Semaphore) -> None:
+    async with AsyncSessionLocal() as db:
+        due = await db.run_sync(_due_accounts, interval)
+    if due:
+        await asyncio.gather(*(_sync_account(pid, user, pwd, sem) for pid, user, pwd in due))
+
+
+_worker_started = False
+
+
+def schedule_panel_user_sync() -> None:
+    global _worker_started
+    if _worker_started or _settings.panel_user_sync_interval_seconds <= 0:
+        return
+    _worker_started = True
+    asyncio.create_task(_sync_loop())
+
+
+async def _sync_loop() -> None:
+    interval = max(30, int(_settings.panel_user_sync_interval_seconds))
+    sem = asyncio.Semaphore(max(1, int(_settings.panel_user_sync_concurrency)))
+    while True:
+        try:
+            await sync_due_accounts(interval, sem)
+        except Exception as e:
+            logger.warning("panel_user_sync loop_error err=%s", str(e))
+        await asyncio.sleep(min(interval, 30))
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Any, Optional
+
+from sqlalchemy.orm import Session
+
+from app.core.config import get_settings
+from app.db.session import SessionLocal
+from app.models.plan import Plan
+from app.models.plan_category import PlanCategory
+from app.models.plan_template import PlanTemplate, PlanTemplateItem, UserPlanTemplate
+from app.schemas.plan import PlanRead
+from app.services import cache_invalidation
+
+logger = logging.getLogger("app")
+_settings = get_settings()
+
+_CENT = Decimal("0.01")
+
+
+def _money(value: Any) -> Decimal:
+    return Decimal(str(value or 0)).quantize(_CENT, rounding=ROUND_HALF_UP)
+
+
+@dataclass(frozen=True)
+class CatalogCategory:
+    id: int
+    name: str
+    sort_order: int
+
+
+@dataclass(frozen=True)
+class PriceCatalog:
+    """Categories, plans and the (plan template, plan) -> effective price matrix, as of one load."""
+
+    categories: tuple[CatalogCategory, ...]
+    plans: tuple[PlanRead, ...]
+    base: dict[int, Decimal]
+    # template_id -> plan_id -> price, with the base price filled in where a template has no override
+    matrix: dict[int, dict[int, Decimal]]
+    # operator user_id -> plan template id
+    assignments: dict[int, int]
+
+    def template_for(self, user: Any) -> Optional[int]:
+        if getattr(user, "role", None) != "operator":
+            return None
+        return self.assignments.get(user.id)
+
+    def price(self, user: Any, plan_id: int) -> Optional[Decimal]:
+        template_id = self.template_for(user)
+        if template_id is not None and template_id in self.matrix:
+            return self.matrix[template_id].get(plan_id)
+        return self.base.get(plan_id)
+
+    def plans_for(self, user: Any) -> list[PlanRead]:
+        prices = self.matrix.get(self.template_for(user), self.base)
+        return [p.model_copy(update={"effective_price": prices.get(p.id, p.price)}) for p in self.plans]
+
+
+def load_catalog(db: Session) -> PriceCatalog:
+    categories = tuple(
+        CatalogCategory(id=c.id, name=c.name, sort_order=c.sort_order)
+        for c in db.query(PlanCategory).order_by(PlanCategory.sort_order.asc(), PlanCategory.id.asc())
+    )
+    rows = db.query(Plan).order_by(Plan.category_id.asc(), Plan.sort_order.asc(), Plan.id.asc()).all()
+    plans = tuple(PlanRead.model_validate(p) for p in rows)
+    base = {p.id: _money(p.price) for p in rows}
+    matrix = {t.id: dict(base) for t in db.query(PlanTemplate.id)}
+    for it in db.query(PlanTemplateItem.template_id, PlanTemplateItem.plan_id, PlanTemplateItem.price_override):
+        if it.template_id in matrix and it.plan_id in base:
+            matrix[it.template_id][it.plan_id] = _money(it.price_override)
+    assignments = {r.user_id: r.template_id for r in db.query(UserPlanTemplate.user_id, UserPlanTemplate.template_id)}
+    return PriceCatalog(categories=categories, plans=plans, base=base, matrix=matrix, assignments=assignments)
+
+
+class PriceCatalogCache:
+    """The current PriceCatalog, rebuilt on first use after an invalidation or after `ttl` seconds.
+
+    The TTL is only a backstop for missed broadcasts; plan, category and plan template
+    writes call invalidate_price_catalog(). A generation counter keeps a rebuild that raced
+    with an invalidation from being kept.
+
+    `get` loads with the caller's session and may wait on the lock, so it is for threads
+    (sync routes); code on the event loop uses `aget`, which never blocks the loop.
+    """
+
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+        self._catalog: Optional[PriceCatalog] = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def get(self, db: Session) -> PriceCatalog:
+        catalog = self._catalog
+        if catalog is not None and time.monotonic() < self._expires_at:
+            return catalog
+        with self._lock:
+            if self._catalog is not None and time.monotonic() < self._expires_at:
+                return self._catalog
+            generation = self._generation
+            catalog = load_catalog(db)
+            if generation == self._generation:
+                self._catalog = catalog
+                self._expires_at = time.monotonic() + self.ttl
+            return catalog
+
+    def _load(self) -> PriceCatalog:
+        with SessionLocal() as db:
+            return self.get(db)
+
+    async def aget(self) -> PriceCatalog:
+        """The cached catalog right away, or one rebuilt in a worker thread with its own session."""
+        catalog = self._catalog
+        if catalog is not None and time.monotonic() < self._expires_at:
+            return catalog
+        return await asyncio.to_thread(self._load)
+
+    def invalidate(self) -> None:
+        self._generation += 1
+        self._catalog = None
+
+
+price_catalog = PriceCatalogCache(float(_settings.price_catalog_ttl_seconds))
+cache_invalidation.register("price_catalog", lambda key: price_catalog.invalidate())
+
+
+def invalidate_price_catalog() -> None:
+    """Call after committing a change to plans, plan categories, plan templates or their assignments."""
+    cache_invalidation.broadcast("price_catalog")
+
+
+def _effective_price(catalog: PriceCatalog, user: Any, plan_obj: Plan) -> Decimal:
+    price = catalog.price(user, plan_obj.id)
+    # A plan created after the last load is priced at its base price until the next one
+    return price if price is not None else _money(plan_obj.price)
+
+
+def effective_price_for_user(db: Session, user: Any, plan_obj: Plan) -> Decimal:
+    return _effective_price(price_catalog.get(db), user, plan_obj)
+
+
+async def effective_price(user: Any, plan_obj: Plan) -> Decimal:
+    """effective_price_for_user for async routes; a catalog rebuild runs off the event loop."""
+    return _effective_price(await price_catalog.aget(), user, plan_obj)
+
+
+async def warm_price_catalog() -> None:
+    try:
+        await price_catalog.aget()
+    except Exception as e:
+        logger.warning("price_catalog warm_failed err=%s", str(e))
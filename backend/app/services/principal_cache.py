@@ -0,0 +1,84 @@
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from app.core.config import get_settings
+from app.models.root_admin import RootAdmin
+from app.models.user import User
+from app.services import cache_invalidation
+
+_settings = get_settings()
+
+ROOT_ADMIN_EMAILS = frozenset(e.strip().lower() for e in _settings.root_admin_emails.split(",") if e.strip())
+
+
+@dataclass(frozen=True)
+class Principal:
+    """What authorization needs to know about the caller; stands in for the `User` row in route dependencies."""
+
+    id: int
+    name: str
+    email: str
+    role: str
+    is_active: bool
+    is_root_admin: bool
+
+
+def load_principal(db: Session, user_id: int) -> Optional[Principal]:
+    row = (
+        db.query(User, RootAdmin.id)
+        .outerjoin(RootAdmin, RootAdmin.user_id == User.id)
+        .filter(User.id == user_id)
+        .first()
+    )
+    if row is None:
+        return None
+    user, root_row = row
+    is_root = user.role == "admin" and (user.email.lower() in ROOT_ADMIN_EMAILS or root_row is not None)
+    return Principal(id=user.id, name=user.name, email=user.email, role=user.role, is_active=bool(user.is_active), is_root_admin=is_root)
+
+
+class PrincipalCache:
+    """Principals by user id, kept for a short TTL.
+
+    Sync dependencies read it from the threadpool, so writes take a lock. A generation
+    counter stops a load that raced with an invalidation from re-inserting the old value.
+    """
+
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+        self._entries: dict[int, tuple[Principal, float]] = {}
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def get(self, db: Session, user_id: int) -> Optional[Principal]:
+        entry = self._entries.get(user_id)
+        if entry and time.monotonic() < entry[1]:
+            return entry[0]
+        generation = self._generation
+        principal = load_principal(db, user_id)
+        if principal is not None and self.ttl > 0:
+            with self._lock:
+                if generation == self._generation:
+                    self._entries[user_id] = (principal, time.monotonic() + self.ttl)
+        return principal
+
+    def invalidate(self, user_id: Optional[int] = None) -> None:
+        with self._lock:
+            self._generation += 1
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+
+principal_cache = PrincipalCache(float(_settings.principal_cache_ttl_seconds))
+cache_invalidation.register("principal", lambda key: principal_cache.invalidate(int(key) if key and key.isdigit() else None))
+
+
+def invalidate_principal(user_id: Optional[int] = None) -> None:
+    """Drop the cached principal on every worker; call after role, activation or root status changes."""
+    cache_invalidation.broadcast("principal", None if user_id is None else str(user_id))
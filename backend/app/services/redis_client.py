@@ -1,8 +1,66 @@
+from typing import Optional
+
 from redis import asyncio as aioredis
+from redis.asyncio.retry import Retry
+from redis.backoff import ExponentialBackoff
+from redis.exceptions import ConnectionError, TimeoutError
+
 from app.core.config import get_settings
 
 _settings = get_settings()
 
+# One pool per process, shared by every caller; connections are reused instead of being
+# opened per command. Created on first use inside the running loop (app startup, or the
+# worker's main) and closed at shutdown.
+_pool: Optional[aioredis.BlockingConnectionPool] = None
+_client: Optional[aioredis.Redis] = None
+
+
+def _create_pool() -> aioredis.BlockingConnectionPool:
+    return aioredis.BlockingConnectionPool.from_url(
+        _settings.redis_url,
+        decode_responses=True,
+        max_connections=_settings.redis_max_connections,
+        # How long a caller waits for a free connection before getting ConnectionError
+        timeout=_settings.redis_pool_timeout_seconds,
+        socket_connect_timeout=_settings.redis_connect_timeout_seconds,
+        socket_keepalive=True,
+        # Idle connections are PINGed before reuse, so one dropped by Redis or a proxy is replaced
+        health_check_interval=_settings.redis_health_check_interval_seconds,
+        retry=Retry(ExponentialBackoff(cap=2, base=0.1), 3),
+        retry_on_error=[ConnectionError, TimeoutError],
+    )
+
 
 def get_redis() -> aioredis.Redis:
-    return aioredis.from_url(_settings.redis_url, decode_responses=True)
\ No newline at end of file
+    """The process-wide client. Do not close it; connections go back to the pool after each command."""
+    global _pool, _client
+    if _client is None:
+        _pool = _create_pool()
+        _client = aioredis.Redis(connection_pool=_pool)
+    return _client
+
+
+async def init_redis() -> None:
+    get_redis()
+
+
+async def close_redis() -> None:
+    global _pool, _client
+    pool, _pool, _client = _pool, None, None
+    if pool is not None:
+        await pool.disconnect()
+
+
+def redis_pool_stats() -> dict[str, Optional[int]]:
+    """Pool capacity and usage. Usage comes from redis-py internals and is None if they are gone."""
+    pool = _pool
+    if pool is None:
+        return {"max_connections": _settings.redis_max_connections, "in_use": 0, "idle": 0}
+    in_use = getattr(pool, "_in_use_connections", None)
+    idle = getattr(pool, "_available_connections", None)
+    return {
+        "max_connections": pool.max_connections,
+        "in_use": len(in_use) if in_use is not None else None,
+        "idle": len(idle) if idle is not None else None,
+    }
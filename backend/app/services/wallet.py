@@ -0,0 +1,364 @@
+import asyncio
+import hashlib
+import logging
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Any, Optional
+
+import orjson
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.core.config import get_settings
+from app.db.session import SessionLocal
+from app.models.panel_job import PanelJob
+from app.models.wallet import Wallet, WalletDailyRollup, WalletHold, WalletTransaction
+
+logger = logging.getLogger("app")
+_settings = get_settings()
+
+# Every balance change below is a single UPDATE on the wallet row, so the row lock lasts
+# one statement and concurrent purchases never overwrite each other's balance.
+
+
+class IdempotencyConflict(Exception):
+    """The Idempotency-Key was already used, in the same scope, for a different request."""
+
+
+def request_hash(payload: dict[str, Any]) -> str:
+    """Fingerprint of what a request asks for, stored next to its Idempotency-Key."""
+    return hashlib.sha256(orjson.dumps(payload, option=orjson.OPT_SORT_KEYS, default=str)).hexdigest()
+
+
+def ensure_wallet(db: Session, user_id: int) -> None:
+    db.execute(insert(Wallet).values(user_id=user_id, balance=0).on_conflict_do_nothing(index_elements=[Wallet.user_id]))
+
+
+def _take(db: Session, user_id: int, amount: Decimal) -> bool:
+    """Conditional debit: only succeeds if the balance covers `amount`."""
+    ensure_wallet(db, user_id)
+    row = db.execute(
+        update(Wallet)
+        .where(Wallet.user_id == user_id, Wallet.balance >= amount)
+        .values(balance=Wallet.balance - amount)
+        .returning(Wallet.balance)
+    ).first()
+    return row is not None
+
+
+def _give(db: Session, user_id: int, amount: Decimal) -> Decimal:
+    """Add `amount` (may be negative) without a balance check; returns the new balance."""
+    stmt = insert(Wallet).values(user_id=user_id, balance=amount)
+    stmt = stmt.on_conflict_do_update(index_elements=[Wallet.user_id], set_={"balance": Wallet.balance + stmt.excluded.balance, "updated_at": func.now()})
+    return db.execute(stmt.returning(Wallet.balance)).scalar_one()
+
+
+def _post(
+    db: Session,
+    user_id: int,
+    amount: Decimal,
+    reason: Optional[str],
+    idempotency_key: Optional[str] = None,
+    scope: str = "",
+    fingerprint: Optional[str] = None,
+) -> WalletTransaction:
+    """Append a ledger row with its running balance and fold it into the daily rollup.
+
+    Posts for one user are serialized on their wallet row (locked here, or already by the
+    caller's balance UPDATE) until commit, so reading the previous running balance is safe.
+    """
+    db.execute(select(Wallet.id).where(Wallet.user_id == user_id).with_for_update())
+    previous = db.execute(
+        select(WalletTransaction.balance_after).where(WalletTransaction.user_id == user_id).order_by(WalletTransaction.id.desc()).limit(1)
+    ).scalar()
+    now = datetime.now(tz=timezone.utc)
+    tx = WalletTransaction(
+        user_id=user_id,
+        amount=amount,
+        reason=reason[:255] if reason else reason,
+        balance_after=Decimal(str(previous or 0)) + amount,
+        idempotency_key=idempotency_key,
+        idempotency_scope=scope,
+        request_hash=fingerprint,
+        created_at=now,
+    )
+    db.add(tx)
+    debits, credits = (-amount, Decimal("0")) if amount < 0 else (Decimal("0"), amount)
+    stmt = insert(WalletDailyRollup).values(user_id=user_id, day=now.date(), debits=debits, credits=credits, tx_count=1)
+    db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[WalletDailyRollup.user_id, WalletDailyRollup.day],
+            set_={
+                "debits": WalletDailyRollup.debits + stmt.excluded.debits,
+                "credits": WalletDailyRollup.credits + stmt.excluded.credits,
+                "tx_count": WalletDailyRollup.tx_count + 1,
+            },
+        )
+    )
+    return tx
+
+
+def _by_key(db: Session, model, user_id: int, scope: str, key: str, fingerprint: Optional[str] = None, lock: bool = False):
+    """The row already recorded for this key in `scope`; IdempotencyConflict if it was for another request."""
+    q = select(model).where(model.user_id == user_id, model.idempotency_scope == scope, model.idempotency_key == key)
+    row = db.execute(q.with_for_update() if lock else q).scalar_one_or_none()
+    # Rows from before fingerprints were stored have none and are trusted
+    if row is not None and fingerprint and row.request_hash and row.request_hash != fingerprint:
+        db.commit()
+        raise IdempotencyConflict(key)
+    return row
+
+
+def balance(db: Session, user_id: int) -> Decimal:
+    value = db.execute(select(Wallet.balance).where(Wallet.user_id == user_id)).scalar_one_or_none()
+    return Decimal(str(value or 0))
+
+
+def debit(
+    db: Session,
+    user_id: int,
+    amount: Decimal,
+    reason: str,
+    idempotency_key: Optional[str] = None,
+    scope: str = "debit",
+    fingerprint: Optional[str] = None,
+) -> Optional[WalletTransaction]:
+    """Take `amount` and post the transaction in one commit; None if the balance is short.
+
+    With an idempotency key, a repeat of the same request returns the transaction already
+    posted for it; the same key for another amount or reason raises IdempotencyConflict.
+    """
+    fingerprint = fingerprint or request_hash({"amount": amount, "reason": reason})
+    if idempotency_key:
+        existing = _by_key(db, WalletTransaction, user_id, scope, idempotency_key, fingerprint)
+        if existing is not None:
+            return existing
+    if not _take(db, user_id, amount):
+        db.rollback()
+        return None
+    tx = _post(db, user_id, -amount, reason, idempotency_key, scope, fingerprint)
+    try:
+        db.commit()
+    except IntegrityError:
+        # A concurrent request with the same key won; our debit rolled back with it
+        db.rollback()
+        return _by_key(db, WalletTransaction, user_id, scope, idempotency_key, fingerprint)
+    return tx
+
+
+def adjust(
+    db: Session,
+    user_id: int,
+    amount: Decimal,
+    reason: Optional[str],
+    idempotency_key: Optional[str] = None,
+    scope: str = "adjust",
+    fingerprint: Optional[str] = None,
+) -> Decimal:
+    """Admin credit or correction; the balance may go negative. Returns the new balance."""
+    fingerprint = fingerprint or request_hash({"amount": amount, "reason": reason})
+    if idempotency_key and _by_key(db, WalletTransaction, user_id, scope, idempotency_key, fingerprint) is not None:
+        return balance(db, user_id)
+    new_balance = _give(db, user_id, amount)
+    _post(db, user_id, amount, reason, idempotency_key, scope, fingerprint)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        _by_key(db, WalletTransaction, user_id, scope, idempotency_key, fingerprint)
+        return balance(db, user_id)
+    return new_balance
+
+
+def ledger_page(
+    db: Session,
+    user_id: int,
+    limit: int,
+    before_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> list[WalletTransaction]:
+    """Newest first, `limit` rows below `before_id`; one index range scan on (user_id, id)."""
+    q = select(WalletTransaction).where(WalletTransaction.user_id == user_id)
+    if before_id is not None:
+        q = q.where(WalletTransaction.id < before_id)
+    if since is not None:
+        q = q.where(WalletTransaction.created_at >= since)
+    if until is not None:
+        q = q.where(WalletTransaction.created_at < until)
+    return list(db.scalars(q.order_by(WalletTransaction.id.desc()).limit(limit)))
+
+
+def daily_rollups(db: Session, user_id: int, since: date, until: date) -> list[WalletDailyRollup]:
+    """Rollup rows for since <= day <= until, oldest first; days without transactions are absent."""
+    return list(
+        db.scalars(
+            select(WalletDailyRollup)
+            .where(WalletDailyRollup.user_id == user_id, WalletDailyRollup.day >= since, WalletDailyRollup.day <= until)
+            .order_by(WalletDailyRollup.day.asc())
+        )
+    )
+
+
+def open_hold(db: Session, user_id: int, amount: Decimal, reason: str) -> Optional[WalletHold]:
+    """Take `amount` into a new hold without committing, so the caller can commit it together
+    with whatever it pays for; None (and the caller should roll back) if the balance is short."""
+    if not _take(db, user_id, amount):
+        return None
+    hold = WalletHold(user_id=user_id, amount=amount, reason=reason[:255], status="held")
+    db.add(hold)
+    db.flush()
+    return hold
+
+
+def place_hold(
+    db: Session,
+    user_id: int,
+    amount: Decimal,
+    reason: str,
+    idempotency_key: Optional[str] = None,
+    scope: str = "hold",
+    fingerprint: Optional[str] = None,
+) -> tuple[Optional[WalletHold], bool]:
+    """Take `amount` into a hold until the operation it pays for has finished.
+
+    Returns (hold, True) for a new hold and (None, False) if the balance is short. Keys are
+    unique per user within `scope` (the operation), and `fingerprint` identifies the request
+    (see request_hash). A repeat of the same request whose hold is open or committed returns
+    (that hold, False) so the caller can answer the retry; a released one is re-armed, since
+    its operation never happened. The key used for a different request raises IdempotencyConflict.
+    """
+    fingerprint = fingerprint or request_hash({"amount": amount, "reason": reason})
+    existing = None
+    if idempotency_key:
+        existing = _by_key(db, WalletHold, user_id, scope, idempotency_key, fingerprint, lock=True)
+        if existing is not None and existing.status != "released":
+            db.commit()
+            return existing, False
+    if not _take(db, user_id, amount):
+        db.rollback()
+        return None, False
+    if existing is not None:
+        hold = existing
+        hold.status, hold.amount, hold.reason = "held", amount, reason[:255]
+        hold.created_at, hold.settled_at, hold.transaction_id = datetime.now(tz=timezone.utc), None, None
+    else:
+        hold = WalletHold(
+            user_id=user_id,
+            amount=amount,
+            reason=reason[:255],
+            status="held",
+            idempotency_key=idempotency_key,
+            idempotency_scope=scope,
+            request_hash=fingerprint,
+        )
+        db.add(hold)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return _by_key(db, WalletHold, user_id, scope, idempotency_key, fingerprint), False
+    return hold, True
+
+
+def find_hold(db: Session, user_id: int, scope: str, key: str, fingerprint: str) -> Optional[WalletHold]:
+    """The hold an earlier attempt of this request placed, unless it was released.
+
+    A released hold's operation never happened, so the request may run again (place_hold
+    re-arms it). The key used for a different request raises IdempotencyConflict.
+    """
+    hold = _by_key(db, WalletHold, user_id, scope, key, fingerprint)
+    db.commit()
+    return hold if hold is not None and hold.status != "released" else None
+
+
+def commit_hold(
+    db: Session,
+    hold: WalletHold,
+    amount: Optional[Decimal] = None,
+    reason: Optional[str] = None,
+    result: Optional[dict[str, Any]] = None,
+) -> Optional[WalletTransaction]:
+    """Post the hold as a debit. With `amount`, only that much is charged and the rest goes back.
+
+    `result` is kept on the hold so a retry of the same request can be answered with it.
+    Returns None if the hold was already settled (e.g. released by the stale-hold sweeper).
+    """
+    held = Decimal(str(hold.amount))
+    charge = held if amount is None else min(amount, held)
+    row = db.execute(
+        update(WalletHold)
+        .where(WalletHold.id == hold.id, WalletHold.status == "held")
+        .values(status="committed", amount=charge, settled_at=func.now(), result=result)
+        .returning(WalletHold.id)
+    ).first()
+    if row is None:
+        db.rollback()
+        return None
+    if held > charge:
+        _give(db, hold.user_id, held - charge)
+    tx = None
+    if charge > 0:
+        tx = _post(db, hold.user_id, -charge, reason or hold.reason)
+        db.flush()
+        db.execute(update(WalletHold).where(WalletHold.id == hold.id).values(transaction_id=tx.id))
+    db.commit()
+    return tx
+
+
+def release_hold(db: Session, hold: WalletHold) -> bool:
+    """Give the held amount back; False if the hold was already settled."""
+    row = db.execute(
+        update(WalletHold)
+        .where(WalletHold.id == hold.id, WalletHold.status == "held")
+        .values(status="released", settled_at=func.now())
+        .returning(WalletHold.amount)
+    ).first()
+    if row is None:
+        db.rollback()
+        return False
+    _give(db, hold.user_id, Decimal(str(row.amount)))
+    db.commit()
+    return True
+
+
+def release_stale_holds(db: Session, older_than: timedelta) -> int:
+    """Release holds whose request died between taking the money and settling it."""
+    cutoff = datetime.now(tz=timezone.utc) - older_than
+    # Holds paying for an unfinished panel job are settled by the job worker instead
+    open_job = select(PanelJob.id).where(PanelJob.hold_id == WalletHold.id, PanelJob.status.in_(("queued", "running", "reconciling")))
+    stale = list(db.scalars(select(WalletHold).where(WalletHold.status == "held", WalletHold.created_at < cutoff, ~open_job.exists()).limit(500)))
+    db.commit()
+    released = 0
+    for hold in stale:
+        if release_hold(db, hold):
+            released += 1
+            logger.warning("wallet_hold released_stale id=%s user_id=%s amount=%s reason=%s", hold.id, hold.user_id, hold.amount, hold.reason)
+    return released
+
+
+_sweeper_started = False
+
+
+def schedule_wallet_hold_sweeper() -> None:
+    global _sweeper_started
+    if _sweeper_started or _settings.wallet_hold_ttl_seconds <= 0:
+        return
+    _sweeper_started = True
+    asyncio.create_task(_sweeper_loop())
+
+
+def _sweep() -> int:
+    with SessionLocal() as db:
+        return release_stale_holds(db, timedelta(seconds=_settings.wallet_hold_ttl_seconds))
+
+
+async def _sweeper_loop() -> None:
+    while True:
+        try:
+            await asyncio.to_thread(_sweep)
+        except Exception as e:
+            logger.warning("wallet_hold sweep_failed err=%s", str(e))
+        await asyncio.sleep(60)
@@ -0,0 +1,154 @@
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import func, select
+
+from app.models.wallet import WalletHold, WalletTransaction
+from app.services import panel_jobs
+from app.services import wallet
+
+
+def _fund(db, user_id: int, amount: str) -> None:
+    wallet.adjust(db, user_id, Decimal(amount), "top-up")
+
+
+def _ledger_count(db, user_id: int) -> int:
+    return db.scalar(select(func.count()).select_from(WalletTransaction).where(WalletTransaction.user_id == user_id))
+
+
+def test_request_hash_ignores_key_order():
+    assert wallet.request_hash({"a": 1, "b": Decimal("2.50")}) == wallet.request_hash({"b": Decimal("2.50"), "a": 1})
+    assert wallet.request_hash({"username": "alice"}) != wallet.request_hash({"username": "bob"})
+
+
+def test_debit_takes_balance_and_posts_running_total(db, user):
+    _fund(db, user.id, "10")
+    tx = wallet.debit(db, user.id, Decimal("4"), "plan")
+    assert tx is not None and tx.amount == Decimal("-4")
+    assert tx.balance_after == Decimal("6")
+    assert wallet.balance(db, user.id) == Decimal("6")
+
+
+def test_debit_short_balance_changes_nothing(db, user):
+    _fund(db, user.id, "3")
+    assert wallet.debit(db, user.id, Decimal("4"), "plan") is None
+    assert wallet.balance(db, user.id) == Decimal("3")
+    assert _ledger_count(db, user.id) == 1
+
+
+def test_debit_replay_charges_once(db, user):
+    _fund(db, user.id, "10")
+    first = wallet.debit(db, user.id, Decimal("4"), "plan", idempotency_key="k1")
+    again = wallet.debit(db, user.id, Decimal("4"), "plan", idempotency_key="k1")
+    assert again.id == first.id
+    assert wallet.balance(db, user.id) == Decimal("6")
+
+
+def test_debit_key_reused_for_other_request_conflicts(db, user):
+    _fund(db, user.id, "10")
+    wallet.debit(db, user.id, Decimal("4"), "plan", idempotency_key="k1")
+    with pytest.raises(wallet.IdempotencyConflict):
+        wallet.debit(db, user.id, Decimal("5"), "plan", idempotency_key="k1")
+    assert wallet.balance(db, user.id) == Decimal("6")
+
+
+def test_adjust_replay_credits_once(db, user):
+    assert wallet.adjust(db, user.id, Decimal("10"), "top-up", idempotency_key="a1") == Decimal("10")
+    assert wallet.adjust(db, user.id, Decimal("10"), "top-up", idempotency_key="a1") == Decimal("10")
+    with pytest.raises(wallet.IdempotencyConflict):
+        wallet.adjust(db, user.id, Decimal("20"), "top-up", idempotency_key="a1")
+    assert _ledger_count(db, user.id) == 1
+
+
+def test_hold_commit_posts_debit(db, user):
+    _fund(db, user.id, "10")
+    hold, fresh = wallet.place_hold(db, user.id, Decimal("4"), "create", fingerprint="f")
+    assert fresh and wallet.balance(db, user.id) == Decimal("6")
+    tx = wallet.commit_hold(db, hold)
+    assert tx.amount == Decimal("-4") and tx.balance_after == Decimal("6")
+    assert db.get(WalletHold, hold.id).status == "committed"
+    assert wallet.commit_hold(db, hold) is None
+
+
+def test_hold_partial_commit_returns_the_rest(db, user):
+    _fund(db, user.id, "10")
+    hold, _ = wallet.place_hold(db, user.id, Decimal("6"), "bulk")
+    wallet.commit_hold(db, hold, Decimal("2"))
+    assert wallet.balance(db, user.id) == Decimal("8")
+
+
+def test_hold_release_refunds(db, user):
+    _fund(db, user.id, "10")
+    hold, _ = wallet.place_hold(db, user.id, Decimal("4"), "create")
+    assert wallet.release_hold(db, hold)
+    assert wallet.balance(db, user.id) == Decimal("10")
+    assert not wallet.release_hold(db, hold)
+    assert _ledger_count(db, user.id) == 1
+
+
+def test_hold_short_balance(db, user):
+    _fund(db, user.id, "3")
+    assert wallet.place_hold(db, user.id, Decimal("4"), "create") == (None, False)
+    assert wallet.balance(db, user.id) == Decimal("3")
+
+
+def test_hold_replay_returns_first_hold_without_charging(db, user):
+    _fund(db, user.id, "10")
+    hold, _ = wallet.place_hold(db, user.id, Decimal("4"), "create", "k", "create_user", "f1")
+    wallet.commit_hold(db, hold)
+    again, fresh = wallet.place_hold(db, user.id, Decimal("4"), "create", "k", "create_user", "f1")
+    assert not fresh and again.id == hold.id
+    assert wallet.balance(db, user.id) == Decimal("6")
+
+
+def test_hold_key_reused_for_other_request_conflicts(db, user):
+    _fund(db, user.id, "10")
+    hold, _ = wallet.place_hold(db, user.id, Decimal("4"), "create alice", "k", "create_user", "alice")
+    wallet.commit_hold(db, hold)
+    with pytest.raises(wallet.IdempotencyConflict):
+        wallet.place_hold(db, user.id, Decimal("4"), "create bob", "k", "create_user", "bob")
+    assert wallet.balance(db, user.id) == Decimal("6")
+
+
+def test_hold_keys_are_scoped_per_operation(db, user):
+    _fund(db, user.id, "10")
+    created, _ = wallet.place_hold(db, user.id, Decimal("4"), "create", "k", "create_user", "same")
+    extended, fresh = wallet.place_hold(db, user.id, Decimal("4"), "extend", "k", "extend", "same")
+    assert fresh and extended.id != created.id
+    assert wallet.balance(db, user.id) == Decimal("2")
+
+
+def test_released_hold_is_rearmed_on_replay(db, user):
+    _fund(db, user.id, "10")
+    hold, _ = wallet.place_hold(db, user.id, Decimal("4"), "create", "k", "create_user", "f1")
+    wallet.release_hold(db, hold)
+    again, fresh = wallet.place_hold(db, user.id, Decimal("4"), "create", "k", "create_user", "f1")
+    assert fresh and again.id == hold.id and again.status == "held"
+    assert wallet.balance(db, user.id) == Decimal("6")
+
+
+def test_find_hold_returns_committed_result_and_skips_released(db, user):
+    _fund(db, user.id, "10")
+    hold, _ = wallet.place_hold(db, user.id, Decimal("4"), "bulk", "k", "bulk_extend", "f1")
+    wallet.commit_hold(db, hold, Decimal("2"), result={"total": 2, "succeeded": 1})
+    found = wallet.find_hold(db, user.id, "bulk_extend", "k", "f1")
+    assert found.id == hold.id and found.result == {"total": 2, "succeeded": 1}
+    with pytest.raises(wallet.IdempotencyConflict):
+        wallet.find_hold(db, user.id, "bulk_extend", "k", "f2")
+    other, _ = wallet.place_hold(db, user.id, Decimal("1"), "bulk", "k2", "bulk_extend", "f1")
+    wallet.release_hold(db, other)
+    assert wallet.find_hold(db, user.id, "bulk_extend", "k2", "f1") is None
+
+
+def test_job_submit_replay_and_conflict(db, user, panel):
+    _fund(db, user.id, "10")
+    params = {"account": "admin", "username": "alice", "plan_id": 1}
+    job, fresh = panel_jobs.submit(db, user.id, panel.id, "create_user", params, Decimal("4"), "create", "k")
+    assert fresh and job.hold_id is not None
+    again, fresh = panel_jobs.submit(db, user.id, panel.id, "create_user", params, Decimal("4"), "create", "k")
+    assert not fresh and again.id == job.id
+    assert wallet.balance(db, user.id) == Decimal("6")
+    with pytest.raises(wallet.IdempotencyConflict):
+        panel_jobs.submit(db, user.id, panel.id, "create_user", {**params, "username": "bob"}, Decimal("4"), "create", "k")
+    other, fresh = panel_jobs.submit(db, user.id, panel.id, "extend", params, Decimal("4"), "extend", "k")
+    assert fresh and other.id != job.id
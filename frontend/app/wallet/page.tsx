@@ -4,11 +4,14 @@ import { useEffect, useState } from "react";
 import { apiFetch } from "../../lib/api";
 import { Card, CardContent, CardHeader, CardTitle } from "../../components/ui/card";
 import { formatToman } from "../../lib/utils";
+import { Button } from "../../components/ui/button";
 
 export default function WalletPage() {
   const [balance, setBalance] = useState<string>("0.00");
   const [txs, setTxs] = useState<any[]>([]);
   const [loading, setLoading] = useState(true);
+  const [nextBefore, setNextBefore] = useState<number | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   const load = async () => {
     setLoading(true);
@@ -19,11 +22,24 @@ export default function WalletPage() {
       ]);
       if (w && typeof w.balance !== "undefined") setBalance(String(w.balance));
       setTxs((t && Array.isArray(t.items)) ? t.items : []);
+      setNextBefore(t?.next_before_id ?? null);
     } catch {
       setTxs([]);
+      setNextBefore(null);
     } finally { setLoading(false); }
   };
 
+  // The endpoint returns one page at a time; older rows are fetched with before_id
+  const loadMore = async () => {
+    if (nextBefore == null) return;
+    setLoadingMore(true);
+    try {
+      const t = await apiFetch(`/wallet/me/transactions?before_id=${nextBefore}`);
+      setTxs(s=> [...s, ...((t && Array.isArray(t.items)) ? t.items : [])]);
+      setNextBefore(t?.next_before_id ?? null);
+    } catch {} finally { setLoadingMore(false); }
+  };
+
   useEffect(() => { load(); }, []);
 
   return (
@@ -65,6 +81,11 @@ export default function WalletPage() {
                 )}
               </tbody>
             </table>
+            {nextBefore != null && (
+              <div className="pt-3">
+                <Button type="button" variant="outline" size="sm" disabled={loadingMore} onClick={loadMore}>{loadingMore ? "در حال بارگذاری…" : "بیشتر"}</Button>
+              </div>
+            )}
           </div>
         </CardContent>
       </Card>
@@ -16,6 +16,8 @@ export default function WalletsAdminPage() {
   const [myBalance, setMyBalance] = useState<string>("0.00");
   const [myTxs, setMyTxs] = useState<any[]>([]);
   const [loadingMy, setLoadingMy] = useState(true);
+  const [myNextBefore, setMyNextBefore] = useState<number | null>(null);
+  const [loadingMoreMy, setLoadingMoreMy] = useState(false);
 
   const load = async () => {
     try {
@@ -41,10 +43,23 @@ export default function WalletsAdminPage() {
       ]);
       if (w && typeof w.balance !== "undefined") setMyBalance(String(w.balance));
       setMyTxs((t && Array.isArray(t.items)) ? t.items : []);
+      setMyNextBefore(t?.next_before_id ?? null);
     } catch {
       setMyTxs([]);
+      setMyNextBefore(null);
     } finally { setLoadingMy(false); }
   };
+
+  // The endpoint returns one page at a time; older rows are fetched with before_id
+  const loadMoreMy = async () => {
+    if (myNextBefore == null) return;
+    setLoadingMoreMy(true);
+    try {
+      const t = await apiFetch(`/wallet/me/transactions?before_id=${myNextBefore}`);
+      setMyTxs(s=> [...s, ...((t && Array.isArray(t.items)) ? t.items : [])]);
+      setMyNextBefore(t?.next_before_id ?? null);
+    } catch {} finally { setLoadingMoreMy(false); }
+  };
   useEffect(()=> { if (!isRootAdmin) { void loadMy(); } }, [isRootAdmin]);
 
   const adjust = async (uid: number) => {
@@ -108,6 +123,11 @@ export default function WalletsAdminPage() {
                   )}
                 </tbody>
               </table>
+              {myNextBefore != null && (
+                <div className="pt-3">
+                  <Button type="button" variant="outline" size="sm" disabled={loadingMoreMy} onClick={loadMoreMy}>{loadingMoreMy ? "در حال بارگذاری…" : "بیشتر"}</Button>
+                </div>
+              )}
             </div>
           </CardContent>
         </Card>